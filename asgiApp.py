@@ -0,0 +1,119 @@
+"""
+ASGI application serving the asyncio implementation of the background check process (asyncBackgroundCheck.py)
+Serves the same endpoints as the Flask blueprint of backgroundCheck.py, which stays available for WSGI deployments
+Usage: uvicorn asgiApp:app
+"""
+import functools
+import math
+import urllib.parse
+from asyncBackgroundCheck import handle_outbound_message, handle_checkr_webhook, handle_status_request, flush_BC_objects, request_state
+from asyncCheckrClient import close_async_checkr_client
+from rateLimiting import ServiceUnavailableError
+from tracing import get_tracer
+from structuredLogging import get_logger, flush_logs
+
+logger = get_logger('asgiApp')
+
+
+class BackgroundCheckASGI:
+   """
+   ASGI application routing POST requests of Salesforce outbound messages and Checkr webhooks, and GET requests of the status, to their async handlers
+   POST handlers are given the request body, GET handlers the request headers and query parameters
+   Like the Flask blueprint, every request is traced, deferred work is answered with a 503 and Retry-After,
+   and queued 'Background Check' objects and buffered log lines are written before the request is finished
+   Parameters: None
+   """
+   def __init__(self):
+      self.routes = {'/background-check': ('POST', handle_outbound_message), '/checkr': ('POST', handle_checkr_webhook),
+                     '/status': ('GET', handle_status_request)}
+
+   async def __call__(self, scope, receive, send):
+      if scope['type'] == 'lifespan':
+         await self.lifespan(receive, send)
+      elif scope['type'] == 'http':
+         await self.handle_request(scope, receive, send)
+
+   """
+   Answers lifespan events of the ASGI server, closing Checkr connections and writing buffered log lines on shutdown
+   Parameters: ASGI receive and send callables
+   Output: None
+   """
+   async def lifespan(self, receive, send):
+      while True:
+         message = await receive()
+         if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+         elif message['type'] == 'lifespan.shutdown':
+            await close_async_checkr_client()
+            flush_logs()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+   """
+   Handles one HTTP request in its own trace
+   Parameters: ASGI scope, receive and send callables
+   Output: None
+   """
+   async def handle_request(self, scope, receive, send):
+      route = self.routes.get(scope['path'])
+      if route is None:
+         await send_response(send, 404, [], b'')
+         return
+      method, handler = route
+      if scope['method'] != method:
+         await send_response(send, 405, [(b'allow', method.encode('latin-1'))], b'')
+         return
+
+      body = await read_body(receive)
+      if method == 'GET':
+         request_headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+         query_params = dict(urllib.parse.parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+         handler = functools.partial(handler, request_headers, query_params)
+      else:
+         handler = functools.partial(handler, body)
+      request_trace = get_tracer().start_trace(scope['path'])
+      request_state.set({'BC_objects_queued': False})
+      status, headers, content = 500, [], b''
+      try:
+         response = await handler()
+         await flush_BC_objects()
+         status = response.status_code
+         headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()]
+         content = response.get_data()
+      except ServiceUnavailableError as error:
+         logger.warning("Deferring request until service is available", extra = {'service': error.service_name, 'retry_after': round(error.retry_after, 1)})
+         status, headers = 503, [(b'retry-after', str(int(math.ceil(error.retry_after))).encode('latin-1'))]
+      except Exception:
+         logger.exception("Error in handling request", extra = {'path': scope['path']})
+      finally:
+         get_tracer().end_trace(request_trace, 'error' if status >= 400 else 'success')
+         flush_logs()
+      await send_response(send, status, headers, content)
+
+
+"""
+Reads whole body of HTTP request
+Parameters: ASGI receive callable
+Output: request body
+"""
+async def read_body(receive):
+   chunks = []
+   while True:
+      message = await receive()
+      chunks.append(message.get('body', b''))
+      if not message.get('more_body', False):
+         return b''.join(chunks)
+
+
+"""
+Sends HTTP response
+Parameters: ASGI send callable, status code, list of (name, value) header byte strings, and body
+Output: None
+"""
+async def send_response(send, status, headers, content):
+   headers = [header for header in headers if header[0] != b'content-length'] + [(b'content-length', str(len(content)).encode('latin-1'))]
+   await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+   await send({'type': 'http.response.body', 'body': content})
+
+
+app = BackgroundCheckASGI()
@@ -0,0 +1,329 @@
+"""
+Asyncio implementation of the background check process, served by the ASGI application in asgiApp.py
+Mirrors main(), check_report_status() and process_report() of backgroundCheck.py, whose Flask blueprint stays the synchronous path:
+Checkr requests go through the shared aiohttp connection pool of asyncCheckrClient.py, and DynamoDB requests, idempotency ledger claims, job queue
+writes and the buffered Salesforce writer run in the thread pool of asyncExecutor.py, so one process serves many requests at once
+Calls that don't depend on each other run concurrently: the leads of an outbound message, and the claim of a completed report with its retrieval
+"""
+import asyncio
+import aiohttp
+import contextvars
+import json
+import time
+from settings import settings
+from backgroundCheckTable import get_item_by_lead_ID, get_item_by_candidate_ID, get_item_by_report_ID
+from backgroundCheckTable import claim_report_completion, release_report_completion, put_candidate_item, set_report_created
+import backgroundCheck
+from backgroundCheck import CHECKR_LEAD_ID_FIELD, parse_sf_outbound_msg, get_sf_outbound_msg_acknowledgement, get_BC_object_payload
+from backgroundCheck import get_lead_name, get_lead_ID_from_checkr_object, process_report_results, claim_notifications, complete_notifications, release_notifications
+from backgroundCheck import get_status_response, is_transient_error
+from flask import Response
+from asyncCheckrClient import get_async_checkr_client
+from checkrClient import CheckrUnavailableError, RETRY_STATUS_CODES
+from asyncExecutor import run_blocking
+from salesforceWriter import flush_background_check_writers
+from statusCounters import record_report_completed
+from idempotencyLedger import get_idempotency_ledger, ledger_key
+from tracing import span, traced
+from structuredLogging import get_logger
+from orgRegistry import get_org_by_checkr_account, get_org_settings, get_current_org_ID, set_current_org
+
+logger = get_logger('asyncBackgroundCheck')
+
+## Set by the ASGI application for every request; records whether the request queued 'Background Check' objects, which it then writes
+## before answering, like flush_BC_objects() does for the Flask blueprint
+request_state = contextvars.ContextVar('request_state', default=None)
+
+
+"""
+Returns DynamoDB table through backgroundCheck.py, so both paths use the same table
+Parameters: None
+Output: DynamoDB table
+"""
+def get_background_check_table():
+   return backgroundCheck.get_background_check_table()
+
+
+"""
+Returns job queue through backgroundCheck.py, so both paths enqueue to the same queue and its workers
+Parameters: None
+Output: job queue, or None if no job queue backend is configured
+"""
+def get_job_queue():
+   return backgroundCheck.get_job_queue()
+
+
+"""
+Handles Salesforce outbound message like main() of the Flask blueprint
+Parameters: outbound message body
+Output: acknowledgement to Salesforce outbound message
+"""
+async def handle_outbound_message(outbound_msg_body):
+   salesforce_leads, invalid_org_id = parse_sf_outbound_msg(outbound_msg_body)
+   if invalid_org_id == True:
+      logger.info("Returning acknowledgement to Salesforce outbound message")
+      return get_sf_outbound_msg_acknowledgement()
+
+   ## If a job queue is configured, claims every notification, persists one job per newly claimed lead and acknowledges right away
+   ## Like the Flask blueprint, jobs only carry the lead and notification IDs
+   job_queue = await run_blocking(get_job_queue)
+   if job_queue is not None:
+      salesforce_leads = await run_blocking(claim_notifications, salesforce_leads)
+      if len(salesforce_leads) > 0:
+         try:
+            with span('enqueue_jobs'):
+               job_IDs = await run_blocking(job_queue.enqueue_many, 'background_check',
+                                            [{'salesforce_lead_ID': lead[0], 'notification_ID': lead[2], 'salesforce_org_ID': get_current_org_ID()}
+                                             for lead in salesforce_leads])
+         except BaseException:
+            await run_blocking(release_notifications, salesforce_leads)
+            raise
+         logger.info("Queued background check jobs", extra = {'job_count': len(job_IDs)})
+         await run_blocking(complete_notifications, salesforce_leads, 'queued')
+
+   ## Else, runs background check process for every lead concurrently, at most 'leadWorkers' at a time like the Flask blueprint
+   elif len(salesforce_leads) > 0:
+      semaphore = asyncio.Semaphore(settings.leadWorkers)
+      async def run_lead(lead):
+         async with semaphore:
+            return await run_notification_once(lead)
+      ## Every lead finishes before a transient error of one of them is raised, like the executor of the Flask blueprint
+      results = await asyncio.gather(*[run_lead(lead) for lead in salesforce_leads], return_exceptions = True)
+      for result in results:
+         if isinstance(result, BaseException):
+            raise result
+
+   logger.info("Returning acknowledgement to Salesforce outbound message")
+   return get_sf_outbound_msg_acknowledgement()
+
+
+"""
+Runs background check process for the lead of one outbound message notification, unless the notification was already claimed
+Parameters: (lead ID, dictionary containing lead PII, notification ID) tuple
+Output: 'error_occured' boolean indicating whether error has occured
+"""
+async def run_notification_once(lead):
+   salesforce_lead_ID, salesforce_lead_PII_dict, notification_ID = lead
+   ledger = get_idempotency_ledger()
+   if ledger is None or not notification_ID:
+      return await run_background_check(salesforce_lead_ID, salesforce_lead_PII_dict)
+   key = ledger_key(notification_ID, salesforce_lead_ID)
+   if await run_blocking(ledger.claim, key) == False:
+      logger.info("Skipping redelivered notification", extra = {'notification_ID': notification_ID, 'lead_ID': salesforce_lead_ID})
+      return False
+   try:
+      error_occured = await run_background_check(salesforce_lead_ID, salesforce_lead_PII_dict)
+   except BaseException:
+      await run_blocking(ledger.release, key)
+      raise
+   await run_blocking(ledger.complete, key, 'error' if error_occured else 'success')
+   return error_occured
+
+
+"""
+Runs background check process for one Salesforce lead: creates Checkr candidate and then Checkr report
+Errors that can't succeed on a retry are caught and logged so that one lead's failure doesn't affect other leads;
+transient errors, including aiohttp connection errors and timeouts, are raised so the message isn't acknowledged
+Parameters: Salesforce lead ID and dictionary containing Salesforce lead PII
+Output: 'error_occured' boolean indicating whether error has occured
+"""
+async def run_background_check(salesforce_lead_ID, salesforce_lead_PII_dict):
+   try:
+      checkr_candidate_ID, error_occured = await create_checkr_candidate(salesforce_lead_ID, salesforce_lead_PII_dict)
+      if error_occured == True:
+         return error_occured
+      await create_checkr_report(checkr_candidate_ID, salesforce_lead_ID, get_lead_name(salesforce_lead_PII_dict))
+      return False
+   except Exception as error:
+      if is_transient_error(error) or isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+         logger.warning("Transient error in background check process for Salesforce lead, leaving it for redelivery",
+                        extra = {'lead_ID': salesforce_lead_ID, 'error': repr(error)})
+         raise
+      logger.error("Error in background check process for Salesforce lead", extra = {'lead_ID': salesforce_lead_ID, 'error': repr(error)})
+      return True
+
+
+"""
+Queues Salesforce 'Background Check' object with an error for given lead, and 'incomplete' background check status
+Parameters: Salesforce lead ID and lead name, name of the error field, and error
+Output: None
+"""
+async def create_BC_error_object(salesforce_lead_ID, salesforce_lead_name, error_field_name, error):
+   BC_object_error_payload = get_BC_object_payload(salesforce_lead_ID, salesforce_lead_name)
+   BC_object_error_payload[error_field_name] = error
+   BC_object_error_payload['Status_Background_Check__c'] = 'incomplete'
+   mark_BC_objects_queued()
+   await run_blocking(backgroundCheck.create_BC_object, BC_object_error_payload)
+
+
+def mark_BC_objects_queued():
+   state = request_state.get()
+   if state is not None:
+      state['BC_objects_queued'] = True
+
+
+"""
+Creates Checkr candidate for Salesforce lead like create_checkr_candidate() of the Flask blueprint
+Parameters: Salesforce lead ID and dictionary containing Salesforce lead PII
+Output: Checkr candidate ID and 'error_occured' boolean indicating whether error has occured
+"""
+@traced('create_checkr_candidate', outcome = lambda result: 'error' if result[1] else 'success')
+async def create_checkr_candidate(salesforce_lead_ID, salesforce_lead_PII_dict):
+   background_check_table = get_background_check_table()
+   lead_item = await run_blocking(get_item_by_lead_ID, background_check_table, salesforce_lead_ID)
+
+   ## If Checkr candidate was created but its report wasn't, resumes at report creation
+   if lead_item is not None and lead_item.get('checkr_status') == "candidate created":
+      logger.info("Resuming background check at report creation for Salesforce lead", extra = {'lead_ID': salesforce_lead_ID, 'candidate_ID': lead_item['checkr_candidate_ID']})
+      return lead_item['checkr_candidate_ID'], False
+
+   if lead_item is not None:
+      logger.warning("Checkr candidate has already been created for Salesforce lead",
+                     extra = {'lead_ID': salesforce_lead_ID, 'candidate_ID': lead_item.get('checkr_candidate_ID'), 'checkr_status': lead_item.get('checkr_status')})
+      await create_BC_error_object(salesforce_lead_ID, get_lead_name(salesforce_lead_PII_dict), 'Error_Create_Candidate__c', "Checkr candidate already created")
+      return '', True
+
+   candidate_payload = dict(salesforce_lead_PII_dict, **{CHECKR_LEAD_ID_FIELD: salesforce_lead_ID})
+   create_candidate_response = await get_async_checkr_client().create_candidate(candidate_payload, idempotency_key = 'candidate-' + salesforce_lead_ID)
+   if create_candidate_response.status_code in RETRY_STATUS_CODES:
+      raise CheckrUnavailableError('/v1/candidates', create_candidate_response.status_code, create_candidate_response.headers.get('Retry-After'))
+   candidate_object = create_candidate_response.json()
+   if create_candidate_response.ok == False:
+      error_create_candidate = candidate_object["error"][0]
+      logger.error("Error in creating Checkr candidate", extra = {'lead_ID': salesforce_lead_ID, 'error': error_create_candidate})
+      await create_BC_error_object(salesforce_lead_ID, get_lead_name(salesforce_lead_PII_dict), 'Error_Create_Candidate__c', error_create_candidate)
+      return '', True
+
+   checkr_candidate_ID = candidate_object["id"]
+   logger.info("Created Checkr candidate", extra = {'lead_ID': salesforce_lead_ID, 'candidate_ID': checkr_candidate_ID})
+   await run_blocking(put_candidate_item, background_check_table, salesforce_lead_ID, get_lead_name(salesforce_lead_PII_dict), checkr_candidate_ID)
+   return checkr_candidate_ID, False
+
+
+"""
+Creates Checkr report for Checkr candidate like create_checkr_report() of the Flask blueprint
+Parameters: Checkr candidate ID, and Salesforce lead ID and lead name (looked up by candidate ID if not given)
+Output: None (returns acknowledgement to Salesforce outbound message if report creation failed)
+"""
+@traced('create_checkr_report', outcome = lambda result: 'error' if result.mimetype == 'application/xml' else 'success')
+async def create_checkr_report(checkr_candidate_ID, salesforce_lead_ID = None, salesforce_lead_name = None):
+   background_check_table = get_background_check_table()
+   if salesforce_lead_ID is None:
+      candidate_item = await run_blocking(get_item_by_candidate_ID, background_check_table, checkr_candidate_ID)
+      salesforce_lead_name = candidate_item['name']
+      salesforce_lead_ID = candidate_item['salesforce_lead_ID']
+
+   payload = {'package' : get_org_settings().checkrPackage, 'candidate_id' : checkr_candidate_ID}
+   create_report_response = await get_async_checkr_client().create_report(payload, idempotency_key = 'report-' + checkr_candidate_ID)
+   if create_report_response.status_code in RETRY_STATUS_CODES:
+      raise CheckrUnavailableError('/v1/reports', create_report_response.status_code, create_report_response.headers.get('Retry-After'))
+   report_object = create_report_response.json()
+   if create_report_response.ok == False:
+      error_create_report = report_object['error'][0]
+      logger.error("Error in creating Checkr report", extra = {'lead_ID': salesforce_lead_ID, 'candidate_ID': checkr_candidate_ID, 'error': error_create_report})
+      await create_BC_error_object(salesforce_lead_ID, salesforce_lead_name, 'Error_Create_Report__c', error_create_report)
+      return get_sf_outbound_msg_acknowledgement()
+
+   checkr_report_ID = report_object['id']
+   logger.info("Created Checkr report", extra = {'lead_ID': salesforce_lead_ID, 'candidate_ID': checkr_candidate_ID, 'report_ID': checkr_report_ID})
+   await run_blocking(set_report_created, background_check_table, salesforce_lead_ID, checkr_candidate_ID, checkr_report_ID)
+   return Response(status = 200)
+
+
+"""
+Handles Checkr webhook like check_report_status() of the Flask blueprint
+Parameters: webhook body
+Output: Flask response
+"""
+async def handle_checkr_webhook(webhook_body):
+   webhook_object = json.loads(webhook_body)
+   logger.info("Received Checkr webhook", extra = {'webhook_ID': webhook_object.get('id'), 'type': webhook_object.get('type')})
+   set_current_org(get_org_by_checkr_account(webhook_object.get('account_id')))
+   if "report.completed" == webhook_object["type"]:
+      checkr_report_ID = webhook_object["data"]["object"]["id"]
+      salesforce_lead_ID = get_lead_ID_from_checkr_object(webhook_object["data"]["object"])
+      job_queue = await run_blocking(get_job_queue)
+      if job_queue is not None:
+         await run_blocking(job_queue.enqueue, 'report_completed', {'checkr_report_ID': checkr_report_ID, 'salesforce_lead_ID': salesforce_lead_ID,
+                                                                    'salesforce_org_ID': get_current_org_ID()})
+         logger.info("Queued report completed job for Checkr report", extra = {'report_ID': checkr_report_ID})
+      else:
+         result = await process_report(checkr_report_ID, salesforce_lead_ID)
+         if isinstance(result, Response) and result.status_code == 503:
+            return result
+   return Response(status = 200)
+
+
+"""
+Retrieves Checkr report and creates Salesforce 'Background Check' object with its results, like process_report() of the Flask blueprint
+The report is retrieved from Checkr while it is claimed (or, without the lead ID, looked up) in DynamoDB, instead of after
+A report that turns out to be already completed was retrieved for nothing, which only happens for redelivered webhooks
+Input: Checkr report ID, and Salesforce lead ID, if known
+Output: None (503 response if no item holds the report yet, error response if the report couldn't be retrieved or a screening has an error)
+"""
+@traced('process_report', outcome = backgroundCheck.response_status_outcome)
+async def process_report(checkr_report_ID, salesforce_lead_ID = None):
+   background_check_table = get_background_check_table()
+   params = {'include':['ssn_trace,sex_offender_search,global_watchlist_search,national_criminal_search']}
+   if salesforce_lead_ID is not None:
+      lookup = run_blocking(claim_report_completion, background_check_table, salesforce_lead_ID, checkr_report_ID, return_item = True)
+   else:
+      lookup = run_blocking(get_item_by_report_ID, background_check_table, checkr_report_ID)
+   lookup_result, retrieve_report_response = await asyncio.gather(lookup, get_async_checkr_client().retrieve_report(checkr_report_ID, params = params),
+                                                                  return_exceptions = True)
+   if isinstance(lookup_result, BaseException):
+      raise lookup_result
+
+   if salesforce_lead_ID is not None:
+      claimed, report_item = lookup_result
+      if claimed == False and report_item is not None and report_item.get('checkr_report_ID') == checkr_report_ID:
+         logger.info("Report already completed so not processing again", extra = {'lead_ID': salesforce_lead_ID, 'report_ID': checkr_report_ID})
+         return
+      if claimed == False:
+         report_item = None
+   else:
+      claimed, report_item = False, lookup_result
+   if report_item is None:
+      logger.warning("No DynamoDB item for Checkr report yet, asking Checkr to deliver webhook again", extra = {'lead_ID': salesforce_lead_ID, 'report_ID': checkr_report_ID})
+      return Response(status = 503)
+   salesforce_lead_name = report_item['name']
+   salesforce_lead_ID = report_item['salesforce_lead_ID']
+
+   if claimed == False and await run_blocking(claim_report_completion, background_check_table, salesforce_lead_ID, checkr_report_ID) == False:
+      logger.info("Report already completed so not processing again", extra = {'lead_ID': salesforce_lead_ID, 'report_ID': checkr_report_ID})
+      return
+
+   try:
+      ## Retrieval failed (e.g. connection error, or deferred by the service guard) after the report was claimed
+      if isinstance(retrieve_report_response, BaseException):
+         raise retrieve_report_response
+      report_results_object = retrieve_report_response.json()
+      mark_BC_objects_queued()
+      result = await run_blocking(process_report_results, checkr_report_ID, salesforce_lead_ID, salesforce_lead_name,
+                                  retrieve_report_response.ok, report_results_object)
+   except Exception:
+      logger.exception("Releasing Checkr report after error so it can be processed again", extra = {'lead_ID': salesforce_lead_ID, 'report_ID': checkr_report_ID})
+      await run_blocking(release_report_completion, background_check_table, salesforce_lead_ID, checkr_report_ID)
+      raise
+   await run_blocking(record_report_completed, salesforce_lead_ID, report_item.get('report_created_at'), report_item.get('report_completed_at') or time.time())
+   return result
+
+
+"""
+Writes 'Background Check' objects queued while handling the current request, before it is answered
+Parameters: None
+Output: None
+"""
+async def flush_BC_objects():
+   state = request_state.get()
+   if state is not None and state.get('BC_objects_queued'):
+      await run_blocking(flush_background_check_writers)
+
+
+"""
+Serves the '/status' endpoint like status() of the Flask blueprint
+Parameters: request headers (lowercase names) and query parameters
+Output: Flask response
+"""
+async def handle_status_request(headers, query_params):
+   return await run_blocking(get_status_response, headers.get('x-api-key'), query_params.get('organization_ID'))
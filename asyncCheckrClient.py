@@ -0,0 +1,180 @@
+import asyncio
+import json
+import random
+import threading
+import aiohttp
+from settings import settings
+from tracing import traced, response_outcome
+from structuredLogging import get_logger
+from rateLimiting import get_service_guard
+from asyncExecutor import run_blocking
+from orgRegistry import get_current_org, get_org_resource
+from checkrClient import DEFAULT_TIMEOUT, DEFAULT_MAX_RETRIES, DEFAULT_BACKOFF_BASE, DEFAULT_BACKOFF_CAP, RETRY_STATUS_CODES
+
+logger = get_logger('asyncCheckrClient')
+
+
+class CheckrResponse:
+   """
+   Checkr API response read in full, with the attributes of a requests response the background check process uses
+   Parameters: status code, headers and body
+   """
+   def __init__(self, status_code, headers, content):
+      self.status_code = status_code
+      self.headers = headers
+      self.content = content
+      self.ok = status_code < 400
+
+   def json(self):
+      return json.loads(self.content)
+
+
+class AsyncCheckrClient:
+   """
+   Asyncio counterpart of CheckrClient (checkrClient.py): every request of every coroutine goes over one aiohttp keep-alive connection pool,
+   with the same timeouts, retries of idempotent requests with jittered exponential backoff, and service guard
+   Parameters: Checkr base URL, Checkr API key, connection pool size, request timeout, maximum retries, backoff base and cap in seconds,
+   and service guard (rateLimiting.py), if any
+   """
+   def __init__(self, base_url, api_key, pool_size=None, timeout=DEFAULT_TIMEOUT,
+                max_retries=DEFAULT_MAX_RETRIES, backoff_base=DEFAULT_BACKOFF_BASE, backoff_cap=DEFAULT_BACKOFF_CAP, guard=None):
+      self.base_url = base_url
+      self.api_key = api_key
+      self.max_retries = max_retries
+      self.backoff_base = backoff_base
+      self.backoff_cap = backoff_cap
+      self.guard = guard
+      pool_size = pool_size or settings.asyncPoolSize
+      self.session = aiohttp.ClientSession(auth=aiohttp.BasicAuth(api_key, ''), timeout=aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1]),
+                                           connector=aiohttp.TCPConnector(limit=pool_size))
+
+   """
+   Creates Checkr candidate through POST request to Checkr API
+   Parameters: candidate data and idempotency key
+   Output: Checkr API response
+   """
+   @traced('checkr_create_candidate', outcome=response_outcome)
+   async def create_candidate(self, data, idempotency_key=None):
+      return await self.request('post', '/v1/candidates', data=data, idempotency_key=idempotency_key)
+
+   """
+   Creates Checkr report through POST request to Checkr API
+   Parameters: report data and idempotency key
+   Output: Checkr API response
+   """
+   @traced('checkr_create_report', outcome=response_outcome)
+   async def create_report(self, data, idempotency_key=None):
+      return await self.request('post', '/v1/reports', data=data, idempotency_key=idempotency_key)
+
+   """
+   Retrieves Checkr report through GET request to Checkr API
+   Parameters: Checkr report ID and URL params
+   Output: Checkr API response
+   """
+   @traced('checkr_retrieve_report', outcome=response_outcome)
+   async def retrieve_report(self, report_ID, params=None):
+      return await self.request('get', '/v1/reports/' + report_ID, params=params)
+
+   """
+   Sends request to Checkr API, retrying connection errors, timeouts and retryable statuses if request is idempotent
+   Form data and URL params are encoded like requests does: fields set to None are left out and list values are repeated
+   Parameters: method, path, form data, URL params and idempotency key
+   Output: Checkr API response (the last one received if all retries failed)
+   Raises ServiceUnavailableError, without sending the request, if the guard defers it
+   """
+   async def request(self, method, path, data=None, params=None, idempotency_key=None):
+      headers = {}
+      if idempotency_key is not None:
+         headers['Idempotency-Key'] = idempotency_key
+      if data is not None:
+         data = {name: str(value) for name, value in data.items() if value is not None}
+      if params is not None:
+         params = [(name, str(value)) for name, values in params.items() for value in (values if isinstance(values, list) else [values])]
+      retryable = method == 'get' or idempotency_key is not None
+      attempt = 0
+      while True:
+         if self.guard is not None:
+            ## The guard may read or write the DynamoDB rate limit table, so it runs off the event loop
+            wait = await run_blocking(self.guard.reserve)
+            if wait > 0:
+               await asyncio.sleep(wait)
+         try:
+            async with self.session.request(method, self.base_url + path, data=data, params=params, headers=headers) as raw_response:
+               response = CheckrResponse(raw_response.status, raw_response.headers, await raw_response.read())
+         except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            if self.guard is not None:
+               await run_blocking(self.guard.record_error)
+            if not retryable or attempt >= self.max_retries:
+               raise
+            logger.warning("Checkr request failed, retrying", extra={'method': method.upper(), 'path': path, 'attempt': attempt + 1, 'error': str(error)})
+            await self.wait(attempt, None)
+            attempt += 1
+            continue
+         if self.guard is not None:
+            await run_blocking(self.guard.record_response, response.status_code, response.headers)
+         if response.status_code not in RETRY_STATUS_CODES or not retryable or attempt >= self.max_retries:
+            return response
+         logger.warning("Checkr responded with retryable status, retrying",
+                        extra={'method': method.upper(), 'path': path, 'attempt': attempt + 1, 'status_code': response.status_code})
+         await self.wait(attempt, response.headers.get('Retry-After'))
+         attempt += 1
+
+   """
+   Sleeps before next retry using exponential backoff with full jitter, or the server's Retry-After if it is longer
+   Parameters: number of the failed attempt and Retry-After header value, if any
+   Output: None
+   """
+   async def wait(self, attempt, retry_after):
+      delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+      if retry_after is not None:
+         try:
+            delay = max(delay, min(self.backoff_cap, float(retry_after)))
+         except ValueError:
+            pass
+      await asyncio.sleep(delay)
+
+   async def close(self):
+      await self.session.close()
+
+
+## Client is kept at module level so every request of the event loop shares its connections
+async_checkr_client = None
+async_checkr_client_lock = threading.Lock()
+
+
+"""
+Returns asyncio Checkr client for current environment, creating it on first use or again after the Checkr API key or URL has changed
+A registered org being handled (orgRegistry.py) gets its own client, with its own API key, connection pool and guard
+Must be called from the event loop the client is used on
+Parameters: None
+Output: asyncio Checkr client
+"""
+def get_async_checkr_client():
+   global async_checkr_client
+   org = get_current_org()
+   if org is not None:
+      api_key = org.checkrApiKey
+      return get_org_resource(org, 'async_checkr_client', lambda: AsyncCheckrClient(org.checkrBaseUrl, api_key, guard=get_service_guard('checkr', org)),
+                              valid=lambda client: client.api_key == api_key)
+   with async_checkr_client_lock:
+      if (async_checkr_client is None or async_checkr_client.api_key != settings.checkrApiKey
+          or async_checkr_client.base_url != settings.checkrBaseUrl):
+         previous_client = async_checkr_client
+         async_checkr_client = AsyncCheckrClient(settings.checkrBaseUrl, settings.checkrApiKey, guard=get_service_guard('checkr'))
+         if previous_client is not None:
+            asyncio.get_running_loop().create_task(previous_client.close())
+      return async_checkr_client
+
+
+"""
+Closes connections of the asyncio Checkr client, e.g. when the ASGI server shuts down
+Parameters: None
+Output: None
+"""
+async def close_async_checkr_client():
+   global async_checkr_client
+   with async_checkr_client_lock:
+      client = async_checkr_client
+      async_checkr_client = None
+   if client is not None:
+      await client.close()
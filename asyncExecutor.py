@@ -0,0 +1,38 @@
+"""
+Runs blocking calls of the asyncio pipeline (asyncBackgroundCheck.py) off the event loop
+boto3 DynamoDB requests, the idempotency ledger, the job queue, the rate limit backend and the buffered Salesforce writer are synchronous,
+so they run in one bounded thread pool shared by every request, in the trace of the request that started them
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from settings import settings
+
+## Executor is kept at module level so every request shares its threads
+blocking_executor = None
+blocking_executor_lock = threading.Lock()
+
+
+"""
+Returns thread pool running blocking calls, creating it on first use
+Parameters: None
+Output: thread pool executor
+"""
+def get_blocking_executor():
+   global blocking_executor
+   with blocking_executor_lock:
+      if blocking_executor is None:
+         blocking_executor = ThreadPoolExecutor(max_workers=settings.asyncBlockingWorkers, thread_name_prefix='blocking')
+      return blocking_executor
+
+
+"""
+Runs blocking function in the thread pool, in a copy of the current context so its spans are recorded in the current trace
+Parameters: function and its arguments
+Output: function's return value
+"""
+async def run_blocking(function, *args, **kwargs):
+   context = contextvars.copy_context()
+   return await asyncio.get_running_loop().run_in_executor(get_blocking_executor(), functools.partial(context.run, function, *args, **kwargs))
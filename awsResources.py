@@ -0,0 +1,75 @@
+import threading
+import boto3
+
+## AWS clients are created once per process and reused by every request and warm Lambda invocation
+## Creating them is slow (boto3 loads service models from disk) and boto3 sessions are not thread-safe, so creation is locked
+## Clients are thread-safe, but resources and the Table objects they create are not, so every thread gets its own resources,
+## built on the process's resource client so they share its connection pool
+aws_session = None
+aws_clients = {}
+aws_resources = {}
+aws_local = threading.local()
+aws_lock = threading.Lock()
+
+
+def get_aws_session():
+   global aws_session
+   if aws_session is None:
+      aws_session = boto3.session.Session()
+   return aws_session
+
+
+"""
+Returns boto3 client for given AWS service, creating it on first use
+Parameters: service name
+Output: boto3 client
+"""
+def get_aws_client(service_name):
+   with aws_lock:
+      if service_name not in aws_clients:
+         aws_clients[service_name] = get_aws_session().client(service_name)
+      return aws_clients[service_name]
+
+
+"""
+Returns boto3 resource for given AWS service of the current thread, creating it on the thread's first use
+Parameters: service name
+Output: boto3 service resource
+"""
+def get_aws_resource(service_name):
+   resources = getattr(aws_local, 'resources', None)
+   if resources is None:
+      resources = aws_local.resources = {}
+   if service_name not in resources:
+      with aws_lock:
+         if service_name not in aws_resources:
+            aws_resources[service_name] = get_aws_session().resource(service_name)
+         process_resource = aws_resources[service_name]
+      ## A resource built on an existing client costs about a millisecond, rather than the 13 ms of a new resource and its client
+      resources[service_name] = type(process_resource)(client=process_resource.meta.client)
+   return resources[service_name]
+
+
+class DynamoDBTable:
+   """
+   DynamoDB Table that can be kept in a module or object and used from any thread: each thread uses a Table object of its own resource
+   Parameters: table name
+   """
+   def __init__(self, table_name):
+      self.table_name = table_name
+      self.local = threading.local()
+
+   def __getattr__(self, name):
+      table = getattr(self.local, 'table', None)
+      if table is None:
+         table = self.local.table = get_aws_resource('dynamodb').Table(self.table_name)
+      return getattr(table, name)
+
+
+"""
+Returns DynamoDB table which can be shared by threads
+Parameters: table name
+Output: DynamoDBTable
+"""
+def get_dynamodb_table(table_name):
+   return DynamoDBTable(table_name)
@@ -1,88 +1,416 @@
-from flask import Flask, Blueprint, request, Response
+from flask import Flask, Blueprint, request, Response, g, has_request_context
 import xmltodict
 import requests
 import json
+import logging
+import math
+import time
+import hmac
 from simple_salesforce import Salesforce, SFType, SalesforceLogin
 import boto3
 from boto3.dynamodb.conditions import Key, Attr
-from threading import Thread
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, HTTPClientError
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
 import xml.etree.ElementTree as ET
 from settings import settings
+from backgroundCheckTable import get_background_check_table, get_item_by_lead_ID, get_item_by_candidate_ID, get_item_by_report_ID
+from backgroundCheckTable import claim_report_completion, release_report_completion, put_candidate_item, set_report_created
+from salesforceClient import get_salesforce_client
+from checkrClient import get_checkr_client, CheckrUnavailableError, RETRY_STATUS_CODES
+from salesforceWriter import get_background_check_writer, flush_background_check_writers
+from salesforceFiles import prepare_records_fields, upload_records_file
+from jobQueue import JobQueue, JobWorkerPool, create_job_queue_backend
+from tracing import get_tracer, span, traced, propagate
+from idempotencyLedger import get_idempotency_ledger, ledger_key
+from rateLimiting import ServiceUnavailableError
+from structuredLogging import get_logger, flush_logs
+from statusCounters import record_report_completed, get_status
+from orgRegistry import get_org, get_org_by_checkr_account, get_org_settings, get_current_org_ID, set_current_org, in_job_org
 
 app = Blueprint('backgroundCheck', __name__, template_folder='templates')
+logger = get_logger('backgroundCheck')
+
+## Checkr candidate field holding the Salesforce lead ID, which Checkr returns on the candidate's reports and report webhooks
+CHECKR_LEAD_ID_FIELD = 'custom_id'
+## Lead fields of the outbound message, retrieved again by job queue workers since jobs don't carry lead PII
+LEAD_FIELDS = ['Id', 'FirstName', 'MiddleName', 'LastName', 'Email', 'PostalCode', 'Birthdate__c', 'SSN__c', 'Phone', 'no_middle_name__c']
+LEAD_ACTION = "/services/data/v49.0/sobjects/Lead/"
+
+
+'''
+Writes the log lines buffered while handling the request once it is finished
+Registered first so it runs after the other teardown functions, and after the request's trace is exported
+Input: exception, if any
+Output: None
+'''
+@app.teardown_request
+def flush_request_logs(exception):
+   flush_logs()
+
+
+'''
+Starts a trace for every request, so stages timed while handling it are exported with the request's endpoint
+Input: None
+Output: None
+'''
+@app.before_request
+def start_request_trace():
+   g.request_trace = get_tracer().start_trace(request.path)
+
+
+'''
+Ends the request's trace, recording the whole request as the 'request' stage
+Registered before flush_BC_objects() so it runs after it and the trace includes the Salesforce write
+Input: Flask response
+Output: Flask response
+'''
+@app.after_request
+def end_request_trace(response):
+   request_trace = g.pop('request_trace', None)
+   if request_trace is not None:
+      get_tracer().end_trace(request_trace, 'error' if response.status_code >= 400 else 'success')
+   return response
+
+
+'''
+Ends the request's trace if the request raised an exception before end_request_trace() ran
+Input: exception, if any
+Output: None
+'''
+@app.teardown_request
+def end_failed_request_trace(exception):
+   request_trace = g.pop('request_trace', None)
+   if request_trace is not None:
+      get_tracer().end_trace(request_trace, 'error')
+
+
+'''
+Deselects the org selected while handling the request, so the next request handled by the same thread starts without one
+Input: exception, if any
+Output: None
+'''
+@app.teardown_request
+def reset_request_org(exception):
+   set_current_org(None)
+
+
+'''
+Answers a request whose work was deferred because Checkr or Salesforce is throttling us or its circuit is open with a 503 and Retry-After,
+so Salesforce redelivers the outbound message, or Checkr the webhook, instead of the work being recorded as an error
+Input: ServiceUnavailableError
+Output: Flask response
+'''
+@app.errorhandler(ServiceUnavailableError)
+def defer_request(error):
+   logger.warning("Deferring request until service is available", extra = {'service': error.service_name, 'retry_after': round(error.retry_after, 1)})
+   return Response(status = 503, headers = {'Retry-After': str(int(math.ceil(error.retry_after)))})
+
+
+'''
+Outcome of a step that returns a Flask response on failure: 'error' if it returned a response with an error status
+Input: value returned by the step
+Output: 'success' or 'error'
+'''
+def response_status_outcome(result):
+   return 'error' if isinstance(result, Response) and result.status_code >= 400 else 'success'
+
+
 @app.route('/background-check', methods=['POST'])
 
 def main():
-   ## Parses Salesforce outbound message after 'Request Background Check' trigger activated for Salesforce lead
+   ## Parses Salesforce outbound message after 'Request Background Check' trigger activated for Salesforce leads
    ## If invalid Organization ID detected, returns acknowledgement to Salesforce outbound message and exits main() 
-   ## Else, retrieves Salesforce lead ID and dictionary containing lead PII 
+   ## Else, retrieves Salesforce lead ID, dictionary containing lead PII and notification ID for every lead in the message
    return_tuple = parse_sf_outbound_msg()
-   invalid_org_id = return_tuple[2]
+   invalid_org_id = return_tuple[1]
    if invalid_org_id == True:
-      print("Returning acknowledgement to Salesforce outbound message")
+      logger.info("Returning acknowledgement to Salesforce outbound message")
       sf_outbound_msg_acknowledgement = get_sf_outbound_msg_acknowledgement()
       return sf_outbound_msg_acknowledgement
    else:
-      salesforce_lead_ID = return_tuple[0]
-      salesforce_lead_PII_dict = return_tuple[1]
-      
-   ## Creates Checkr candidate for Salesforce lead with corresponding lead ID and lead PII
-   ## If error occured in create_checkr_candidate(), returns acknowledgement to Salesforce outbound message and exits main()
-   ## Else, retrieves Checkr candidate ID 
+      salesforce_leads = return_tuple[0]
+
+   ## If a job queue is configured, claims every notification, persists one job per newly claimed lead and acknowledges right away;
+   ## workers run the background check process
+   ## Jobs only carry the lead and notification IDs, so lead PII is never written to the queue, its dead-letter queue or its SQLite file
+   job_queue = get_job_queue()
+   if job_queue is not None:
+      salesforce_leads = claim_notifications(salesforce_leads)
+      if len(salesforce_leads) > 0:
+         try:
+            with span('enqueue_jobs'):
+               job_IDs = job_queue.enqueue_many('background_check', [{'salesforce_lead_ID': lead[0], 'notification_ID': lead[2],
+                                                                      'salesforce_org_ID': get_current_org_ID()} for lead in salesforce_leads])
+         except BaseException:
+            ## Claims are released so the redelivery Salesforce sends after the failed request can queue the jobs
+            release_notifications(salesforce_leads)
+            raise
+         logger.info("Queued background check jobs", extra = {'job_count': len(job_IDs)})
+         complete_notifications(salesforce_leads, 'queued')
+
+   ## Else, runs background check process for every lead concurrently with a bounded number of workers
+   ## Each lead is isolated so an error for one lead doesn't stop the others, and runs in the request's trace
+   ## Error records are queued from the executor's threads, where Flask's 'g' may not be set for flush_BC_objects(), so they are written here
+   elif len(salesforce_leads) > 0:
+      try:
+         with ThreadPoolExecutor(max_workers = min(settings.leadWorkers, len(salesforce_leads))) as executor:
+            list(executor.map(propagate(run_notification_once), salesforce_leads))
+      finally:
+         flush_background_check_writers()
+
+   ## Returns acknowledgement to Salesforce outbound message once for the whole batch and exits main()
+   logger.info("Returning acknowledgement to Salesforce outbound message")
+   sf_outbound_msg_acknowledgement = get_sf_outbound_msg_acknowledgement()
+   return sf_outbound_msg_acknowledgement
+
+
+"""
+Runs background check process for the lead of one outbound message notification, unless the notification was already claimed
+A redelivered notification is skipped without any Checkr, Salesforce or background check table calls, and acknowledged with the rest
+Parameters: (lead ID, dictionary containing lead PII, notification ID) tuple
+Output: 'error_occured' boolean indicating whether error has occured
+"""
+def run_notification_once(lead):
+   salesforce_lead_ID, salesforce_lead_PII_dict, notification_ID = lead
+   ledger = get_idempotency_ledger()
+   ## Notifications without an ID can't be recognized when redelivered, so they are always processed
+   if ledger is None or not notification_ID:
+      return run_background_check(salesforce_lead_ID, salesforce_lead_PII_dict)
+   key = ledger_key(notification_ID, salesforce_lead_ID)
+   if ledger.claim(key) == False:
+      logger.info("Skipping redelivered notification", extra = {'notification_ID': notification_ID, 'lead_ID': salesforce_lead_ID})
+      return False
+   try:
+      error_occured = run_background_check(salesforce_lead_ID, salesforce_lead_PII_dict)
+   except BaseException:
+      ledger.release(key)
+      raise
+   ledger.complete(key, 'error' if error_occured else 'success')
+   return error_occured
+
+
+"""
+Claims notifications of an outbound message concurrently, skipping redelivered ones
+Parameters: list of (lead ID, dictionary containing lead PII, notification ID) tuples
+Output: list of leads whose notification was claimed (or has no ID)
+"""
+def claim_notifications(salesforce_leads):
+   ledger = get_idempotency_ledger()
+   if ledger is None or len(salesforce_leads) == 0:
+      return salesforce_leads
+   def claim(lead):
+      if not lead[2]:
+         return True
+      if ledger.claim(ledger_key(lead[2], lead[0])):
+         return True
+      logger.info("Skipping redelivered notification", extra = {'notification_ID': lead[2], 'lead_ID': lead[0]})
+      return False
+   with ThreadPoolExecutor(max_workers = min(settings.leadWorkers, len(salesforce_leads))) as executor:
+      claimed = list(executor.map(propagate(claim), salesforce_leads))
+   return [lead for lead, lead_claimed in zip(salesforce_leads, claimed) if lead_claimed]
+
+
+"""
+Records notifications as handled in the idempotency ledger concurrently
+Parameters: list of (lead ID, dictionary containing lead PII, notification ID) tuples, and result
+Output: None
+"""
+def complete_notifications(salesforce_leads, result):
+   ledger = get_idempotency_ledger()
+   salesforce_leads = [lead for lead in salesforce_leads if lead[2]]
+   if ledger is None or len(salesforce_leads) == 0:
+      return
+   with ThreadPoolExecutor(max_workers = min(settings.leadWorkers, len(salesforce_leads))) as executor:
+      list(executor.map(propagate(lambda lead: ledger.complete(ledger_key(lead[2], lead[0]), result)), salesforce_leads))
+
+
+"""
+Releases claims of notifications which couldn't be handled, so their redelivery is processed
+Parameters: list of (lead ID, dictionary containing lead PII, notification ID) tuples
+Output: None
+"""
+def release_notifications(salesforce_leads):
+   ledger = get_idempotency_ledger()
+   if ledger is None:
+      return
+   for lead in salesforce_leads:
+      if lead[2]:
+         ledger.release(ledger_key(lead[2], lead[0]))
+
+
+## Error codes of AWS requests that were throttled or failed on the service's side, and may succeed when sent again
+TRANSIENT_AWS_ERROR_CODES = {'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded', 'InternalServerError',
+                             'ServiceUnavailable', 'TransactionConflictException'}
+
+
+"""
+Returns whether an error may not happen again when the work is retried: connection errors and timeouts,
+Checkr still answering with a retryable status, and throttled or failed AWS requests
+Parameters: exception
+Output: boolean
+"""
+def is_transient_error(error):
+   if isinstance(error, (ServiceUnavailableError, requests.ConnectionError, requests.Timeout,
+                         BotocoreConnectionError, HTTPClientError)):
+      return True
+   if isinstance(error, ClientError):
+      return (error.response.get('Error', {}).get('Code') in TRANSIENT_AWS_ERROR_CODES
+              or error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500)
+   return False
+
+
+"""
+Runs background check process for one Salesforce lead: creates Checkr candidate and then Checkr report
+Errors that can't succeed on a retry (e.g. invalid lead data) are caught and logged so that one lead's failure doesn't affect other leads
+in the same outbound message; transient errors (is_transient_error()) are raised, so the outbound message isn't acknowledged
+and the lead is processed again when Salesforce redelivers it
+Parameters: Salesforce lead ID and dictionary containing Salesforce lead PII
+Output: 'error_occured' boolean indicating whether error has occured
+"""
+def run_background_check(salesforce_lead_ID, salesforce_lead_PII_dict):
+   try:
+      ## Creates Checkr candidate for Salesforce lead with corresponding lead ID and lead PII
+      ## If error occured in create_checkr_candidate(), stops background check process for lead
+      ## Else, retrieves Checkr candidate ID 
+      return_tuple_candidate = create_checkr_candidate(salesforce_lead_ID, salesforce_lead_PII_dict)
+      error_occured = return_tuple_candidate[1]
+      if error_occured == True:
+         return error_occured
+      else:
+         checkr_candidate_ID = return_tuple_candidate[0]
+
+      ## Creates Checkr report for Checkr candidate with corresponding candidate ID
+      create_checkr_report(checkr_candidate_ID, salesforce_lead_ID, get_lead_name(salesforce_lead_PII_dict))
+      return False
+   except Exception as error:
+      if is_transient_error(error):
+         logger.warning("Transient error in background check process for Salesforce lead, leaving it for redelivery",
+                        extra = {'lead_ID': salesforce_lead_ID, 'error': repr(error)})
+         raise
+      logger.error("Error in background check process for Salesforce lead", extra = {'lead_ID': salesforce_lead_ID, 'error': repr(error)})
+      return True
+
+
+"""
+Job queue handler which runs background check process for one Salesforce lead
+Unlike run_background_check(), exceptions are raised so the job queue retries the job with backoff
+On a retry, resumes after the last step that completed instead of creating the Checkr candidate again
+The lead's PII is retrieved from Salesforce, since jobs only carry its ID
+Parameters: job payload containing Salesforce lead ID and notification ID, and attempt number
+Output: None
+"""
+def run_background_check_job(payload, attempt):
+   salesforce_lead_ID = payload['salesforce_lead_ID']
+   if attempt > 1:
+      lead_item = get_item_by_lead_ID(get_background_check_table(), salesforce_lead_ID)
+      if lead_item is not None:
+         if lead_item['checkr_status'] == "candidate created":
+            logger.info("Resuming background check job at report creation for Salesforce lead", extra = {'lead_ID': salesforce_lead_ID})
+            create_checkr_report(lead_item['checkr_candidate_ID'], salesforce_lead_ID, lead_item['name'])
+         return
+
+   ## Jobs queued before lead PII was left out of job payloads still carry it
+   salesforce_lead_PII_dict = payload.get('salesforce_lead_PII_dict') or get_lead_PII(salesforce_lead_ID)
    return_tuple_candidate = create_checkr_candidate(salesforce_lead_ID, salesforce_lead_PII_dict)
    error_occured = return_tuple_candidate[1]
-   if error_occured == True:
-      print("Returning acknowledgement to Salesforce outbound message")
-      sf_outbound_msg_acknowledgement = get_sf_outbound_msg_acknowledgement()
-      return sf_outbound_msg_acknowledgement
-   else:
-      checkr_candidate_ID = return_tuple_candidate[0]      
-   
-   ## Creates Checkr report for Checkr candidate with corresponding candidate ID
-   create_checkr_report(checkr_candidate_ID)
-   
-   ## Returns acknowledgement to Salesforce outbound message and exits main()
-   sf_outbound_msg_acknowledgement = get_sf_outbound_msg_acknowledgement()
-   return sf_outbound_msg_acknowledgement         
-   
+   if error_occured == False:
+      create_checkr_report(return_tuple_candidate[0], salesforce_lead_ID, get_lead_name(salesforce_lead_PII_dict))
+
+
+"""
+Job queue handler which processes a completed Checkr report
+A webhook can arrive before create_checkr_report() has stored the report ID, so a missing item raises an exception and the job is retried
+Parameters: job payload containing Checkr report ID and, for candidates with a custom ID, Salesforce lead ID, and attempt number
+Output: None
+"""
+def report_completed_job(payload, attempt):
+   process_report(payload['checkr_report_ID'], salesforce_lead_ID = payload.get('salesforce_lead_ID'), raise_if_missing = True)
+
+
+## Handlers for each job type run by the job queue workers
+## Jobs run for the org that queued them
+JOB_HANDLERS = {'background_check': in_job_org(run_background_check_job), 'report_completed': in_job_org(report_completed_job)}
+
+## Job queue and its local worker pool are kept at module level so they are created once per process
+job_queue = None
+job_worker_pool = None
+job_queue_lock = Lock()
 
 
 """
-Parses Salesforce outbound message after 'Request Background Check' trigger activated for Salesforce lead
+Returns job queue for configured backend, creating it on first use
+Local backends ('memory' and 'sqlite') are drained by worker threads started in this process; SQS is drained by jobWorker.py
 Parameters: None
-Output: lead ID, dictionary containing lead PII (Personally Identifiable Information), and 'invalid_org_id' boolean indicating whether invalid Organization ID detected
+Output: job queue, or None if no job queue backend is configured
+"""
+def get_job_queue():
+   global job_queue, job_worker_pool
+   with job_queue_lock:
+      if job_queue is None and settings.jobQueueBackend:
+         job_queue = JobQueue(create_job_queue_backend(), JOB_HANDLERS, max_attempts = settings.jobMaxAttempts)
+         if settings.jobQueueBackend in ['memory', 'sqlite']:
+            job_worker_pool = JobWorkerPool(job_queue, settings.jobWorkers).start()
+      return job_queue
+
+
+"""
+Parses Salesforce outbound message after 'Request Background Check' trigger activated for Salesforce leads
+Salesforce can batch up to 100 notifications in one outbound message, so every notification is parsed
+The message's org, this environment's org or one registered in orgRegistry.py, is selected for the rest of the request
+Parameters: outbound message body (default: body of the current Flask request)
+Output: list of (lead ID, dictionary containing lead PII (Personally Identifiable Information), notification ID) tuples, and 'invalid_org_id' boolean indicating whether invalid Organization ID detected
 """
-def parse_sf_outbound_msg():
-   outbound_msg_dict = xmltodict.parse(request.data)
+@traced('parse_outbound_message')
+def parse_sf_outbound_msg(outbound_msg_body = None):
+   ## 'Notification' is always parsed as a list, even when the message only contains one
+   outbound_msg_dict = xmltodict.parse(request.data if outbound_msg_body is None else outbound_msg_body, force_list = ('Notification',))
    
    ## Retrieves Salesforce Organization ID from outbound message and checks whether it matches Morning Star Foundation's Organization ID
-   ## This prevents someone from outside Morning Star Foundation running the background check process
+   ## or the Organization ID of a registered org
+   ## This prevents someone from outside Morning Star Foundation and its registered orgs running the background check process
    organizationID = outbound_msg_dict["soapenv:Envelope"]["soapenv:Body"]['notifications']['OrganizationId']
-   ## If organization ID is invalid, sets 'invalid_org_id' to True, puts in placeholders for 'salesforce_lead_ID' and 'salesforce_lead_PII_dict', and returns all three fields
-   if organizationID != settings.salesforceOrgID:
-      print("Invalid Organization ID")
+   org = get_org(organizationID) if organizationID != settings.salesforceOrgID else None
+   ## If organization ID is invalid, sets 'invalid_org_id' to True, puts in placeholder for 'salesforce_leads', and returns both fields
+   if organizationID != settings.salesforceOrgID and org is None:
+      logger.warning("Invalid Organization ID")
       invalid_org_id = True
-      salesforce_lead_ID = ''
-      salesforce_lead_PII_dict = {}
-      return salesforce_lead_ID, salesforce_lead_PII_dict, invalid_org_id      
+      salesforce_leads = []
+      return salesforce_leads, invalid_org_id      
    else:
-      print("Valid Organization ID")
+      logger.debug("Valid Organization ID")
+      set_current_org(org)
 
-   ## Retrieves Salesforce lead ID and PII from outbound message
-   print("")
-   print("Salesforce Lead")
-   lead_dict = outbound_msg_dict["soapenv:Envelope"]["soapenv:Body"]['notifications']['Notification']['sObject']
+   ## Retrieves Salesforce lead ID, PII and notification ID for every notification in outbound message
+   ## A notification that can't be parsed is skipped so the rest of the batch is still processed
+   notifications = outbound_msg_dict["soapenv:Envelope"]["soapenv:Body"]['notifications'].get('Notification') or []
+   logger.info("Parsed Salesforce outbound message", extra = {'notification_count': len(notifications)})
+   salesforce_leads = []
+   for notification in notifications:
+      try:
+         salesforce_leads.append(parse_sf_lead(notification['sObject']) + (notification.get('Id'),))
+      except (KeyError, TypeError) as error:
+         logger.warning("Skipping notification that could not be parsed", extra = {'notification_ID': notification.get('Id'), 'missing_field': str(error)})
+
+   ## Set 'invalid_org_id' field to False and returns it along with list of leads
+   invalid_org_id = False
+   return salesforce_leads, invalid_org_id
+
+
+"""
+Retrieves Salesforce lead ID and PII from lead sObject of one outbound message notification
+Parameters: dictionary of lead sObject fields
+Output: lead ID and dictionary containing lead PII
+"""
+def parse_sf_lead(lead_dict):
    salesforce_lead_ID = lead_dict["sf:Id"]
-   print("lead ID: " + salesforce_lead_ID)
+   logger.debug("Parsed Salesforce lead", extra = {'lead_ID': salesforce_lead_ID})
    first_name = lead_dict["sf:FirstName"]
-   print("first name: " + first_name)
    no_middle_name = bool(lead_dict["sf:no_middle_name__c"])
    middle_name = None
    if no_middle_name == False:
       middle_name = lead_dict["sf:MiddleName"]
-   print("middle_name: " + str(middle_name))
    last_name = lead_dict["sf:LastName"]
-   print("last name: " + last_name)
    email = lead_dict["sf:Email"]
    zipcode = lead_dict["sf:PostalCode"][0:5]
    dob =  lead_dict["sf:Birthdate__c"]
@@ -92,10 +420,32 @@ def parse_sf_outbound_msg():
    ## Creates dictionary containing Salesforce lead PII
    salesforce_lead_PII_dict = {'first_name':first_name,'no_middle_name':no_middle_name,'middle_name':middle_name,'last_name':last_name,'email':email,
                                'zipcode':zipcode,'dob':dob,'ssn':ssn,'phone':phone}
-   
-   ## Set 'invalid_org_id' field to False and returns it along with lead ID and dictionary containing lead PII    
-   invalid_org_id = False
-   return salesforce_lead_ID, salesforce_lead_PII_dict, invalid_org_id
+   return salesforce_lead_ID, salesforce_lead_PII_dict
+
+
+"""
+Converts lead fields retrieved through the REST API, or read from a file, to the lead ID and PII dictionary, with parse_sf_lead()
+Parameters: dictionary of lead fields
+Output: lead ID and dictionary containing lead PII
+"""
+def parse_lead_row(row):
+   fields = {'sf:' + name: row[name] for name in LEAD_FIELDS if name != 'MiddleName'}
+   fields['sf:MiddleName'] = row.get('MiddleName')
+   ## CSV and JSONL files hold the checkbox as text, while the REST API returns a boolean
+   if isinstance(row['no_middle_name__c'], str):
+      fields['sf:no_middle_name__c'] = row['no_middle_name__c'].strip().lower() in ['true', '1', 'yes']
+   return parse_sf_lead(fields)
+
+
+"""
+Retrieves lead's fields from Salesforce for a job queue worker
+Parameters: Salesforce lead ID
+Output: dictionary containing Salesforce lead PII
+"""
+@traced('salesforce_get_lead')
+def get_lead_PII(salesforce_lead_ID):
+   lead_row = sf_api_call(LEAD_ACTION + salesforce_lead_ID, parameters = {'fields': ','.join(LEAD_FIELDS)})
+   return parse_lead_row(lead_row)[1]
 
 
 """
@@ -103,39 +453,47 @@ Creates Checkr candidate for Salesforce lead with corresponding lead ID and lead
 Parameters: Salesforce lead ID and dictionary containing Salesforce lead PII
 Output: Checkr candidate ID and 'error_occured' boolean indicating whether error has occured
 """
+@traced('create_checkr_candidate', outcome = lambda result: 'error' if result[1] else 'success')
 def create_checkr_candidate(salesforce_lead_ID, salesforce_lead_PII_dict):
    ## Queries Salesforce lead ID in DynamoDB table to check if Checkr candidate has already been created for Salesforce lead
-   dynamodb = boto3.resource('dynamodb')
-   background_check_table = dynamodb.Table(settings.backgroundCheckTable)
-   print("")
-   print("Querying DynamoDB table to see if Checkr candidate has already been created for Salesforce lead (lead_ID: " + salesforce_lead_ID + ")")
-   lead_ID_query = background_check_table.scan(FilterExpression=Attr('salesforce_lead_ID').eq(salesforce_lead_ID))
+   background_check_table = get_background_check_table()
+   logger.debug("Querying DynamoDB table to see if Checkr candidate has already been created for Salesforce lead", extra = {'lead_ID': salesforce_lead_ID})
+   lead_item = get_item_by_lead_ID(background_check_table, salesforce_lead_ID)
    
+   ## If Checkr candidate was created but its report wasn't, e.g. because report creation was deferred, resumes at report creation
+   ## The report's idempotency key keeps Checkr from creating a second report if another request is creating it
+   if lead_item is not None and lead_item.get('checkr_status') == "candidate created":
+      logger.info("Resuming background check at report creation for Salesforce lead", extra = {'lead_ID': salesforce_lead_ID, 'candidate_ID': lead_item['checkr_candidate_ID']})
+      error_occured = False
+      return lead_item['checkr_candidate_ID'], error_occured
+
    ## If Checkr candidate already exists for Salesforce lead, creates a Salesforce 'Background Check' object with error for given lead
    ## Then sets 'error_occured' to True, puts in placeholder for 'checkr_candidate_ID', and returns both fields
-   if lead_ID_query['Count'] != 0:
-      print("Checkr candidate has already been created for Salesforce lead (lead_ID: " + salesforce_lead_ID + ")")
-      print(lead_ID_query['Items'])
+   if lead_item is not None:
+      logger.warning("Checkr candidate has already been created for Salesforce lead",
+                     extra = {'lead_ID': salesforce_lead_ID, 'candidate_ID': lead_item.get('checkr_candidate_ID'), 'checkr_status': lead_item.get('checkr_status')})
       ### Gets 'Background Check' object payload for given Salesforce lead and updates it with error and 'incomplete' background check status
       salesforce_lead_name = salesforce_lead_PII_dict['first_name'] + ' ' + salesforce_lead_PII_dict['last_name']
       BC_object_error_payload = get_BC_object_payload(salesforce_lead_ID, salesforce_lead_name)
       BC_object_error_payload['Error_Create_Candidate__c'] = "Checkr candidate already created"
       BC_object_error_payload['Status_Background_Check__c'] = 'incomplete'
-      ### Creates a Salesforce 'Background Check' object with error for given lead by making call to Salesforce REST API
-      call = sf_api_call("/services/data/v49.0/sobjects/Background_Check__c", method = "post", data = BC_object_error_payload)      
-      BC_object_id = call.get('id')
-      print("Created Background Check object (" + BC_object_id + ") for Salesforce lead containing error")            
+      ### Creates a Salesforce 'Background Check' object with error for given lead through buffered call to Salesforce REST API
+      create_BC_object(BC_object_error_payload)
       ### Sets 'error_occured' to True, puts in placeholder for 'checkr_candidate_ID', and returns both fields
       error_occured = True
       checkr_candidate_ID = ''
       return checkr_candidate_ID, error_occured
-   else:
-      print("Checkr candidate does not exist for Salesforce lead (lead_ID: " + salesforce_lead_ID + ")")
 
    ## Creates a Checkr candidate for Salesforce lead through POST request to Checkr API
-   print("")
-   print("Creating Checkr candidate for Salesforce lead (lead_ID: " + salesforce_lead_ID + ")")
-   create_candidate_response =  requests.post(url = settings.checkrBaseUrl + '/v1/candidates', auth = (settings.checkrApiKey, ''), data = salesforce_lead_PII_dict)
+   logger.debug("Creating Checkr candidate for Salesforce lead", extra = {'lead_ID': salesforce_lead_ID})
+   ## Idempotency key makes retried POSTs return the same candidate instead of creating another one
+   ## Lead ID is stamped on the candidate as its custom ID, so Checkr reports and webhooks carry it back without a DynamoDB lookup
+   candidate_payload = dict(salesforce_lead_PII_dict, **{CHECKR_LEAD_ID_FIELD: salesforce_lead_ID})
+   create_candidate_response = get_checkr_client().create_candidate(candidate_payload, idempotency_key = 'candidate-' + salesforce_lead_ID)
+   ## Checkr still throttling or failing once the client's retries are spent is raised, so the lead is retried rather than recorded as an error
+   if create_candidate_response.status_code in RETRY_STATUS_CODES:
+      create_candidate_response.close()
+      raise CheckrUnavailableError('/v1/candidates', create_candidate_response.status_code, create_candidate_response.headers.get('Retry-After'))
    candidate_object = create_candidate_response.json()
    create_candidate_response.close()
    
@@ -144,32 +502,25 @@ def create_checkr_candidate(salesforce_lead_ID, salesforce_lead_PII_dict):
    if create_candidate_response.ok == False:
       ### Retrieves error
       error_create_candidate = candidate_object["error"][0]
-      print("Error in creating Checkr candidate: " + error_create_candidate)
+      logger.error("Error in creating Checkr candidate", extra = {'lead_ID': salesforce_lead_ID, 'error': error_create_candidate})
       ### Gets 'Background Check' object payload for given Salesforce lead and updates it with error and 'incomplete' background check status
       salesforce_lead_name = salesforce_lead_PII_dict['first_name'] + ' ' + salesforce_lead_PII_dict['last_name']
       BC_object_error_payload = get_BC_object_payload(salesforce_lead_ID, salesforce_lead_name)
       BC_object_error_payload['Error_Create_Candidate__c'] = error_create_candidate
       BC_object_error_payload['Status_Background_Check__c'] = 'incomplete'
-      ### Creates a Salesforce 'Background Check' object with error for given lead by making call to Salesforce REST API
-      call = sf_api_call("/services/data/v49.0/sobjects/Background_Check__c", method = "post", data = BC_object_error_payload)
-      BC_object_id = call.get('id')
-      print("Created Background Check object (" + BC_object_id + ") for Salesforce lead containing error")            
+      ### Creates a Salesforce 'Background Check' object with error for given lead through buffered call to Salesforce REST API
+      create_BC_object(BC_object_error_payload)
       ## Sets 'error_occured' to True, puts in placeholder for 'checkr_candidate_ID', and returns both fields
       error_occured = True
       checkr_candidate_ID = ''
       return checkr_candidate_ID, error_occured
-   else:
-      print("No errors in creating Checkr candidate")
 
    ## Retrieves ID of Checkr candidate
    checkr_candidate_ID = candidate_object["id"]
-   print("Checkr candidate ID: " + checkr_candidate_ID)
+   logger.info("Created Checkr candidate", extra = {'lead_ID': salesforce_lead_ID, 'candidate_ID': checkr_candidate_ID})
 
-   ### Creates new item in DynamoDB table for Checkr candidate
-   print("")
-   print("Creating new item in DynamoDB table for Checkr candidate (candidate_ID: " + checkr_candidate_ID + ")")
-   background_check_table.put_item(Item={'name': salesforce_lead_PII_dict['first_name'] + ' ' + salesforce_lead_PII_dict['last_name'], 'salesforce_lead_ID': salesforce_lead_ID, 
-                                         'checkr_candidate_ID': checkr_candidate_ID, 'checkr_report_ID': '', 'checkr_status': "candidate created"})
+   ### Creates new item in DynamoDB table for Checkr candidate, counted in the status counters
+   put_candidate_item(background_check_table, salesforce_lead_ID, get_lead_name(salesforce_lead_PII_dict), checkr_candidate_ID)
    
    ## Sets 'error_occured' field to False and returns it along with checkr candidate ID    
    error_occured = False
@@ -178,125 +529,163 @@ def create_checkr_candidate(salesforce_lead_ID, salesforce_lead_PII_dict):
 
 """
 Creates Checkr report for Checkr candidate with corresponding candidate ID
-Parameters: Checkr candidate ID
-Output: None
+Callers that know the Salesforce lead ID and name pass them, so the report is recorded with one conditional update by primary key and no read
+Parameters: Checkr candidate ID, and Salesforce lead ID and lead name (looked up by candidate ID if not given)
+Output: None (returns acknowledgement to Salesforce outbound message if report creation failed, which the span records as an error)
 """
-def create_checkr_report(checkr_candidate_ID):
-   ## Gets Salesforce lead name and lead ID for given Checkr candidate ID in DynamoDB table
-   dynamodb = boto3.resource('dynamodb')
-   background_check_table = dynamodb.Table(settings.backgroundCheckTable)
-   candidate_ID_query = background_check_table.scan(FilterExpression=Attr('checkr_candidate_ID').eq(checkr_candidate_ID))
-   salesforce_lead_name = candidate_ID_query['Items'][0]['name']
-   salesforce_lead_ID = candidate_ID_query['Items'][0]['salesforce_lead_ID']
+@traced('create_checkr_report', outcome = lambda result: 'error' if result.mimetype == 'application/xml' else 'success')
+def create_checkr_report(checkr_candidate_ID, salesforce_lead_ID = None, salesforce_lead_name = None):
+   background_check_table = get_background_check_table()
+   ## Gets Salesforce lead name and lead ID for given Checkr candidate ID in DynamoDB table if the caller doesn't know them
+   if salesforce_lead_ID is None:
+      candidate_item = get_item_by_candidate_ID(background_check_table, checkr_candidate_ID)
+      salesforce_lead_name = candidate_item['name']
+      salesforce_lead_ID = candidate_item['salesforce_lead_ID']
    
    ## Creates Checkr report for given Checkr candidate with corresponding candidate ID
-   print("")
-   print("Creating Checkr report for candidate (candidate_ID: " + checkr_candidate_ID + ")")
-   payload = {'package' : settings.checkrPackage, 'candidate_id' : checkr_candidate_ID}
-   create_report_response =  requests.post(url = settings.checkrBaseUrl + '/v1/reports', auth = (settings.checkrApiKey, ''), data = payload)
+   logger.debug("Creating Checkr report for candidate", extra = {'lead_ID': salesforce_lead_ID, 'candidate_ID': checkr_candidate_ID})
+   payload = {'package' : get_org_settings().checkrPackage, 'candidate_id' : checkr_candidate_ID}
+   create_report_response = get_checkr_client().create_report(payload, idempotency_key = 'report-' + checkr_candidate_ID)
+   if create_report_response.status_code in RETRY_STATUS_CODES:
+      create_report_response.close()
+      raise CheckrUnavailableError('/v1/reports', create_report_response.status_code, create_report_response.headers.get('Retry-After'))
    report_object = create_report_response.json()
    create_report_response.close()
    ## If error in creating Checkr report, creates a Salesforce 'Background Check' object with error for given lead, and returns acknowledgement to Salesforce outbound message
    if create_report_response.ok == False:
       ### Retrieves error
       error_create_report = report_object['error'][0]
-      print("Error in creating Checkr report: " + error_create_report)
+      logger.error("Error in creating Checkr report", extra = {'lead_ID': salesforce_lead_ID, 'candidate_ID': checkr_candidate_ID, 'error': error_create_report})
       ### Creates 'Background Check' object payload for given Salesforce lead and updates it with error and incomplete 'background_check' status
       BC_object_error_payload = get_BC_object_payload(salesforce_lead_ID, salesforce_lead_name)
       BC_object_error_payload['Error_Create_Report__c'] = error_create_report
       BC_object_error_payload['Status_Background_Check__c'] = 'incomplete'
       ### Creates a Salesforce 'Background Check' object with error for given lead
-      call = sf_api_call("/services/data/v49.0/sobjects/Background_Check__c", method = "post", data = BC_object_error_payload)
-      BC_object_id = call.get('id')
-      print("Created Background Check object (" + BC_object_id + ") for Salesforce lead containing error")      
+      create_BC_object(BC_object_error_payload)
       ## Return acknowledgement to Salesforce outbound message
       sf_outbound_msg_acknowledgement = get_sf_outbound_msg_acknowledgement()
       return sf_outbound_msg_acknowledgement  
-   else:
-      print("No errors in creating report")
 
    ## Retrieves Checkr report ID
    checkr_report_ID = report_object['id']
-   print("checkr_report_ID: " + checkr_report_ID)
-
-   ## Updates report ID and status for Checkr candidate in DynamoDB table
-   dynamodb = boto3.resource('dynamodb')
-   background_check_table = dynamodb.Table(settings.backgroundCheckTable)
-   print("")
-   print("Updating report ID and status for Checkr candidate (candidate_ID: " + checkr_candidate_ID + ")" " in DynamoDB table")
-   response = background_check_table.update_item(
-    Key={'salesforce_lead_ID': salesforce_lead_ID},
-    UpdateExpression="set checkr_status=:v1, checkr_report_ID=:v2",
-    ExpressionAttributeValues={
-        ':v1': "report created",
-        ':v2': checkr_report_ID
-    },
-    ReturnValues="UPDATED_NEW"
-   )
+   logger.info("Created Checkr report", extra = {'lead_ID': salesforce_lead_ID, 'candidate_ID': checkr_candidate_ID, 'report_ID': checkr_report_ID})
+
+   ## Updates report ID and status for Checkr candidate in DynamoDB table, and adds the report to the outstanding reports of the status counters
+   set_report_created(background_check_table, salesforce_lead_ID, checkr_candidate_ID, checkr_report_ID)
 
    return Response(status = 200)
 
 
 """
 Retrieves Checkr report and creates Salesforce 'Background Check' object with report results for Salesforce lead
-Input: Checkr report ID
-Output: None
+The report is claimed with an atomic 'report created' to 'report completed' transition first, so it is processed exactly once
+however many times its webhook is delivered; if processing raises an exception, the claim is released so it can be retried
+If the Salesforce lead ID is known (from the candidate's custom ID), the claim is the only DynamoDB request: it returns the lead's name
+Otherwise, e.g. for candidates created before lead IDs were stamped on them, the item is looked up by report ID first
+A report found on no item may only be missing from the eventually consistent 'checkr_report_ID-index', or not be stored yet by
+create_checkr_report(), so it is answered with a 503 for Checkr to deliver the webhook again rather than acknowledged and dropped
+Input: Checkr report ID, report already retrieved with retrieve_completed_report(), if any, Salesforce lead ID, if known,
+and whether to raise LookupError instead of returning if no item holds the report yet
+Output: None (503 response if no item holds the report yet, error response if the report couldn't be retrieved or a screening has an error)
 """
-def process_report(report_ID):
-   ## Gets lead ID for given Checkr report ID in DynamoDB table
+@traced('process_report', outcome = response_status_outcome)
+def process_report(report_ID, retrieve_report_response = None, salesforce_lead_ID = None, raise_if_missing = False):
    checkr_report_ID = report_ID
-   dynamodb = boto3.resource('dynamodb')
-   background_check_table = dynamodb.Table(settings.backgroundCheckTable)
-   report_ID_query = background_check_table.scan(FilterExpression=Attr('checkr_report_ID').eq(checkr_report_ID))
-   salesforce_lead_name = report_ID_query['Items'][0]['name']
-   salesforce_lead_ID = report_ID_query['Items'][0]['salesforce_lead_ID']
-   
-   ## Updates DynamoDB table to indicate that Checkr report is completed
-   print("Updating status to 'report_completed' in DynamoDB table for Checkr report (report_ID: " + checkr_report_ID + ")")
-   response = background_check_table.update_item(
-    Key={'salesforce_lead_ID': salesforce_lead_ID},
-    UpdateExpression="set checkr_status=:v1",
-    ExpressionAttributeValues={
-        ':v1': "report completed",
-    },
-    ReturnValues="UPDATED_NEW"
-   )
-
-   ### Retrieves Checkr report with corresponding report_ID through GET request to Checkr API
-   print("")
-   print("Retrieving completed report from Checkr (report_ID: " + checkr_report_ID + ")")
+   background_check_table = get_background_check_table()
+   if salesforce_lead_ID is not None:
+      ## Updates DynamoDB table to indicate that Checkr report is completed, unless another delivery of the webhook already did
+      claimed, report_item = claim_report_completion(background_check_table, salesforce_lead_ID, checkr_report_ID, return_item = True)
+      if claimed == False:
+         if report_item is not None and report_item.get('checkr_report_ID') == checkr_report_ID:
+            logger.info("Report already completed so not processing again", extra = {'lead_ID': salesforce_lead_ID, 'report_ID': checkr_report_ID})
+            return
+         ## A webhook can arrive before create_checkr_report() has stored the report ID on the lead's item
+         report_item = None
+   else:
+      ## Gets lead ID for given Checkr report ID in DynamoDB table
+      claimed = False
+      report_item = get_item_by_report_ID(background_check_table, checkr_report_ID)
+   if report_item is None:
+      if raise_if_missing:
+         raise LookupError("No DynamoDB item for Checkr report (report_ID: " + checkr_report_ID + ") yet")
+      logger.warning("No DynamoDB item for Checkr report yet, asking Checkr to deliver webhook again", extra = {'lead_ID': salesforce_lead_ID, 'report_ID': checkr_report_ID})
+      return Response(status = 503)
+   salesforce_lead_name = report_item['name']
+   salesforce_lead_ID = report_item['salesforce_lead_ID']
+
+   ## Updates DynamoDB table to indicate that Checkr report is completed, unless another delivery of the webhook already did
+   if claimed == False and claim_report_completion(background_check_table, salesforce_lead_ID, checkr_report_ID) == False:
+      logger.info("Report already completed so not processing again", extra = {'lead_ID': salesforce_lead_ID, 'report_ID': checkr_report_ID})
+      return
+
+   try:
+      result = process_completed_report(checkr_report_ID, salesforce_lead_ID, salesforce_lead_name, retrieve_report_response)
+   except Exception:
+      logger.exception("Releasing Checkr report after error so it can be processed again", extra = {'lead_ID': salesforce_lead_ID, 'report_ID': checkr_report_ID})
+      release_report_completion(background_check_table, salesforce_lead_ID, checkr_report_ID)
+      raise
+   ## Completion is only counted once the claim is no longer released, like the item's status
+   record_report_completed(salesforce_lead_ID, report_item.get('report_created_at'), report_item.get('report_completed_at') or time.time())
+   return result
+
+
+"""
+Retrieves Checkr report with SSN Trace, Sex Offender Search, Global Watchlist Search, and National Criminal Search through GET request to Checkr API
+Input: Checkr report ID
+Output: Checkr API response
+"""
+def retrieve_completed_report(checkr_report_ID):
+   logger.debug("Retrieving completed report from Checkr", extra = {'report_ID': checkr_report_ID})
    params = {'include':['ssn_trace,sex_offender_search,global_watchlist_search,national_criminal_search']}
-   retrieve_report_response = requests.get(url = settings.checkrBaseUrl + '/v1/reports/' + checkr_report_ID, auth = (settings.checkrApiKey, ''), params = params)
+   return get_checkr_client().retrieve_report(checkr_report_ID, params = params)
+
+
+"""
+Retrieves completed Checkr report and creates Salesforce 'Background Check' object with report results for Salesforce lead
+Input: Checkr report ID, Salesforce lead ID and lead name, and report already retrieved with retrieve_completed_report(), if any
+Output: None
+"""
+def process_completed_report(checkr_report_ID, salesforce_lead_ID, salesforce_lead_name, retrieve_report_response = None):
+   ### Retrieves Checkr report with corresponding report_ID through GET request to Checkr API, unless the caller already did
+   if retrieve_report_response is None:
+      retrieve_report_response = retrieve_completed_report(checkr_report_ID)
    report_results_object = retrieve_report_response.json()
    retrieve_report_response.close()
+   return process_report_results(checkr_report_ID, salesforce_lead_ID, salesforce_lead_name, retrieve_report_response.ok, report_results_object)
+
+
+"""
+Creates Salesforce 'Background Check' object with results of a retrieved Checkr report, or with the error if it couldn't be retrieved
+The object is written before returning, and an error writing it is raised, so process_report() releases the report's claim
+and the redelivered webhook creates it again
+Input: Checkr report ID, Salesforce lead ID and lead name, whether the report was retrieved, and Checkr API response body
+Output: None (returns error response if the report couldn't be retrieved or a screening has an error)
+"""
+def process_report_results(checkr_report_ID, salesforce_lead_ID, salesforce_lead_name, report_retrieved, report_results_object):
    ## If error in retrieving Checkr report, creates a Salesforce 'Background Check' object with error for given lead, and returns error code
    ## Also returns error code which terminates background check process
-   if retrieve_report_response.ok == False:
+   if report_retrieved == False:
       error_retrieve_report = report_results_object['error'][0]
-      print("error_retrieve_report: " + error_retrieve_report)
+      logger.error("Error in retrieving Checkr report", extra = {'lead_ID': salesforce_lead_ID, 'report_ID': checkr_report_ID, 'error': error_retrieve_report})
       ### Creates 'Background Check' object payload for given Salesforce lead and updates it with error and incomplete 'background_check' status
       BC_object_error_payload = get_BC_object_payload(salesforce_lead_ID, salesforce_lead_name)
       BC_object_error_payload['Error_Retrieve_Report__c'] = error_retrieve_report
       BC_object_error_payload['Status_Background_Check__c'] = 'incomplete'
       ### Creates a Salesforce 'Background Check' object with error for given lead
-      call = sf_api_call("/services/data/v49.0/sobjects/Background_Check__c", method = "post", data = BC_object_error_payload)
-      BC_object_id = call.get('id')
-      print("Created Background Check object (" + BC_object_id + ") for Salesforce lead containing error")  
+      create_BC_object(BC_object_error_payload, wait = True)
       ## Returns error 
       return Response(status = 400)
-   else:
-      print("No errors in retrieving report")
    
    ## If error in SSN Trace, Sex Offender Search, Global Watchlist Search, or National Criminal Search, creates a Salesforce 'Background Check' object with error for given lead
    ## Also returns error code
+   ## Screening objects hold SSNs, dates of birth, addresses and records, which the logger redacts; they are only logged at DEBUG level
    ssn_trace_object = report_results_object['ssn_trace']
-   print(ssn_trace_object)
    sex_offender_search_object = report_results_object['sex_offender_search']
-   print(sex_offender_search_object)
    global_watchlist_search_object = report_results_object['global_watchlist_search']
-   print(global_watchlist_search_object)
    national_criminal_search_object = report_results_object['national_criminal_search']
-   print(national_criminal_search_object)
+   if logger.isEnabledFor(logging.DEBUG):
+      logger.debug("Retrieved Checkr report", extra = {'report_ID': checkr_report_ID, 'ssn_trace': ssn_trace_object, 'sex_offender_search': sex_offender_search_object,
+                                                       'global_watchlist_search': global_watchlist_search_object, 'national_criminal_search': national_criminal_search_object})
    background_check_objects = [ssn_trace_object, sex_offender_search_object, global_watchlist_search_object, national_criminal_search_object]
    for object in background_check_objects:
       if "error" in object:
@@ -311,24 +700,16 @@ def process_report(report_ID):
          BC_object_error_payload[error_field_name] = object['error'][0]
          BC_object_error_payload['Status_Background_Check__c'] = 'incomplete'
          ### Creates a Salesforce 'Background Check' object with error for given lead         
-         call = sf_api_call("/services/data/v49.0/sobjects/Background_Check__c", method = "post", data = BC_object_error_payload)
-         BC_object_id = call.get('id')
-         print("Error in " + object["object"] + ": " + object['error'][0])
-         print("Created Background Check object (" + BC_object_id + ") for Salesforce lead containing error")   
+         create_BC_object(BC_object_error_payload, wait = True)
+         logger.error("Error in Checkr screening", extra = {'lead_ID': salesforce_lead_ID, 'report_ID': checkr_report_ID, 'screening': object["object"], 'error': object['error'][0]})
          return Response(status = 400)
-   print("")
-   print("No errors in SSN Trace, Sex Offender Search, Global Watchlist Search, and National Criminal Search")
       
    ## Parses Checkr report, creates 'Background Check' object payload for given Salesforce lead, and updates 'Background Check' object payload with report contents 
-   print("Results of Checkr report (report_ID: " + checkr_report_ID + ")")
    BC_object_payload = get_BC_object_payload(salesforce_lead_ID, salesforce_lead_name)
    BC_object_payload['Status_Background_Check__c'] = report_results_object['status'] 
-   print("")
-   print("overall status: " + report_results_object['status'])
    BC_object_payload['Turnaround_Time_Background_Check__c'] = report_results_object['turnaround_time']
    ssn_trace_object = report_results_object['ssn_trace']
    BC_object_payload['SSN_Trace_Status__c'] = ssn_trace_object['status']   
-   print("ssn_trace_status: " + ssn_trace_object['status'])
    BC_object_payload['Turnaround_Time_SSN_Trace__c'] = ssn_trace_object['turnaround_time']
    BC_object_payload['No_Data__c'] = ssn_trace_object['no_data']
    BC_object_payload['DOB_Mismatch__c'] = ssn_trace_object['dob_mismatch']
@@ -340,28 +721,28 @@ def process_report(report_ID):
    BC_object_payload['SSN_Already_Taken__c'] = ssn_trace_object['ssn_already_taken']
    BC_object_payload['Issued_Year__c'] = ssn_trace_object['issued_year']
    BC_object_payload['Issued_State__c'] = ssn_trace_object['issued_state']
-   BC_object_payload['Addresses__c'] = str(ssn_trace_object['addresses'])
-   BC_object_payload['Aliases__c'] = str(ssn_trace_object['aliases'])
    BC_object_payload['Sex_Offender_Registry_Search_Status__c'] = report_results_object['sex_offender_search']['status']
-   print("sex_offender_registry_search_status: " + report_results_object['sex_offender_search']['status'])
    BC_object_payload['Turnaround_Time_Sex_Offender_Search__c'] =  report_results_object['sex_offender_search']['turnaround_time']
-   BC_object_payload['Sex_Offender_Records__c'] =  str(report_results_object['sex_offender_search']['records'])
    BC_object_payload['Global_Watchlist_Status__c'] = report_results_object['global_watchlist_search']['status']
-   print("global_watchlist_status: " + report_results_object['global_watchlist_search']['status'])
    BC_object_payload['Turnaround_Time_Global_Watchlist__c'] = report_results_object['global_watchlist_search']['turnaround_time']
-   BC_object_payload['Global_Watchlist_Records__c'] = str(report_results_object['global_watchlist_search']['records'])
    BC_object_payload['National_Criminal_Search_Status__c'] = report_results_object['national_criminal_search']['status']
-   print("national_criminal_search_status: " + report_results_object['national_criminal_search']['status'])   
    BC_object_payload['Turnaround_Time_National_Criminal_Search__c'] = report_results_object['national_criminal_search']['turnaround_time']
-   BC_object_payload['National_Criminal_Search_Records__c'] = str(report_results_object['national_criminal_search']['records'])
    
-   ### Creates 'Background Check' object for given Salesforce lead
-   print("")
-   print("Updating Salesforce lead (lead_ID: " + salesforce_lead_ID + ") with background check results")   
-   call = sf_api_call("/services/data/v49.0/sobjects/Background_Check__c", method = "post", data = BC_object_payload)
-   BC_object_id = call.get('id')
-   print('Background Check object ID: ' + BC_object_id)
-   print("")
+   ## Record sets are written as JSON; those too long for their field are summarized and stored in a Salesforce File once the object is created
+   record_fields, records_file = prepare_records_fields([('Addresses__c', ssn_trace_object['addresses']), ('Aliases__c', ssn_trace_object['aliases']),
+                                                         ('Sex_Offender_Records__c', sex_offender_search_object['records']),
+                                                         ('Global_Watchlist_Records__c', global_watchlist_search_object['records']),
+                                                         ('National_Criminal_Search_Records__c', national_criminal_search_object['records'])])
+   BC_object_payload.update(record_fields)
+   
+   ### Creates 'Background Check' object for given Salesforce lead, then uploads its file, if any
+   BC_object_ID = create_BC_object(BC_object_payload, wait = True).result()
+   upload_records_file(records_file, BC_object_ID, salesforce_lead_ID, checkr_report_ID)
+   logger.info("Created Background Check object for Salesforce lead with background check results",
+               extra = {'lead_ID': salesforce_lead_ID, 'report_ID': checkr_report_ID, 'status': report_results_object['status'],
+                        'ssn_trace_status': ssn_trace_object['status'], 'sex_offender_search_status': sex_offender_search_object['status'],
+                        'global_watchlist_status': global_watchlist_search_object['status'],
+                        'national_criminal_search_status': national_criminal_search_object['status']})
 
 '''
 Creates and returns 'Background Check' object payload for given Salesforce lead
@@ -382,41 +763,64 @@ def get_BC_object_payload(salesforce_lead_ID, salesforce_lead_name):
 
 
 '''
-Helper function to make calls to Salesforce REST API 
-Parameters: action (the Salesforce URL), Salesforce URL params, method (get, post or patch), data for POST/PATCH
-Output: None
+Returns Salesforce lead name stored in the DynamoDB table and on 'Background Check' objects
+Input: dictionary containing Salesforce lead PII
+Output: lead name
 '''
-def sf_api_call(action, parameters = {}, method = 'get', data = {}):
-   ## Obtains access token and instance URL using Connected App and OAuth 2.0 authorization flow
-   ## Need access token and instance URL to make calls to Salesforce
-   params = {"grant_type": "password", "client_id": settings.salesforceClientID, "client_secret": settings.salesforceClientSecret,
-             "username": settings.salesforceUsername, "password": settings.salesforcePassword}
-   sf_response = requests.post(settings.salesforceOAuthURL, params=params)
-   sf_response_json = sf_response.json()
-   if "error" in sf_response_json:
-      print(sf_response_json.get("error"))
-      print(sf_response_json.get("error_description"))
-   else:
-      access_token = sf_response_json.get("access_token")
-      instance_url = sf_response_json.get("instance_url")
-      print("")
-      print("Obtaining Salesforce access token and instance URL using Connected App and Oauth authorization flow")
+def get_lead_name(salesforce_lead_PII_dict):
+   return salesforce_lead_PII_dict['first_name'] + ' ' + salesforce_lead_PII_dict['last_name']
 
-   headers = {'Content-type': 'application/json', 'Accept-Encoding': 'gzip', 'Authorization': 'Bearer %s' % access_token}
 
-   if method == 'get':
-      r = requests.request(method, instance_url+action, headers = headers, params = parameters, timeout = 30)
-   elif method in ['post', 'patch']:
-      r = requests.request(method, instance_url+action, headers = headers, json = data, params = parameters, timeout = 30)
-   else:
-      raise ValueError('Method should be post or patch')
-   if r.status_code < 300:
-      if method == 'patch':
-         return None
-      else:
-         return r.json()
-   else:
-      raise Exception('API Error when calling %s: %s' % (r.url, r.content))
+'''
+Returns Salesforce lead ID stamped on a Checkr candidate, from the candidate or from one of its reports
+Input: Checkr candidate or report object, e.g. the object of a 'report.completed' webhook
+Output: Salesforce lead ID, or None if the candidate was created before lead IDs were stamped on candidates
+'''
+def get_lead_ID_from_checkr_object(checkr_object):
+   return checkr_object.get(CHECKR_LEAD_ID_FIELD) or None
+
+
+'''
+Queues Salesforce 'Background Check' object to be created with other buffered objects in one sObject Collections request
+Buffered objects are written when 200 are queued, after 'salesforceBatchMaxAge' seconds, or at the end of the request
+Callers that must undo their work if the object isn't created wait for it: the buffer is flushed right away, without retrying the object,
+and an error writing it is raised
+Input: 'Background Check' object payload, and whether to wait until it is written
+Output: Future resolving to ID of created 'Background Check' object (already resolved if waiting)
+'''
+def create_BC_object(BC_object_payload, wait = False):
+   if has_request_context():
+      g.BC_objects_queued = True
+   writer = get_background_check_writer()
+   future = writer.add(BC_object_payload, retry = not wait)
+   if wait:
+      writer.flush()
+      future.result()
+   return future
+
+
+'''
+Writes buffered Salesforce 'Background Check' objects before the response is returned, so none are left behind when the invocation ends
+Only requests which queued objects themselves flush, so queued webhooks don't wait for objects created by job workers
+Input: Flask response
+Output: Flask response
+'''
+@app.after_request
+def flush_BC_objects(response):
+   if g.get('BC_objects_queued'):
+      flush_background_check_writers()
+   return response
+
+
+'''
+Helper function to make calls to Salesforce REST API
+Access token and instance URL are cached by the Salesforce client and only obtained again on expiry or a 401
+Raises SalesforceAuthError if the Connected App OAuth login fails
+Parameters: action (the Salesforce URL), Salesforce URL params, method (get, post or patch), data for POST/PATCH
+Output: JSON response, or None for PATCH
+'''
+def sf_api_call(action, parameters = {}, method = 'get', data = {}):
+   return get_salesforce_client().call(action, parameters = parameters, method = method, data = data)
 
 '''
 Builds and returns XML acknowledgement to Salesforce outbound message
@@ -441,25 +845,60 @@ def get_sf_outbound_msg_acknowledgement():
 
 """
 Receives webhooks from Checkr API at separate endpoint to check whether report has been completed
-Once endpoint recieves 'report_completed' webhook, retrieves report ID of completed Checkr report and processes it with process_report()
+Once endpoint recieves 'report.completed' webhook, retrieves report ID of completed Checkr report and processes it with process_report()
+If a job queue is configured, the report is queued and the webhook is answered right away
 """
 @app.route('/checkr', methods=['POST'])
 def check_report_status():
-   print("")
-   print("Receiving Checkr webhooks and checking whether report completed")
-   print(request.json)
    webhook_object = request.json
+   logger.info("Received Checkr webhook", extra = {'webhook_ID': webhook_object.get('id'), 'type': webhook_object.get('type')})
+   ## Webhooks of a registered org's Checkr account are processed for that org, others for this environment's org
+   set_current_org(get_org_by_checkr_account(webhook_object.get('account_id')))
    if "report.completed" == webhook_object["type"]:
-      ## Retrieves report ID of completed Checkr report
+      ## Retrieves report ID of completed Checkr report, and lead ID stamped on its candidate if it has one
       checkr_report_ID = webhook_object["data"]["object"]["id"]
-      print("")
-      print("Report (report_ID: " + checkr_report_ID + ") has been completed")
-      dynamodb = boto3.resource('dynamodb')
-      background_check_table = dynamodb.Table(settings.backgroundCheckTable)
-      report_ID_query = background_check_table.scan(FilterExpression=Attr('checkr_report_ID').eq(checkr_report_ID))
-      if report_ID_query['Count'] != 0 and report_ID_query['Items'][0]['checkr_status'] != "report_completed":
-         process_report(checkr_report_ID)
+      salesforce_lead_ID = get_lead_ID_from_checkr_object(webhook_object["data"]["object"])
+      job_queue = get_job_queue()
+      if job_queue is not None:
+         job_queue.enqueue('report_completed', {'checkr_report_ID': checkr_report_ID, 'salesforce_lead_ID': salesforce_lead_ID,
+                                                'salesforce_org_ID': get_current_org_ID()})
+         logger.info("Queued report completed job for Checkr report", extra = {'report_ID': checkr_report_ID})
       else:
-         print("Report (report_ID: " + checkr_report_ID + ") already completed so not processing again!")
+         ## Written here rather than only by flush_BC_objects(), which relies on Flask's 'g', with the files of screening records
+         try:
+            result = process_report(checkr_report_ID, salesforce_lead_ID = salesforce_lead_ID)
+         finally:
+            flush_background_check_writers()
+         ## A report not on any item yet is answered with a 503, so Checkr delivers the webhook again
+         if isinstance(result, Response) and result.status_code == 503:
+            return result
 
    return Response(status = 200)
+
+
+"""
+Serves the status of the background check process from the materialized status counters, without reading the background check table
+Requests must send the BIM API key in the 'X-API-Key' header; 'organization_ID' selects a registered org instead of this environment's org
+"""
+@app.route('/status', methods=['GET'])
+def status():
+   return get_status_response(request.headers.get('X-API-Key'), request.args.get('organization_ID'))
+
+
+'''
+Builds response of the '/status' endpoint, for the Flask blueprint and the ASGI application
+Input: API key sent with the request, and Organization ID of the org whose status is requested, if any
+Output: Flask response with the status as JSON (401 if the API key is wrong, 404 if the org isn't registered, 503 if no status backend is configured)
+'''
+def get_status_response(api_key, organization_ID = None):
+   if not api_key or not hmac.compare_digest(api_key, settings.bimApiKey):
+      return Response(status = 401)
+   if organization_ID and organization_ID != settings.salesforceOrgID:
+      org = get_org(organization_ID)
+      if org is None:
+         return Response(status = 404)
+      set_current_org(org)
+   status_object = get_status()
+   if status_object is None:
+      return Response(status = 503)
+   return Response(json.dumps(status_object), mimetype = 'application/json')
@@ -0,0 +1,248 @@
+import time
+from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+from settings import settings
+from awsResources import get_dynamodb_table
+from tracing import traced
+from orgRegistry import get_current_org, get_org_resource
+from statusCounters import record_candidate_created, record_report_created
+
+## Global secondary indexes on the background check table
+## 'salesforce_lead_ID' is the table's partition key, so lead lookups are a GetItem and need no index
+CANDIDATE_ID_INDEX = 'checkr_candidate_ID-index'
+REPORT_ID_INDEX = 'checkr_report_ID-index'
+## BatchGetItem accepts at most 100 keys per request
+BATCH_GET_SIZE = 100
+
+
+## Table is kept at module level so it is created once per process
+background_check_table = None
+
+
+"""
+Returns DynamoDB background check table for current environment, creating it on first use
+A registered org being handled (orgRegistry.py) gets its own table
+Parameters: None
+Output: DynamoDB table resource
+"""
+def get_background_check_table():
+   global background_check_table
+   org = get_current_org()
+   if org is not None:
+      return get_org_resource(org, 'background_check_table', lambda: get_dynamodb_table(org.backgroundCheckTable))
+   if background_check_table is None:
+      background_check_table = get_dynamodb_table(settings.backgroundCheckTable)
+   return background_check_table
+
+
+"""
+Retrieves background check item for given Salesforce lead ID by primary key
+Parameters: DynamoDB table and Salesforce lead ID
+Output: background check item, or None if no item exists for lead
+"""
+@traced('dynamodb_get_item')
+def get_item_by_lead_ID(background_check_table, salesforce_lead_ID):
+   response = background_check_table.get_item(Key={'salesforce_lead_ID': salesforce_lead_ID}, ConsistentRead=True)
+   return response.get('Item')
+
+
+"""
+Retrieves background check items of many Salesforce leads with BatchGetItem requests of up to 100 keys
+Keys DynamoDB leaves unprocessed, e.g. when throttled, are requested again after a short backoff
+Parameters: DynamoDB table and list of Salesforce lead IDs
+Output: dictionary mapping lead ID to its item's 'salesforce_lead_ID' and 'checkr_status', for leads that have an item
+"""
+@traced('dynamodb_batch_get_item')
+def get_items_by_lead_IDs(background_check_table, salesforce_lead_IDs):
+   deserializer = TypeDeserializer()
+   items = {}
+   for start in range(0, len(salesforce_lead_IDs), BATCH_GET_SIZE):
+      request_items = {background_check_table.name: {'Keys': [{'salesforce_lead_ID': {'S': lead_ID}} for lead_ID in salesforce_lead_IDs[start:start + BATCH_GET_SIZE]],
+                                                     'ProjectionExpression': 'salesforce_lead_ID, checkr_status', 'ConsistentRead': True}}
+      attempt = 0
+      while request_items:
+         if attempt > 0:
+            time.sleep(min(1.0, 0.05 * (2 ** attempt)))
+         response = background_check_table.meta.client.batch_get_item(RequestItems=request_items)
+         for item in response['Responses'].get(background_check_table.name, []):
+            item = {name: deserializer.deserialize(value) for name, value in item.items()}
+            items[item['salesforce_lead_ID']] = item
+         request_items = response.get('UnprocessedKeys') or {}
+         attempt += 1
+   return items
+
+
+"""
+Retrieves background check item for given Checkr candidate ID through 'checkr_candidate_ID-index'
+Parameters: DynamoDB table and Checkr candidate ID
+Output: background check item, or None if no item exists for candidate
+"""
+def get_item_by_candidate_ID(background_check_table, checkr_candidate_ID):
+   return query_single_item(background_check_table, CANDIDATE_ID_INDEX, 'checkr_candidate_ID', checkr_candidate_ID)
+
+
+"""
+Retrieves background check item for given Checkr report ID through 'checkr_report_ID-index'
+Parameters: DynamoDB table and Checkr report ID
+Output: background check item, or None if no item exists for report
+"""
+def get_item_by_report_ID(background_check_table, checkr_report_ID):
+   return query_single_item(background_check_table, REPORT_ID_INDEX, 'checkr_report_ID', checkr_report_ID)
+
+
+"""
+Helper function to query a global secondary index for the single item with the given key
+Parameters: DynamoDB table, index name, index key attribute name and value
+Output: first matching item, or None if no item matches
+"""
+@traced('dynamodb_query')
+def query_single_item(background_check_table, index_name, attribute_name, value):
+   ## Empty strings can't be stored as index keys, so there is never a match for them
+   if not value:
+      return None
+   response = background_check_table.query(IndexName=index_name, KeyConditionExpression=Key(attribute_name).eq(value), Limit=1)
+   items = response.get('Items', [])
+   if len(items) == 0:
+      return None
+   return items[0]
+
+
+"""
+Creates background check item at 'candidate created' for a new Checkr candidate, and counts it in the status counters
+'checkr_report_ID' is left unset until report is created since it is the key of 'checkr_report_ID-index' and can't be an empty string
+Parameters: DynamoDB table, Salesforce lead ID, lead name and Checkr candidate ID
+Output: None
+"""
+@traced('dynamodb_put_item')
+def put_candidate_item(background_check_table, salesforce_lead_ID, salesforce_lead_name, checkr_candidate_ID):
+   created_at = int(time.time())
+   ## The item it replaces, if any, is returned at no extra cost, so a candidate stored again for the same lead isn't counted twice,
+   ## and a replaced report is no longer counted at its status
+   response = background_check_table.put_item(Item={'name': salesforce_lead_name, 'salesforce_lead_ID': salesforce_lead_ID, 'checkr_candidate_ID': checkr_candidate_ID,
+                                                    'checkr_status': "candidate created", 'candidate_created_at': created_at},
+                                              ReturnValues='ALL_OLD')
+   replaced_item = response.get('Attributes', {})
+   if replaced_item.get('checkr_status') != "candidate created":
+      record_candidate_created(created_at, replaced_item)
+
+
+"""
+Records Checkr report on the background check item of its candidate and moves it to 'report created', counting it in the status counters
+The condition keeps a report from being recorded on the item of another lead than the candidate's
+The report's creation time is only set the first time, so recording the same report again keeps its place among outstanding reports
+Parameters: DynamoDB table, Salesforce lead ID, Checkr candidate ID and Checkr report ID
+Output: None
+"""
+@traced('dynamodb_update_item')
+def set_report_created(background_check_table, salesforce_lead_ID, checkr_candidate_ID, checkr_report_ID):
+   report_created_at = int(time.time())
+   response = background_check_table.update_item(
+    Key={'salesforce_lead_ID': salesforce_lead_ID},
+    UpdateExpression="set checkr_status=:v1, checkr_report_ID=:v2, report_created_at=if_not_exists(report_created_at, :v3)",
+    ConditionExpression=Attr('checkr_candidate_ID').eq(checkr_candidate_ID),
+    ExpressionAttributeValues={
+        ':v1': "report created",
+        ':v2': checkr_report_ID,
+        ':v3': report_created_at
+    },
+    ReturnValues="UPDATED_OLD"
+   )
+   ## Only the update that moved the item out of 'candidate created' is counted, not a report recorded again by a retry
+   old_values = response.get('Attributes', {})
+   if old_values.get('checkr_status') == "candidate created":
+      record_report_created(salesforce_lead_ID, checkr_report_ID, old_values.get('report_created_at') or report_created_at)
+
+
+"""
+Atomically moves background check item from 'report created' to 'report completed' for given Checkr report
+Only one caller can succeed for a report, so duplicate or concurrent webhooks can't process it twice
+With 'return_item', the item is returned by the update itself, so a caller that knows the lead ID needs no read to get the lead's name
+Parameters: DynamoDB table, Salesforce lead ID, Checkr report ID, and whether to return the item
+Output: True if this caller claimed the report, False if it was already completed or belongs to another report;
+with 'return_item', a tuple of that and the item after the update if claimed, else the item as it was (None if the lead has no item)
+"""
+def claim_report_completion(background_check_table, salesforce_lead_ID, checkr_report_ID, return_item=False):
+   return conditional_status_update(background_check_table, salesforce_lead_ID, checkr_report_ID, "report created", "report completed", return_item)
+
+
+"""
+Moves background check item back from 'report completed' to 'report created' after processing the report failed, so it can be retried
+Parameters: DynamoDB table, Salesforce lead ID and Checkr report ID
+Output: True if item was moved back
+"""
+def release_report_completion(background_check_table, salesforce_lead_ID, checkr_report_ID):
+   return conditional_status_update(background_check_table, salesforce_lead_ID, checkr_report_ID, "report completed", "report created")
+
+
+"""
+Helper function to change 'checkr_status' of an item only if it has the expected status and Checkr report ID
+Parameters: DynamoDB table, Salesforce lead ID, Checkr report ID, expected status, new status, and whether to return the item
+Output: True if status was changed, False if condition failed; with 'return_item', a tuple of that and the item after the update
+if it was changed, else the item as it was (None if there is no item)
+"""
+@traced('dynamodb_update_item')
+def conditional_status_update(background_check_table, salesforce_lead_ID, checkr_report_ID, expected_status, new_status, return_item=False):
+   ## The item is returned by the update when it succeeds; when it doesn't, it is read again, since the pinned botocore doesn't
+   ## support ReturnValuesOnConditionCheckFailure
+   return_kwargs = {'ReturnValues': 'ALL_NEW'} if return_item else {}
+   ## Completion time is set by the claim and removed by its release, for the turnaround counted in the status counters
+   if new_status == "report completed":
+      update_expression, values = "set checkr_status=:v1, report_completed_at=:v2", {':v1': new_status, ':v2': int(time.time())}
+   else:
+      update_expression, values = "set checkr_status=:v1 remove report_completed_at", {':v1': new_status}
+   try:
+      response = background_check_table.update_item(
+       Key={'salesforce_lead_ID': salesforce_lead_ID},
+       UpdateExpression=update_expression,
+       ConditionExpression=Attr('checkr_report_ID').eq(checkr_report_ID) & Attr('checkr_status').eq(expected_status),
+       ExpressionAttributeValues=values,
+       **return_kwargs
+      )
+   except ClientError as error:
+      if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+         if return_item:
+            return False, background_check_table.get_item(Key={'salesforce_lead_ID': salesforce_lead_ID}, ConsistentRead=True).get('Item')
+         return False
+      raise
+   if return_item:
+      return True, response['Attributes']
+   return True
+
+
+"""
+Scans one segment of the background check table for items with the given status, one page at a time
+Segments can be scanned in parallel; each page's 'LastEvaluatedKey' can be passed back as 'start_key' to resume the scan later
+Parameters: DynamoDB table, Checkr status, segment number, total number of segments, key to resume after, if any,
+and maximum number of items read per page (before filtering), if any
+Output: generator of (items, last evaluated key) tuples, where the last page's key is None
+"""
+def scan_items_by_status(background_check_table, checkr_status, segment, total_segments, start_key=None, page_size=None):
+   scan_kwargs = {'FilterExpression': Attr('checkr_status').eq(checkr_status) & Attr('checkr_report_ID').exists(),
+                  'ProjectionExpression': 'salesforce_lead_ID, checkr_report_ID',
+                  'Segment': segment, 'TotalSegments': total_segments}
+   if page_size is not None:
+      scan_kwargs['Limit'] = page_size
+   while True:
+      if start_key is not None:
+         scan_kwargs['ExclusiveStartKey'] = start_key
+      response = background_check_table.scan(**scan_kwargs)
+      start_key = response.get('LastEvaluatedKey')
+      yield response['Items'], start_key
+      if start_key is None:
+         return
+
+
+"""
+Scans one segment of the background check table for every item, one page at a time, e.g. to recompute the status counters
+Parameters: DynamoDB table, attributes to read, segment number and total number of segments
+Output: generator of pages of items
+"""
+def scan_items(background_check_table, attributes, segment, total_segments):
+   scan_kwargs = {'ProjectionExpression': ', '.join(attributes), 'Segment': segment, 'TotalSegments': total_segments}
+   while True:
+      response = background_check_table.scan(**scan_kwargs)
+      yield response['Items']
+      if 'LastEvaluatedKey' not in response:
+         return
+      scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
@@ -0,0 +1,113 @@
+"""
+Compares throughput of the Flask blueprint (backgroundCheck.py) and the ASGI application (asgiApp.py) at 1, 50 and 500 concurrent requests
+The blueprint is driven by one thread per request in flight, like a threaded WSGI server; the ASGI application by one coroutine
+per request in flight on a single event loop, like uvicorn. Both run against the same local Checkr, Salesforce and DynamoDB stand-ins
+Usage: python benchmarks/benchAsync.py [concurrency ...]
+"""
+import asyncio
+import json
+import sys
+import time
+import benchmarkEnvironment
+import asyncCheckrClient
+import asyncExecutor
+from settings import settings
+from asgiApp import app as asgi_app
+from benchmarkStats import summarize
+from benchEndToEnd import send_all
+from localServices import LocalServices
+from payloads import build_lead, build_outbound_message, build_report_webhook
+
+LEADS_PER_MESSAGE = 2
+POOL_SIZE = 100
+
+
+"""
+Sends one POST request to the ASGI application in process
+Parameters: path and body
+Output: response status code
+"""
+async def post_asgi(path, body):
+   messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+   response = {}
+
+   async def receive():
+      return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+   async def send(message):
+      if message['type'] == 'http.response.start':
+         response['status'] = message['status']
+
+   await asgi_app({'type': 'http', 'method': 'POST', 'path': path, 'headers': []}, receive, send)
+   return response['status']
+
+
+"""
+Sends requests to the ASGI application, at most 'concurrency' at a time, and records their latencies
+Parameters: concurrency, and list of (path, body) tuples
+Output: latency summary
+"""
+async def send_all_asgi(concurrency, requests_to_send):
+   latencies = []
+   semaphore = asyncio.Semaphore(concurrency)
+
+   async def send(path, body):
+      async with semaphore:
+         start = time.perf_counter()
+         ## Every request runs in its own task, so it gets its own context like it does under an ASGI server
+         status = await asyncio.ensure_future(post_asgi(path, body))
+         latencies.append(time.perf_counter() - start)
+         if status >= 500:
+            raise AssertionError(path + ' answered ' + str(status))
+
+   start = time.perf_counter()
+   await asyncio.gather(*[send(path, body) for path, body in requests_to_send])
+   return summarize(latencies, time.perf_counter() - start)
+
+
+"""
+Runs outbound messages, then a 'report.completed' webhook for every report created, through the blueprint or the ASGI application
+Parameters: concurrency, and whether to use the ASGI application
+Output: latency summaries of outbound messages and webhooks, and number of Salesforce records created
+"""
+def run(concurrency, use_asgi):
+   ## Both paths get connection pools of the same size, large enough that neither waits for a connection at low concurrency
+   with LocalServices(checkr_latency=0.02, salesforce_latency=0.02, dynamodb_latency=0.005, pool_size=POOL_SIZE) as services:
+      services.patch(settings, 'asyncPoolSize', POOL_SIZE)
+      services.patch(asyncCheckrClient, 'async_checkr_client', None)
+      services.patch(asyncExecutor, 'blocking_executor', None)
+      message_count = max(50, concurrency * 2)
+      messages = [build_outbound_message([build_lead(message_index * LEADS_PER_MESSAGE + index) for index in range(LEADS_PER_MESSAGE)])
+                  for message_index in range(message_count)]
+      if use_asgi:
+         async def run_asgi():
+            outbound = await send_all_asgi(concurrency, [('/background-check', message) for message in messages])
+            webhooks = [('/checkr', json.dumps(build_report_webhook(item['checkr_report_ID'], custom_ID=item['salesforce_lead_ID'])).encode())
+                        for item in services.table.items.values() if item.get('checkr_report_ID')]
+            completed = await send_all_asgi(concurrency, webhooks)
+            await asyncCheckrClient.close_async_checkr_client()
+            return outbound, completed
+         outbound, completed = asyncio.run(run_asgi())
+         asyncExecutor.get_blocking_executor().shutdown()
+      else:
+         outbound = send_all(services, concurrency, [('/background-check', {'data': message}) for message in messages])
+         webhooks = [('/checkr', {'json': build_report_webhook(item['checkr_report_ID'], custom_ID=item['salesforce_lead_ID'])})
+                     for item in services.table.items.values() if item.get('checkr_report_ID')]
+         completed = send_all(services, concurrency, webhooks)
+      return outbound, completed, len(services.salesforce.created())
+
+
+def main():
+   concurrencies = [int(argument) for argument in sys.argv[1:]] or [1, 50, 500]
+   print("%d leads per outbound message, 20 ms Checkr and Salesforce latency, 5 ms DynamoDB latency" % LEADS_PER_MESSAGE)
+   print("%-12s %-6s %-18s %9s %9s %9s %12s %9s" % ('concurrency', 'path', 'endpoint', 'requests', 'p50 ms', 'p95 ms', 'requests/s', 'records'))
+   for concurrency in concurrencies:
+      for use_asgi in [False, True]:
+         outbound, completed, records = run(concurrency, use_asgi)
+         for endpoint, summary in [('/background-check', outbound), ('/checkr', completed)]:
+            print("%-12d %-6s %-18s %9d %9.1f %9.1f %12.1f %9d" % (concurrency, 'asgi' if use_asgi else 'flask', endpoint, summary['requests'],
+                                                                 summary['p50_ms'], summary['p95_ms'], summary['throughput_rps'], records))
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,46 @@
+"""
+Benchmarks /background-check with Salesforce outbound messages carrying 1, 10 and 100 notifications
+Compares processing the leads of a message one at a time against the bounded worker pool, and checks that every valid lead
+gets a DynamoDB item while one lead with an invalid SSN only produces its own error record
+Usage: python benchmarks/benchBatchNotifications.py [Checkr/Salesforce latency in seconds]
+"""
+import contextlib
+import io
+import sys
+import time
+import benchmarkEnvironment
+from settings import settings
+from fakeCheckr import INVALID_SSN
+from localServices import LocalServices
+from payloads import build_lead, build_outbound_message
+
+BATCH_SIZES = [1, 10, 100]
+
+
+def main():
+   latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.02
+   default_workers = settings.leadWorkers
+   print("%-14s %8s %12s %14s %10s %14s" % ('notifications', 'workers', 'request ms', 'leads/s', 'items', 'error records'))
+   for batch_size in BATCH_SIZES:
+      leads = [build_lead(index) for index in range(batch_size)]
+      ## Last lead of each multi-lead batch has an invalid SSN, to show its failure stays isolated
+      if batch_size > 1:
+         leads[-1]['SSN__c'] = INVALID_SSN
+      message = build_outbound_message(leads)
+      for workers in sorted(set([1, default_workers])):
+         settings.leadWorkers = workers
+         with LocalServices(checkr_latency=latency, salesforce_latency=latency, pool_size=max(workers, 1)) as services:
+            with contextlib.redirect_stdout(io.StringIO()):
+               start = time.perf_counter()
+               response = services.client.post('/background-check', data=message)
+               elapsed = time.perf_counter() - start
+            if response.status_code != 200 or b'<Ack>true</Ack>' not in response.data:
+               raise AssertionError('Outbound message was not acknowledged')
+            error_records = [record for record in services.salesforce.created() if record['Status_Background_Check__c'] == 'incomplete']
+            print("%-14d %8d %12.1f %14.1f %10d %14d" % (batch_size, workers, elapsed * 1000, batch_size / elapsed,
+                                                         len(services.table.items), len(error_records)))
+   settings.leadWorkers = default_workers
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,72 @@
+"""
+Benchmarks bulk submission (bulkSubmit.py) against sending one outbound message per lead, one after another, as toggling
+'Request Background Check' lead by lead does
+Bulk submission runs with several worker counts, then resumes a run interrupted halfway and runs the whole input again, to show that
+done leads are skipped through the checkpoint and leads submitted earlier are skipped with one BatchGetItem per 100 leads
+Usage: python benchmarks/benchBulkSubmit.py [leads] [service latency in seconds]
+"""
+import os
+import sys
+import tempfile
+import time
+import benchmarkEnvironment
+from bulkSubmit import BulkCheckpoint, BulkSubmitter, parse_lead_row
+from localServices import LocalServices
+from payloads import build_lead, build_outbound_message
+
+
+"""
+Sends one outbound message per lead, one after another
+Parameters: number of leads and service latency
+Output: dictionary of results
+"""
+def run_outbound_messages(lead_count, latency):
+   with LocalServices(checkr_latency=latency, salesforce_latency=latency, dynamodb_latency=latency / 4) as services:
+      start = time.perf_counter()
+      for index in range(lead_count):
+         services.client.post('/background-check', data=build_outbound_message([build_lead(index)]))
+      elapsed = time.perf_counter() - start
+      submitted = sum(1 for item in services.table.items.values() if item.get('checkr_status') == 'report created')
+      return {'elapsed': elapsed, 'submitted': submitted, 'skipped': 0, 'table_requests': services.table.request_count}
+
+
+"""
+Submits leads with a bulk submitter, optionally against the table and checkpoint of an earlier run
+Parameters: local services, leads, number of workers and checkpoint
+Output: dictionary of results
+"""
+def run_bulk(services, leads, workers, checkpoint):
+   services.table.reset_stats()
+   start = time.perf_counter()
+   outcomes = BulkSubmitter(services.table, checkpoint, workers).run(leads)
+   elapsed = time.perf_counter() - start
+   return {'elapsed': elapsed, 'submitted': sum(1 for outcome in outcomes.values() if outcome == 'submitted'),
+           'skipped': len(leads) - sum(1 for outcome in outcomes.values() if outcome == 'submitted'), 'table_requests': services.table.request_count}
+
+
+def main():
+   lead_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+   latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+   leads = [parse_lead_row(build_lead(index)) for index in range(lead_count)]
+   print("%d leads, %.0f ms Checkr and Salesforce latency" % (lead_count, latency * 1000))
+   print("%-34s %9s %8s %10s %8s %14s" % ('run', 'elapsed s', 'leads/s', 'submitted', 'skipped', 'table requests'))
+
+   def report(name, result):
+      print("%-34s %9.2f %8.1f %10d %8d %14d" % (name, result['elapsed'], (result['submitted'] + result['skipped']) / result['elapsed'],
+                                                result['submitted'], result['skipped'], result['table_requests']))
+
+   report('outbound message per lead', run_outbound_messages(lead_count, latency))
+   for workers in [1, 10, 50]:
+      with LocalServices(checkr_latency=latency, salesforce_latency=latency, dynamodb_latency=latency / 4, pool_size=workers) as services:
+         report('bulk, %d workers' % workers, run_bulk(services, leads, workers, BulkCheckpoint(None, 'leads')))
+
+   with tempfile.TemporaryDirectory() as directory, LocalServices(checkr_latency=latency, salesforce_latency=latency, dynamodb_latency=latency / 4,
+                                                                  pool_size=10) as services:
+      path = os.path.join(directory, 'checkpoint.json')
+      report('bulk, first half (interrupted)', run_bulk(services, leads[:lead_count // 2], 10, BulkCheckpoint(path, 'leads')))
+      report('bulk, resumed from checkpoint', run_bulk(services, leads, 10, BulkCheckpoint(path, 'leads')))
+      report('bulk, run again without checkpoint', run_bulk(services, leads, 10, BulkCheckpoint(None, 'leads')))
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,100 @@
+"""
+Benchmarks Checkr API calls made with bare requests.post/requests.get against the pooled, retrying CheckrClient
+Runs candidate creation, report creation and report retrieval against a local fake Checkr server, sequentially and concurrently,
+and with a share of transient 503 responses to show how many calls each approach completes
+Usage: python benchmarks/benchCheckrClient.py [calls per run] [latency in seconds] [error rate]
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import benchmarkEnvironment
+from benchmarkStats import summarize
+from fakeCheckr import FakeCheckrServer
+from checkrClient import CheckrClient
+
+API_KEY = 'benchmark-checkr-key'
+CANDIDATE_FIELDS = {'first_name': 'Jane', 'last_name': 'Doe', 'email': 'jane@example.com', 'zipcode': '94105',
+                    'dob': '1990-01-01', 'ssn': '111-11-2001', 'phone': '5555555555', 'no_middle_name': True}
+
+
+"""
+Runs the candidate, report and retrieve calls once using bare requests calls, as the background check process did previously
+Parameters: fake Checkr server and index of run
+Output: True if all three calls succeeded
+"""
+def bare_pipeline(server, index):
+   candidate_response = requests.post(url=server.base_url + '/v1/candidates', auth=(API_KEY, ''), data=CANDIDATE_FIELDS)
+   if not candidate_response.ok:
+      return False
+   report_response = requests.post(url=server.base_url + '/v1/reports', auth=(API_KEY, ''),
+                                   data={'package': 'tasker_standard', 'candidate_id': candidate_response.json()['id']})
+   if not report_response.ok:
+      return False
+   retrieve_response = requests.get(url=server.base_url + '/v1/reports/' + report_response.json()['id'], auth=(API_KEY, ''))
+   return retrieve_response.ok
+
+
+"""
+Runs the candidate, report and retrieve calls once using CheckrClient
+Parameters: Checkr client and index of run
+Output: True if all three calls succeeded
+"""
+def client_pipeline(client, index):
+   candidate_response = client.create_candidate(CANDIDATE_FIELDS, idempotency_key='candidate-lead' + str(index))
+   if not candidate_response.ok:
+      return False
+   candidate_ID = candidate_response.json()['id']
+   report_response = client.create_report({'package': 'tasker_standard', 'candidate_id': candidate_ID},
+                                          idempotency_key='report-' + candidate_ID)
+   if not report_response.ok:
+      return False
+   return client.retrieve_report(report_response.json()['id']).ok
+
+
+"""
+Runs pipeline given number of times at given concurrency and measures latency of each run
+Parameters: pipeline function taking index of run, number of runs and number of concurrent workers
+Output: latency summary with success rate
+"""
+def run(pipeline, call_count, concurrency):
+   latencies = []
+   successes = []
+
+   def timed(index):
+      start = time.perf_counter()
+      succeeded = pipeline(index)
+      latencies.append(time.perf_counter() - start)
+      successes.append(succeeded)
+
+   start = time.perf_counter()
+   with ThreadPoolExecutor(max_workers=concurrency) as executor:
+      list(executor.map(timed, range(call_count)))
+   summary = summarize(latencies, time.perf_counter() - start)
+   summary['success_rate'] = sum(successes) / len(successes)
+   return summary
+
+
+def main():
+   call_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+   latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.005
+   error_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+   print("%-8s %-12s %6s %9s %9s %9s %11s %8s %12s" % ('client', 'errors', 'conc', 'p50 ms', 'p95 ms', 'p99 ms', 'pipelines/s',
+                                                          'success', 'connections'))
+   for run_error_rate in [0.0, error_rate]:
+      for concurrency in [1, 10]:
+         for name in ['bare', 'client']:
+            with FakeCheckrServer(latency=latency, error_rate=run_error_rate) as server:
+               if name == 'bare':
+                  pipeline = lambda index: bare_pipeline(server, index)
+               else:
+                  client = CheckrClient(server.base_url, API_KEY, pool_size=concurrency, backoff_base=0.01)
+                  pipeline = lambda index: client_pipeline(client, index)
+               summary = run(pipeline, call_count, concurrency)
+               print("%-8s %-12s %6d %9.2f %9.2f %9.2f %11.1f %8.3f %12d" % (name, str(run_error_rate), concurrency, summary['p50_ms'],
+                                                                             summary['p95_ms'], summary['p99_ms'], summary['throughput_rps'],
+                                                                             summary['success_rate'], len(server.connections)))
+
+
+if __name__ == '__main__':
+   main()
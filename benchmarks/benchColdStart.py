@@ -0,0 +1,103 @@
+"""
+Benchmarks cold starts: time to import backgroundCheck and latency of the first request to '/checkr' and '/background-check'
+Each measurement runs in a fresh Python process with secrets served by a local fake SSM endpoint
+'eager' emulates the previous settings.py, which fetched all five secrets with sequential GetParameter calls at import;
+'lazy' is the current settings.py, which fetches secrets on first use in one GetParameters call
+Usage: python benchmarks/benchColdStart.py [runs per scenario] [SSM latency in seconds]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SECRETS = {'CHECKR_API_KEY': 'benchmark-checkr-key', 'BIM_API_KEY': 'benchmark-bim-key', 'SALESFORCE_ORG_ID': '00D000000000001AAA',
+           'SALESFORCE_PASSWORD': 'benchmark-password', 'SALESFORCE_CLIENT_SECRET': 'benchmark-client-secret'}
+
+
+"""
+Runs in the child process: imports the blueprint, points it at local fakes and sends one request
+Parameters: 'eager' or 'lazy', and endpoint name ('checkr' or 'background-check')
+Output: None (prints JSON result)
+"""
+def child(mode, endpoint):
+   start = time.perf_counter()
+   if mode == 'eager':
+      import boto3
+      ssm = boto3.client('ssm')
+      for name in SECRETS:
+         os.environ[name] = ssm.get_parameter(Name=name)['Parameter']['Value']
+   import benchmarkEnvironment
+   import backgroundCheck
+   import_ms = (time.perf_counter() - start) * 1000
+
+   from flask import Flask
+   import checkrClient
+   import salesforceClient
+   from settings import settings
+   from fakeCheckr import FakeCheckrServer
+   from fakeSalesforce import FakeSalesforceServer
+   from localDynamoDB import create_background_check_table
+   from payloads import build_lead, build_outbound_message, build_report_webhook
+   checkr = FakeCheckrServer().start()
+   salesforce = FakeSalesforceServer().start()
+   table = create_background_check_table()
+   settings.checkrBaseUrl = checkr.base_url
+   settings.salesforceOAuthURL = salesforce.oauth_url
+   backgroundCheck.get_background_check_table = lambda: table
+   checkrClient.checkr_client = None
+   salesforceClient.salesforce_client = None
+   app = Flask(__name__)
+   app.register_blueprint(backgroundCheck.app)
+   client = app.test_client()
+   if endpoint == 'checkr':
+      candidate_ID = checkr.create_candidate({'first_name': 'Volunteer'})[1]['id']
+      report_ID = checkr.create_report({'candidate_id': candidate_ID})[1]['id']
+      table.put_item(Item={'name': 'Volunteer 0', 'salesforce_lead_ID': 'lead0', 'checkr_candidate_ID': candidate_ID,
+                           'checkr_report_ID': report_ID, 'checkr_status': 'report created'})
+      request = lambda: client.post('/checkr', json=build_report_webhook(report_ID))
+   else:
+      message = build_outbound_message([build_lead(0)], organization_id=SECRETS['SALESFORCE_ORG_ID'])
+      request = lambda: client.post('/background-check', data=message)
+
+   import contextlib
+   import io
+   with contextlib.redirect_stdout(io.StringIO()):
+      start = time.perf_counter()
+      response = request()
+      first_request_ms = (time.perf_counter() - start) * 1000
+   print(json.dumps({'import_ms': import_ms, 'first_request_ms': first_request_ms, 'status': response.status_code}))
+
+
+def main():
+   runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+   latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+   sys.path.insert(0, BENCHMARK_DIRECTORY)
+   from fakeSSM import FakeSSMServer
+   print("%-6s %-17s %12s %18s %10s %10s" % ('mode', 'endpoint', 'import ms', 'first request ms', 'total ms', 'SSM calls'))
+   with FakeSSMServer(SECRETS, latency=latency) as ssm:
+      environment = dict(os.environ, BENCHMARK_USE_SSM='1', AWS_ENDPOINT_URL_SSM=ssm.endpoint_url, AWS_DEFAULT_REGION='us-west-2',
+                         AWS_ACCESS_KEY_ID='benchmark', AWS_SECRET_ACCESS_KEY='benchmark')
+      for name in SECRETS:
+         environment.pop(name, None)
+      for mode in ['eager', 'lazy']:
+         for endpoint in ['checkr', 'background-check']:
+            results = []
+            calls_before = sum(ssm.requests_by_action.values())
+            for run in range(runs):
+               output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, endpoint], env=environment,
+                                       cwd=BENCHMARK_DIRECTORY, capture_output=True, text=True, check=True).stdout
+               results.append(json.loads(output.strip().splitlines()[-1]))
+            ssm_calls = (sum(ssm.requests_by_action.values()) - calls_before) / runs
+            print("%-6s %-17s %12.1f %18.1f %10.1f %10.1f" % (mode, endpoint, statistics.median(result['import_ms'] for result in results),
+                                                              statistics.median(result['first_request_ms'] for result in results),
+                                                              statistics.median(result['import_ms'] + result['first_request_ms'] for result in results), ssm_calls))
+
+
+if __name__ == '__main__':
+   if len(sys.argv) > 1 and sys.argv[1] == '--child':
+      child(sys.argv[2], sys.argv[3])
+   else:
+      main()
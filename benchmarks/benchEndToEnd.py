@@ -0,0 +1,181 @@
+"""
+End-to-end load test of the background check blueprint against local stand-ins for Checkr, Salesforce and DynamoDB
+Sends Salesforce outbound messages to '/background-check' at the given concurrency, then a 'report.completed' webhook for every report
+Checkr created to '/checkr', and reports p50/p95/p99 latency and throughput per endpoint plus time spent in each stage as recorded by the tracing spans
+Results are written as JSON so runs on different commits can be compared with --compare
+Usage: python benchmarks/benchEndToEnd.py [--messages 50] [--leads-per-message 5] [--concurrency 10] [--checkr-latency 0.02] ...
+"""
+import argparse
+import collections
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import benchmarkEnvironment
+import tracing
+from tracing import Tracer, LocalExporter
+from benchmarkStats import percentile, summarize
+from localServices import LocalServices
+from payloads import build_lead, build_outbound_message, build_report_webhook
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+## A latency or throughput this much worse than the baseline is flagged as a regression
+REGRESSION_THRESHOLD = 0.10
+
+
+"""
+Summarizes span durations of each stage, per endpoint
+Parameters: local exporter holding the run's spans
+Output: dictionary mapping endpoint to dictionary mapping stage to call count, p50/p95/p99 and total in milliseconds
+"""
+def summarize_stages(exporter):
+   stages = {}
+   for endpoint in sorted(set(span[0] for span in exporter.spans)):
+      stages[endpoint] = {stage: {'calls': len(durations), 'p50_ms': percentile(durations, 50), 'p95_ms': percentile(durations, 95),
+                                  'p99_ms': percentile(durations, 99), 'total_ms': sum(durations)}
+                          for stage, durations in sorted(exporter.durations_by_stage(endpoint).items())}
+   return stages
+
+
+"""
+Sends requests concurrently, each from a thread-local test client, and records their latencies
+Parameters: local services, concurrency, and list of (path, keyword arguments for client.post) tuples
+Output: latency summary
+"""
+def send_all(services, concurrency, requests_to_send):
+   latencies = []
+   clients = threading.local()
+
+   def send(request_to_send):
+      path, kwargs = request_to_send
+      if not hasattr(clients, 'client'):
+         clients.client = services.app.test_client()
+      start = time.perf_counter()
+      response = clients.client.post(path, **kwargs)
+      latencies.append(time.perf_counter() - start)
+      if response.status_code >= 500:
+         raise AssertionError(path + ' answered ' + str(response.status_code))
+
+   start = time.perf_counter()
+   with ThreadPoolExecutor(max_workers=concurrency) as executor:
+      list(executor.map(send, requests_to_send))
+   return summarize(latencies, time.perf_counter() - start)
+
+
+"""
+Runs the load test
+Parameters: parsed command line arguments
+Output: results dictionary
+"""
+def run(arguments):
+   with LocalServices(checkr_latency=arguments.checkr_latency, checkr_error_rate=arguments.checkr_error_rate,
+                      salesforce_latency=arguments.salesforce_latency, salesforce_error_rate=arguments.salesforce_error_rate,
+                      dynamodb_latency=arguments.dynamodb_latency, record_count=arguments.records, pool_size=arguments.concurrency) as services:
+      exporter = LocalExporter()
+      services.patch(tracing, 'tracer', Tracer(exporter))
+      messages = [build_outbound_message([build_lead(message_index * arguments.leads_per_message + index)
+                                          for index in range(arguments.leads_per_message)])
+                  for message_index in range(arguments.messages)]
+      with contextlib.redirect_stdout(io.StringIO()):
+         endpoints = {'/background-check': send_all(services, arguments.concurrency, [('/background-check', {'data': message}) for message in messages])}
+         ## Webhooks carry the lead ID stamped on the candidate, like Checkr's do
+         webhooks = [('/checkr', {'json': build_report_webhook(item['checkr_report_ID'], custom_ID=item['salesforce_lead_ID'])})
+                     for item in services.table.items.values() if item.get('checkr_report_ID')]
+         endpoints['/checkr'] = send_all(services, arguments.concurrency, webhooks)
+      records_per_lead = collections.Counter(record['Lead__c'] for record in services.salesforce.created())
+      return {'endpoints': endpoints, 'stages': summarize_stages(exporter),
+              'checks': {'leads': arguments.messages * arguments.leads_per_message, 'reports': len(webhooks),
+                         'records': len(records_per_lead), 'duplicate_records': sum(count - 1 for count in records_per_lead.values()),
+                         'checkr_requests': services.checkr.request_count, 'checkr_errors': services.checkr.error_count,
+                         'salesforce_requests': services.salesforce.request_count}}
+
+
+def get_commit():
+   try:
+      return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=benchmarkEnvironment.REPOSITORY_ROOT,
+                            capture_output=True, text=True, check=True).stdout.strip()
+   except (OSError, subprocess.CalledProcessError):
+      return 'unknown'
+
+
+"""
+Prints endpoint metrics which got worse than in the baseline results by more than the regression threshold
+Parameters: current results and baseline results
+Output: number of regressions
+"""
+def compare(results, baseline):
+   regressions = 0
+   print("")
+   print("Compared with " + baseline['commit'] + " (" + baseline['timestamp'] + "):")
+   for endpoint, summary in results['endpoints'].items():
+      baseline_summary = baseline['endpoints'].get(endpoint)
+      if baseline_summary is None:
+         continue
+      for metric in ['p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps']:
+         if not baseline_summary[metric]:
+            continue
+         change = (summary[metric] - baseline_summary[metric]) / baseline_summary[metric]
+         worse = -change if metric == 'throughput_rps' else change
+         flag = 'REGRESSION' if worse > REGRESSION_THRESHOLD else ''
+         regressions += 1 if flag else 0
+         print("%-18s %-15s %10.2f -> %10.2f %+8.1f%% %s" % (endpoint, metric, baseline_summary[metric], summary[metric], change * 100, flag))
+   return regressions
+
+
+def parse_arguments():
+   parser = argparse.ArgumentParser(description='End-to-end load test of /background-check and /checkr')
+   parser.add_argument('--messages', type=int, default=50, help='outbound messages sent to /background-check')
+   parser.add_argument('--leads-per-message', type=int, default=5, help='notifications per outbound message')
+   parser.add_argument('--concurrency', type=int, default=10, help='requests in flight at once')
+   parser.add_argument('--checkr-latency', type=float, default=0.02, help='seconds added to every Checkr response')
+   parser.add_argument('--salesforce-latency', type=float, default=0.02, help='seconds added to every Salesforce response')
+   parser.add_argument('--dynamodb-latency', type=float, default=0.005, help='seconds added to every DynamoDB request')
+   parser.add_argument('--checkr-error-rate', type=float, default=0.0, help='fraction of Checkr requests answered with a 503')
+   parser.add_argument('--salesforce-error-rate', type=float, default=0.0, help='fraction of Salesforce requests answered with a 503')
+   parser.add_argument('--records', type=int, default=0, help='records in each search of a Checkr report')
+   parser.add_argument('--output', help='JSON results file (default: benchmarks/results/<commit>.json)')
+   parser.add_argument('--compare', help='JSON results file of an earlier run to compare against')
+   return parser.parse_args()
+
+
+def main():
+   arguments = parse_arguments()
+   results = run(arguments)
+   results.update({'commit': get_commit(), 'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                   'python': platform.python_version(), 'config': vars(arguments)})
+
+   print("%-18s %9s %9s %9s %9s %12s" % ('endpoint', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'requests/s'))
+   for endpoint, summary in results['endpoints'].items():
+      print("%-18s %9d %9.2f %9.2f %9.2f %12.1f" % (endpoint, summary['requests'], summary['p50_ms'], summary['p95_ms'], summary['p99_ms'],
+                                                   summary['throughput_rps']))
+   print("")
+   print("%-18s %-26s %8s %9s %9s %9s %10s" % ('trace', 'stage', 'calls', 'p50 ms', 'p95 ms', 'p99 ms', 'total ms'))
+   for endpoint, stages in results['stages'].items():
+      for stage, summary in stages.items():
+         print("%-18s %-26s %8d %9.2f %9.2f %9.2f %10.1f" % (endpoint, stage, summary['calls'], summary['p50_ms'], summary['p95_ms'],
+                                                            summary['p99_ms'], summary['total_ms']))
+   print("")
+   print("Checks: " + json.dumps(results['checks']))
+
+   output = arguments.output or os.path.join(RESULTS_DIRECTORY, results['commit'] + '.json')
+   os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+   with open(output, 'w') as results_file:
+      json.dump(results, results_file, indent=2)
+   print("Results written to " + output)
+
+   if arguments.compare:
+      with open(arguments.compare) as baseline_file:
+         regressions = compare(results, json.load(baseline_file))
+      if regressions:
+         return 1
+
+
+if __name__ == '__main__':
+   sys.exit(main())
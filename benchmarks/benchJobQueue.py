@@ -0,0 +1,78 @@
+"""
+Benchmarks acknowledging Salesforce outbound messages inline against queueing jobs for background workers
+Measures how long /background-check takes to return the Ack, how long queued jobs take to finish, and checks that jobs queued
+in the SQLite backend are still processed after the process restarts
+Usage: python benchmarks/benchJobQueue.py [leads per message] [Checkr/Salesforce latency in seconds]
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import benchmarkEnvironment
+import backgroundCheck
+from settings import settings
+from jobQueue import JobQueue, SQLiteQueueBackend
+from localServices import LocalServices
+from payloads import build_lead, build_outbound_message
+
+
+"""
+Sends outbound message with given job queue backend and waits until every lead has a Checkr report
+Parameters: job queue backend name ('' for inline), outbound message, number of leads, service latency, SQLite path
+Output: Ack latency and time until all leads were processed, in seconds, and queue metrics
+"""
+def run(backend_name, message, lead_count, latency, path):
+   settings.jobQueueBackend = backend_name
+   settings.jobQueuePath = path
+   backgroundCheck.job_queue = None
+   with LocalServices(checkr_latency=latency, salesforce_latency=latency) as services:
+      with contextlib.redirect_stdout(io.StringIO()):
+         start = time.perf_counter()
+         response = services.client.post('/background-check', data=message)
+         ack_latency = time.perf_counter() - start
+         while sum(1 for item in services.table.items.values() if item['checkr_status'] == 'report created') < lead_count:
+            time.sleep(0.005)
+         total = time.perf_counter() - start
+      if b'<Ack>true</Ack>' not in response.data:
+         raise AssertionError('Outbound message was not acknowledged')
+      metrics = backgroundCheck.job_queue.get_metrics() if backgroundCheck.job_queue else {}
+      if backgroundCheck.job_worker_pool is not None:
+         backgroundCheck.job_worker_pool.stop()
+         backgroundCheck.job_worker_pool = None
+   return ack_latency, total, metrics
+
+
+"""
+Queues jobs in an SQLite file with no workers running, then opens the file again as a restarted process would and drains it
+Parameters: SQLite path and number of jobs
+Output: number of jobs processed after the restart
+"""
+def check_restart(path, job_count):
+   processed = []
+   handlers = {'noop': lambda payload, attempt: processed.append(payload)}
+   JobQueue(SQLiteQueueBackend(path), handlers).enqueue_many('noop', [{'index': index} for index in range(job_count)])
+   restarted_queue = JobQueue(SQLiteQueueBackend(path), handlers)
+   while restarted_queue.drain(max_jobs=10, wait=0):
+      pass
+   return len(processed)
+
+
+def main():
+   lead_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+   latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+   message = build_outbound_message([build_lead(index) for index in range(lead_count)])
+   with tempfile.TemporaryDirectory() as directory:
+      print("%-8s %12s %16s %14s %16s" % ('backend', 'ack ms', 'all done ms', 'job p50 ms', 'job p95 ms'))
+      for backend_name in ['', 'memory', 'sqlite']:
+         ack_latency, total, metrics = run(backend_name, message, lead_count, latency, os.path.join(directory, backend_name + '.sqlite'))
+         print("%-8s %12.1f %16.1f %14.1f %16.1f" % (backend_name or 'inline', ack_latency * 1000, total * 1000,
+                                                     metrics.get('job_latency_p50_ms', 0.0), metrics.get('job_latency_p95_ms', 0.0)))
+      restart_path = os.path.join(directory, 'restart.sqlite')
+      print("jobs processed after restart: %d of %d" % (check_restart(restart_path, 25), 25))
+   settings.jobQueueBackend = ''
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,143 @@
+"""
+Measures what request logging costs, before and after print() calls were replaced with the structured logger (structuredLogging.py)
+The baseline commit is extracted to a temporary folder and both trees serve the same requests in a subprocess whose stdout is a
+line-buffered file, like a Lambda's stdout pipe; reports bytes and lines logged, mean latency per request, and lines containing PII
+Usage: python benchmarks/benchLogging.py [--requests 300] [--baseline <commit>]
+"""
+import argparse
+import builtins
+import functools
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import benchmarkEnvironment
+
+## Strings from the synthetic leads and Checkr reports that only appear in output if names, addresses or records are logged
+PII_MARKERS = ['Volunteer', 'Market St', 'Main St', '111-11-']
+
+
+"""
+Sends requests to both endpoints one at a time with stdout going to a file, and measures what was written for each endpoint
+Runs in a subprocess started by main(), against the tree in BENCHMARK_REPOSITORY_ROOT
+Parameters: number of requests per endpoint
+Output: dictionary mapping endpoint to mean latency and time spent logging in milliseconds, bytes and lines logged per request,
+and lines containing PII
+"""
+def measure(request_count):
+   from localServices import LocalServices
+   from payloads import build_lead, build_outbound_message, build_report_webhook
+   logging_time = [0.0]
+   logging_time_lock = threading.Lock()
+
+   def timed(function):
+      @functools.wraps(function)
+      def wrapper(*args, **kwargs):
+         start = time.perf_counter()
+         try:
+            return function(*args, **kwargs)
+         finally:
+            with logging_time_lock:
+               logging_time[0] += time.perf_counter() - start
+      return wrapper
+
+   ## Times print() calls of the baseline, and log calls and flushes of the structured logger
+   builtins.print = timed(builtins.print)
+   logging.Logger._log = timed(logging.Logger._log)
+   try:
+      import structuredLogging
+      structuredLogging.BufferedHandler.flush = timed(structuredLogging.BufferedHandler.flush)
+      flush_logs = structuredLogging.flush_logs
+   except ImportError:
+      flush_logs = lambda: None
+
+   results = {}
+   real_stdout = sys.stdout
+   with tempfile.TemporaryDirectory() as directory, LocalServices() as services:
+      ## Warms up connections and the Salesforce token before timing
+      for index in range(20):
+         services.client.post('/background-check', data=build_outbound_message([build_lead(index)]))
+      report_IDs = {}
+      for endpoint in ['/background-check', '/checkr']:
+         path = os.path.join(directory, endpoint.strip('/') + '.log')
+         sys.stdout = open(path, 'w', buffering=1)
+         logging_time[0] = 0.0
+         try:
+            start = time.perf_counter()
+            for index in range(20, 20 + request_count):
+               if endpoint == '/background-check':
+                  services.client.post('/background-check', data=build_outbound_message([build_lead(index)]))
+               else:
+                  services.client.post('/checkr', json=build_report_webhook(report_IDs[index]))
+            elapsed = time.perf_counter() - start
+            flush_logs()
+         finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+         if endpoint == '/background-check':
+            report_IDs = {index: services.table.get_item(Key={'salesforce_lead_ID': build_lead(index)['Id']})['Item']['checkr_report_ID']
+                          for index in range(20, 20 + request_count)}
+         with open(path) as log_file:
+            lines = log_file.read().splitlines()
+         results[endpoint] = {'ms_per_request': elapsed / request_count * 1000, 'logging_ms_per_request': logging_time[0] / request_count * 1000,
+                              'bytes_per_request': sum(len(line) + 1 for line in lines) / request_count,
+                              'lines_per_request': len(lines) / request_count,
+                              'pii_lines': sum(1 for line in lines if any(marker in line for marker in PII_MARKERS))}
+   return results
+
+
+"""
+Returns commit before the one which added the structured logger, or HEAD if it isn't committed yet
+Parameters: None
+Output: commit
+"""
+def get_default_baseline():
+   added = subprocess.run(['git', 'log', '--diff-filter=A', '--format=%h', '--', 'structuredLogging.py'], cwd=benchmarkEnvironment.REPOSITORY_ROOT,
+                          capture_output=True, text=True).stdout.split()
+   return added[-1] + '~1' if added else 'HEAD'
+
+
+"""
+Runs measure() in a subprocess against the given tree with the given log level
+Parameters: repository root, log level and number of requests per endpoint
+Output: results of measure()
+"""
+def run_measurement(repository_root, log_level, request_count):
+   environment = dict(os.environ, BENCHMARK_REPOSITORY_ROOT=repository_root, LOG_LEVEL=log_level)
+   output = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', '--requests', str(request_count)], env=environment,
+                           capture_output=True, text=True, check=True).stdout
+   return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+   parser = argparse.ArgumentParser(description='Bytes and time logged per request before and after structured logging')
+   parser.add_argument('--requests', type=int, default=300, help='requests per endpoint')
+   parser.add_argument('--baseline', help='commit logging with print() (default: the commit before structuredLogging.py was added)')
+   parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+   arguments = parser.parse_args()
+   if arguments.measure:
+      print(json.dumps(measure(arguments.requests)))
+      return
+
+   baseline = arguments.baseline or get_default_baseline()
+   with tempfile.TemporaryDirectory() as baseline_root:
+      archive = subprocess.run(['git', 'archive', baseline], cwd=benchmarkEnvironment.REPOSITORY_ROOT, capture_output=True, check=True).stdout
+      subprocess.run(['tar', '-x', '-C', baseline_root], input=archive, check=True)
+      configurations = [('print (' + baseline + ')', baseline_root, 'INFO'),
+                        ('structured, INFO', benchmarkEnvironment.REPOSITORY_ROOT, 'INFO'),
+                        ('structured, DEBUG', benchmarkEnvironment.REPOSITORY_ROOT, 'DEBUG'),
+                        ('structured, WARNING', benchmarkEnvironment.REPOSITORY_ROOT, 'WARNING')]
+      print("%d requests per endpoint, one lead per outbound message, no service latency" % arguments.requests)
+      print("%-26s %-18s %10s %14s %10s %10s %10s" % ('logging', 'endpoint', 'ms/req', 'logging ms/req', 'bytes/req', 'lines/req', 'PII lines'))
+      for name, repository_root, log_level in configurations:
+         for endpoint, result in run_measurement(repository_root, log_level, arguments.requests).items():
+            print("%-26s %-18s %10.3f %14.3f %10.0f %10.1f %10d" % (name, endpoint, result['ms_per_request'], result['logging_ms_per_request'],
+                                                                   result['bytes_per_request'], result['lines_per_request'], result['pii_lines']))
+
+
+if __name__ == '__main__':
+   main()
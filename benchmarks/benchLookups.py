@@ -0,0 +1,88 @@
+"""
+Benchmarks DynamoDB lookups by Salesforce lead ID, Checkr candidate ID and Checkr report ID as the background check table grows
+Compares the full-table scans used previously against the primary key and global secondary index lookups in backgroundCheckTable.py
+Usage: python benchmarks/benchLookups.py [table sizes...]
+"""
+import sys
+import time
+import benchmarkEnvironment
+from boto3.dynamodb.conditions import Attr
+from localDynamoDB import create_background_check_table
+from backgroundCheckTable import get_item_by_lead_ID, get_item_by_candidate_ID, get_item_by_report_ID
+
+DEFAULT_TABLE_SIZES = [1000, 10000, 100000]
+LOOKUPS_PER_SIZE = 50
+
+
+"""
+Fills table with given number of items, every other one with a Checkr report
+Parameters: local table and number of items
+Output: None
+"""
+def populate_table(table, item_count):
+   for index in range(item_count):
+      item = {'name': 'Volunteer ' + str(index), 'salesforce_lead_ID': 'lead' + str(index),
+              'checkr_candidate_ID': 'candidate' + str(index), 'checkr_status': 'candidate created'}
+      if index % 2 == 0:
+         item['checkr_report_ID'] = 'report' + str(index)
+         item['checkr_status'] = 'report created'
+      table.put_item(Item=item)
+
+
+"""
+Finds item with given attribute value by scanning every page of the table, which is what a correct scan-based lookup has to do
+Parameters: local table, attribute name and value
+Output: first matching item, or None
+"""
+def scan_lookup(table, attribute_name, value):
+   scan_kwargs = {'FilterExpression': Attr(attribute_name).eq(value)}
+   while True:
+      response = table.scan(**scan_kwargs)
+      if response['Items']:
+         return response['Items'][0]
+      if 'LastEvaluatedKey' not in response:
+         return None
+      scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+"""
+Times given lookup function over a spread of IDs and collects capacity consumed
+Parameters: local table, lookup function, list of IDs to look up
+Output: dictionary with mean latency, read capacity units, requests and items read per lookup
+"""
+def measure(table, lookup, ids):
+   table.reset_stats()
+   start = time.perf_counter()
+   for value in ids:
+      if lookup(value) is None:
+         raise AssertionError('Lookup missed ' + value)
+   elapsed = time.perf_counter() - start
+   return {'mean_ms': elapsed * 1000 / len(ids), 'read_units': table.consumed_read_units / len(ids),
+           'requests': table.request_count / len(ids), 'items_read': table.items_read / len(ids)}
+
+
+def main():
+   table_sizes = [int(size) for size in sys.argv[1:]] or DEFAULT_TABLE_SIZES
+   print("%-8s %-22s %10s %12s %10s %12s" % ('items', 'lookup', 'mean ms', 'read units', 'requests', 'items read'))
+   for item_count in table_sizes:
+      table = create_background_check_table()
+      populate_table(table, item_count)
+      ## Spreads lookups over the whole table and only picks items that have a report ID
+      step = max(2, (item_count // LOOKUPS_PER_SIZE) // 2 * 2)
+      indexes = list(range(0, item_count, step))[:LOOKUPS_PER_SIZE]
+      lookups = [
+         ('scan lead_ID', lambda value: scan_lookup(table, 'salesforce_lead_ID', value), ['lead' + str(index) for index in indexes]),
+         ('get_item lead_ID', lambda value: get_item_by_lead_ID(table, value), ['lead' + str(index) for index in indexes]),
+         ('scan candidate_ID', lambda value: scan_lookup(table, 'checkr_candidate_ID', value), ['candidate' + str(index) for index in indexes]),
+         ('index candidate_ID', lambda value: get_item_by_candidate_ID(table, value), ['candidate' + str(index) for index in indexes]),
+         ('scan report_ID', lambda value: scan_lookup(table, 'checkr_report_ID', value), ['report' + str(index) for index in indexes]),
+         ('index report_ID', lambda value: get_item_by_report_ID(table, value), ['report' + str(index) for index in indexes]),
+      ]
+      for name, lookup, ids in lookups:
+         result = measure(table, lookup, ids)
+         print("%-8d %-22s %10.3f %12.1f %10.1f %12.1f" % (item_count, name, result['mean_ms'], result['read_units'],
+                                                           result['requests'], result['items_read']))
+
+
+if __name__ == '__main__':
+   main()
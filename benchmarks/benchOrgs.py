@@ -0,0 +1,180 @@
+"""
+Benchmarks one deployment serving many Salesforce orgs registered in orgRegistry.py, against local stand-ins
+Warm-up: every org sends an outbound message and then the 'report.completed' webhooks of its reports, for several rounds; reports Salesforce
+OAuth logins, Checkr connections opened and org clients created per round with all orgs cached, and with fewer orgs cached than are sending (evicting the least recently used)
+Isolation: one org sends a burst of outbound messages to a Checkr account that throttles it, while every other org sends a few; reports
+messages deferred with a 503 and latency of the other orgs, with every org getting its own service guards and with one guard shared by all orgs
+Usage: python benchmarks/benchOrgs.py [orgs]
+"""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import benchmarkEnvironment
+import checkrClient
+import orgRegistry
+import rateLimiting
+from settings import settings
+from benchmarkStats import percentile
+from fakeCheckr import FakeCheckrServer
+from localServices import LocalServices
+from payloads import build_lead, build_outbound_message, build_report_webhook
+
+LEADS_PER_MESSAGE = 2
+WARM_UP_ROUNDS = 3
+NOISY_MESSAGES = 40
+NOISY_LEADS_PER_MESSAGE = 5
+QUIET_MESSAGES = 2
+## Requests per second the noisy org's Checkr account allows before it answers with a 429
+NOISY_CHECKR_RATE_LIMIT = 5
+
+
+"""
+Registers orgs whose secrets are read from environment variables, pointed at the local stand-ins
+Parameters: local services, number of orgs, and Checkr base URL of each org by index (default: the shared fake Checkr)
+Output: dictionary mapping Organization ID to org
+"""
+def build_registry(services, org_count, checkr_base_urls={}):
+   registry = {}
+   for index in range(org_count):
+      prefix = 'BENCHMARK_ORG_%d_' % index
+      for name in ['CHECKR_API_KEY', 'SALESFORCE_PASSWORD', 'SALESFORCE_CLIENT_SECRET']:
+         os.environ[prefix + name] = 'org-%d-%s' % (index, name.lower())
+      org = orgRegistry.Org({'organizationID': '00D%012dAAA' % index, 'name': 'org-%d' % index, 'checkrAccountID': 'account-%d' % index,
+                             'checkrApiKey': prefix + 'CHECKR_API_KEY', 'checkrBaseUrl': checkr_base_urls.get(index, services.checkr.base_url),
+                             'checkrPackage': 'basic_criminal', 'salesforceOAuthURL': services.salesforce.oauth_url,
+                             'salesforceClientID': 'client-%d' % index, 'salesforceUsername': 'admin@org-%d.example.com' % index,
+                             'salesforcePassword': prefix + 'SALESFORCE_PASSWORD', 'salesforceClientSecret': prefix + 'SALESFORCE_CLIENT_SECRET',
+                             'backgroundCheckTable': 'bim-benchmark-org-%d-background-check' % index})
+      registry[org.organizationID] = org
+   return registry
+
+
+"""
+Sends POST requests concurrently from thread-local test clients
+Parameters: local services, concurrency, and list of (path, keyword arguments for client.post) tuples
+Output: list of (status code, latency in seconds) tuples, in the order of the requests
+"""
+def send_all(services, concurrency, requests_to_send):
+   clients = threading.local()
+
+   def send(request_to_send):
+      path, kwargs = request_to_send
+      if not hasattr(clients, 'client'):
+         clients.client = services.app.test_client()
+      start = time.perf_counter()
+      response = clients.client.post(path, **kwargs)
+      return response.status_code, time.perf_counter() - start
+
+   with ThreadPoolExecutor(max_workers=concurrency) as executor:
+      return list(executor.map(send, requests_to_send))
+
+
+"""
+Sends one outbound message per org, then the 'report.completed' webhook of every report created, for several rounds
+Parameters: number of orgs and number of orgs whose clients are cached
+Output: list of (seconds, Salesforce OAuth logins, Checkr connections opened, org resources created, orgs evicted) tuples, one per round
+"""
+def run_warm_up(org_count, cache_size):
+   with LocalServices(checkr_latency=0.01, salesforce_latency=0.01, dynamodb_latency=0.002, pool_size=20) as services:
+      registry = build_registry(services, org_count)
+      services.patch(orgRegistry, 'org_registry', registry)
+      services.patch(orgRegistry, 'org_resource_cache', orgRegistry.OrgResourceCache(cache_size, settings.orgIdleTimeout))
+      orgs = list(registry.values())
+      rounds = []
+      for round_index in range(WARM_UP_ROUNDS):
+         services.salesforce.reset_stats()
+         connection_count = len(services.checkr.connections)
+         cache = orgRegistry.org_resource_cache
+         created_count, evicted_count = cache.created_count, cache.evicted_count
+         first_lead = round_index * org_count * LEADS_PER_MESSAGE
+         messages = [('/background-check', {'data': build_outbound_message([build_lead(first_lead + index * LEADS_PER_MESSAGE + lead_index)
+                                                                             for lead_index in range(LEADS_PER_MESSAGE)], org.organizationID)})
+                     for index, org in enumerate(orgs)]
+         start = time.perf_counter()
+         send_all(services, 10, messages)
+         webhooks = []
+         for index, org in enumerate(orgs):
+            for lead_index in range(LEADS_PER_MESSAGE):
+               item = services.table.items[build_lead(first_lead + index * LEADS_PER_MESSAGE + lead_index)['Id']]
+               webhooks.append(('/checkr', {'json': build_report_webhook(item['checkr_report_ID'], custom_ID=item['salesforce_lead_ID'],
+                                                                         account_ID=org.checkrAccountID)}))
+         send_all(services, 10, webhooks)
+         rounds.append((time.perf_counter() - start, services.salesforce.login_count, len(services.checkr.connections) - connection_count,
+                        cache.created_count - created_count, cache.evicted_count - evicted_count))
+      expected_records = WARM_UP_ROUNDS * org_count * LEADS_PER_MESSAGE
+      if len(services.salesforce.created()) != expected_records:
+         raise AssertionError('%d records created instead of %d' % (len(services.salesforce.created()), expected_records))
+      return rounds
+
+
+"""
+Sends a burst of messages from org 0, whose Checkr account throttles it, together with a few messages from every other org
+Parameters: number of orgs, and whether every org gets its own service guards or all orgs share one
+Output: dictionary of results for the noisy org and the other orgs
+"""
+def run_isolation(org_count, guard_per_org):
+   noisy_checkr = FakeCheckrServer(latency=0.01, rate_limit=NOISY_CHECKR_RATE_LIMIT)
+   noisy_checkr.start()
+   services = LocalServices(checkr_latency=0.01, salesforce_latency=0.01, dynamodb_latency=0.002, pool_size=20,
+                            rate_limit_backend=rateLimiting.LocalRateLimitBackend())
+   services.patch(settings, 'rateLimitMaxWait', 2.0)
+   if not guard_per_org:
+      ## Every org's client gets the guard of this environment's org, as if guards were only kept per service
+      services.patch(checkrClient, 'get_service_guard', lambda service_name, org=None: rateLimiting.get_service_guard(service_name))
+   try:
+      with services:
+         registry = build_registry(services, org_count, {0: noisy_checkr.base_url})
+         services.patch(orgRegistry, 'org_registry', registry)
+         services.patch(orgRegistry, 'org_resource_cache', orgRegistry.OrgResourceCache(org_count, settings.orgIdleTimeout))
+         orgs = list(registry.values())
+         requests_to_send = []
+         lead_index = 0
+         for message_index in range(NOISY_MESSAGES):
+            requests_to_send.append(('noisy', build_outbound_message([build_lead(lead_index + index) for index in range(NOISY_LEADS_PER_MESSAGE)],
+                                                                     orgs[0].organizationID)))
+            lead_index += NOISY_LEADS_PER_MESSAGE
+         for org in orgs[1:]:
+            for message_index in range(QUIET_MESSAGES):
+               requests_to_send.append(('quiet', build_outbound_message([build_lead(lead_index + index) for index in range(LEADS_PER_MESSAGE)],
+                                                                        org.organizationID)))
+               lead_index += LEADS_PER_MESSAGE
+         start = time.perf_counter()
+         responses = send_all(services, 50, [('/background-check', {'data': message}) for group, message in requests_to_send])
+         elapsed = time.perf_counter() - start
+         results = {'elapsed': elapsed}
+         for group in ['noisy', 'quiet']:
+            group_responses = [response for (request_group, message), response in zip(requests_to_send, responses) if request_group == group]
+            latencies = [latency for status, latency in group_responses if status == 200]
+            results[group] = {'messages': len(group_responses), 'deferred': sum(1 for status, latency in group_responses if status == 503),
+                              'p50_ms': percentile(latencies, 50) * 1000, 'p95_ms': percentile(latencies, 95) * 1000}
+         results['throttled'] = noisy_checkr.throttled_count
+         return results
+   finally:
+      noisy_checkr.stop()
+
+
+def main():
+   org_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+   print("%d orgs, %d leads per message, 10 ms Checkr and Salesforce latency, 2 ms DynamoDB latency" % (org_count, LEADS_PER_MESSAGE))
+   print("")
+   print("%-14s %6s %10s %14s %18s %18s %13s" % ('orgs cached', 'round', 'seconds', 'OAuth logins', 'Checkr connections', 'resources created', 'orgs evicted'))
+   for cache_size in [org_count, max(1, org_count // 5)]:
+      for round_index, (seconds, logins, connections, created, evicted) in enumerate(run_warm_up(org_count, cache_size)):
+         print("%-14d %6d %10.2f %14d %18d %18d %13d" % (cache_size, round_index + 1, seconds, logins, connections, created, evicted))
+   print("")
+   print("Org 0 sends %d messages of %d leads to a Checkr account allowing %d requests/s; the other orgs send %d messages of %d leads"
+         % (NOISY_MESSAGES, NOISY_LEADS_PER_MESSAGE, NOISY_CHECKR_RATE_LIMIT, QUIET_MESSAGES, LEADS_PER_MESSAGE))
+   print("%-16s %-8s %9s %9s %9s %9s %7s %10s" % ('guards', 'orgs', 'messages', 'deferred', 'p50 ms', 'p95 ms', '429s', 'seconds'))
+   for guard_per_org in [False, True]:
+      results = run_isolation(org_count, guard_per_org)
+      for group in ['noisy', 'quiet']:
+         summary = results[group]
+         print("%-16s %-8s %9d %9d %9.1f %9.1f %7d %10.2f" % ('per org' if guard_per_org else 'shared', 'org 0' if group == 'noisy' else 'others',
+                                                             summary['messages'], summary['deferred'], summary['p50_ms'], summary['p95_ms'],
+                                                             results['throttled'], results['elapsed']))
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,121 @@
+"""
+Benchmarks reconciliation of reports whose webhook was missed (reconcileReports.py)
+Fills the local table with items stuck at 'report created' among already completed ones, some of whose Checkr reports are still pending,
+then compares a sequential run (1 segment, 1 worker) with a parallel run, and checks an interrupted run resumes from its checkpoint
+without processing any report twice, and stops soon after its deadline even when the deadline falls in the middle of a large page
+Usage: python benchmarks/benchReconcile.py [stuck items] [Checkr latency in seconds] [Checkr requests per second]
+"""
+import collections
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import benchmarkEnvironment
+from settings import settings
+from localServices import LocalServices
+from salesforceWriter import flush_background_check_writers
+import reconcileReports
+from reconcileReports import Reconciler, ReconcileCheckpoint
+
+## Fraction of stuck items whose Checkr report isn't finished yet
+PENDING_FRACTION = 0.2
+## Smaller scan pages than in production, so a benchmark-sized table has several checkpoints per segment
+SCAN_PAGE_SIZE = 50
+
+
+"""
+Creates stuck items with reports in the fake Checkr server, plus as many completed items
+Parameters: local services and number of stuck items
+Output: number of stuck items whose report is completed
+"""
+def populate(services, stuck_count):
+   completed_count = 0
+   for index in range(stuck_count * 2):
+      candidate_ID = services.checkr.create_candidate({'first_name': 'Volunteer', 'last_name': str(index)})[1]['id']
+      report_ID = services.checkr.create_report({'candidate_id': candidate_ID, 'package': settings.checkrPackage})[1]['id']
+      status = 'report created' if index % 2 == 0 else 'report completed'
+      services.table.put_item(Item={'name': 'Volunteer ' + str(index), 'salesforce_lead_ID': 'lead' + str(index),
+                                    'checkr_candidate_ID': candidate_ID, 'checkr_report_ID': report_ID, 'checkr_status': status})
+      if status == 'report created':
+         if (index // 2) % int(1 / PENDING_FRACTION) == 0:
+            services.checkr.pending_reports.add(report_ID)
+         else:
+            completed_count += 1
+   return completed_count
+
+
+"""
+Runs reconciliation to completion, or until the deadline, against the local services
+Parameters: local services, checkpoint, segments, workers, Checkr requests per second and deadline
+Output: True if reconciliation finished
+"""
+def reconcile(services, checkpoint, segments, workers, rate, deadline=None):
+   reconciler = Reconciler(services.table, checkpoint, segments, workers, rate)
+   with contextlib.redirect_stdout(io.StringIO()):
+      complete = reconciler.run(deadline)
+      flush_background_check_writers()
+   return complete
+
+
+"""
+Runs one scenario on fresh local services
+Parameters: stuck items, Checkr latency, segments, workers, Checkr requests per second, seconds after which
+the first run is interrupted (None to run without interruption), and items per scan page
+Output: dictionary of results
+"""
+def run(stuck_count, latency, segments, workers, rate, interrupt_after=None, page_size=SCAN_PAGE_SIZE):
+   reconcileReports.SCAN_PAGE_SIZE = page_size
+   with LocalServices(checkr_latency=latency, salesforce_latency=latency, pool_size=workers) as services:
+      completed_count = populate(services, stuck_count)
+      services.checkr.reset_stats()
+      checkpoint_path = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+      checkpoint = ReconcileCheckpoint(checkpoint_path, segments)
+      runs = 1
+      start = time.perf_counter()
+      deadline = None
+      if interrupt_after is not None:
+         deadline = time.time() + interrupt_after
+      complete = reconcile(services, checkpoint, segments, workers, rate, deadline)
+      overrun = time.perf_counter() - start - interrupt_after if interrupt_after is not None else 0.0
+      interrupted_counts = dict(checkpoint.data['counts'])
+      while not complete:
+         runs += 1
+         complete = reconcile(services, ReconcileCheckpoint(checkpoint_path, segments), segments, workers, rate)
+      elapsed = time.perf_counter() - start
+      records_per_lead = collections.Counter(record['Lead__c'] for record in services.salesforce.created())
+      counts = ReconcileCheckpoint(checkpoint_path, segments).data['counts']
+      return {'elapsed': elapsed, 'runs': runs, 'processed': counts.get('processed', 0), 'pending': counts.get('pending', 0),
+              'failed': counts.get('failed', 0), 'expected': completed_count, 'records': len(records_per_lead),
+              'duplicates': sum(count - 1 for count in records_per_lead.values()), 'checkr_gets': services.checkr.request_count,
+              'interrupted_counts': interrupted_counts, 'overrun': overrun}
+
+
+def main():
+   stuck_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+   latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+   rate = float(sys.argv[3]) if len(sys.argv) > 3 else 200
+   print("%d stuck items (%d%% still pending in Checkr) among %d, Checkr latency %.0f ms, at most %.0f Checkr requests/s"
+         % (stuck_count, PENDING_FRACTION * 100, stuck_count * 2, latency * 1000, rate))
+   print("%-22s %9s %8s %10s %8s %8s %10s %11s %12s %16s" % ('scenario', 'time s', 'runs', 'processed', 'pending', 'failed', 'records',
+                                                           'duplicates', 'Checkr GETs', '10k items est. s'))
+   ## The last scenario paces Checkr at the default 10 requests/s with production-sized pages, which take far longer than the deadline margin
+   scenarios = [('sequential', stuck_count, 1, 1, 10000, None, SCAN_PAGE_SIZE),
+                ('parallel 8x20', stuck_count, 8, 20, rate, None, SCAN_PAGE_SIZE),
+                ('parallel, interrupted', stuck_count, 8, 20, rate, 1.0, SCAN_PAGE_SIZE),
+                ('10/s, interrupted', 100, 8, 10, 10, 2.0, reconcileReports.SCAN_PAGE_SIZE)]
+   for name, scenario_stuck_count, segments, workers, scenario_rate, interrupt_after, page_size in scenarios:
+      result = run(scenario_stuck_count, latency, segments, workers, scenario_rate, interrupt_after, page_size)
+      if result['processed'] != result['expected']:
+         raise AssertionError(name + ': processed ' + str(result['processed']) + ' of ' + str(result['expected']) + ' completed reports')
+      print("%-22s %9.2f %8d %10d %8d %8d %10d %11d %12d %16.0f" % (name, result['elapsed'], result['runs'], result['processed'], result['pending'],
+                                                                 result['failed'], result['records'], result['duplicates'], result['checkr_gets'],
+                                                                 result['elapsed'] * 10000 / scenario_stuck_count))
+      if interrupt_after is not None:
+         print("   interrupted after %.1f s, stopped %.2f s after the deadline with %s" % (interrupt_after, result['overrun'],
+                                                                                           result['interrupted_counts']))
+
+
+if __name__ == '__main__':
+   main()
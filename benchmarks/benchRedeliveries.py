@@ -0,0 +1,76 @@
+"""
+Benchmarks Salesforce outbound message redeliveries with and without the idempotency ledger (idempotencyLedger.py)
+Sends one outbound message, then delivers it again several times, one after another and while the first delivery is still running,
+and counts the Checkr, Salesforce and DynamoDB calls and the 'Background Check' records each configuration makes
+Usage: python benchmarks/benchRedeliveries.py [leads per message] [redeliveries] [service latency in seconds]
+"""
+import statistics
+import sys
+import threading
+import time
+import benchmarkEnvironment
+import idempotencyLedger
+from settings import settings
+from idempotencyLedger import MemoryLedger, DynamoDBLedger
+from localDynamoDB import LocalTable
+from localServices import LocalServices
+from payloads import build_lead, build_outbound_message
+
+
+"""
+Delivers the same outbound message once, then again 'redeliveries' times
+Parameters: local services, outbound message, number of redeliveries, and whether the first redelivery overlaps the first delivery
+Output: first delivery latency and mean redelivery latency in milliseconds
+"""
+def deliver(services, message, redeliveries, overlapping):
+   latencies = []
+
+   def post():
+      start = time.perf_counter()
+      response = services.app.test_client().post('/background-check', data=message)
+      latencies.append(time.perf_counter() - start)
+      if b'<Ack>true</Ack>' not in response.data:
+         raise AssertionError('Outbound message was not acknowledged')
+
+   if overlapping:
+      ## Salesforce redelivers a message whose acknowledgement is late while the first request is still running
+      threads = [threading.Thread(target=post) for index in range(2)]
+      for thread in threads:
+         thread.start()
+      for thread in threads:
+         thread.join()
+      ## The slower of the two is taken as the first delivery, since only one of them does the work
+      latencies.sort(reverse=True)
+      redeliveries -= 1
+   else:
+      post()
+   for index in range(redeliveries):
+      post()
+   return latencies[0] * 1000, statistics.mean(latencies[1:]) * 1000
+
+
+def main():
+   lead_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+   redeliveries = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+   latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+   message = build_outbound_message([build_lead(index) for index in range(lead_count)])
+   print("%d leads per message, %d redeliveries, %.0f ms service latency" % (lead_count, redeliveries, latency * 1000))
+   print("%-10s %-12s %10s %12s %10s %10s %14s %14s %12s" % ('ledger', 'redelivery', 'first ms', 'redeliver ms', 'checkr', 'salesforce',
+                                                               'table requests', 'ledger requests', 'BC records'))
+   for overlapping in [False, True]:
+      for name in ['none', 'memory', 'dynamodb']:
+         ledger_table = LocalTable(key='idempotency_key', latency=latency / 4)
+         ledger = {'none': None, 'memory': MemoryLedger(), 'dynamodb': DynamoDBLedger(ledger_table)}[name]
+         with LocalServices(checkr_latency=latency, salesforce_latency=latency, dynamodb_latency=latency / 4, ledger=ledger) as services:
+            if ledger is None:
+               services.patch(settings, 'idempotencyBackend', '')
+               services.patch(idempotencyLedger, 'idempotency_ledger', None)
+            first_ms, redelivery_ms = deliver(services, message, redeliveries, overlapping)
+            print("%-10s %-12s %10.1f %12.1f %10d %10d %14d %14d %12d" % (name, 'overlapping' if overlapping else 'sequential', first_ms, redelivery_ms,
+                                                                         services.checkr.request_count, services.salesforce.request_count,
+                                                                         services.table.request_count, ledger_table.request_count if name == 'dynamodb' else 0,
+                                                                         len(services.salesforce.created())))
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,63 @@
+"""
+Benchmarks writing bursts of Background_Check__c records one POST at a time against the buffered sObject Collections writer
+Concurrent workers each create records, as report completions do after a recruitment drive, against a local fake Salesforce server
+Usage: python benchmarks/benchSalesforceWrites.py [records] [workers] [Salesforce latency in seconds]
+"""
+import contextlib
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import benchmarkEnvironment
+from settings import settings
+from fakeSalesforce import FakeSalesforceServer
+from salesforceClient import SalesforceClient
+from salesforceWriter import SObjectWriter
+
+
+def build_record(index):
+   return {'Name': 'Volunteer ' + str(index), 'Lead__c': '00Q' + str(index).zfill(15), 'Request_Background_Check__c': True,
+           'Status_Background_Check__c': 'clear'}
+
+
+"""
+Creates records with given write function from concurrent workers
+Parameters: write function, number of records, number of workers and function run after all records were added
+Output: elapsed time in seconds
+"""
+def run(write, record_count, workers, finish=None):
+   start = time.perf_counter()
+   with ThreadPoolExecutor(max_workers=workers) as executor:
+      list(executor.map(write, [build_record(index) for index in range(record_count)]))
+   if finish is not None:
+      finish()
+   return time.perf_counter() - start
+
+
+def main():
+   record_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+   workers = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+   latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+   print("%-16s %10s %10s %12s %12s %12s" % ('writer', 'records', 'API calls', 'calls saved', 'elapsed ms', 'records/s'))
+   for name in ['single POST', 'collections 200']:
+      with FakeSalesforceServer(latency=latency) as server:
+         client = SalesforceClient(server.oauth_url, settings.salesforceClientID, settings.salesforceClientSecret,
+                                   settings.salesforceUsername, settings.salesforcePassword, pool_size=workers)
+         with contextlib.redirect_stdout(io.StringIO()):
+            if name == 'single POST':
+               elapsed = run(lambda record: client.call("/services/data/v49.0/sobjects/Background_Check__c", method='post', data=record),
+                             record_count, workers)
+            else:
+               writer = SObjectWriter('Background_Check__c', client.call, batch_size=200, max_age=1.0)
+               futures = []
+               elapsed = run(lambda record: futures.append(writer.add(record)), record_count, workers, writer.flush)
+               if not all(future.result() for future in futures):
+                  raise AssertionError('Record was not created')
+         if len(server.created()) != record_count:
+            raise AssertionError('Expected %d records, found %d' % (record_count, len(server.created())))
+         print("%-16s %10d %10d %12d %12.1f %12.1f" % (name, record_count, server.request_count, record_count - server.request_count,
+                                                       elapsed * 1000, record_count / elapsed))
+
+
+if __name__ == '__main__':
+   main()
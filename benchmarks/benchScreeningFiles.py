@@ -0,0 +1,128 @@
+"""
+Benchmarks writing screening record sets of 'Background Check' objects as str() of the lists in their fields against compact JSON,
+with record sets longer than the field limit stored in a gzip-compressed Salesforce File (salesforceFiles.py)
+Payload: builds the record fields and the sObject Collections request body of one synthetic report, and measures their size,
+peak memory and time
+End to end: runs report completions of leads whose searches have many records against a fake Salesforce rejecting fields longer than the limit,
+and without a limit, as if the fields were long enough, and checks the files hold the full record sets
+Usage: python benchmarks/benchScreeningFiles.py [records per search] [leads] [Salesforce latency in seconds]
+"""
+import base64
+import gzip
+import json
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import benchmarkEnvironment
+import backgroundCheck
+from settings import settings
+from localServices import LocalServices
+from fakeCheckr import build_report
+from payloads import build_lead, build_outbound_message, build_report_webhook
+from salesforceFiles import prepare_records_fields
+
+LEADS_PER_MESSAGE = 10
+
+
+"""
+Returns record fields of the 'Background Check' object like process_report_results() did before record sets were stored in files
+Parameters: list of (field name, record set) tuples
+Output: dictionary mapping field name to str() of the record set, and no file
+"""
+def legacy_records_fields(record_sets):
+   return {field_name: str(records) for field_name, records in record_sets}, None
+
+
+"""
+Returns record sets of a report with the fields they are written to
+Parameters: Checkr report object
+Output: list of (field name, record set) tuples
+"""
+def record_sets(report):
+   return [('Addresses__c', report['ssn_trace']['addresses']), ('Aliases__c', report['ssn_trace']['aliases']),
+           ('Sex_Offender_Records__c', report['sex_offender_search']['records']),
+           ('Global_Watchlist_Records__c', report['global_watchlist_search']['records']),
+           ('National_Criminal_Search_Records__c', report['national_criminal_search']['records'])]
+
+
+"""
+Builds record fields and the request body writing the 'Background Check' object
+Parameters: function returning the record fields and file, and Checkr report object
+Output: request body bytes and file, if any
+"""
+def build_request(records_fields, report):
+   payload = backgroundCheck.get_BC_object_payload('00Q000000000000000', 'Volunteer Number0')
+   record_fields, records_file = records_fields(record_sets(report))
+   payload.update(record_fields, attributes={'type': 'Background_Check__c'})
+   return json.dumps({'allOrNone': False, 'records': [payload]}).encode(), records_file
+
+
+"""
+Measures building the request of one report
+Parameters: function returning the record fields and file, and number of records per search
+Output: request body bytes, longest field, file bytes, peak memory bytes and milliseconds
+"""
+def measure_payload(records_fields, record_count):
+   report = build_report('report0', 'candidate0', record_count)
+   start = time.perf_counter()
+   for _ in range(5):
+      body, records_file = build_request(records_fields, report)
+   elapsed = (time.perf_counter() - start) / 5
+   tracemalloc.start()
+   build_request(records_fields, report)
+   peak = tracemalloc.get_traced_memory()[1]
+   tracemalloc.stop()
+   longest = max(len(value) for value in json.loads(body)['records'][0].values() if isinstance(value, str))
+   return len(body), longest, len(records_file.data) if records_file is not None else 0, peak, elapsed * 1000
+
+
+"""
+Runs report completions of leads with Salesforce rejecting fields longer than the field limit
+Parameters: function returning the record fields and file, number of records per search, number of leads, Salesforce latency, and field limit
+Output: seconds, Salesforce request bytes, 'Background Check' objects created, files created, and whether files hold the full record sets
+"""
+def run_end_to_end(records_fields, record_count, lead_count, latency, field_limit):
+   with LocalServices(record_count=record_count, salesforce_latency=latency, salesforce_field_limit=field_limit) as services:
+      services.patch(backgroundCheck, 'prepare_records_fields', records_fields)
+      messages = [build_outbound_message([build_lead(first + index) for index in range(min(LEADS_PER_MESSAGE, lead_count - first))])
+                  for first in range(0, lead_count, LEADS_PER_MESSAGE)]
+      with ThreadPoolExecutor(max_workers=10) as executor:
+         list(executor.map(lambda message: services.client.post('/background-check', data=message), messages))
+      items = [services.table.items[build_lead(index)['Id']] for index in range(lead_count)]
+      webhooks = [build_report_webhook(item['checkr_report_ID'], custom_ID=item['salesforce_lead_ID']) for item in items]
+      services.salesforce.reset_stats()
+      start = time.perf_counter()
+      with ThreadPoolExecutor(max_workers=10) as executor:
+         list(executor.map(lambda webhook: services.client.post('/checkr', json=webhook), webhooks))
+      elapsed = time.perf_counter() - start
+      created = [record for record in services.salesforce.created() if record.get('Status_Background_Check__c') == 'clear']
+      files = services.salesforce.created('ContentVersion')
+      expected = dict(record_sets(build_report(items[0]['checkr_report_ID'], items[0]['checkr_candidate_ID'], record_count)))
+      complete = all(record_sets == {field_name: expected[field_name] for field_name in record_sets}
+                     for record_sets in [json.loads(gzip.decompress(base64.b64decode(content_version['VersionData']))) for content_version in files])
+      return elapsed, services.salesforce.request_bytes, len(created), len(files), complete
+
+
+def main():
+   record_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+   lead_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+   latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+   writers = [('str() fields', legacy_records_fields), ('JSON + file', prepare_records_fields)]
+   print("Field limit %d characters, summary %d characters" % (settings.screeningFieldLimit, settings.screeningSummaryLength))
+   print("%-8s %-14s %14s %14s %12s %14s %10s" % ('records', 'fields', 'request bytes', 'longest field', 'file bytes', 'peak memory KB', 'ms'))
+   for count in sorted(set([10, 100, record_count])):
+      for name, records_fields in writers:
+         body_size, longest, file_size, peak, elapsed = measure_payload(records_fields, count)
+         print("%-8d %-14s %14d %14d %12d %14.0f %10.2f" % (count, name, body_size, longest, file_size, peak / 1024.0, elapsed))
+   print("")
+   print("%d leads with %d records per search, report.completed webhooks at 10 concurrent requests, %.0f ms Salesforce latency"
+         % (lead_count, record_count, latency * 1000))
+   print("%-14s %12s %10s %22s %18s %8s %14s" % ('fields', 'field limit', 'seconds', 'Salesforce bytes sent', 'objects created', 'files', 'files complete'))
+   for name, records_fields, field_limit in [writers[0] + (None,), writers[0] + (settings.screeningFieldLimit,), writers[1] + (settings.screeningFieldLimit,)]:
+      elapsed, request_bytes, created, files, complete = run_end_to_end(records_fields, record_count, lead_count, latency, field_limit)
+      print("%-14s %12s %10.2f %22d %18s %8d %14s" % (name, field_limit or 'none', elapsed, request_bytes, '%d/%d' % (created, lead_count), files, complete))
+
+
+if __name__ == '__main__':
+   main()
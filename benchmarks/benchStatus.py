@@ -0,0 +1,150 @@
+"""
+Benchmarks the materialized status counters (statusCounters.py) served by '/status'
+Reading: fills the background check table with items spread over 30 days, then compares counting items by status with a scan of the table,
+which is how the process was monitored before, with a '/status' request served from the counters, at several table sizes
+Writing: runs leads through '/background-check' and their 'report.completed' webhooks with and without counters, and checks the counters
+kept up to date by the transitions match the counters rebuilt from the table by rebuildStatusCounters.py
+Usage: python benchmarks/benchStatus.py [largest table size] [DynamoDB latency in seconds]
+"""
+import collections
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import benchmarkEnvironment
+import rebuildStatusCounters
+import statusCounters
+from settings import settings
+from localServices import LocalServices
+from localDynamoDB import create_status_table
+from payloads import build_lead, build_outbound_message, build_report_webhook
+
+DAYS = 30
+LEADS_PER_MESSAGE = 10
+
+
+"""
+Fills the background check table with items in every status, created over the last days, without going through the pipeline
+Parameters: local services and number of items
+Output: None
+"""
+def populate(services, item_count):
+   now = int(time.time())
+   generator = random.Random(0)
+   for index in range(item_count):
+      lead_ID = '00Q' + str(index).zfill(15)
+      candidate_created_at = now - generator.randint(0, DAYS * 86400)
+      item = {'name': 'Volunteer Number' + str(index), 'salesforce_lead_ID': lead_ID, 'checkr_candidate_ID': 'candidate%d' % index,
+              'checkr_status': "candidate created", 'candidate_created_at': candidate_created_at}
+      draw = generator.random()
+      if draw > 0.02:
+         item.update(checkr_status="report created", checkr_report_ID='report%d' % index, report_created_at=candidate_created_at + 60)
+      if draw > 0.1:
+         item.update(checkr_status="report completed", report_completed_at=min(now, item['report_created_at'] + generator.randint(3600, 5 * 86400)))
+      services.table.items[lead_ID] = item
+
+
+"""
+Counts items by status with a full scan of the table, like reading 'checkr_status' across the table in the console
+Parameters: DynamoDB table
+Output: dictionary mapping status to number of items
+"""
+def scan_counts(table):
+   counts = collections.Counter()
+   scan_kwargs = {'ProjectionExpression': 'checkr_status'}
+   while True:
+      response = table.scan(**scan_kwargs)
+      counts.update(item['checkr_status'] for item in response['Items'])
+      if 'LastEvaluatedKey' not in response:
+         return dict(counts)
+      scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+"""
+Compares a full scan with a '/status' request at one table size
+Parameters: number of items and DynamoDB latency in seconds
+Output: list of (method, seconds, DynamoDB requests, read capacity units, items read) tuples
+"""
+def run_read(item_count, latency):
+   with LocalServices(dynamodb_latency=latency) as services:
+      status_table = create_status_table(latency=latency)
+      services.patch(statusCounters, 'status_store', statusCounters.DynamoDBStatusStore(status_table))
+      services.patch(rebuildStatusCounters, 'get_background_check_table', lambda: services.table)
+      populate(services, item_count)
+      results = []
+
+      services.table.reset_stats()
+      start = time.perf_counter()
+      counts = scan_counts(services.table)
+      results.append(('scan', time.perf_counter() - start, services.table.request_count, services.table.consumed_read_units, services.table.items_read))
+
+      services.table.reset_stats()
+      start = time.perf_counter()
+      rebuildStatusCounters.rebuild_status_counters(settings.reconcileSegments)
+      results.append(('rebuild', time.perf_counter() - start, services.table.request_count + status_table.request_count,
+                      services.table.consumed_read_units, services.table.items_read))
+
+      services.table.reset_stats()
+      status_table.reset_stats()
+      start = time.perf_counter()
+      response = services.client.get('/status', headers={'X-API-Key': settings.bimApiKey})
+      results.append(('/status', time.perf_counter() - start, services.table.request_count + status_table.request_count,
+                      status_table.consumed_read_units, status_table.items_read))
+      if response.status_code != 200 or response.json['counts'] != {status: counts.get(status, 0) for status in statusCounters.CHECKR_STATUSES}:
+         raise AssertionError('/status counts %s differ from scanned counts %s' % (response.json.get('counts'), counts))
+      return results
+
+
+"""
+Runs leads through outbound messages and then the 'report.completed' webhooks of two thirds of them, with or without status counters
+Parameters: number of leads, DynamoDB latency in seconds, and whether status counters are kept
+Output: seconds, DynamoDB write requests per lead, and whether live counters match rebuilt counters (None without counters)
+"""
+def run_write(lead_count, latency, with_counters):
+   with LocalServices(dynamodb_latency=latency) as services:
+      status_table = create_status_table(latency=latency)
+      services.patch(statusCounters, 'status_store', statusCounters.DynamoDBStatusStore(status_table) if with_counters else None)
+      services.patch(settings, 'statusBackend', 'dynamodb' if with_counters else '')
+      services.patch(rebuildStatusCounters, 'get_background_check_table', lambda: services.table)
+      messages = [build_outbound_message([build_lead(first + index) for index in range(LEADS_PER_MESSAGE)])
+                  for first in range(0, lead_count, LEADS_PER_MESSAGE)]
+      start = time.perf_counter()
+      with ThreadPoolExecutor(max_workers=10) as executor:
+         list(executor.map(lambda message: services.client.post('/background-check', data=message), messages))
+      items = [services.table.items[build_lead(index)['Id']] for index in range(lead_count) if index % 3 != 0]
+      webhooks = [build_report_webhook(item['checkr_report_ID'], custom_ID=item['salesforce_lead_ID']) for item in items]
+      with ThreadPoolExecutor(max_workers=10) as executor:
+         list(executor.map(lambda webhook: services.client.post('/checkr', json=webhook), webhooks))
+      elapsed = time.perf_counter() - start
+      write_requests = (services.table.request_count + status_table.request_count) / float(lead_count)
+      if not with_counters:
+         return elapsed, write_requests, None
+      live = services.client.get('/status', headers={'X-API-Key': settings.bimApiKey}).json
+      rebuildStatusCounters.rebuild_status_counters(settings.reconcileSegments)
+      rebuilt = services.client.get('/status', headers={'X-API-Key': settings.bimApiKey}).json
+      for status in [live, rebuilt]:
+         status['oldest_outstanding_report'].pop('age_seconds')
+      return elapsed, write_requests, live == rebuilt
+
+
+def main():
+   largest = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+   latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.005
+   print("%.0f ms DynamoDB latency per request, %d days of items" % (latency * 1000, DAYS))
+   print("%-10s %-10s %10s %18s %16s %12s" % ('items', 'method', 'ms', 'DynamoDB requests', 'read units', 'items read'))
+   item_count = 1000
+   while item_count <= largest:
+      for method, seconds, requests, read_units, items_read in run_read(item_count, latency):
+         print("%-10d %-10s %10.1f %18d %16.1f %12d" % (item_count, method, seconds * 1000, requests, read_units, items_read))
+      item_count *= 10
+   print("")
+   lead_count = 300
+   print("%d leads through outbound messages of %d leads, then webhooks of two thirds of them, 10 concurrent requests" % (lead_count, LEADS_PER_MESSAGE))
+   print("%-16s %10s %22s %26s" % ('counters', 'seconds', 'DynamoDB requests/lead', 'live matches rebuilt'))
+   for with_counters in [False, True]:
+      elapsed, write_requests, matches = run_write(lead_count, latency, with_counters)
+      print("%-16s %10.2f %22.2f %26s" % ('on' if with_counters else 'off', elapsed, write_requests, '-' if matches is None else matches))
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,152 @@
+"""
+Benchmarks Checkr throttling and outages with and without the client-side rate limiter and circuit breaker (rateLimiting.py)
+Throttling: outbound messages are sent concurrently to a fake Checkr that answers requests over its per-second limit with a 429
+Outage: outbound messages are sent one after another while the fake Checkr answers every request with a 503 for a few seconds
+Messages answered with a 503 are delivered again, like Salesforce does, until every one is acknowledged; reports the Checkr requests sent,
+429s received and requests sent during the outage, messages deferred, and leads recorded as errors instead of getting a report
+Usage: python benchmarks/benchThrottling.py [leads] [Checkr requests per second] [outage seconds]
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import benchmarkEnvironment
+from settings import settings
+from rateLimiting import DynamoDBRateLimitBackend
+from localDynamoDB import LocalTable
+from localServices import LocalServices
+from payloads import build_lead, build_outbound_message
+
+LEADS_PER_MESSAGE = 5
+## Seconds between rounds of redeliveries of deferred messages, and seconds after which undelivered messages are given up
+REDELIVERY_INTERVAL = 0.5
+REDELIVERY_TIMEOUT = 60.0
+
+
+"""
+Sends outbound message once
+Parameters: local services and outbound message
+Output: True if it was acknowledged, False if it was deferred with a 503
+"""
+def send(services, message):
+   response = services.app.test_client().post('/background-check', data=message)
+   if response.status_code == 503:
+      return False
+   if b'<Ack>true</Ack>' not in response.data:
+      raise AssertionError('Outbound message was neither acknowledged nor deferred: %d' % response.status_code)
+   return True
+
+
+"""
+Delivers deferred messages again every REDELIVERY_INTERVAL seconds until all of them are acknowledged
+Parameters: local services, deferred messages and number of concurrent deliveries
+Output: number of redeliveries
+"""
+def redeliver(services, messages, concurrency):
+   redeliveries = 0
+   deadline = time.time() + REDELIVERY_TIMEOUT
+   while messages and time.time() < deadline:
+      time.sleep(REDELIVERY_INTERVAL)
+      with ThreadPoolExecutor(max_workers=concurrency) as executor:
+         acknowledged = list(executor.map(lambda message: send(services, message), messages))
+      redeliveries += len(messages)
+      messages = [message for message, message_acknowledged in zip(messages, acknowledged) if not message_acknowledged]
+   if messages:
+      raise AssertionError('%d messages still deferred after %.0f s' % (len(messages), REDELIVERY_TIMEOUT))
+   return redeliveries
+
+
+"""
+Counts leads which got a Checkr report and leads recorded as 'Background Check' objects with an error
+Parameters: local services
+Output: number of reports created and number of error records
+"""
+def count_outcomes(services):
+   reports = sum(1 for item in services.table.items.values() if item.get('checkr_status') == 'report created')
+   errors = sum(1 for record in services.salesforce.created() if record.get('Error_Create_Candidate__c') or record.get('Error_Create_Report__c'))
+   return reports, errors
+
+
+"""
+Creates local services with the given rate limit backend ('none', 'local' or 'dynamodb') and fast circuit reset for benchmarking
+Parameters: backend name, Checkr requests per second the fake allows (None for no limit), and rate the guard allows
+Output: local services, not started yet, and rate limit table (None unless backend is 'dynamodb')
+"""
+def create_services(backend_name, checkr_rate_limit, guard_rate):
+   table = LocalTable(key='limit_key', latency=0.002) if backend_name == 'dynamodb' else None
+   services = LocalServices(checkr_latency=0.01, salesforce_latency=0.01, checkr_rate_limit=checkr_rate_limit,
+                            rate_limit_backend=DynamoDBRateLimitBackend(table) if table is not None else None)
+   services.patch(settings, 'rateLimitBackend', '' if backend_name == 'none' else 'local')
+   services.patch(settings, 'checkrRateLimit', guard_rate)
+   services.patch(settings, 'checkrBurst', 5)
+   services.patch(settings, 'circuitResetTimeout', 1.0)
+   services.patch(settings, 'rateLimitMaxWait', 5.0)
+   return services, table
+
+
+"""
+Sends every message concurrently to a Checkr that allows 'rate' requests per second, then redelivers deferred messages
+Parameters: backend name, number of leads and Checkr requests per second
+Output: dictionary of results
+"""
+def run_throttling(backend_name, lead_count, rate):
+   messages = [build_outbound_message([build_lead(index) for index in range(start, min(start + LEADS_PER_MESSAGE, lead_count))])
+               for start in range(0, lead_count, LEADS_PER_MESSAGE)]
+   services, table = create_services(backend_name, rate, rate * 0.9)
+   with services:
+      start = time.perf_counter()
+      with ThreadPoolExecutor(max_workers=len(messages)) as executor:
+         acknowledged = list(executor.map(lambda message: send(services, message), messages))
+      deferred = [message for message, message_acknowledged in zip(messages, acknowledged) if not message_acknowledged]
+      redeliveries = redeliver(services, deferred, len(messages))
+      elapsed = time.perf_counter() - start
+      reports, errors = count_outcomes(services)
+      return {'elapsed': elapsed, 'checkr_requests': services.checkr.request_count, 'throttled': services.checkr.throttled_count,
+              'outage_requests': 0, 'deferred': redeliveries, 'reports': reports, 'errors': errors,
+              'limit_requests': table.request_count if table is not None else 0}
+
+
+"""
+Sends messages one after another, with Checkr down for 'outage' seconds once a third of them have been sent, then redelivers deferred messages
+Parameters: backend name, number of leads and outage duration in seconds
+Output: dictionary of results
+"""
+def run_outage(backend_name, lead_count, outage):
+   messages = [build_outbound_message([build_lead(index) for index in range(start, min(start + LEADS_PER_MESSAGE, lead_count))])
+               for start in range(0, lead_count, LEADS_PER_MESSAGE)]
+   services, table = create_services(backend_name, None, 1000.0)
+   ## Messages are spread over twice the outage, so the outage starts after the first third and ends before the last third
+   interval = outage * 2 / len(messages)
+   with services:
+      start = time.perf_counter()
+      deferred = []
+      for index, message in enumerate(messages):
+         if index == len(messages) // 3:
+            services.checkr.start_outage(outage)
+         if not send(services, message):
+            deferred.append(message)
+         time.sleep(interval)
+      redeliveries = redeliver(services, deferred, 1)
+      elapsed = time.perf_counter() - start
+      reports, errors = count_outcomes(services)
+      return {'elapsed': elapsed, 'checkr_requests': services.checkr.request_count, 'throttled': 0,
+              'outage_requests': services.checkr.outage_request_count, 'deferred': redeliveries, 'reports': reports, 'errors': errors,
+              'limit_requests': table.request_count if table is not None else 0}
+
+
+def main():
+   lead_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+   rate = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+   outage = float(sys.argv[3]) if len(sys.argv) > 3 else 3.0
+   print("%d leads in messages of %d, Checkr limit %d requests/s, %.0f s Checkr outage, 10 ms service latency" % (lead_count, LEADS_PER_MESSAGE, rate, outage))
+   print("%-10s %-8s %9s %8s %7s %13s %9s %8s %7s %14s" % ('scenario', 'guard', 'elapsed s', 'checkr', '429s', 'outage checkr', 'deferred',
+                                                            'reports', 'errors', 'limit requests'))
+   for scenario, run in [('throttled', lambda name: run_throttling(name, lead_count, rate)), ('outage', lambda name: run_outage(name, lead_count, outage))]:
+      for backend_name in ['none', 'local', 'dynamodb']:
+         result = run(backend_name)
+         print("%-10s %-8s %9.1f %8d %7d %13d %9d %8d %7d %14d" % (scenario, backend_name, result['elapsed'], result['checkr_requests'], result['throttled'],
+                                                                  result['outage_requests'], result['deferred'], result['reports'], result['errors'],
+                                                                  result['limit_requests']))
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,115 @@
+"""
+Measures the overhead of the tracing layer (tracing.py)
+Times spans and traced calls in a tight loop with tracing disabled, unsampled and sampled, then sends requests to both endpoints
+with no exporter, the EMF exporter, and the EMF exporter sampling 10% of traces, reporting latency and bytes of EMF output per request
+Usage: python benchmarks/benchTracing.py [requests per configuration]
+"""
+import contextlib
+import io
+import statistics
+import sys
+import time
+import benchmarkEnvironment
+import tracing
+from tracing import Tracer, LocalExporter, EMFExporter, traced
+from localServices import LocalServices
+from payloads import build_lead, build_outbound_message, build_report_webhook
+
+LOOP_ITERATIONS = 200000
+ROUNDS = 5
+
+
+@traced('benchmark_stage')
+def traced_function():
+   return None
+
+
+def untraced_function():
+   return None
+
+
+"""
+Times one iteration of a loop body in nanoseconds, best of several rounds
+Parameters: tracer, loop body, and endpoint of the trace the loop runs in (None for no trace)
+Output: nanoseconds per iteration
+"""
+def time_loop(tracer, body, endpoint):
+   tracing.tracer = tracer
+   best = None
+   for round_number in range(ROUNDS):
+      trace = tracer.start_trace(endpoint) if endpoint is not None else None
+      start = time.perf_counter()
+      for iteration in range(LOOP_ITERATIONS):
+         body()
+      elapsed = time.perf_counter() - start
+      if trace is not None:
+         trace.spans = []
+         tracer.end_trace(trace)
+      best = elapsed if best is None else min(best, elapsed)
+   return best / LOOP_ITERATIONS * 1e9
+
+
+def span_body():
+   with tracing.span('benchmark_stage'):
+      pass
+
+
+"""
+Sends requests to both endpoints with the given tracer, interleaving the endpoints
+Parameters: local services, tracer, number of requests per endpoint, and index of the first lead
+Output: mean latency of each endpoint in milliseconds and bytes of EMF output per request
+"""
+def run_requests(services, tracer, request_count, offset):
+   services.patch(tracing, 'tracer', tracer)
+   latencies = {'/background-check': [], '/checkr': []}
+   output = io.StringIO()
+   with contextlib.redirect_stdout(output):
+      for index in range(request_count):
+         start = time.perf_counter()
+         services.client.post('/background-check', data=build_outbound_message([build_lead(offset + index)]))
+         latencies['/background-check'].append(time.perf_counter() - start)
+         report_ID = services.table.get_item(Key={'salesforce_lead_ID': build_lead(offset + index)['Id']})['Item']['checkr_report_ID']
+         start = time.perf_counter()
+         services.client.post('/checkr', json=build_report_webhook(report_ID))
+         latencies['/checkr'].append(time.perf_counter() - start)
+   emf_bytes = sum(len(line) + 1 for line in output.getvalue().splitlines() if line.startswith('{"_aws"'))
+   return {endpoint: statistics.mean(values) * 1000 for endpoint, values in latencies.items()}, emf_bytes / (request_count * 2)
+
+
+def main():
+   request_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+   print("%-40s %10s" % ('loop body', 'ns/call'))
+   loops = [('plain function call', Tracer(None), untraced_function, None),
+            ('span, tracing disabled', Tracer(None), span_body, None),
+            ('span, trace not sampled', Tracer(LocalExporter(), 0.0), span_body, '/checkr'),
+            ('span, trace sampled', Tracer(LocalExporter(), 1.0), span_body, '/checkr'),
+            ('traced function, tracing disabled', Tracer(None), traced_function, None),
+            ('traced function, trace sampled', Tracer(LocalExporter(), 1.0), traced_function, '/checkr')]
+   for name, tracer, body, endpoint in loops:
+      print("%-40s %10.0f" % (name, time_loop(tracer, body, endpoint)))
+   tracing.tracer = None
+
+   print("")
+   print("%d requests per endpoint, no service latency" % request_count)
+   print("%-22s %22s %14s %16s" % ('tracer', '/background-check ms', '/checkr ms', 'EMF bytes/req'))
+   configurations = [('none', lambda: Tracer(None)),
+                     ('emf', lambda: Tracer(EMFExporter('BackgroundCheck', 'benchmark'))),
+                     ('emf, 10% sampled', lambda: Tracer(EMFExporter('BackgroundCheck', 'benchmark'), 0.1))]
+   results = {name: [] for name, create_tracer in configurations}
+   with LocalServices() as services:
+      ## Warms up connections and the Salesforce token before timing
+      run_requests(services, Tracer(None), 20, 0)
+      offset = 20
+      ## Configurations are rotated every round so none always runs first
+      for round_number in range(ROUNDS):
+         for name, create_tracer in configurations[round_number % len(configurations):] + configurations[:round_number % len(configurations)]:
+            results[name].append(run_requests(services, create_tracer(), request_count, offset))
+            offset += request_count
+   for name, create_tracer in configurations:
+      runs = results[name]
+      print("%-22s %22.3f %14.3f %16.0f" % (name, statistics.median(run[0]['/background-check'] for run in runs),
+                                            statistics.median(run[0]['/checkr'] for run in runs), statistics.median(run[1] for run in runs)))
+
+
+if __name__ == '__main__':
+   main()
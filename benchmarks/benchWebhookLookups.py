@@ -0,0 +1,73 @@
+"""
+Benchmarks DynamoDB round trips of report creation and of 'report.completed' webhooks with and without the Salesforce lead ID
+stamped on the Checkr candidate as its custom ID
+Without it (candidates created before lead IDs were stamped), report creation looks the lead up by candidate ID and webhooks look it up
+by report ID before their update; with it, each is a single conditional update by primary key
+Usage: python benchmarks/benchWebhookLookups.py [leads] [DynamoDB latency in seconds]
+"""
+import sys
+import time
+import benchmarkEnvironment
+import backgroundCheck
+from localServices import LocalServices
+from payloads import build_lead, build_report_webhook
+
+
+"""
+Creates Checkr candidates and reports for leads, recording the report with or without the lead ID known
+Parameters: local services, leads, and whether create_checkr_report() is given the lead ID and name
+Output: DynamoDB requests and seconds per report creation
+"""
+def create_reports(services, leads, with_lead_ID):
+   candidates = [(backgroundCheck.create_checkr_candidate(*lead)[0], lead) for lead in leads]
+   services.table.reset_stats()
+   start = time.perf_counter()
+   for checkr_candidate_ID, (salesforce_lead_ID, salesforce_lead_PII_dict) in candidates:
+      if with_lead_ID:
+         backgroundCheck.create_checkr_report(checkr_candidate_ID, salesforce_lead_ID, backgroundCheck.get_lead_name(salesforce_lead_PII_dict))
+      else:
+         backgroundCheck.create_checkr_report(checkr_candidate_ID)
+   elapsed = time.perf_counter() - start
+   return services.table.request_count / len(leads), elapsed / len(leads)
+
+
+"""
+Sends a 'report.completed' webhook, or runs a report completed job, for every report, then does it again as a redelivery
+Parameters: local services, leads, whether webhooks carry the lead ID, and whether reports are processed as jobs
+Output: DynamoDB requests and seconds per first delivery, and DynamoDB requests per redelivery
+"""
+def complete_reports(services, leads, with_lead_ID, as_jobs):
+   items = [services.table.items[lead[0]] for lead in leads]
+   results = []
+   for delivery in range(2):
+      services.table.reset_stats()
+      start = time.perf_counter()
+      for item in items:
+         custom_ID = item['salesforce_lead_ID'] if with_lead_ID else None
+         if as_jobs:
+            backgroundCheck.report_completed_job({'checkr_report_ID': item['checkr_report_ID'], 'salesforce_lead_ID': custom_ID}, 1)
+         else:
+            services.client.post('/checkr', json=build_report_webhook(item['checkr_report_ID'], custom_ID=custom_ID))
+      results.append((services.table.request_count / len(items), (time.perf_counter() - start) / len(items)))
+   return results[0][0], results[0][1], results[1][0]
+
+
+def main():
+   lead_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+   latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.005
+   print("%d leads, %.0f ms DynamoDB latency, no Checkr or Salesforce latency" % (lead_count, latency * 1000))
+   print("%-28s %-10s %16s %8s %22s" % ('step', 'lead ID', 'DynamoDB/request', 'ms', 'DynamoDB/redelivery'))
+   for with_lead_ID in [False, True]:
+      label = 'stamped' if with_lead_ID else 'looked up'
+      with LocalServices(dynamodb_latency=latency) as services:
+         leads = [backgroundCheck.parse_sf_lead({'sf:' + name: value for name, value in build_lead(index).items()}) for index in range(lead_count)]
+         requests, seconds = create_reports(services, leads, with_lead_ID)
+         print("%-28s %-10s %16.1f %8.1f %22s" % ('create report', label, requests, seconds * 1000, '-'))
+         requests, seconds, redelivery_requests = complete_reports(services, leads[:lead_count // 2], with_lead_ID, False)
+         print("%-28s %-10s %16.1f %8.1f %22.1f" % ('report.completed webhook', label, requests, seconds * 1000, redelivery_requests))
+         requests, seconds, redelivery_requests = complete_reports(services, leads[lead_count // 2:], with_lead_ID, True)
+         print("%-28s %-10s %16.1f %8.1f %22.1f" % ('report completed job', label, requests, seconds * 1000, redelivery_requests))
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,129 @@
+"""
+Load test for the '/checkr' webhook endpoint with bursts of duplicate and out-of-order report.completed webhooks
+Every report's webhook is delivered several times concurrently, and some arrive before the report ID has been stored in DynamoDB
+and are delivered again after being answered with a 503
+Checks that each lead gets exactly one Background_Check__c record and reports webhook response latency, inline and with a job queue
+Usage: python benchmarks/benchWebhooks.py [reports] [deliveries per report] [concurrency] [Checkr/Salesforce latency in seconds]
+"""
+import collections
+import contextlib
+import io
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import benchmarkEnvironment
+import backgroundCheck
+from settings import settings
+from benchmarkStats import summarize
+from localServices import LocalServices
+from salesforceWriter import flush_background_check_writers
+from payloads import build_report_webhook
+
+## Seconds after the burst starts at which late reports get their report ID stored
+LATE_REPORT_DELAY = 0.3
+## Seconds before a webhook answered with a 503 is delivered again
+REDELIVERY_DELAY = 0.05
+
+
+"""
+Creates candidates and reports in the fake Checkr server and items in the local table
+Every fourth report is 'late': its item is still at 'candidate created' with no report ID
+Parameters: local services and number of reports
+Output: list of report IDs, and list of (lead ID, report ID) tuples for late reports
+"""
+def create_reports(services, report_count):
+   report_IDs = []
+   late_reports = []
+   for index in range(report_count):
+      candidate_ID = services.checkr.create_candidate({'first_name': 'Volunteer', 'last_name': str(index)})[1]['id']
+      report_ID = services.checkr.create_report({'candidate_id': candidate_ID, 'package': settings.checkrPackage})[1]['id']
+      item = {'name': 'Volunteer ' + str(index), 'salesforce_lead_ID': 'lead' + str(index), 'checkr_candidate_ID': candidate_ID,
+              'checkr_status': 'candidate created'}
+      if index % 4 == 3:
+         late_reports.append((item['salesforce_lead_ID'], report_ID))
+      else:
+         item['checkr_report_ID'] = report_ID
+         item['checkr_status'] = 'report created'
+      services.table.put_item(Item=item)
+      report_IDs.append(report_ID)
+   return report_IDs, late_reports
+
+
+def store_late_reports(services, late_reports):
+   time.sleep(LATE_REPORT_DELAY)
+   for salesforce_lead_ID, report_ID in late_reports:
+      services.table.update_item(Key={'salesforce_lead_ID': salesforce_lead_ID}, UpdateExpression="set checkr_status=:v1, checkr_report_ID=:v2",
+                                 ExpressionAttributeValues={':v1': 'report created', ':v2': report_ID})
+
+
+"""
+Sends duplicated, shuffled webhooks for every report and waits until processing settles
+Parameters: job queue backend name ('' for inline), number of reports, deliveries per report, concurrency and service latency
+Output: webhook latency summary, Background_Check__c record counts per lead, and total time
+"""
+def run(backend_name, report_count, deliveries, concurrency, latency):
+   settings.jobQueueBackend = backend_name
+   backgroundCheck.job_queue = None
+   with LocalServices(checkr_latency=latency, salesforce_latency=latency, pool_size=concurrency) as services:
+      report_IDs, late_reports = create_reports(services, report_count)
+      webhooks = [build_report_webhook(report_ID) for report_ID in report_IDs for delivery in range(deliveries)]
+      random.shuffle(webhooks)
+      job_queue = backgroundCheck.get_job_queue()
+      if job_queue is not None:
+         job_queue.backoff_base = 0.1
+      latencies = []
+      clients = threading.local()
+
+      def send(webhook):
+         if not hasattr(clients, 'client'):
+            clients.client = services.app.test_client()
+         while True:
+            start = time.perf_counter()
+            response = clients.client.post('/checkr', json=webhook)
+            latencies.append(time.perf_counter() - start)
+            ## A report not stored yet is answered with a 503, and Checkr delivers the webhook again
+            if response.status_code != 503:
+               break
+            time.sleep(REDELIVERY_DELAY)
+         if response.status_code != 200:
+            raise AssertionError('Webhook answered ' + str(response.status_code))
+
+      with contextlib.redirect_stdout(io.StringIO()):
+         late_thread = threading.Thread(target=store_late_reports, args=(services, late_reports))
+         start = time.perf_counter()
+         late_thread.start()
+         with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(send, webhooks))
+         elapsed = time.perf_counter() - start
+         late_thread.join()
+         if job_queue is not None:
+            while job_queue.backend.depth() > 0:
+               time.sleep(0.01)
+         flush_background_check_writers()
+         total = time.perf_counter() - start
+      if backgroundCheck.job_worker_pool is not None:
+         backgroundCheck.job_worker_pool.stop()
+         backgroundCheck.job_worker_pool = None
+      records_per_lead = collections.Counter(record['Lead__c'] for record in services.salesforce.created())
+      return summarize(latencies, elapsed), records_per_lead, total
+
+
+def main():
+   report_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+   deliveries = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+   concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+   latency = float(sys.argv[4]) if len(sys.argv) > 4 else 0.02
+   print("%d reports x %d deliveries at concurrency %d, %d late" % (report_count, deliveries, concurrency, report_count // 4))
+   print("%-8s %9s %9s %9s %12s %10s %12s %12s" % ('mode', 'p50 ms', 'p95 ms', 'p99 ms', 'webhooks/s', 'leads', 'duplicates', 'settled ms'))
+   for backend_name in ['', 'memory']:
+      summary, records_per_lead, total = run(backend_name, report_count, deliveries, concurrency, latency)
+      duplicates = sum(count - 1 for count in records_per_lead.values())
+      print("%-8s %9.2f %9.2f %9.2f %12.1f %10d %12d %12.1f" % (backend_name or 'inline', summary['p50_ms'], summary['p95_ms'], summary['p99_ms'],
+                                                                summary['throughput_rps'], len(records_per_lead), duplicates, total * 1000))
+   settings.jobQueueBackend = ''
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,40 @@
+"""
+Prepares the process environment so benchmarks can import the background check modules without AWS access
+Import this module before any module from the repository root
+"""
+import os
+import sys
+
+## BENCHMARK_REPOSITORY_ROOT points benchmarks at another checkout, e.g. an earlier commit extracted to compare against
+REPOSITORY_ROOT = os.environ.get('BENCHMARK_REPOSITORY_ROOT') or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPOSITORY_ROOT not in sys.path:
+   sys.path.insert(0, REPOSITORY_ROOT)
+
+## Secrets are read from the environment before SSM, so placeholder values keep settings.py from calling AWS
+SECRET_NAMES = ['CHECKR_API_KEY', 'BIM_API_KEY', 'SALESFORCE_ORG_ID', 'SALESFORCE_PASSWORD', 'SALESFORCE_CLIENT_SECRET']
+BENCHMARK_ENVIRONMENT = {
+   'PYTHON_ENV': 'benchmark',
+   ## Benchmarks that look at spans install their own exporter, so the others don't print EMF documents
+   'TRACE_EXPORTER': 'none',
+   ## Benchmarks that look at logs set their own level, so the others don't write a line per request
+   'LOG_LEVEL': 'CRITICAL',
+   ## The idempotency ledger is kept in memory; LocalServices gives every run an empty one
+   'IDEMPOTENCY_BACKEND': 'memory',
+   ## Status counters are kept in memory; LocalServices gives every run empty ones
+   'STATUS_BACKEND': 'memory',
+   ## Checkr and Salesforce requests aren't rate limited unless a benchmark turns it on, so throughput benchmarks measure the code
+   'RATE_LIMIT_BACKEND': '',
+   'AWS_DEFAULT_REGION': 'us-west-2',
+   'AWS_ACCESS_KEY_ID': 'benchmark',
+   'AWS_SECRET_ACCESS_KEY': 'benchmark',
+   'CHECKR_API_KEY': 'benchmark-checkr-key',
+   'BIM_API_KEY': 'benchmark-bim-key',
+   'SALESFORCE_ORG_ID': '00D000000000001AAA',
+   'SALESFORCE_PASSWORD': 'benchmark-password',
+   'SALESFORCE_CLIENT_SECRET': 'benchmark-client-secret',
+}
+## Cold-start benchmarks set BENCHMARK_USE_SSM so secrets are read from a fake SSM endpoint instead
+for name, value in BENCHMARK_ENVIRONMENT.items():
+   if os.environ.get('BENCHMARK_USE_SSM') and name in SECRET_NAMES:
+      continue
+   os.environ.setdefault(name, value)
@@ -0,0 +1,32 @@
+"""
+Summary statistics shared by the benchmarks
+"""
+import math
+
+
+"""
+Returns the given percentile of a list of values using the nearest-rank method
+Parameters: list of values and percentile between 0 and 100
+Output: percentile value, or 0.0 for an empty list
+"""
+def percentile(values, percent):
+   if not values:
+      return 0.0
+   ordered = sorted(values)
+   rank = max(1, int(math.ceil(percent / 100.0 * len(ordered))))
+   return ordered[rank - 1]
+
+
+"""
+Summarizes request latencies measured over a run
+Parameters: list of latencies in seconds and wall-clock duration of the run in seconds
+Output: dictionary with request count, p50/p95/p99/mean latency in milliseconds and throughput in requests per second
+"""
+def summarize(latencies, elapsed):
+   count = len(latencies)
+   return {'requests': count,
+           'p50_ms': percentile(latencies, 50) * 1000,
+           'p95_ms': percentile(latencies, 95) * 1000,
+           'p99_ms': percentile(latencies, 99) * 1000,
+           'mean_ms': (sum(latencies) / count * 1000) if count else 0.0,
+           'throughput_rps': count / elapsed if elapsed else 0.0}
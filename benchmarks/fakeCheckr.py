@@ -0,0 +1,226 @@
+"""
+Local fake of the Checkr API for benchmarks, served over HTTP on a background thread
+Implements POST /v1/candidates, POST /v1/reports and GET /v1/reports/<id> with configurable latency and error rate,
+honors Idempotency-Key headers like Checkr does, can rate limit requests or simulate an outage, and counts requests and connections
+"""
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from fakeServer import FakeHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+## Candidates with this SSN are rejected like Checkr rejects invalid SSNs
+INVALID_SSN = '000-00-0000'
+
+
+"""
+Builds a completed Checkr report with SSN trace and the three searches
+Parameters: report ID, candidate ID, and number of records in each search
+Output: report object
+"""
+def build_report(report_ID, candidate_ID, record_count=0):
+   def search(object_name):
+      records = [{'id': object_name + str(index), 'case_number': 'CR-' + str(index), 'file_date': '2015-01-01',
+                  'charges': [{'charge': 'Disorderly conduct', 'disposition': 'Dismissed', 'offense_date': '2014-12-01'}],
+                  'address': {'street': str(index) + ' Main St', 'city': 'San Francisco', 'state': 'CA', 'zipcode': '94105'}}
+                 for index in range(record_count)]
+      return {'id': object_name + '_' + report_ID, 'object': 'test_' + object_name, 'status': 'consider' if records else 'clear',
+              'turnaround_time': 120, 'records': records}
+
+   return {'id': report_ID, 'object': 'test_report', 'candidate_id': candidate_ID, 'status': 'clear', 'turnaround_time': 360,
+           'ssn_trace': {'id': 'ssn_trace_' + report_ID, 'object': 'test_ssn_trace', 'status': 'clear', 'turnaround_time': 30,
+                         'no_data': False, 'dob_mismatch': False, 'name_mismatch': False, 'data_mismatch': False, 'thin_file': False,
+                         'invalid_issuance_year': False, 'death_index': False, 'ssn_already_taken': False, 'issued_year': 2000,
+                         'issued_state': 'CA',
+                         'addresses': [{'street': str(index) + ' Market St', 'city': 'San Francisco', 'state': 'CA', 'zipcode': '94105',
+                                        'county': 'San Francisco', 'from_date': '2010-01-01', 'to_date': '2012-01-01'}
+                                       for index in range(max(1, record_count))],
+                         'aliases': [{'first_name': 'Alias', 'middle_name': None, 'last_name': str(index)} for index in range(record_count)]},
+           'sex_offender_search': search('sex_offender_search'),
+           'global_watchlist_search': search('global_watchlist_search'),
+           'national_criminal_search': search('national_criminal_search')}
+
+
+class FakeCheckrServer:
+   """
+   Creates fake Checkr API server
+   Parameters: latency in seconds added to every response, fraction of requests answered with a 503,
+   number of records in each search of retrieved reports, and requests allowed per second before answering with a 429, if any
+   """
+   def __init__(self, latency=0.0, error_rate=0.0, record_count=0, rate_limit=None):
+      self.latency = latency
+      self.error_rate = error_rate
+      self.record_count = record_count
+      self.rate_limit = rate_limit
+      ## Every request is answered with a 503 until this time.time(), as if Checkr were down
+      self.unavailable_until = 0.0
+      self.window = (0, 0)
+      self.lock = threading.Lock()
+      self.candidates = {}
+      self.reports = {}
+      self.idempotent_responses = {}
+      ## Reports in this set are returned with status 'pending', as if Checkr hadn't finished them yet
+      self.pending_reports = set()
+      self.reset_stats()
+      self.server = FakeHTTPServer(('127.0.0.1', 0), self.build_handler())
+      self.thread = None
+
+   @property
+   def base_url(self):
+      return 'http://127.0.0.1:' + str(self.server.server_port)
+
+   def reset_stats(self):
+      self.request_count = 0
+      self.error_count = 0
+      self.throttled_count = 0
+      self.outage_request_count = 0
+      self.connections = set()
+      self.requests_by_path = {}
+
+   def start(self):
+      self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+      self.thread.start()
+      return self
+
+   def stop(self):
+      self.server.shutdown()
+      self.server.server_close()
+
+   def __enter__(self):
+      return self.start()
+
+   def __exit__(self, *exc_info):
+      self.stop()
+
+   """
+   Answers every request with a 503 for given number of seconds
+   Parameters: outage duration in seconds
+   Output: None
+   """
+   def start_outage(self, duration):
+      self.unavailable_until = time.time() + duration
+
+   """
+   Counts request in the current one-second window like Checkr's per-key rate limit
+   Parameters: None
+   Output: rate limit headers, and whether the request is over the limit
+   """
+   def rate_limit_request(self):
+      now = time.time()
+      window_start, count = self.window
+      if int(now) != window_start:
+         window_start, count = int(now), 0
+      count += 1
+      self.window = (window_start, count)
+      headers = {'X-Ratelimit-Limit': str(self.rate_limit), 'X-Ratelimit-Remaining': str(max(0, self.rate_limit - count)),
+                 'X-Ratelimit-Reset': str(window_start + 1)}
+      if count > self.rate_limit:
+         headers['Retry-After'] = str(int(math.ceil(window_start + 1 - now)))
+      return headers, count > self.rate_limit
+
+   def create_candidate(self, fields):
+      if fields.get('ssn') == INVALID_SSN:
+         return 422, {'error': ['SSN is invalid']}
+      candidate_ID = uuid.uuid4().hex[:24]
+      candidate = dict(fields, id=candidate_ID, object='test_candidate')
+      self.candidates[candidate_ID] = candidate
+      return 201, candidate
+
+   def create_report(self, fields):
+      candidate_ID = fields.get('candidate_id', '')
+      if candidate_ID not in self.candidates:
+         return 404, {'error': ['Candidate not found']}
+      report_ID = uuid.uuid4().hex[:24]
+      self.reports[report_ID] = {'id': report_ID, 'object': 'test_report', 'candidate_id': candidate_ID, 'status': 'pending',
+                                 'package': fields.get('package')}
+      ## Reports carry the custom ID of their candidate, if it has one
+      if self.candidates[candidate_ID].get('custom_id'):
+         self.reports[report_ID]['custom_id'] = self.candidates[candidate_ID]['custom_id']
+      return 201, self.reports[report_ID]
+
+   def retrieve_report(self, report_ID):
+      if report_ID not in self.reports:
+         return 404, {'error': ['Report not found']}
+      report = build_report(report_ID, self.reports[report_ID]['candidate_id'], self.record_count)
+      if 'custom_id' in self.reports[report_ID]:
+         report['custom_id'] = self.reports[report_ID]['custom_id']
+      if report_ID in self.pending_reports:
+         report['status'] = 'pending'
+      return 200, report
+
+   """
+   Routes a request to the matching fake endpoint
+   Parameters: method, path, form fields and headers
+   Output: status code, response body and response headers
+   """
+   def handle(self, method, path, fields, headers):
+      with self.lock:
+         self.request_count += 1
+         route = method + ' ' + '/'.join(path.split('/')[:3])
+         self.requests_by_path[route] = self.requests_by_path.get(route, 0) + 1
+         if time.time() < self.unavailable_until:
+            self.outage_request_count += 1
+            return 503, {'error': ['Service unavailable']}, {}
+         response_headers = {}
+         if self.rate_limit:
+            response_headers, throttled = self.rate_limit_request()
+            if throttled:
+               self.throttled_count += 1
+               return 429, {'error': ['Too many requests']}, response_headers
+         if self.error_rate and random.random() < self.error_rate:
+            self.error_count += 1
+            return 503, {'error': ['Service unavailable']}, response_headers
+         idempotency_key = headers.get('Idempotency-Key')
+         if method == 'POST' and idempotency_key in self.idempotent_responses:
+            return self.idempotent_responses[idempotency_key] + (response_headers,)
+         if method == 'POST' and path == '/v1/candidates':
+            result = self.create_candidate(fields)
+         elif method == 'POST' and path == '/v1/reports':
+            result = self.create_report(fields)
+         elif method == 'GET' and path.startswith('/v1/reports/'):
+            result = self.retrieve_report(path[len('/v1/reports/'):])
+         else:
+            result = 404, {'error': ['Not found']}
+         if method == 'POST' and idempotency_key is not None and result[0] < 300:
+            self.idempotent_responses[idempotency_key] = result
+         return result + (response_headers,)
+
+   def build_handler(self):
+      fake = self
+
+      class Handler(BaseHTTPRequestHandler):
+         protocol_version = 'HTTP/1.1'
+         ## Headers and body are written separately, so Nagle's algorithm would otherwise stall keep-alive responses
+         disable_nagle_algorithm = True
+
+         def log_message(self, *args):
+            pass
+
+         def respond(self, method):
+            fake.connections.add(self.client_address)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length).decode() if length else ''
+            fields = {name: values[0] for name, values in parse_qs(body).items()}
+            if fake.latency:
+               time.sleep(fake.latency)
+            status, response_body, response_headers = fake.handle(method, urlparse(self.path).path, fields, self.headers)
+            encoded = json.dumps(response_body).encode()
+            self.send_response(status)
+            for name, value in response_headers.items():
+               self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(encoded)))
+            self.end_headers()
+            self.wfile.write(encoded)
+
+         def do_GET(self):
+            self.respond('GET')
+
+         def do_POST(self):
+            self.respond('POST')
+
+      return Handler
@@ -0,0 +1,80 @@
+"""
+Local fake of the SSM Parameter Store API for benchmarks, served over HTTP on a background thread
+Point boto3 at it with the AWS_ENDPOINT_URL_SSM environment variable; implements GetParameter and GetParameters
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from fakeServer import FakeHTTPServer
+
+
+class FakeSSMServer:
+   """
+   Creates fake SSM server
+   Parameters: dictionary of parameter names and values, and latency in seconds added to every response
+   """
+   def __init__(self, parameters, latency=0.0):
+      self.parameters = dict(parameters)
+      self.latency = latency
+      self.lock = threading.Lock()
+      self.requests_by_action = {}
+      self.server = FakeHTTPServer(('127.0.0.1', 0), self.build_handler())
+
+   @property
+   def endpoint_url(self):
+      return 'http://127.0.0.1:' + str(self.server.server_port)
+
+   def start(self):
+      threading.Thread(target=self.server.serve_forever, daemon=True).start()
+      return self
+
+   def stop(self):
+      self.server.shutdown()
+      self.server.server_close()
+
+   def __enter__(self):
+      return self.start()
+
+   def __exit__(self, *exc_info):
+      self.stop()
+
+   def parameter(self, name):
+      return {'Name': name, 'Type': 'SecureString', 'Value': self.parameters[name], 'Version': 1}
+
+   def handle(self, action, body):
+      with self.lock:
+         self.requests_by_action[action] = self.requests_by_action.get(action, 0) + 1
+      if action == 'GetParameter':
+         if body['Name'] not in self.parameters:
+            return 400, {'__type': 'ParameterNotFound', 'message': body['Name']}
+         return 200, {'Parameter': self.parameter(body['Name'])}
+      if action == 'GetParameters':
+         return 200, {'Parameters': [self.parameter(name) for name in body['Names'] if name in self.parameters],
+                      'InvalidParameters': [name for name in body['Names'] if name not in self.parameters]}
+      return 400, {'__type': 'InvalidAction', 'message': action}
+
+   def build_handler(self):
+      fake = self
+
+      class Handler(BaseHTTPRequestHandler):
+         protocol_version = 'HTTP/1.1'
+         disable_nagle_algorithm = True
+
+         def log_message(self, *args):
+            pass
+
+         def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if fake.latency:
+               time.sleep(fake.latency)
+            status, response_body = fake.handle(self.headers.get('X-Amz-Target', '').split('.')[-1], body)
+            encoded = json.dumps(response_body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/x-amz-json-1.1')
+            self.send_header('Content-Length', str(len(encoded)))
+            self.end_headers()
+            self.wfile.write(encoded)
+
+      return Handler
@@ -0,0 +1,230 @@
+"""
+Local fake of the Salesforce OAuth and REST endpoints for benchmarks, served over HTTP on a background thread
+Implements the username-password token endpoint, sObject creation and lead retrieval with configurable latency, error rate and maximum length of text fields,
+can simulate an outage, and keeps every created record so benchmarks can check what was written
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from fakeServer import FakeHTTPServer
+from urllib.parse import urlparse
+from payloads import build_lead
+
+
+class FakeSalesforceServer:
+   """
+   Creates fake Salesforce server
+   Parameters: latency in seconds added to every response, fraction of REST requests answered with a 503,
+   and maximum length of text fields of records other than files, like the limit of long text area fields (None for no limit)
+   """
+   def __init__(self, latency=0.0, error_rate=0.0, field_limit=None):
+      self.latency = latency
+      self.error_rate = error_rate
+      self.field_limit = field_limit
+      ## Every REST request is answered with a 503 until this time.time(), as if Salesforce were down
+      self.unavailable_until = 0.0
+      ## This many file (ContentVersion) uploads are answered with a 500, as if Salesforce couldn't store them
+      self.file_errors = 0
+      self.lock = threading.Lock()
+      self.records = {}
+      ## Leads returned by lead retrieval; leads not added here are built with payloads.build_lead() from the index in their ID
+      self.leads = {}
+      self.tokens = set()
+      self.reset_stats()
+      self.server = FakeHTTPServer(('127.0.0.1', 0), self.build_handler())
+      self.thread = None
+
+   @property
+   def base_url(self):
+      return 'http://127.0.0.1:' + str(self.server.server_port)
+
+   @property
+   def oauth_url(self):
+      return self.base_url + '/services/oauth2/token'
+
+   def reset_stats(self):
+      self.login_count = 0
+      self.request_count = 0
+      self.error_count = 0
+      self.outage_request_count = 0
+      self.request_bytes = 0
+      self.connections = set()
+      self.requests_by_path = {}
+
+   def start(self):
+      self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+      self.thread.start()
+      return self
+
+   def stop(self):
+      self.server.shutdown()
+      self.server.server_close()
+
+   def __enter__(self):
+      return self.start()
+
+   def __exit__(self, *exc_info):
+      self.stop()
+
+   """
+   Answers every REST request with a 503 for given number of seconds
+   Parameters: outage duration in seconds
+   Output: None
+   """
+   def start_outage(self, duration):
+      self.unavailable_until = time.time() + duration
+
+   """
+   Returns every record created for given sObject type
+   Parameters: sObject type name
+   Output: list of records
+   """
+   def created(self, sobject_type='Background_Check__c'):
+      with self.lock:
+         return list(self.records.get(sobject_type, []))
+
+   """
+   Returns lead fields like Salesforce does, with the checkbox as a boolean
+   Parameters: lead ID
+   Output: status code and lead record
+   """
+   def get_lead(self, lead_ID):
+      lead = self.leads.get(lead_ID)
+      if lead is None and lead_ID.startswith('00Q') and lead_ID[3:].isdigit():
+         lead = build_lead(int(lead_ID[3:]))
+      if lead is None or lead['Id'] != lead_ID:
+         return 404, [{'message': 'The requested resource does not exist', 'errorCode': 'NOT_FOUND'}]
+      record = dict(lead, attributes={'type': 'Lead', 'url': '/services/data/v49.0/sobjects/Lead/' + lead_ID})
+      if isinstance(record['no_middle_name__c'], str):
+         record['no_middle_name__c'] = record['no_middle_name__c'] == 'true'
+      return 200, record
+
+   def login(self):
+      self.login_count += 1
+      token = uuid.uuid4().hex
+      self.tokens.add(token)
+      return 200, {'access_token': token, 'instance_url': self.base_url, 'token_type': 'Bearer',
+                   'issued_at': str(int(time.time() * 1000))}
+
+   """
+   Creates record, rejecting 'Background Check' objects without a lead like Salesforce rejects missing required fields,
+   and records with a text field longer than the field limit
+   Parameters: sObject type and record fields
+   Output: status code and save result
+   """
+   def create_record(self, sobject_type, record):
+      if sobject_type == 'Background_Check__c' and not record.get('Lead__c'):
+         return 400, {'success': False, 'errors': [{'statusCode': 'REQUIRED_FIELD_MISSING', 'message': 'Required fields are missing: [Lead__c]'}]}
+      if self.field_limit is not None and sobject_type != 'ContentVersion':
+         too_long = [name for name, value in record.items() if isinstance(value, str) and len(value) > self.field_limit]
+         if too_long:
+            return 400, {'success': False, 'errors': [{'statusCode': 'STRING_TOO_LONG', 'message': 'data value too large', 'fields': too_long}]}
+      record_ID = 'a0X' + uuid.uuid4().hex[:15]
+      self.records.setdefault(sobject_type, []).append(dict(record, Id=record_ID))
+      return 201, {'id': record_ID, 'success': True, 'errors': []}
+
+   """
+   Updates fields of a record
+   Parameters: sObject type, record ID and fields
+   Output: status code and response body (none on success, like Salesforce)
+   """
+   def update_record(self, sobject_type, record_ID, fields):
+      for record in self.records.get(sobject_type, []):
+         if record['Id'] == record_ID:
+            record.update(fields)
+            return 204, None
+      return 404, [{'message': 'The requested resource does not exist', 'errorCode': 'NOT_FOUND'}]
+
+   """
+   Creates records of an sObject Collections request, each independently since allOrNone is false
+   Parameters: request body
+   Output: status code and list of save results
+   """
+   def create_collection(self, body):
+      records = body.get('records', [])
+      if len(records) > 200:
+         return 400, [{'message': 'Maximum 200 records allowed', 'errorCode': 'EXCEEDED_ID_LIMIT'}]
+      results = []
+      for record in records:
+         fields = {name: value for name, value in record.items() if name != 'attributes'}
+         results.append(self.create_record(record['attributes']['type'], fields)[1])
+      return 200, results
+
+   """
+   Routes a request to the matching fake endpoint
+   Parameters: method, path, authorization header, parsed JSON body and its size in bytes
+   Output: status code and response body
+   """
+   def handle(self, method, path, authorization, body, body_size=0):
+      with self.lock:
+         self.request_bytes += body_size
+         route = method + ' ' + path
+         self.requests_by_path[route] = self.requests_by_path.get(route, 0) + 1
+         if path == '/services/oauth2/token':
+            return self.login()
+         self.request_count += 1
+         if authorization is None or authorization[len('Bearer '):] not in self.tokens:
+            return 401, [{'message': 'Session expired or invalid', 'errorCode': 'INVALID_SESSION_ID'}]
+         if time.time() < self.unavailable_until:
+            self.outage_request_count += 1
+            return 503, [{'message': 'Server unavailable', 'errorCode': 'SERVER_UNAVAILABLE'}]
+         if self.error_rate and random.random() < self.error_rate:
+            self.error_count += 1
+            return 503, [{'message': 'Server unavailable', 'errorCode': 'SERVER_UNAVAILABLE'}]
+         parts = path.split('/')
+         if method == 'POST' and path.endswith('/composite/sobjects'):
+            return self.create_collection(body)
+         if method == 'POST' and len(parts) == 6 and parts[5] == 'ContentVersion' and self.file_errors > 0:
+            self.file_errors -= 1
+            return 500, [{'message': 'An unexpected error occurred', 'errorCode': 'UNKNOWN_EXCEPTION'}]
+         if method == 'POST' and len(parts) == 6 and parts[4] == 'sobjects':
+            status, result = self.create_record(parts[5], body)
+            return status, result if status < 300 else result['errors']
+         if method == 'GET' and len(parts) == 7 and parts[4] == 'sobjects' and parts[5] == 'Lead':
+            return self.get_lead(parts[6])
+         if method == 'PATCH' and len(parts) == 7 and parts[4] == 'sobjects':
+            return self.update_record(parts[5], parts[6], body)
+         return 404, [{'message': 'The requested resource does not exist', 'errorCode': 'NOT_FOUND'}]
+
+   def build_handler(self):
+      fake = self
+
+      class Handler(BaseHTTPRequestHandler):
+         protocol_version = 'HTTP/1.1'
+         ## Headers and body are written separately, so Nagle's algorithm would otherwise stall keep-alive responses
+         disable_nagle_algorithm = True
+
+         def log_message(self, *args):
+            pass
+
+         def respond(self, method):
+            fake.connections.add(self.client_address)
+            length = int(self.headers.get('Content-Length') or 0)
+            raw_body = self.rfile.read(length) if length else b''
+            try:
+               body = json.loads(raw_body) if raw_body else None
+            except ValueError:
+               body = None
+            if fake.latency:
+               time.sleep(fake.latency)
+            status, response_body = fake.handle(method, urlparse(self.path).path, self.headers.get('Authorization'), body, len(raw_body))
+            encoded = json.dumps(response_body).encode() if response_body is not None else b''
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(encoded)))
+            self.end_headers()
+            self.wfile.write(encoded)
+
+         def do_GET(self):
+            self.respond('GET')
+
+         def do_POST(self):
+            self.respond('POST')
+
+         def do_PATCH(self):
+            self.respond('PATCH')
+
+      return Handler
@@ -0,0 +1,13 @@
+"""
+HTTP server shared by the fake Checkr, Salesforce and SSM servers
+"""
+from http.server import ThreadingHTTPServer
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+   """
+   Threaded HTTP server whose listen backlog is large enough for benchmark concurrency
+   The default backlog of 5 makes connections beyond it wait for a SYN retransmit, which adds 1-3 s to some requests
+   """
+   request_queue_size = 128
+   daemon_threads = True
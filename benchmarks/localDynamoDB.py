@@ -0,0 +1,461 @@
+"""
+In-memory stand-in for a DynamoDB table, used by the benchmarks in place of the real background check table
+Supports the subset of the boto3 Table API the background check process uses (get_item, put_item, update_item, delete_item, query, scan, batch_writer,
+and batch_get_item and transact_write_items through table.meta.client) with boto3 condition objects, an optional sort key, global secondary indexes,
+1 MB scan pages, and read/write capacity accounting so benchmarks can compare how much of the table each access pattern reads
+Only the request parameters listed by each method are accepted; others raise a TypeError, like botocore rejects parameters its version doesn't know,
+so a parameter the pinned botocore doesn't have can't pass the benchmarks unnoticed
+"""
+import copy
+import json
+import re
+import threading
+from decimal import Decimal
+from types import SimpleNamespace
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from botocore.exceptions import ClientError
+
+## DynamoDB stops a scan or query page after 1 MB of data has been read
+PAGE_SIZE_BYTES = 1024 * 1024
+
+
+"""
+Approximates the stored size of an item in bytes
+Parameters: item
+Output: size in bytes
+"""
+def item_size(item):
+   return len(json.dumps(item, default=str))
+
+
+"""
+Returns read capacity units consumed by reading given number of bytes with eventually consistent reads
+Parameters: number of bytes read
+Output: read capacity units
+"""
+def read_units(size_bytes):
+   return max(1, -(-size_bytes // 4096)) / 2
+
+
+"""
+Builds the error DynamoDB raises when a condition fails
+Parameters: operation name
+Output: ClientError
+"""
+def conditional_check_failed(operation_name):
+   return ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}}, operation_name)
+
+
+"""
+Evaluates a boto3 condition object ('Key' or 'Attr' condition) against an item
+Parameters: boto3 condition and item
+Output: True if item satisfies condition
+"""
+def evaluate_condition(condition, item):
+   expression = condition.get_expression()
+   operator = expression['operator']
+   values = expression['values']
+   if operator == 'AND':
+      return evaluate_condition(values[0], item) and evaluate_condition(values[1], item)
+   if operator == 'OR':
+      return evaluate_condition(values[0], item) or evaluate_condition(values[1], item)
+   if operator == 'NOT':
+      return not evaluate_condition(values[0], item)
+   name = values[0].name
+   if operator == 'attribute_exists':
+      return name in item
+   if operator == 'attribute_not_exists':
+      return name not in item
+   if name not in item:
+      ## Comparisons against a missing attribute are false in DynamoDB, except '<>'
+      return operator == '<>'
+   actual = item[name]
+   if operator == '=':
+      return actual == values[1]
+   if operator == '<>':
+      return actual != values[1]
+   if operator == '<':
+      return actual < values[1]
+   if operator == '<=':
+      return actual <= values[1]
+   if operator == '>':
+      return actual > values[1]
+   if operator == '>=':
+      return actual >= values[1]
+   if operator == 'BETWEEN':
+      return values[1] <= actual <= values[2]
+   if operator == 'IN':
+      return actual in values[1]
+   if operator == 'begins_with':
+      return actual.startswith(values[1])
+   if operator == 'contains':
+      return values[1] in actual
+   raise ValueError('Unsupported condition operator: ' + operator)
+
+
+"""
+Applies a DynamoDB update expression to an item in place
+Supports 'set a=:v', 'set a=if_not_exists(a, :v)', 'set a=a + :v', 'add a :v' and 'remove a' clauses
+Parameters: item, update expression, expression attribute values and names
+Output: None
+"""
+def apply_update(item, update_expression, values, names):
+   def resolve_name(token):
+      token = token.strip()
+      return names.get(token, token)
+
+   def resolve_operand(token):
+      token = token.strip()
+      if token.startswith(':'):
+         return values[token]
+      if_not_exists = re.match(r'if_not_exists\(\s*([^,]+),\s*([^)]+)\)', token)
+      if if_not_exists:
+         name = resolve_name(if_not_exists.group(1))
+         return item[name] if name in item else resolve_operand(if_not_exists.group(2))
+      return item[resolve_name(token)]
+
+   clauses = re.split(r'\b(set|add|remove)\b', update_expression, flags=re.IGNORECASE)
+   for index in range(1, len(clauses), 2):
+      action = clauses[index].lower()
+      for part in [part for part in re.split(r',(?![^(]*\))', clauses[index + 1]) if part.strip()]:
+         if action == 'set':
+            name, value = part.split('=', 1)
+            if '+' in value or ' - ' in value:
+               sign = 1 if '+' in value else -1
+               left, right = re.split(r'\+| - ', value, maxsplit=1)
+               item[resolve_name(name)] = resolve_operand(left) + sign * resolve_operand(right)
+            else:
+               item[resolve_name(name)] = resolve_operand(value)
+         elif action == 'add':
+            name, value = part.split()
+            name = resolve_name(name)
+            item[name] = item.get(name, Decimal(0)) + values[value]
+         else:
+            item.pop(resolve_name(part), None)
+
+
+class LocalTable:
+   """
+   Creates an empty table
+   Parameters: partition key attribute name, dictionary mapping index name to index partition key attribute name,
+   optional network latency in seconds added to every request, table name, and sort key attribute name, if any
+   """
+   def __init__(self, key='salesforce_lead_ID', indexes=None, latency=0.0, name='local-table', sort_key=None):
+      self.name = name
+      self.key = key
+      self.sort_key = sort_key
+      ## Low-level client calls reach the table through table.meta.client, like with a boto3 Table
+      self.meta = SimpleNamespace(client=LocalTableClient(self))
+      self.indexes = dict(indexes or {})
+      self.latency = latency
+      self.items = {}
+      self.index_entries = {index_name: {} for index_name in self.indexes}
+      self.lock = threading.Lock()
+      self.reset_stats()
+
+   ## Items are stored by partition key, or by (partition key, sort key) tuple if the table has a sort key
+   def item_key(self, key):
+      if self.sort_key is None:
+         return key[self.key]
+      return (key[self.key], key[self.sort_key])
+
+   def key_attributes(self, item_key):
+      if self.sort_key is None:
+         return {self.key: item_key}
+      return {self.key: item_key[0], self.sort_key: item_key[1]}
+
+   def reset_stats(self):
+      self.request_count = 0
+      self.consumed_read_units = 0.0
+      self.consumed_write_units = 0.0
+      self.items_read = 0
+
+   def record_request(self, read_bytes=0, write_bytes=0, read_item_count=0):
+      self.request_count += 1
+      if read_bytes:
+         self.consumed_read_units += read_units(read_bytes)
+      if write_bytes:
+         self.consumed_write_units += max(1, -(-write_bytes // 1024))
+      self.items_read += read_item_count
+
+   ## Latency is added outside the table lock, so concurrent requests wait for the network in parallel like they do with DynamoDB
+   def network_delay(self):
+      if self.latency:
+         threading.Event().wait(self.latency)
+
+   def add_to_indexes(self, item):
+      for index_name, attribute_name in self.indexes.items():
+         if attribute_name in item:
+            self.index_entries[index_name].setdefault(item[attribute_name], set()).add(self.item_key(item))
+
+   def remove_from_indexes(self, item):
+      for index_name, attribute_name in self.indexes.items():
+         if attribute_name in item:
+            keys = self.index_entries[index_name].get(item[attribute_name], set())
+            keys.discard(self.item_key(item))
+
+   def check_index_keys(self, item, operation_name):
+      for attribute_name in self.indexes.values():
+         if item.get(attribute_name) == '':
+            raise ClientError({'Error': {'Code': 'ValidationException',
+                                         'Message': 'One or more parameter values are not valid. A value specified for a secondary index key is not supported.'}},
+                              operation_name)
+
+   def put_item(self, Item, ConditionExpression=None, ReturnValues='NONE'):
+      self.network_delay()
+      with self.lock:
+         self.check_index_keys(Item, 'PutItem')
+         existing = self.items.get(self.item_key(Item), {})
+         if ConditionExpression is not None and not evaluate_condition(ConditionExpression, existing):
+            self.record_request(write_bytes=item_size(Item))
+            raise conditional_check_failed('PutItem')
+         if existing:
+            self.remove_from_indexes(existing)
+         self.items[self.item_key(Item)] = copy.deepcopy(Item)
+         self.add_to_indexes(Item)
+         self.record_request(write_bytes=item_size(Item))
+      if ReturnValues == 'ALL_OLD' and existing:
+         return {'Attributes': copy.deepcopy(existing)}
+      return {}
+
+   def get_item(self, Key, ConsistentRead=False):
+      self.network_delay()
+      with self.lock:
+         item = self.items.get(self.item_key(Key))
+         self.record_request(read_bytes=item_size(item) if item else 1, read_item_count=1 if item else 0)
+         if item is None:
+            return {}
+         return {'Item': copy.deepcopy(item)}
+
+   def delete_item(self, Key, ConditionExpression=None):
+      self.network_delay()
+      with self.lock:
+         existing = self.items.get(self.item_key(Key), {})
+         if ConditionExpression is not None and not evaluate_condition(ConditionExpression, existing):
+            self.record_request(write_bytes=1)
+            raise conditional_check_failed('DeleteItem')
+         if existing:
+            self.remove_from_indexes(existing)
+            del self.items[self.item_key(Key)]
+         self.record_request(write_bytes=item_size(existing) if existing else 1)
+      return {}
+
+   def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None, ExpressionAttributeNames=None,
+                   ConditionExpression=None, ReturnValues='NONE'):
+      self.network_delay()
+      with self.lock:
+         existing = self.items.get(self.item_key(Key))
+         item = copy.deepcopy(existing) if existing is not None else dict(Key)
+         if ConditionExpression is not None and not evaluate_condition(ConditionExpression, existing or {}):
+            self.record_request(write_bytes=item_size(item))
+            raise conditional_check_failed('UpdateItem')
+         apply_update(item, UpdateExpression, ExpressionAttributeValues or {}, ExpressionAttributeNames or {})
+         self.check_index_keys(item, 'UpdateItem')
+         if existing is not None:
+            self.remove_from_indexes(existing)
+         self.items[self.item_key(Key)] = item
+         self.add_to_indexes(item)
+         self.record_request(write_bytes=item_size(item))
+         if ReturnValues in ('ALL_NEW', 'UPDATED_NEW'):
+            return {'Attributes': copy.deepcopy(item)}
+         if ReturnValues in ('ALL_OLD', 'UPDATED_OLD') and existing is not None:
+            return {'Attributes': copy.deepcopy(existing)}
+         return {}
+
+   def query(self, KeyConditionExpression, IndexName=None, FilterExpression=None, Limit=None, ProjectionExpression=None):
+      expression = KeyConditionExpression.get_expression()
+      sort_condition = None
+      if expression['operator'] == 'AND':
+         ## Partition key equality and a condition on the sort key, which is evaluated like any other condition
+         partition_condition, sort_condition = expression['values']
+         expression = partition_condition.get_expression()
+      if expression['operator'] != '=':
+         raise ValueError('Local table only supports equality conditions on partition keys')
+      value = expression['values'][1]
+      self.network_delay()
+      with self.lock:
+         if IndexName is not None:
+            keys = sorted(self.index_entries[IndexName].get(value, set()))
+         elif self.sort_key is None:
+            keys = [value] if value in self.items else []
+         else:
+            keys = sorted(key for key in self.items if key[0] == value and (sort_condition is None or evaluate_condition(sort_condition, self.items[key])))
+         if Limit is not None:
+            keys = keys[:Limit]
+         matched = [copy.deepcopy(self.items[key]) for key in keys]
+         self.record_request(read_bytes=sum(item_size(item) for item in matched) or 1, read_item_count=len(matched))
+      if FilterExpression is not None:
+         matched = [item for item in matched if evaluate_condition(FilterExpression, item)]
+      if ProjectionExpression is not None:
+         attributes = [attribute.strip() for attribute in ProjectionExpression.split(',')]
+         matched = [{name: item[name] for name in attributes if name in item} for item in matched]
+      return {'Items': matched, 'Count': len(matched), 'ScannedCount': len(keys)}
+
+   """
+   Returns batch writer whose puts and deletes are sent in BatchWriteItem requests of up to 25 items, like boto3's
+   Parameters: partition and sort key names whose earlier requests are replaced by a later one for the same key (accepted for compatibility)
+   Output: batch writer
+   """
+   def batch_writer(self, overwrite_by_pkeys=None):
+      return LocalBatchWriter(self)
+
+   def scan(self, FilterExpression=None, ExclusiveStartKey=None, Limit=None, ProjectionExpression=None,
+            Segment=None, TotalSegments=None):
+      self.network_delay()
+      with self.lock:
+         keys = list(self.items)
+         if TotalSegments:
+            keys = [key for key in keys if hash(key) % TotalSegments == Segment]
+         start = 0
+         if ExclusiveStartKey is not None:
+            start = keys.index(self.item_key(ExclusiveStartKey)) + 1
+         page = []
+         page_bytes = 0
+         last_key = None
+         for key in keys[start:]:
+            item = self.items[key]
+            page.append(copy.deepcopy(item))
+            page_bytes += item_size(item)
+            last_key = key
+            if page_bytes >= PAGE_SIZE_BYTES or (Limit is not None and len(page) >= Limit):
+               break
+         self.record_request(read_bytes=page_bytes or 1, read_item_count=len(page))
+         finished = last_key is None or keys.index(last_key) == len(keys) - 1
+      matched = page
+      if FilterExpression is not None:
+         matched = [item for item in page if evaluate_condition(FilterExpression, item)]
+      if ProjectionExpression is not None:
+         attributes = [attribute.strip() for attribute in ProjectionExpression.split(',')]
+         matched = [{name: item[name] for name in attributes if name in item} for item in matched]
+      response = {'Items': matched, 'Count': len(matched), 'ScannedCount': len(page)}
+      if not finished:
+         response['LastEvaluatedKey'] = self.key_attributes(last_key)
+      return response
+
+
+class LocalTableClient:
+   """
+   Stand-in for the low-level DynamoDB client of a local table, with the BatchGetItem call; items are returned in DynamoDB's typed format
+   Parameters: local table
+   """
+   def __init__(self, table):
+      self.table = table
+      self.serializer = TypeSerializer()
+
+   def batch_get_item(self, RequestItems):
+      table = self.table
+      request = RequestItems[table.name]
+      if len(request['Keys']) > 100:
+         raise ClientError({'Error': {'Code': 'ValidationException', 'Message': 'Too many items requested for the BatchGetItem call'}}, 'BatchGetItem')
+      attributes = [attribute.strip() for attribute in request['ProjectionExpression'].split(',')] if 'ProjectionExpression' in request else None
+      table.network_delay()
+      with table.lock:
+         matched = [table.items[key[table.key]['S']] for key in request['Keys'] if key[table.key]['S'] in table.items]
+         table.record_request(read_bytes=sum(item_size(item) for item in matched) or 1, read_item_count=len(matched))
+         if attributes is not None:
+            matched = [{name: item[name] for name in attributes if name in item} for item in matched]
+         typed = [{name: self.serializer.serialize(value) for name, value in item.items()} for item in matched]
+      return {'Responses': {table.name: typed}, 'UnprocessedKeys': {}}
+
+   """
+   Applies the updates, puts and deletes of a TransactWriteItems request together, as one request
+   Items, keys and values are in DynamoDB's typed format; conditions aren't supported
+   Parameters: list of transaction items
+   Output: empty response
+   """
+   def transact_write_items(self, TransactItems):
+      table = self.table
+      deserializer = TypeDeserializer()
+
+      def deserialize(values):
+         return {name: deserializer.deserialize(value) for name, value in values.items()}
+
+      table.network_delay()
+      with table.lock:
+         write_bytes = 0
+         for transact_item in TransactItems:
+            (action, request), = transact_item.items()
+            if request['TableName'] != table.name:
+               raise ClientError({'Error': {'Code': 'ResourceNotFoundException', 'Message': 'Requested resource not found'}}, 'TransactWriteItems')
+            if action == 'Update':
+               key = deserialize(request['Key'])
+               item = table.items.get(table.item_key(key), dict(key))
+               apply_update(item, request['UpdateExpression'], deserialize(request.get('ExpressionAttributeValues', {})),
+                            request.get('ExpressionAttributeNames', {}))
+               table.items[table.item_key(key)] = item
+            elif action == 'Put':
+               item = deserialize(request['Item'])
+               table.items[table.item_key(item)] = item
+            elif action == 'Delete':
+               item = table.items.pop(table.item_key(deserialize(request['Key'])), {})
+            else:
+               raise ValueError('Unsupported transaction action: ' + action)
+            ## Transactional writes consume twice the write capacity of standard writes
+            write_bytes += 2 * item_size(item)
+         table.record_request(write_bytes=write_bytes)
+      return {}
+
+
+class LocalBatchWriter:
+   """
+   Stand-in for boto3's batch writer: buffers puts and deletes and applies them 25 at a time, each batch as one request
+   Parameters: local table
+   """
+   def __init__(self, table):
+      self.table = table
+      self.pending = []
+
+   def put_item(self, Item):
+      self.pending.append(('put', Item))
+      if len(self.pending) >= 25:
+         self.flush()
+
+   def delete_item(self, Key):
+      self.pending.append(('delete', Key))
+      if len(self.pending) >= 25:
+         self.flush()
+
+   def flush(self):
+      if not self.pending:
+         return
+      table = self.table
+      table.network_delay()
+      with table.lock:
+         write_bytes = 0
+         for action, value in self.pending:
+            existing = table.items.pop(table.item_key(value), None)
+            if existing is not None:
+               table.remove_from_indexes(existing)
+            if action == 'put':
+               table.items[table.item_key(value)] = copy.deepcopy(value)
+               table.add_to_indexes(value)
+            write_bytes += item_size(value)
+         table.record_request(write_bytes=write_bytes)
+      self.pending = []
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc_info):
+      self.flush()
+
+
+"""
+Creates a local stand-in for the background check table with the same key schema and indexes as the real table
+Parameters: optional network latency in seconds added to every request
+Output: local table
+"""
+def create_background_check_table(latency=0.0):
+   from backgroundCheckTable import CANDIDATE_ID_INDEX, REPORT_ID_INDEX
+   return LocalTable(key='salesforce_lead_ID',
+                     indexes={CANDIDATE_ID_INDEX: 'checkr_candidate_ID', REPORT_ID_INDEX: 'checkr_report_ID'},
+                     latency=latency)
+
+
+"""
+Creates a local stand-in for the status counters table (statusCounters.py) with the same key schema as the real table
+Parameters: optional network latency in seconds added to every request
+Output: local table
+"""
+def create_status_table(latency=0.0):
+   return LocalTable(key='status_key', sort_key='sort_key', latency=latency, name='local-status-table')
@@ -0,0 +1,79 @@
+"""
+Runs the background check blueprint against local stand-ins for Checkr, Salesforce and DynamoDB
+Usage:
+   with LocalServices(checkr_latency=0.01) as services:
+      services.client.post('/background-check', data=build_outbound_message([build_lead(0)]))
+"""
+import benchmarkEnvironment
+from flask import Flask
+import backgroundCheck
+import checkrClient
+import idempotencyLedger
+import rateLimiting
+import salesforceClient
+import salesforceWriter
+import statusCounters
+from settings import settings
+from fakeCheckr import FakeCheckrServer
+from fakeSalesforce import FakeSalesforceServer
+from localDynamoDB import create_background_check_table
+
+
+class LocalServices:
+   """
+   Creates fake Checkr and Salesforce servers and a local background check table, and points the blueprint at them
+   Parameters: Checkr latency and error rate, Salesforce latency, error rate and text field limit, DynamoDB latency, records per report search,
+   HTTP connection pool size, idempotency ledger (default: a new ledger for the configured backend), Checkr requests per second
+   before it answers with a 429, and rate limit backend (default: a new backend for the configured setting)
+   """
+   def __init__(self, checkr_latency=0.0, checkr_error_rate=0.0, salesforce_latency=0.0, salesforce_error_rate=0.0, salesforce_field_limit=None,
+                dynamodb_latency=0.0, record_count=0, pool_size=10, ledger=None, checkr_rate_limit=None, rate_limit_backend=None):
+      self.checkr = FakeCheckrServer(latency=checkr_latency, error_rate=checkr_error_rate, record_count=record_count, rate_limit=checkr_rate_limit)
+      self.salesforce = FakeSalesforceServer(latency=salesforce_latency, error_rate=salesforce_error_rate, field_limit=salesforce_field_limit)
+      self.table = create_background_check_table(latency=dynamodb_latency)
+      self.pool_size = pool_size
+      self.ledger = ledger
+      self.rate_limit_backend = rate_limit_backend
+      self.patched = []
+
+   def patch(self, target, name, value):
+      self.patched.append((target, name, getattr(target, name)))
+      setattr(target, name, value)
+
+   def start(self):
+      self.checkr.start()
+      self.salesforce.start()
+      self.patch(settings, 'checkrBaseUrl', self.checkr.base_url)
+      self.patch(settings, 'salesforceOAuthURL', self.salesforce.oauth_url)
+      self.patch(backgroundCheck, 'get_background_check_table', lambda: self.table)
+      ## Every run gets its own buckets and circuits, so one run's throttling doesn't carry over to the next
+      self.patch(rateLimiting, 'rate_limit_backend', self.rate_limit_backend or rateLimiting.create_rate_limit_backend())
+      self.patch(rateLimiting, 'service_guards', {})
+      self.patch(checkrClient, 'checkr_client', checkrClient.CheckrClient(self.checkr.base_url, settings.checkrApiKey,
+                                                                          pool_size=self.pool_size, backoff_base=0.01,
+                                                                          guard=rateLimiting.get_service_guard('checkr')))
+      self.patch(salesforceClient, 'salesforce_client',
+                 salesforceClient.SalesforceClient(self.salesforce.oauth_url, settings.salesforceClientID, settings.salesforceClientSecret,
+                                                   settings.salesforceUsername, settings.salesforcePassword, pool_size=self.pool_size,
+                                                   guard=rateLimiting.get_service_guard('salesforce')))
+      self.patch(salesforceWriter, 'background_check_writer', None)
+      self.patch(idempotencyLedger, 'idempotency_ledger', self.ledger or idempotencyLedger.create_idempotency_ledger())
+      self.patch(statusCounters, 'status_store', statusCounters.create_status_store())
+      app = Flask(__name__)
+      app.register_blueprint(backgroundCheck.app)
+      self.app = app
+      self.client = app.test_client()
+      return self
+
+   def stop(self):
+      for target, name, value in reversed(self.patched):
+         setattr(target, name, value)
+      self.patched = []
+      self.checkr.stop()
+      self.salesforce.stop()
+
+   def __enter__(self):
+      return self.start()
+
+   def __exit__(self, *exc_info):
+      self.stop()
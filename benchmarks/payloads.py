@@ -0,0 +1,60 @@
+"""
+Builds realistic Salesforce outbound messages and Checkr webhook payloads for benchmarks
+"""
+import json
+import os
+from xml.sax.saxutils import escape
+
+ORGANIZATION_ID = os.environ.get('SALESFORCE_ORG_ID', '00D000000000001AAA')
+
+
+"""
+Returns lead fields for a synthetic volunteer
+Parameters: index of volunteer
+Output: dictionary of lead sObject fields without the 'sf:' prefix
+"""
+def build_lead(index):
+   return {'Id': '00Q' + str(index).zfill(15), 'FirstName': 'Volunteer', 'MiddleName': 'Q', 'LastName': 'Number' + str(index),
+           'no_middle_name__c': 'false', 'Email': 'volunteer' + str(index) + '@example.com', 'PostalCode': '94105-1234',
+           'Birthdate__c': '1990-01-01', 'SSN__c': '111-11-' + str(2000 + index % 8000).zfill(4), 'Phone': '5555550100'}
+
+
+"""
+Builds Salesforce outbound SOAP message with one notification per lead
+Parameters: list of lead field dictionaries, and Organization ID
+Output: XML bytes
+"""
+def build_outbound_message(leads, organization_id=ORGANIZATION_ID):
+   notifications = []
+   for lead in leads:
+      fields = ''.join('<sf:%s>%s</sf:%s>' % (name, escape(str(value)), name) for name, value in lead.items())
+      ## Salesforce keeps a notification's ID when it delivers it again, so the same lead always gets the same notification ID here
+      notifications.append('<Notification><Id>04l' + lead['Id'][3:] + '</Id>'
+                           '<sObject xsi:type="sf:Lead" xmlns:sf="urn:sobject.enterprise.soap.sforce.com">' + fields + '</sObject>'
+                           '</Notification>')
+   return ('<?xml version="1.0" encoding="UTF-8"?>'
+           '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+           'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><soapenv:Body>'
+           '<notifications xmlns="http://soap.sforce.com/2005/09/outbound">'
+           '<OrganizationId>' + organization_id + '</OrganizationId><ActionId>04k000000000001AAA</ActionId>'
+           '<SessionId xsi:nil="true"/><EnterpriseUrl>https://example.my.salesforce.com/services/Soap/c/49.0</EnterpriseUrl>'
+           '<PartnerUrl>https://example.my.salesforce.com/services/Soap/u/49.0</PartnerUrl>'
+           + ''.join(notifications) +
+           '</notifications></soapenv:Body></soapenv:Envelope>').encode()
+
+
+"""
+Builds Checkr webhook payload for a report event
+Parameters: Checkr report ID, candidate ID, event type, webhook event ID, custom ID (Salesforce lead ID) of the candidate, if it has one,
+and ID of the Checkr account sending the webhook, if any
+Output: webhook payload dictionary
+"""
+def build_report_webhook(report_ID, candidate_ID='', event_type='report.completed', event_ID=None, custom_ID=None, account_ID=None):
+   report = {'id': report_ID, 'object': 'test_report', 'status': 'clear', 'candidate_id': candidate_ID}
+   if custom_ID is not None:
+      report['custom_id'] = custom_ID
+   webhook = {'id': event_ID or 'event_' + report_ID, 'object': 'event', 'type': event_type, 'created_at': '2021-03-01T00:00:00Z',
+              'data': {'object': report}}
+   if account_ID is not None:
+      webhook['account_id'] = account_ID
+   return webhook
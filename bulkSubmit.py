@@ -0,0 +1,295 @@
+"""
+Bulk submission of background checks for a cohort of leads, e.g. an onboarding drive, instead of toggling 'Request Background Check' lead by lead
+Reads leads from a CSV or JSONL file whose columns are Salesforce Lead field names, or from a SOQL query, skips leads that already have a
+background check in the DynamoDB table (looked up 100 at a time), and creates the Checkr candidate and report of 'bulkWorkers' leads at a time
+with create_checkr_candidate() and create_checkr_report(), like an outbound message does
+Progress is checkpointed after every batch so an interrupted run resumes where it stopped; '--dry-run' runs against local stand-ins
+Leads are submitted for the org configured by settings.py, or for the registered org given with '--org', with that org's Checkr account and table
+Run from a host: PYTHON_ENV=qa python bulkSubmit.py leads.csv [--org <Organization ID>] [--workers 10] [--restart] [--dry-run]
+"""
+import argparse
+import collections
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from settings import settings
+from backgroundCheckTable import BATCH_GET_SIZE, get_items_by_lead_IDs
+from backgroundCheck import LEAD_FIELDS, get_background_check_table, parse_lead_row, create_checkr_candidate, create_checkr_report, get_lead_name, sf_api_call
+from rateLimiting import ServiceUnavailableError, LocalRateLimitBackend
+from idempotencyLedger import MemoryLedger
+from salesforceWriter import flush_background_check_writers
+from orgRegistry import get_org, get_org_path, get_current_org, org_context, run_in_org
+from tracing import get_tracer
+from structuredLogging import get_logger, flush_logs
+
+QUERY_ACTION = "/services/data/v49.0/query"
+## Outcomes after which a lead isn't submitted again when the run is resumed; 'deferred' and 'failed' leads are retried on resume
+DONE_OUTCOMES = ['submitted', 'error', 'duplicate']
+## Lead IDs listed in the summary for each outcome that needs attention
+SUMMARY_LEAD_IDS = 10
+## Folder of the local stand-ins used by '--dry-run'; it is only in a checkout of the repository, not in the deployed package
+BENCHMARKS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+
+logger = get_logger('bulkSubmit')
+
+
+"""
+Reads lead rows from a CSV file with a header row, or a JSONL file with one JSON object per line
+Parameters: file path
+Output: list of dictionaries of lead fields
+"""
+def read_leads_file(path):
+   with open(path, newline='') as leads_file:
+      if path.endswith('.jsonl') or path.endswith('.json'):
+         return [json.loads(line) for line in leads_file if line.strip()]
+      return list(csv.DictReader(leads_file))
+
+
+"""
+Retrieves lead rows with a SOQL query, following 'nextRecordsUrl' until every page has been read
+A query that doesn't start with SELECT is taken as the WHERE clause of a query of the lead fields
+Parameters: SOQL query or WHERE clause
+Output: list of dictionaries of lead fields
+"""
+def query_leads(soql):
+   if not soql.strip().lower().startswith('select'):
+      soql = 'SELECT ' + ', '.join(LEAD_FIELDS) + ' FROM Lead WHERE ' + soql
+   response = sf_api_call(QUERY_ACTION, parameters={'q': soql})
+   rows = response['records']
+   while not response.get('done', True):
+      response = sf_api_call(response['nextRecordsUrl'])
+      rows.extend(response['records'])
+   return rows
+
+
+class BulkCheckpoint:
+   """
+   Progress of a bulk submission: the outcome of every lead that is done
+   Saved to a JSON file after every batch if a path is given; a checkpoint of a different input is discarded
+   Parameters: checkpoint file path (or None to keep it in memory only) and input description (file path or SOQL query)
+   """
+   def __init__(self, path, source):
+      self.path = path
+      data = None
+      if path is not None and os.path.exists(path):
+         with open(path) as checkpoint_file:
+            data = json.load(checkpoint_file)
+      if data is None or data.get('source') != source:
+         data = {'source': source, 'done': {}}
+      self.data = data
+
+   def is_done(self, salesforce_lead_ID):
+      return salesforce_lead_ID in self.data['done']
+
+   """
+   Records outcomes of a batch of leads, and saves the checkpoint
+   Parameters: dictionary mapping lead ID to outcome
+   Output: None
+   """
+   def record_batch(self, outcomes):
+      for salesforce_lead_ID, outcome in outcomes.items():
+         if outcome in DONE_OUTCOMES:
+            self.data['done'][salesforce_lead_ID] = outcome
+      self.save()
+
+   def save(self):
+      if self.path is None:
+         return
+      temporary_path = self.path + '.tmp'
+      with open(temporary_path, 'w') as checkpoint_file:
+         json.dump(self.data, checkpoint_file)
+      os.replace(temporary_path, self.path)
+
+   def clear(self):
+      if self.path is not None and os.path.exists(self.path):
+         os.remove(self.path)
+
+
+class BulkSubmitter:
+   """
+   Submits background checks of many leads, in batches of up to 100 leads deduplicated with one BatchGetItem each
+   Parameters: DynamoDB table, checkpoint and number of leads processed concurrently
+   """
+   def __init__(self, background_check_table, checkpoint, workers):
+      self.background_check_table = background_check_table
+      self.checkpoint = checkpoint
+      self.workers = workers
+      self.outcomes = {}
+      ## Leads are submitted in worker threads, which don't inherit the org being handled
+      self.org = get_current_org()
+
+   """
+   Submits every lead that isn't done yet
+   Parameters: list of (lead ID, dictionary containing lead PII) tuples
+   Output: dictionary mapping lead ID to outcome for the leads of this run
+   """
+   def run(self, leads):
+      ## Leads listed twice in the input are submitted once
+      pending = []
+      seen_lead_IDs = set()
+      for lead in leads:
+         if lead[0] in seen_lead_IDs or self.checkpoint.is_done(lead[0]):
+            continue
+         seen_lead_IDs.add(lead[0])
+         pending.append(lead)
+      with ThreadPoolExecutor(max_workers=self.workers) as executor:
+         for start in range(0, len(pending), BATCH_GET_SIZE):
+            self.submit_batch(pending[start:start + BATCH_GET_SIZE], executor)
+      return self.outcomes
+
+   """
+   Submits one batch: leads that already have a background check are skipped, the others are submitted concurrently
+   A lead whose candidate was created but whose report wasn't is submitted again, and resumes at report creation
+   'Background Check' objects recording errors are written before the batch is checkpointed
+   Parameters: list of leads and executor
+   Output: None
+   """
+   def submit_batch(self, batch, executor):
+      existing_items = get_items_by_lead_IDs(self.background_check_table, [lead[0] for lead in batch])
+      outcomes = {}
+      new_leads = []
+      for lead in batch:
+         item = existing_items.get(lead[0])
+         if item is not None and item.get('checkr_status') != "candidate created":
+            outcomes[lead[0]] = 'duplicate'
+         else:
+            new_leads.append(lead)
+      for lead, outcome in zip(new_leads, executor.map(lambda lead: run_in_org(self.org, self.submit_lead, lead), new_leads)):
+         outcomes[lead[0]] = outcome
+      flush_background_check_writers()
+      self.checkpoint.record_batch(outcomes)
+      self.outcomes.update(outcomes)
+      counts = collections.Counter(outcomes.values())
+      logger.info("Submitted batch of leads", extra={'lead_count': len(batch), 'counts': dict(counts), 'done': len(self.checkpoint.data['done'])})
+
+   """
+   Creates Checkr candidate and report for one lead
+   Parameters: (lead ID, dictionary containing lead PII) tuple
+   Output: 'submitted', 'error' if Checkr rejected the lead and an error was recorded in Salesforce, 'deferred' if Checkr or Salesforce
+   is unavailable, or 'failed' if an unexpected exception was raised
+   """
+   def submit_lead(self, lead):
+      salesforce_lead_ID, salesforce_lead_PII_dict = lead
+      with get_tracer().trace('bulk_submit'):
+         try:
+            checkr_candidate_ID, error_occured = create_checkr_candidate(salesforce_lead_ID, salesforce_lead_PII_dict)
+            if error_occured:
+               return 'error'
+            result = create_checkr_report(checkr_candidate_ID, salesforce_lead_ID, get_lead_name(salesforce_lead_PII_dict))
+            return 'error' if result.mimetype == 'application/xml' else 'submitted'
+         except ServiceUnavailableError as error:
+            logger.warning("Service unavailable, leaving lead for next run", extra={'lead_ID': salesforce_lead_ID, 'error': str(error)})
+            return 'deferred'
+         except Exception as error:
+            logger.error("Error submitting lead", extra={'lead_ID': salesforce_lead_ID, 'error': repr(error)})
+            return 'failed'
+
+
+"""
+Points the background check process at local stand-ins for Checkr, Salesforce and DynamoDB from the benchmarks folder, so nothing is sent
+Parameters: latency in seconds added by each stand-in
+Output: started local services
+"""
+def start_dry_run(latency):
+   sys.path.insert(0, BENCHMARKS_PATH)
+   import benchmarkEnvironment
+   from localServices import LocalServices
+   ## The idempotency ledger and rate limit buckets are kept in memory too, so a dry run writes nothing to AWS
+   services = LocalServices(checkr_latency=latency, salesforce_latency=latency, dynamodb_latency=latency / 4,
+                            ledger=MemoryLedger(settings.idempotencyTTL, settings.idempotencyLease), rate_limit_backend=LocalRateLimitBackend())
+   return services.start()
+
+
+"""
+Prints outcome counts, throughput, and the first lead IDs of each outcome that needs attention
+Parameters: outcomes of this run, checkpoint and elapsed seconds
+Output: None
+"""
+def print_summary(outcomes, checkpoint, elapsed):
+   counts = collections.Counter(outcomes.values())
+   print("Processed %d leads in %.1f s (%.1f leads/s)" % (len(outcomes), elapsed, len(outcomes) / elapsed if elapsed else 0.0))
+   for outcome in ['submitted', 'duplicate', 'error', 'deferred', 'failed']:
+      print("  %-10s %6d" % (outcome, counts.get(outcome, 0)))
+   print("Done in all runs: %d leads" % len(checkpoint.data['done']))
+   for outcome in ['error', 'deferred', 'failed']:
+      lead_IDs = [lead_ID for lead_ID, lead_outcome in outcomes.items() if lead_outcome == outcome]
+      if lead_IDs:
+         print("  %s: %s%s" % (outcome, ', '.join(lead_IDs[:SUMMARY_LEAD_IDS]), ' ...' if len(lead_IDs) > SUMMARY_LEAD_IDS else ''))
+   if counts.get('deferred') or counts.get('failed'):
+      print("Run the same command again to retry deferred and failed leads")
+
+
+"""
+Reads leads, submits them for the org being handled and prints the summary
+Parameters: parsed command line arguments and org, or None for the org configured by settings.py
+Output: None
+"""
+def submit_leads(arguments, org):
+   ## Leads are read before the dry run starts, so a SOQL query reads real leads
+   rows = read_leads_file(arguments.path) if arguments.path else query_leads(arguments.soql)
+   leads = []
+   for index, row in enumerate(rows):
+      try:
+         leads.append(parse_lead_row(row))
+      except (KeyError, TypeError) as error:
+         logger.warning("Skipping lead that could not be parsed", extra={'row': index + 1, 'missing_field': str(error)})
+   print("Read %d leads (%d could not be parsed)" % (len(leads), len(rows) - len(leads)))
+
+   services = start_dry_run(arguments.dry_run_latency) if arguments.dry_run else None
+   source = os.path.abspath(arguments.path) if arguments.path else arguments.soql
+   ## A dry run keeps its checkpoint in memory, so it doesn't mark leads done for the real run
+   checkpoint_path = None if arguments.dry_run else arguments.checkpoint or get_org_path(settings.bulkCheckpointPath, org)
+   checkpoint = BulkCheckpoint(checkpoint_path, source)
+   if arguments.restart:
+      checkpoint.clear()
+      checkpoint = BulkCheckpoint(checkpoint_path, source)
+   elif checkpoint.data['done']:
+      print("Resuming from %s: %d leads already done" % (checkpoint_path, len(checkpoint.data['done'])))
+   try:
+      start = time.perf_counter()
+      submitter = BulkSubmitter(services.table if services else get_background_check_table(), checkpoint, arguments.workers)
+      outcomes = submitter.run(leads)
+      elapsed = time.perf_counter() - start
+   finally:
+      flush_logs()
+      if services is not None:
+         services.stop()
+   print_summary(outcomes, checkpoint, elapsed)
+   ## Nothing is left to retry, so the next run of the same input starts over and is deduplicated against the table only
+   if 'deferred' not in outcomes.values() and 'failed' not in outcomes.values():
+      checkpoint.clear()
+
+
+
+def main():
+   parser = argparse.ArgumentParser(description='Submit background checks of many leads')
+   parser.add_argument('path', nargs='?', help='CSV or JSONL file of leads, with columns ' + ', '.join(LEAD_FIELDS))
+   parser.add_argument('--soql', help='SOQL query of leads, or WHERE clause of a query of the lead fields')
+   parser.add_argument('--org', help='Organization ID of a registered org to submit the leads for instead of this environment')
+   parser.add_argument('--workers', type=int, default=settings.bulkWorkers, help='leads processed concurrently')
+   parser.add_argument('--checkpoint', help='checkpoint file (default: BULK_CHECKPOINT_PATH, suffixed with the Organization ID for --org)')
+   parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start over')
+   parser.add_argument('--dry-run', action='store_true', help='run against local stand-ins instead of Checkr, Salesforce and DynamoDB')
+   parser.add_argument('--dry-run-latency', type=float, default=0.0, help='latency in seconds of each stand-in')
+   arguments = parser.parse_args()
+   if (arguments.path is None) == (arguments.soql is None):
+      parser.error('give either a file of leads or --soql')
+   if arguments.dry_run and not os.path.isfile(os.path.join(BENCHMARKS_PATH, 'localServices.py')):
+      parser.error('--dry-run needs the local stand-ins of the benchmarks folder, which is missing from ' + os.path.dirname(BENCHMARKS_PATH) +
+                   '; run it from a checkout of the repository')
+   org = None
+   if arguments.org and arguments.org != settings.salesforceOrgID:
+      if arguments.dry_run:
+         parser.error('--dry-run only stands in for the org configured by settings.py, so it can\'t be used with --org')
+      org = get_org(arguments.org)
+      if org is None:
+         parser.error('org ' + arguments.org + ' is not registered')
+   with org_context(org):
+      submit_leads(arguments, org)
+
+
+if __name__ == '__main__':
+   sys.exit(main())
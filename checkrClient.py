@@ -0,0 +1,163 @@
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from settings import settings
+from tracing import traced, response_outcome
+from structuredLogging import get_logger
+from rateLimiting import ServiceUnavailableError, get_service_guard, parse_retry_after
+from orgRegistry import get_current_org, get_org_resource
+
+DEFAULT_POOL_SIZE = 10
+## Connect and read timeouts in seconds for every Checkr request
+DEFAULT_TIMEOUT = (3.05, 30)
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_CAP = 8.0
+## Responses worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+logger = get_logger('checkrClient')
+
+
+class CheckrUnavailableError(ServiceUnavailableError):
+   """
+   Raised by callers when Checkr still answers with a retryable status once the client's retries are spent,
+   so the work is deferred like a request the service guard holds back instead of being recorded as an error
+   Parameters: Checkr API path, status code, and Retry-After header value, if any
+   """
+   def __init__(self, path, status_code, retry_after=None):
+      super().__init__('checkr', parse_retry_after(retry_after) or DEFAULT_BACKOFF_CAP, 'status %d to %s' % (status_code, path))
+      self.path = path
+      self.status_code = status_code
+
+
+class CheckrClient:
+   """
+   Client for the Checkr API which sends every request over one keep-alive connection pool with timeouts,
+   and retries idempotent requests with jittered exponential backoff
+   POST requests are only retried when they carry an idempotency key, so Checkr never creates a candidate or report twice
+   If a service guard is given, every attempt waits for the rate limiter and raises ServiceUnavailableError while the circuit is open
+   Parameters: Checkr base URL, Checkr API key, connection pool size, request timeout, maximum retries, backoff base and cap in seconds,
+   and service guard (rateLimiting.py), if any
+   """
+   def __init__(self, base_url, api_key, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                max_retries=DEFAULT_MAX_RETRIES, backoff_base=DEFAULT_BACKOFF_BASE, backoff_cap=DEFAULT_BACKOFF_CAP, guard=None):
+      self.base_url = base_url
+      self.api_key = api_key
+      self.timeout = timeout
+      self.max_retries = max_retries
+      self.backoff_base = backoff_base
+      self.backoff_cap = backoff_cap
+      self.guard = guard
+      self.session = requests.Session()
+      self.session.auth = (api_key, '')
+      adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+      self.session.mount('https://', adapter)
+      self.session.mount('http://', adapter)
+
+   """
+   Creates Checkr candidate through POST request to Checkr API
+   Parameters: candidate data and idempotency key
+   Output: Checkr API response
+   """
+   @traced('checkr_create_candidate', outcome=response_outcome)
+   def create_candidate(self, data, idempotency_key=None):
+      return self.request('post', '/v1/candidates', data=data, idempotency_key=idempotency_key)
+
+   """
+   Creates Checkr report through POST request to Checkr API
+   Parameters: report data and idempotency key
+   Output: Checkr API response
+   """
+   @traced('checkr_create_report', outcome=response_outcome)
+   def create_report(self, data, idempotency_key=None):
+      return self.request('post', '/v1/reports', data=data, idempotency_key=idempotency_key)
+
+   """
+   Retrieves Checkr report through GET request to Checkr API
+   Parameters: Checkr report ID and URL params
+   Output: Checkr API response
+   """
+   @traced('checkr_retrieve_report', outcome=response_outcome)
+   def retrieve_report(self, report_ID, params=None):
+      return self.request('get', '/v1/reports/' + report_ID, params=params)
+
+   """
+   Sends request to Checkr API, retrying connection errors, timeouts and retryable statuses if request is idempotent
+   Parameters: method, path, form data, URL params and idempotency key
+   Output: Checkr API response (the last one received if all retries failed)
+   Raises ServiceUnavailableError, without sending the request, if the guard defers it
+   """
+   def request(self, method, path, data=None, params=None, idempotency_key=None):
+      headers = {}
+      if idempotency_key is not None:
+         headers['Idempotency-Key'] = idempotency_key
+      retryable = method == 'get' or idempotency_key is not None
+      attempt = 0
+      while True:
+         if self.guard is not None:
+            self.guard.before_request()
+         try:
+            response = self.session.request(method, self.base_url + path, data=data, params=params, headers=headers, timeout=self.timeout)
+         except (requests.ConnectionError, requests.Timeout) as error:
+            if self.guard is not None:
+               self.guard.record_error()
+            if not retryable or attempt >= self.max_retries:
+               raise
+            logger.warning("Checkr request failed, retrying", extra={'method': method.upper(), 'path': path, 'attempt': attempt + 1, 'error': str(error)})
+            self.wait(attempt, None)
+            attempt += 1
+            continue
+         if self.guard is not None:
+            self.guard.record_response(response.status_code, response.headers)
+         if response.status_code not in RETRY_STATUS_CODES or not retryable or attempt >= self.max_retries:
+            return response
+         logger.warning("Checkr responded with retryable status, retrying",
+                        extra={'method': method.upper(), 'path': path, 'attempt': attempt + 1, 'status_code': response.status_code})
+         retry_after = response.headers.get('Retry-After')
+         response.close()
+         self.wait(attempt, retry_after)
+         attempt += 1
+
+   """
+   Sleeps before next retry using exponential backoff with full jitter, or the server's Retry-After if it is longer
+   Parameters: number of the failed attempt and Retry-After header value, if any
+   Output: None
+   """
+   def wait(self, attempt, retry_after):
+      delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+      if retry_after is not None:
+         try:
+            delay = max(delay, min(self.backoff_cap, float(retry_after)))
+         except ValueError:
+            pass
+      time.sleep(delay)
+
+   def close(self):
+      self.session.close()
+
+
+## Client is kept at module level so warm Lambda invocations reuse its connections
+checkr_client = None
+checkr_client_lock = threading.Lock()
+
+
+"""
+Returns Checkr client for current environment, creating it on first use or again after the Checkr API key has been rotated
+A registered org being handled (orgRegistry.py) gets its own client, with its own API key, connection pool and guard
+Parameters: None
+Output: Checkr client
+"""
+def get_checkr_client():
+   global checkr_client
+   org = get_current_org()
+   if org is not None:
+      api_key = org.checkrApiKey
+      return get_org_resource(org, 'checkr_client', lambda: CheckrClient(org.checkrBaseUrl, api_key, guard=get_service_guard('checkr', org)),
+                              valid=lambda client: client.api_key == api_key)
+   with checkr_client_lock:
+      if checkr_client is None or checkr_client.api_key != settings.checkrApiKey:
+         checkr_client = CheckrClient(settings.checkrBaseUrl, settings.checkrApiKey, guard=get_service_guard('checkr'))
+      return checkr_client
@@ -0,0 +1,169 @@
+"""
+Idempotency ledger for Salesforce outbound message notifications
+Salesforce delivers an outbound message again until it is acknowledged, so a slow or failed request is followed by redeliveries of the
+same notifications; each notification is claimed here, keyed by its notification ID and lead ID, before any Checkr or Salesforce call
+A redelivered notification finds the claim in progress or completed and is acknowledged without doing anything
+Claims are atomic conditional writes and expire after 'idempotencyTTL' seconds; a claim left in progress longer than
+'idempotencyLease' seconds (e.g. the Lambda timed out) can be claimed again
+Backends: DynamoDB in production and in-memory for tests and benchmarks
+"""
+import threading
+import time
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+from settings import settings
+from awsResources import get_dynamodb_table
+from tracing import traced
+
+IN_PROGRESS = 'in progress'
+COMPLETED = 'completed'
+## Salesforce retries an outbound message for up to 24 hours, so claims are kept for twice that
+DEFAULT_TTL = 48 * 60 * 60
+DEFAULT_LEASE = 300
+## Seconds between removals of expired claims from a memory ledger
+MEMORY_PRUNE_INTERVAL = 600
+
+
+"""
+Builds ledger key of one notification
+Parameters: Salesforce notification ID and lead ID
+Output: ledger key
+"""
+def ledger_key(notification_ID, salesforce_lead_ID):
+   return notification_ID + ':' + salesforce_lead_ID
+
+
+class MemoryLedger:
+   """
+   In-memory ledger, the default: claims are only seen by the process that made them and are lost when it exits
+   Expired claims are removed every few minutes, so a long-running process doesn't keep every notification it handled
+   Parameters: seconds claims are kept, and seconds after which a claim still in progress can be taken over
+   """
+   def __init__(self, ttl=DEFAULT_TTL, lease=DEFAULT_LEASE):
+      self.ttl = ttl
+      self.lease = lease
+      self.entries = {}
+      self.lock = threading.Lock()
+      self.next_prune = time.time() + MEMORY_PRUNE_INTERVAL
+
+   def claim(self, key):
+      now = time.time()
+      with self.lock:
+         if now >= self.next_prune:
+            self.entries = {entry_key: entry for entry_key, entry in self.entries.items() if entry['expires_at'] > now}
+            self.next_prune = now + MEMORY_PRUNE_INTERVAL
+         entry = self.entries.get(key)
+         if entry is not None and entry['expires_at'] > now and (entry['claim_status'] == COMPLETED or entry['claimed_at'] > now - self.lease):
+            return False
+         self.entries[key] = {'claim_status': IN_PROGRESS, 'claimed_at': now, 'expires_at': now + self.ttl}
+         return True
+
+   def complete(self, key, result):
+      now = time.time()
+      with self.lock:
+         self.entries[key] = {'claim_status': COMPLETED, 'claim_result': result, 'claimed_at': now, 'expires_at': now + self.ttl}
+
+   def release(self, key):
+      with self.lock:
+         if self.entries.get(key, {}).get('claim_status') == IN_PROGRESS:
+            del self.entries[key]
+
+   def get(self, key):
+      with self.lock:
+         entry = self.entries.get(key)
+         return dict(entry) if entry is not None and entry['expires_at'] > time.time() else None
+
+
+class DynamoDBLedger:
+   """
+   Ledger stored in a DynamoDB table with partition key 'idempotency_key' and Time to Live enabled on 'expires_at'
+   DynamoDB deletes expired items up to a few days late, so expiry is also checked in the claim condition
+   Parameters: DynamoDB table, seconds claims are kept, and seconds after which a claim still in progress can be taken over
+   """
+   def __init__(self, table, ttl=DEFAULT_TTL, lease=DEFAULT_LEASE):
+      self.table = table
+      self.ttl = ttl
+      self.lease = lease
+
+   """
+   Claims notification with a conditional put which only succeeds if there is no live claim for it
+   Parameters: ledger key
+   Output: True if this caller claimed the notification, False if it is in progress or completed elsewhere
+   """
+   @traced('ledger_claim')
+   def claim(self, key):
+      now = int(time.time())
+      try:
+         self.table.put_item(
+          Item={'idempotency_key': key, 'claim_status': IN_PROGRESS, 'claimed_at': now, 'expires_at': now + self.ttl},
+          ConditionExpression=Attr('idempotency_key').not_exists() | Attr('expires_at').lte(now) |
+                              (Attr('claim_status').eq(IN_PROGRESS) & Attr('claimed_at').lte(now - self.lease))
+         )
+      except ClientError as error:
+         if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+         raise
+      return True
+
+   """
+   Records that the notification was handled, so redeliveries are skipped until the claim expires
+   Parameters: ledger key and result ('success', 'error' or 'queued')
+   Output: None
+   """
+   @traced('ledger_complete')
+   def complete(self, key, result):
+      now = int(time.time())
+      self.table.update_item(
+       Key={'idempotency_key': key},
+       UpdateExpression="set claim_status=:v1, claim_result=:v2, expires_at=:v3",
+       ExpressionAttributeValues={':v1': COMPLETED, ':v2': result, ':v3': now + self.ttl}
+      )
+
+   """
+   Removes claim still in progress after handling the notification failed, so a redelivery can handle it
+   Parameters: ledger key
+   Output: None
+   """
+   def release(self, key):
+      try:
+         self.table.delete_item(Key={'idempotency_key': key}, ConditionExpression=Attr('claim_status').eq(IN_PROGRESS))
+      except ClientError as error:
+         if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+   def get(self, key):
+      item = self.table.get_item(Key={'idempotency_key': key}, ConsistentRead=True).get('Item')
+      return item if item is not None and item['expires_at'] > time.time() else None
+
+
+## Ledger is kept at module level so it is created once per process
+idempotency_ledger = None
+idempotency_ledger_lock = threading.Lock()
+
+
+"""
+Creates ledger for configured backend
+Parameters: None
+Output: ledger, or None if no idempotency backend is configured
+"""
+def create_idempotency_ledger():
+   if settings.idempotencyBackend == 'dynamodb':
+      return DynamoDBLedger(get_dynamodb_table(settings.idempotencyTable), settings.idempotencyTTL, settings.idempotencyLease)
+   if settings.idempotencyBackend == 'memory':
+      return MemoryLedger(settings.idempotencyTTL, settings.idempotencyLease)
+   if settings.idempotencyBackend:
+      raise ValueError('Unknown idempotency backend: ' + settings.idempotencyBackend)
+   return None
+
+
+"""
+Returns ledger for configured backend, creating it on first use
+Parameters: None
+Output: ledger, or None if no idempotency backend is configured
+"""
+def get_idempotency_ledger():
+   global idempotency_ledger
+   with idempotency_ledger_lock:
+      if idempotency_ledger is None:
+         idempotency_ledger = create_idempotency_ledger()
+      return idempotency_ledger
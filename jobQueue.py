@@ -0,0 +1,407 @@
+"""
+Durable job queue for running background check steps off the request path
+A job is a JSON-serializable dictionary {'id', 'type', 'payload', 'attempts', 'enqueued_at'} handled by the function registered for its type
+Backends: SQS in production, SQLite for a single host, and in-memory for tests and benchmarks
+"""
+import collections
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from settings import settings
+from awsResources import get_aws_client
+from tracing import get_tracer
+from structuredLogging import get_logger
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF_BASE = 2.0
+DEFAULT_BACKOFF_CAP = 300.0
+## Seconds a received job stays hidden from other workers before it is handed out again, e.g. after a worker crashed
+DEFAULT_VISIBILITY_TIMEOUT = 300
+## Longest visibility timeout SQS accepts, in seconds
+MAX_VISIBILITY_TIMEOUT = 43200
+
+logger = get_logger('jobQueue')
+
+
+"""
+Creates new job
+Parameters: job type and payload
+Output: job dictionary
+"""
+def new_job(job_type, payload):
+   return {'id': uuid.uuid4().hex, 'type': job_type, 'payload': payload, 'attempts': 0, 'enqueued_at': time.time()}
+
+
+class MemoryQueueBackend:
+   """
+   In-memory queue backend for tests and benchmarks; jobs are lost when the process exits
+   Parameters: visibility timeout in seconds
+   """
+   def __init__(self, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+      self.visibility_timeout = visibility_timeout
+      self.jobs = collections.OrderedDict()
+      self.available_at = {}
+      self.dead_letters = []
+      self.condition = threading.Condition()
+
+   def enqueue(self, jobs, delay=0):
+      with self.condition:
+         for job in jobs:
+            self.jobs[job['id']] = dict(job)
+            self.available_at[job['id']] = time.time() + delay
+         self.condition.notify_all()
+
+   """
+   Receives available jobs, waiting up to 'wait' seconds for one, and hides them from other workers until completed or retried
+   Parameters: maximum number of jobs and wait time in seconds
+   Output: list of (job, receipt) tuples
+   """
+   def receive(self, max_jobs=1, wait=0):
+      deadline = time.time() + wait
+      with self.condition:
+         while True:
+            now = time.time()
+            ready = [job_ID for job_ID, available_at in self.available_at.items() if available_at <= now][:max_jobs]
+            if ready or now >= deadline:
+               break
+            self.condition.wait(min(deadline - now, 0.05))
+         received = []
+         for job_ID in ready:
+            self.available_at[job_ID] = now + self.visibility_timeout
+            self.jobs[job_ID]['attempts'] += 1
+            received.append((dict(self.jobs[job_ID]), job_ID))
+         return received
+
+   def complete(self, receipt):
+      with self.condition:
+         self.jobs.pop(receipt, None)
+         self.available_at.pop(receipt, None)
+
+   def retry(self, receipt, job, delay):
+      with self.condition:
+         if receipt in self.jobs:
+            self.available_at[receipt] = time.time() + delay
+            self.condition.notify_all()
+
+   def dead_letter(self, receipt, job):
+      with self.condition:
+         self.dead_letters.append(dict(job))
+         self.jobs.pop(receipt, None)
+         self.available_at.pop(receipt, None)
+
+   def depth(self):
+      with self.condition:
+         return len(self.jobs)
+
+
+class SQLiteQueueBackend:
+   """
+   SQLite queue backend; jobs are stored in a local database file so they survive process restarts
+   Jobs given up on are moved to the 'dead_jobs' table of the same file, to be inspected and enqueued again by hand
+   Parameters: path of database file and visibility timeout in seconds
+   """
+   def __init__(self, path, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+      self.path = path
+      self.visibility_timeout = visibility_timeout
+      self.lock = threading.Lock()
+      self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+      self.connection.execute("PRAGMA journal_mode=WAL")
+      self.connection.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, body TEXT NOT NULL, available_at REAL NOT NULL)")
+      self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_available_at ON jobs (available_at)")
+      self.connection.execute("CREATE TABLE IF NOT EXISTS dead_jobs (id TEXT PRIMARY KEY, body TEXT NOT NULL, failed_at REAL NOT NULL)")
+
+   def enqueue(self, jobs, delay=0):
+      available_at = time.time() + delay
+      with self.lock:
+         self.connection.executemany("INSERT INTO jobs (id, body, available_at) VALUES (?, ?, ?)",
+                                     [(job['id'], json.dumps(job), available_at) for job in jobs])
+
+   def receive(self, max_jobs=1, wait=0):
+      deadline = time.time() + wait
+      while True:
+         now = time.time()
+         with self.lock:
+            ## Selecting and leasing jobs in one write transaction keeps two workers from receiving the same job
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+               rows = self.connection.execute("SELECT id, body FROM jobs WHERE available_at <= ? ORDER BY available_at LIMIT ?",
+                                              (now, max_jobs)).fetchall()
+               received = []
+               for job_ID, body in rows:
+                  job = json.loads(body)
+                  job['attempts'] += 1
+                  self.connection.execute("UPDATE jobs SET body = ?, available_at = ? WHERE id = ?",
+                                          (json.dumps(job), now + self.visibility_timeout, job_ID))
+                  received.append((job, job_ID))
+               self.connection.execute("COMMIT")
+            except Exception:
+               self.connection.execute("ROLLBACK")
+               raise
+         if received or now >= deadline:
+            return received
+         time.sleep(min(deadline - now, 0.05))
+
+   def complete(self, receipt):
+      with self.lock:
+         self.connection.execute("DELETE FROM jobs WHERE id = ?", (receipt,))
+
+   def retry(self, receipt, job, delay):
+      with self.lock:
+         self.connection.execute("UPDATE jobs SET available_at = ? WHERE id = ?", (time.time() + delay, receipt))
+
+   def dead_letter(self, receipt, job):
+      with self.lock:
+         self.connection.execute("BEGIN IMMEDIATE")
+         try:
+            self.connection.execute("INSERT OR REPLACE INTO dead_jobs (id, body, failed_at) VALUES (?, ?, ?)", (receipt, json.dumps(job), time.time()))
+            self.connection.execute("DELETE FROM jobs WHERE id = ?", (receipt,))
+            self.connection.execute("COMMIT")
+         except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+   def depth(self):
+      with self.lock:
+         return self.connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+
+class SQSQueueBackend:
+   """
+   Amazon SQS queue backend for production; jobs are retried by changing the message visibility timeout
+   Jobs given up on are left on the queue, whose redrive policy moves them to its dead-letter queue: the policy's 'maxReceiveCount'
+   must be 'JOB_MAX_ATTEMPTS', so the message is moved instead of being received again
+   Parameters: SQS queue URL and visibility timeout in seconds
+   """
+   def __init__(self, queue_url, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+      self.queue_url = queue_url
+      self.visibility_timeout = visibility_timeout
+      self.sqs = get_aws_client('sqs')
+
+   def enqueue(self, jobs, delay=0):
+      ## SQS accepts at most 10 messages per batch and delays of at most 15 minutes
+      for start in range(0, len(jobs), 10):
+         entries = [{'Id': str(index), 'MessageBody': json.dumps(job), 'DelaySeconds': int(min(delay, 900))}
+                    for index, job in enumerate(jobs[start:start + 10])]
+         response = self.sqs.send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+         if response.get('Failed'):
+            raise Exception('Failed to enqueue jobs: %s' % response['Failed'])
+
+   """
+   Builds job from an SQS message, taking number of attempts from the message's receive count
+   Parameters: SQS message, as returned by ReceiveMessage or delivered in a Lambda SQS event
+   Output: job and receipt handle
+   """
+   def job_from_message(self, message):
+      job = json.loads(message.get('Body', message.get('body')))
+      attributes = message.get('Attributes', message.get('attributes', {}))
+      job['attempts'] = int(attributes.get('ApproximateReceiveCount', 1))
+      return job, message.get('ReceiptHandle', message.get('receiptHandle'))
+
+   def receive(self, max_jobs=1, wait=0):
+      response = self.sqs.receive_message(QueueUrl=self.queue_url, MaxNumberOfMessages=min(max_jobs, 10), WaitTimeSeconds=int(min(wait, 20)),
+                                          VisibilityTimeout=self.visibility_timeout, AttributeNames=['ApproximateReceiveCount'])
+      return [self.job_from_message(message) for message in response.get('Messages', [])]
+
+   def complete(self, receipt):
+      self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=receipt)
+
+   def retry(self, receipt, job, delay):
+      self.sqs.change_message_visibility(QueueUrl=self.queue_url, ReceiptHandle=receipt, VisibilityTimeout=int(min(delay, MAX_VISIBILITY_TIMEOUT)))
+
+   ## Message is made visible right away, so its next receive moves it to the dead-letter queue
+   def dead_letter(self, receipt, job):
+      self.retry(receipt, job, 0)
+
+   def depth(self):
+      attributes = self.sqs.get_queue_attributes(QueueUrl=self.queue_url,
+                                                 AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible'])['Attributes']
+      return int(attributes['ApproximateNumberOfMessages']) + int(attributes['ApproximateNumberOfMessagesNotVisible'])
+
+
+class QueueMetrics:
+   """
+   Counts jobs by outcome and keeps recent job latencies (time from enqueue to completion)
+   Parameters: number of recent latencies kept
+   """
+   def __init__(self, window=1000):
+      self.lock = threading.Lock()
+      self.counts = collections.Counter()
+      self.latencies = collections.deque(maxlen=window)
+
+   def record(self, outcome, latency=None):
+      with self.lock:
+         self.counts[outcome] += 1
+         if latency is not None:
+            self.latencies.append(latency)
+
+   """
+   Returns current metrics
+   Parameters: queue depth, or None to leave it out
+   Output: dictionary with queue depth, job counts by outcome, and p50/p95/max job latency in milliseconds
+   """
+   def snapshot(self, depth):
+      with self.lock:
+         latencies = sorted(self.latencies)
+         counts = dict(self.counts)
+
+      def latency_percentile(percent):
+         if not latencies:
+            return 0.0
+         return latencies[min(len(latencies) - 1, int(percent / 100.0 * len(latencies)))] * 1000
+
+      metrics = {'enqueued': counts.get('enqueued', 0), 'completed': counts.get('completed', 0),
+                 'retried': counts.get('retried', 0), 'deferred': counts.get('deferred', 0), 'failed': counts.get('failed', 0),
+                 'job_latency_p50_ms': latency_percentile(50), 'job_latency_p95_ms': latency_percentile(95),
+                 'job_latency_max_ms': latencies[-1] * 1000 if latencies else 0.0}
+      if depth is not None:
+         metrics['queue_depth'] = depth
+      return metrics
+
+
+class JobQueue:
+   """
+   Queue of jobs dispatched to handler functions by job type, with retries and exponential backoff
+   Handlers are called as handler(payload, attempt) and signal a retryable failure by raising an exception
+   Parameters: queue backend, dictionary mapping job type to handler, maximum attempts per job, backoff base and cap in seconds
+   """
+   def __init__(self, backend, handlers, max_attempts=DEFAULT_MAX_ATTEMPTS, backoff_base=DEFAULT_BACKOFF_BASE, backoff_cap=DEFAULT_BACKOFF_CAP):
+      self.backend = backend
+      self.handlers = handlers
+      self.max_attempts = max_attempts
+      self.backoff_base = backoff_base
+      self.backoff_cap = backoff_cap
+      self.metrics = QueueMetrics()
+
+   """
+   Persists jobs of given type, one per payload
+   Parameters: job type and list of payloads
+   Output: list of job IDs
+   """
+   def enqueue_many(self, job_type, payloads):
+      jobs = [new_job(job_type, payload) for payload in payloads]
+      if jobs:
+         self.backend.enqueue(jobs)
+         for job in jobs:
+            self.metrics.record('enqueued')
+      return [job['id'] for job in jobs]
+
+   def enqueue(self, job_type, payload):
+      return self.enqueue_many(job_type, [payload])[0]
+
+   """
+   Runs handler for given job, then completes it, schedules a retry with backoff, or gives up after the maximum number of attempts
+   A handler deferred because a service is unavailable raises an exception with a 'retry_after' attribute (rateLimiting.ServiceUnavailableError);
+   since no request was sent, the job is retried once the service should be back however many attempts it has had
+   A job given up on is dead-lettered rather than deleted, since its outbound message was already acknowledged and nothing else would
+   start the lead's background check
+   Parameters: job and receipt returned by the backend
+   Output: True if job succeeded
+   """
+   def run_job(self, job, receipt):
+      ## Only received again if the SQS queue has no redrive policy moving it to the dead-letter queue, or a larger 'maxReceiveCount'
+      if job['attempts'] > self.max_attempts:
+         logger.error("Job received after maximum attempts, check the redrive policy of the queue",
+                      extra={'job_ID': job['id'], 'job_type': job['type'], 'attempts': job['attempts']})
+         ## Hidden for as long as SQS allows, so the message isn't received over and over until the queue's retention period ends
+         self.backend.retry(receipt, job, MAX_VISIBILITY_TIMEOUT)
+         self.metrics.record('failed')
+         return False
+      try:
+         with get_tracer().trace('job:' + job['type']):
+            self.handlers[job['type']](job['payload'], job['attempts'])
+      except Exception as error:
+         retry_after = getattr(error, 'retry_after', None)
+         if retry_after is not None:
+            ## Jitter spreads out the deferred jobs so they don't all resume at the same moment
+            delay = retry_after * random.uniform(1.0, 1.5)
+            logger.warning("Job deferred until service is available",
+                           extra={'job_ID': job['id'], 'job_type': job['type'], 'attempts': job['attempts'], 'delay': round(delay, 1), 'error': repr(error)})
+            self.backend.retry(receipt, job, delay)
+            self.metrics.record('deferred')
+         elif job['attempts'] >= self.max_attempts:
+            logger.error("Job failed after maximum attempts, moving it to the dead-letter queue",
+                         extra={'job_ID': job['id'], 'job_type': job['type'], 'attempts': job['attempts'], 'error': repr(error)})
+            self.backend.dead_letter(receipt, job)
+            self.metrics.record('failed')
+         else:
+            delay = random.uniform(0.5, 1.0) * min(self.backoff_cap, self.backoff_base * (2 ** (job['attempts'] - 1)))
+            logger.warning("Job failed, retrying with backoff",
+                           extra={'job_ID': job['id'], 'job_type': job['type'], 'attempts': job['attempts'], 'delay': round(delay, 1), 'error': repr(error)})
+            self.backend.retry(receipt, job, delay)
+            self.metrics.record('retried')
+         return False
+      self.backend.complete(receipt)
+      self.metrics.record('completed', time.time() - job['enqueued_at'])
+      return True
+
+   """
+   Receives and runs available jobs
+   Parameters: maximum number of jobs and time in seconds to wait for one
+   Output: number of jobs received
+   """
+   def drain(self, max_jobs=10, wait=1.0):
+      received = self.backend.receive(max_jobs=max_jobs, wait=wait)
+      for job, receipt in received:
+         self.run_job(job, receipt)
+      return len(received)
+
+   """
+   Returns metrics of the jobs handled by this process, with the queue depth read from the backend if asked for
+   Parameters: whether to read the queue depth, which is one GetQueueAttributes request with SQS
+   Output: metrics dictionary (see QueueMetrics.snapshot())
+   """
+   def get_metrics(self, depth=True):
+      return self.metrics.snapshot(self.backend.depth() if depth else None)
+
+
+class JobWorkerPool:
+   """
+   Pool of threads that drain a job queue until stopped
+   Parameters: job queue and number of worker threads
+   """
+   def __init__(self, job_queue, workers):
+      self.job_queue = job_queue
+      self.workers = workers
+      self.stopping = threading.Event()
+      self.threads = []
+
+   def start(self):
+      for index in range(self.workers):
+         thread = threading.Thread(target=self.run, name='job-worker-' + str(index), daemon=True)
+         thread.start()
+         self.threads.append(thread)
+      return self
+
+   def run(self):
+      while not self.stopping.is_set():
+         try:
+            self.job_queue.drain(max_jobs=1, wait=1.0)
+         except Exception as error:
+            logger.exception("Job worker error")
+            self.stopping.wait(1.0)
+
+   def stop(self, timeout=None):
+      self.stopping.set()
+      for thread in self.threads:
+         thread.join(timeout)
+      self.threads = []
+
+
+"""
+Creates queue backend selected by settings.jobQueueBackend ('sqs', 'sqlite' or 'memory')
+Parameters: None
+Output: queue backend, or None if no backend is configured and jobs run inline
+"""
+def create_job_queue_backend():
+   if settings.jobQueueBackend == 'sqs':
+      return SQSQueueBackend(settings.jobQueueURL)
+   if settings.jobQueueBackend == 'sqlite':
+      return SQLiteQueueBackend(settings.jobQueuePath)
+   if settings.jobQueueBackend == 'memory':
+      return MemoryQueueBackend()
+   if settings.jobQueueBackend:
+      raise ValueError('Unknown job queue backend: ' + settings.jobQueueBackend)
+   return None
@@ -0,0 +1,58 @@
+"""
+Runs background check jobs queued by the '/background-check' endpoint
+In production the SQS queue triggers lambda_handler(); 'python jobWorker.py' instead polls the configured queue with a pool of worker threads
+Either way, the SQS queue needs a redrive policy to a dead-letter queue, so jobs that keep failing are kept there instead of being lost
+"""
+import time
+from settings import settings
+from backgroundCheck import get_job_queue
+from jobQueue import JobWorkerPool, SQSQueueBackend
+from salesforceWriter import flush_background_check_writers
+from structuredLogging import get_logger, flush_logs
+
+## Seconds between queue metrics logged by the polling worker
+METRICS_INTERVAL = 60
+
+logger = get_logger('jobWorker')
+
+
+"""
+Lambda handler for SQS-triggered job processing
+Failed jobs are given a backoff visibility timeout and reported as batch item failures so SQS redelivers only them
+Jobs that failed 'JOB_MAX_ATTEMPTS' times are kept on the queue and reported as failures too: the queue needs a redrive policy
+to a dead-letter queue with 'maxReceiveCount' set to 'JOB_MAX_ATTEMPTS', which moves them there on their next receive
+Parameters: Lambda SQS event and context
+Output: partial batch response listing failed message IDs
+"""
+def lambda_handler(event, context):
+   job_queue = get_job_queue()
+   if job_queue is None or not isinstance(job_queue.backend, SQSQueueBackend):
+      raise ValueError('lambda_handler requires JOB_QUEUE_BACKEND=sqs')
+   batch_item_failures = []
+   for record in event.get('Records', []):
+      job, receipt = job_queue.backend.job_from_message(record)
+      if not job_queue.run_job(job, receipt):
+         batch_item_failures.append({'itemIdentifier': record['messageId']})
+   ## Buffered 'Background Check' objects are written before the invocation ends
+   flush_background_check_writers()
+   ## Queue depth would cost an SQS request per invocation; SQS already publishes it as the ApproximateNumberOfMessagesVisible metric
+   logger.info("Job queue metrics", extra={'metrics': job_queue.get_metrics(depth=False)})
+   flush_logs()
+   return {'batchItemFailures': batch_item_failures}
+
+
+def main():
+   job_queue = get_job_queue()
+   if job_queue is None:
+      raise ValueError('JOB_QUEUE_BACKEND is not set')
+   ## Local backends already have worker threads started by get_job_queue()
+   if settings.jobQueueBackend == 'sqs':
+      JobWorkerPool(job_queue, settings.jobWorkers).start()
+   logger.info("Draining job queue", extra={'backend': settings.jobQueueBackend, 'workers': settings.jobWorkers})
+   while True:
+      time.sleep(METRICS_INTERVAL)
+      logger.info("Job queue metrics", extra={'metrics': job_queue.get_metrics()})
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,155 @@
+"""
+One-time migration of the background check table to indexed lookups
+Creates the 'checkr_candidate_ID-index' and 'checkr_report_ID-index' global secondary indexes if they don't exist yet,
+then backfills existing items by removing empty 'checkr_report_ID' strings, which can't be stored as index keys
+Also creates the outbound message idempotency ledger table, with Time to Live on 'expires_at', the rate limit table and the status counters table
+if they don't exist yet
+Run once per environment: PYTHON_ENV=qa python migrateBackgroundCheckTable.py
+"""
+import sys
+import time
+import boto3
+from boto3.dynamodb.conditions import Attr
+from settings import settings
+from backgroundCheckTable import CANDIDATE_ID_INDEX, REPORT_ID_INDEX
+
+INDEXES = [(CANDIDATE_ID_INDEX, 'checkr_candidate_ID'), (REPORT_ID_INDEX, 'checkr_report_ID')]
+
+
+"""
+Creates global secondary index on given attribute and waits for it to become active
+DynamoDB only allows one index to be created per UpdateTable call, so indexes are created one at a time
+Parameters: DynamoDB client, table name, index name, index key attribute name
+Output: None
+"""
+def create_index(dynamodb_client, table_name, index_name, attribute_name):
+   table_description = dynamodb_client.describe_table(TableName=table_name)['Table']
+   existing_indexes = [index['IndexName'] for index in table_description.get('GlobalSecondaryIndexes', [])]
+   if index_name in existing_indexes:
+      print(index_name + " already exists")
+   else:
+      print("Creating " + index_name)
+      index = {'IndexName': index_name,
+               'KeySchema': [{'AttributeName': attribute_name, 'KeyType': 'HASH'}],
+               'Projection': {'ProjectionType': 'ALL'}}
+      ## Tables in provisioned mode need throughput for the index as well, so it copies the table's throughput
+      if table_description.get('BillingModeSummary', {}).get('BillingMode') != 'PAY_PER_REQUEST':
+         throughput = table_description['ProvisionedThroughput']
+         index['ProvisionedThroughput'] = {'ReadCapacityUnits': throughput['ReadCapacityUnits'],
+                                           'WriteCapacityUnits': throughput['WriteCapacityUnits']}
+      dynamodb_client.update_table(TableName=table_name,
+                                   AttributeDefinitions=[{'AttributeName': attribute_name, 'AttributeType': 'S'}],
+                                   GlobalSecondaryIndexUpdates=[{'Create': index}])
+
+   ## Waits until index has finished backfilling before returning
+   while True:
+      table_description = dynamodb_client.describe_table(TableName=table_name)['Table']
+      index_status = [index['IndexStatus'] for index in table_description.get('GlobalSecondaryIndexes', []) if index['IndexName'] == index_name]
+      if index_status == ['ACTIVE']:
+         print(index_name + " is active")
+         return
+      print("Waiting for " + index_name + " (status: " + str(index_status) + ")")
+      time.sleep(15)
+
+
+"""
+Creates idempotency ledger table with on-demand capacity and enables Time to Live on 'expires_at' so expired claims are deleted
+Parameters: DynamoDB client and table name
+Output: None
+"""
+def create_ledger_table(dynamodb_client, table_name):
+   try:
+      dynamodb_client.describe_table(TableName=table_name)
+      print(table_name + " already exists")
+   except dynamodb_client.exceptions.ResourceNotFoundException:
+      print("Creating " + table_name)
+      dynamodb_client.create_table(TableName=table_name, BillingMode='PAY_PER_REQUEST',
+                                   AttributeDefinitions=[{'AttributeName': 'idempotency_key', 'AttributeType': 'S'}],
+                                   KeySchema=[{'AttributeName': 'idempotency_key', 'KeyType': 'HASH'}])
+      dynamodb_client.get_waiter('table_exists').wait(TableName=table_name)
+   time_to_live = dynamodb_client.describe_time_to_live(TableName=table_name)['TimeToLiveDescription']
+   if time_to_live.get('TimeToLiveStatus') not in ['ENABLED', 'ENABLING']:
+      dynamodb_client.update_time_to_live(TableName=table_name, TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'})
+   print(table_name + " is active with Time to Live on expires_at")
+
+
+"""
+Creates table shared by the rate limiters and circuit breakers of every instance, with on-demand capacity
+Parameters: DynamoDB client and table name
+Output: None
+"""
+def create_rate_limit_table(dynamodb_client, table_name):
+   try:
+      dynamodb_client.describe_table(TableName=table_name)
+      print(table_name + " already exists")
+   except dynamodb_client.exceptions.ResourceNotFoundException:
+      print("Creating " + table_name)
+      dynamodb_client.create_table(TableName=table_name, BillingMode='PAY_PER_REQUEST',
+                                   AttributeDefinitions=[{'AttributeName': 'limit_key', 'AttributeType': 'S'}],
+                                   KeySchema=[{'AttributeName': 'limit_key', 'KeyType': 'HASH'}])
+      dynamodb_client.get_waiter('table_exists').wait(TableName=table_name)
+      print(table_name + " is active")
+
+
+"""
+Creates table of the status counters served by '/status', with on-demand capacity
+Counters and outstanding reports of each environment or org are kept in their own partitions ('status_key'), ordered by 'sort_key'
+Parameters: DynamoDB client and table name
+Output: None
+"""
+def create_status_table(dynamodb_client, table_name):
+   try:
+      dynamodb_client.describe_table(TableName=table_name)
+      print(table_name + " already exists")
+   except dynamodb_client.exceptions.ResourceNotFoundException:
+      print("Creating " + table_name)
+      dynamodb_client.create_table(TableName=table_name, BillingMode='PAY_PER_REQUEST',
+                                   AttributeDefinitions=[{'AttributeName': 'status_key', 'AttributeType': 'S'},
+                                                         {'AttributeName': 'sort_key', 'AttributeType': 'S'}],
+                                   KeySchema=[{'AttributeName': 'status_key', 'KeyType': 'HASH'}, {'AttributeName': 'sort_key', 'KeyType': 'RANGE'}])
+      dynamodb_client.get_waiter('table_exists').wait(TableName=table_name)
+      print(table_name + " is active")
+
+
+"""
+Removes empty 'checkr_report_ID' attributes written by earlier versions when a candidate was created
+Items keep every other attribute, and gain the attribute again once their report is created
+Parameters: DynamoDB table
+Output: number of items updated
+"""
+def backfill_items(background_check_table):
+   updated_count = 0
+   scan_kwargs = {'FilterExpression': Attr('checkr_report_ID').eq(''), 'ProjectionExpression': 'salesforce_lead_ID'}
+   while True:
+      response = background_check_table.scan(**scan_kwargs)
+      for item in response['Items']:
+         background_check_table.update_item(Key={'salesforce_lead_ID': item['salesforce_lead_ID']},
+                                            UpdateExpression="remove checkr_report_ID",
+                                            ConditionExpression=Attr('checkr_report_ID').eq(''))
+         updated_count += 1
+      ## Scans return at most 1 MB per page, so it keeps going until there is no 'LastEvaluatedKey'
+      if 'LastEvaluatedKey' not in response:
+         return updated_count
+      scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def main():
+   dynamodb = boto3.resource('dynamodb')
+   background_check_table = dynamodb.Table(settings.backgroundCheckTable)
+   print("Migrating DynamoDB table " + settings.backgroundCheckTable)
+
+   ## Backfills before creating indexes so every existing item can be indexed
+   updated_count = backfill_items(background_check_table)
+   print("Removed empty checkr_report_ID from " + str(updated_count) + " items")
+
+   for index_name, attribute_name in INDEXES:
+      create_index(dynamodb.meta.client, settings.backgroundCheckTable, index_name, attribute_name)
+   create_ledger_table(dynamodb.meta.client, settings.idempotencyTable)
+   create_rate_limit_table(dynamodb.meta.client, settings.rateLimitTable)
+   create_status_table(dynamodb.meta.client, settings.statusTable)
+   print("Run rebuildStatusCounters.py to count the items already in the table")
+   print("Migration complete")
+
+
+if __name__ == '__main__':
+   sys.exit(main())
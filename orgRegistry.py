@@ -0,0 +1,342 @@
+"""
+Registry of the Salesforce orgs served by one deployment, in addition to the org configured by settings.py for PYTHON_ENV
+Each org is read from the JSON file at 'orgRegistryPath' and maps its Organization ID to its own Checkr account, Salesforce
+Connected App user, Checkr package and DynamoDB table; secrets are given as the names of SSM parameters (or environment variables)
+and are only read when the org is first used
+The org of the request or job being handled is kept in a context variable, so Checkr and Salesforce clients, their connection pools,
+OAuth tokens and service guards, the 'Background Check' writer and the DynamoDB table are looked up for that org
+Clients and writers of registered orgs are cached per org, at most 'orgCacheSize' orgs at a time and evicted after 'orgIdleTimeout' seconds unused
+"""
+import asyncio
+import atexit
+import collections
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from settings import settings, get_secret
+from structuredLogging import get_logger
+
+## Seconds an evicted asyncio client stays open, so requests that were already using it can finish
+ASYNC_CLOSE_DELAY = 60.0
+
+logger = get_logger('orgRegistry')
+
+## Org of the request or job being handled; None for the org configured by settings.py
+current_org = contextvars.ContextVar('current_org', default=None)
+
+
+class OrgSecret:
+   """
+   Org attribute whose value is read from the secret cache each time it is used, like settings.Secret
+   Parameters: attribute name
+   """
+   def __init__(self, attribute):
+      self.attribute = attribute
+
+   def __get__(self, instance, owner):
+      if instance is None:
+         return self
+      return get_secret(instance.secretNames[self.attribute])
+
+
+class Org:
+   """
+   Salesforce org registered with the deployment, with the same attribute names as settings.py so either can configure a client
+   Rate limits default to those of settings.py, but every org gets its own buckets and circuits
+   Parameters: registry entry
+   """
+   checkrApiKey = OrgSecret('checkrApiKey')
+   salesforcePassword = OrgSecret('salesforcePassword')
+   salesforceClientSecret = OrgSecret('salesforceClientSecret')
+
+   def __init__(self, entry):
+      self.organizationID = entry['organizationID']
+      self.name = entry.get('name', self.organizationID)
+      self.secretNames = {attribute: entry[attribute] for attribute in ['checkrApiKey', 'salesforcePassword', 'salesforceClientSecret']}
+      self.checkrAccountID = entry.get('checkrAccountID')
+      self.checkrBaseUrl = entry.get('checkrBaseUrl', settings.checkrBaseUrl)
+      self.checkrPackage = entry['checkrPackage']
+      self.salesforceOAuthURL = entry['salesforceOAuthURL']
+      self.salesforceClientID = entry['salesforceClientID']
+      self.salesforceUsername = entry['salesforceUsername']
+      self.backgroundCheckTable = entry['backgroundCheckTable']
+      self.checkrRateLimit = float(entry.get('checkrRateLimit', settings.checkrRateLimit))
+      self.checkrBurst = int(entry.get('checkrBurst', settings.checkrBurst))
+      self.salesforceRateLimit = float(entry.get('salesforceRateLimit', settings.salesforceRateLimit))
+      self.salesforceBurst = int(entry.get('salesforceBurst', settings.salesforceBurst))
+
+
+class OrgResourceCache:
+   """
+   Caches clients and writers per org, evicting the least recently used org beyond 'max_size' orgs and orgs unused for 'idle_timeout' seconds
+   Evicted writers are flushed and evicted clients closed; asyncio clients are closed after ASYNC_CLOSE_DELAY seconds
+   Parameters: maximum number of orgs and idle timeout in seconds
+   """
+   def __init__(self, max_size, idle_timeout):
+      self.max_size = max_size
+      self.idle_timeout = idle_timeout
+      self.entries = collections.OrderedDict()
+      self.lock = threading.Lock()
+      self.created_count = 0
+      self.evicted_count = 0
+
+   """
+   Returns resource of given org, creating it if it doesn't exist yet or is no longer valid, e.g. after the org's secrets were rotated
+   Parameters: org, resource name, function creating the resource (None to only return an existing one),
+   and function telling whether an existing resource is still valid
+   Output: resource, or None if it doesn't exist and no function creating it was given
+   """
+   def get(self, org, name, create=None, valid=None):
+      replaced = None
+      with self.lock:
+         now = time.monotonic()
+         entry = self.entries.get(org.organizationID)
+         if entry is None:
+            if create is None:
+               return None
+            entry = self.entries[org.organizationID] = {'resources': {}, 'used_at': now}
+         self.entries.move_to_end(org.organizationID)
+         entry['used_at'] = now
+         resource = entry['resources'].get(name)
+         if resource is not None and valid is not None and not valid(resource):
+            replaced, resource = resource, None
+         if resource is None and create is not None:
+            resource = entry['resources'][name] = create()
+            self.created_count += 1
+         evicted = self.pop_expired(now)
+      if replaced is not None:
+         close_resource(replaced)
+      for organization_ID, entry in evicted:
+         self.close_entry(organization_ID, entry)
+      return resource
+
+   """
+   Returns every cached resource with given name, e.g. to flush the writers of every org
+   Parameters: resource name
+   Output: list of resources
+   """
+   def get_all(self, name):
+      with self.lock:
+         return [entry['resources'][name] for entry in self.entries.values() if name in entry['resources']]
+
+   """
+   Removes orgs beyond the maximum number of orgs and orgs idle for longer than the idle timeout; called with self.lock held
+   Parameters: current time.monotonic()
+   Output: list of (Organization ID, entry) tuples removed
+   """
+   def pop_expired(self, now):
+      evicted = []
+      while self.entries:
+         organization_ID, entry = next(iter(self.entries.items()))
+         if len(self.entries) <= self.max_size and now - entry['used_at'] < self.idle_timeout:
+            break
+         evicted.append(self.entries.popitem(last=False))
+      self.evicted_count += len(evicted)
+      return evicted
+
+   def close_entry(self, organization_ID, entry):
+      logger.info("Evicting clients of org", extra={'organization_ID': organization_ID, 'resources': sorted(entry['resources'])})
+      ## Writers are flushed before clients are closed, since a flush may still send records with the org's Salesforce client
+      resources = sorted(entry['resources'].values(), key=lambda resource: not hasattr(resource, 'flush'))
+      for resource in resources:
+         close_resource(resource)
+
+   """
+   Flushes and closes resources of every org, e.g. when the process exits
+   Parameters: None
+   Output: None
+   """
+   def close_all(self):
+      while True:
+         with self.lock:
+            if not self.entries:
+               return
+            organization_ID, entry = self.entries.popitem(last=False)
+         self.close_entry(organization_ID, entry)
+
+
+"""
+Flushes a writer, or closes a client, removed from the cache
+Parameters: resource
+Output: None
+"""
+def close_resource(resource):
+   try:
+      if hasattr(resource, 'flush'):
+         resource.flush()
+      close = getattr(resource, 'close', None)
+      if close is None:
+         return
+      if inspect.iscoroutinefunction(close):
+         try:
+            loop = asyncio.get_running_loop()
+         except RuntimeError:
+            return
+         loop.call_later(ASYNC_CLOSE_DELAY, lambda: loop.create_task(close()))
+      else:
+         close()
+   except Exception as error:
+      logger.warning("Error closing evicted org resource", extra={'resource': type(resource).__name__, 'error': repr(error)})
+
+
+## Registry and resource cache are kept at module level so they are loaded once per process
+org_registry = None
+org_registry_lock = threading.Lock()
+org_resource_cache = OrgResourceCache(settings.orgCacheSize, settings.orgIdleTimeout)
+
+
+"""
+Returns registered orgs, reading the registry file on first use
+Parameters: None
+Output: dictionary mapping Organization ID to org
+"""
+def get_org_registry():
+   global org_registry
+   with org_registry_lock:
+      if org_registry is None:
+         org_registry = {}
+         if settings.orgRegistryPath:
+            with open(settings.orgRegistryPath) as registry_file:
+               org_registry = {org.organizationID: org for org in (Org(entry) for entry in json.load(registry_file))}
+            logger.info("Loaded org registry", extra={'org_count': len(org_registry)})
+      return org_registry
+
+
+"""
+Returns registered org with given Organization ID
+Parameters: Salesforce Organization ID
+Output: org, or None if it isn't registered
+"""
+def get_org(organization_ID):
+   return get_org_registry().get(organization_ID)
+
+
+"""
+Returns registered org whose Checkr account sends webhooks with given account ID
+Parameters: Checkr account ID
+Output: org, or None if no org is registered for the account
+"""
+def get_org_by_checkr_account(checkr_account_ID):
+   if not checkr_account_ID:
+      return None
+   for org in get_org_registry().values():
+      if org.checkrAccountID == checkr_account_ID:
+         return org
+   return None
+
+
+"""
+Returns file path or S3 key of a registered org's own copy of a file, e.g. a checkpoint, so orgs don't share it
+Parameters: path of the org configured by settings.py, and org
+Output: path suffixed with the Organization ID, or the path itself for the org configured by settings.py
+"""
+def get_org_path(path, org):
+   if org is None:
+      return path
+   root, extension = os.path.splitext(path)
+   return root + '-' + org.organizationID + extension
+
+
+"""
+Returns org of the request or job being handled
+Parameters: None
+Output: org, or None for the org configured by settings.py
+"""
+def get_current_org():
+   return current_org.get()
+
+
+"""
+Returns Organization ID of the org being handled, to be stored with queued jobs
+Parameters: None
+Output: Organization ID, or None for the org configured by settings.py
+"""
+def get_current_org_ID():
+   org = current_org.get()
+   return org.organizationID if org is not None else None
+
+
+"""
+Selects org for the rest of the request being handled
+Parameters: org, or None for the org configured by settings.py
+Output: None
+"""
+def set_current_org(org):
+   current_org.set(org)
+
+
+"""
+Context manager selecting org while a job or buffered write runs
+Parameters: org, or None for the org configured by settings.py
+Output: context manager
+"""
+@contextlib.contextmanager
+def org_context(org):
+   token = current_org.set(org)
+   try:
+      yield org
+   finally:
+      current_org.reset(token)
+
+
+"""
+Returns settings of the org being handled: the registered org, or settings.py
+Parameters: None
+Output: org or settings
+"""
+def get_org_settings():
+   org = current_org.get()
+   return org if org is not None else settings
+
+
+"""
+Returns resource of given org from the resource cache, creating it on first use
+Parameters: org, resource name, function creating the resource (None to only return an existing one), and function telling whether it is still valid
+Output: resource
+"""
+def get_org_resource(org, name, create=None, valid=None):
+   return org_resource_cache.get(org, name, create, valid)
+
+
+"""
+Returns every cached resource with given name
+Parameters: resource name
+Output: list of resources
+"""
+def get_org_resources(name):
+   return org_resource_cache.get_all(name)
+
+
+"""
+Calls function with given org selected, e.g. for writers whose timer flushes outside of any request
+Parameters: org, function and its arguments
+Output: function's return value
+"""
+def run_in_org(org, function, *args, **kwargs):
+   with org_context(org):
+      return function(*args, **kwargs)
+
+
+"""
+Decorator for job handlers which runs the handler for the org stored in the job payload when the job was queued
+Parameters: job handler
+Output: job handler
+"""
+def in_job_org(handler):
+   @functools.wraps(handler)
+   def wrapper(payload, attempt):
+      organization_ID = payload.get('salesforce_org_ID')
+      org = get_org(organization_ID) if organization_ID else None
+      if organization_ID and org is None:
+         raise LookupError("Org of job is not registered (organization_ID: " + organization_ID + ")")
+      with org_context(org):
+         return handler(payload, attempt)
+   return wrapper
+
+
+atexit.register(org_resource_cache.close_all)
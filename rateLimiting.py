@@ -0,0 +1,447 @@
+"""
+Client-side rate limiting and circuit breaking for the Checkr and Salesforce APIs
+Every request is first checked against the service's circuit breaker, then takes a token from the service's token bucket, waiting
+up to 'rateLimitMaxWait' seconds for one; Retry-After and rate limit response headers pause the bucket until the service allows requests again
+A circuit opens after 'circuitFailureThreshold' consecutive connection errors or 5xx responses, and after 'circuitResetTimeout' seconds
+lets one probe request through: if it succeeds the circuit closes, otherwise it opens again
+Requests refused by an open circuit or a long wait raise ServiceUnavailableError, so callers defer the work instead of recording an error
+Backends: DynamoDB shares buckets and circuits between Lambda instances and job workers, local keeps them in this process
+"""
+import email.utils
+import threading
+import time
+from decimal import Decimal
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+from settings import settings
+from awsResources import get_dynamodb_table
+from structuredLogging import get_logger
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+## Seconds a 429 response without a Retry-After header pauses the bucket for
+DEFAULT_THROTTLE_PAUSE = 1.0
+## Seconds the bucket is paused for once Salesforce reports the org's daily API requests are used up
+SALESFORCE_LIMIT_PAUSE = 300.0
+## Seconds circuit state read from DynamoDB is reused before it is read again
+DEFAULT_CIRCUIT_CACHE_TTL = 1.0
+## Rounds of conditional updates tried before a DynamoDB bucket reservation is refused
+MAX_RESERVE_ATTEMPTS = 2
+
+logger = get_logger('rateLimiting')
+
+
+class ServiceUnavailableError(Exception):
+   """
+   Raised instead of sending a request when the service is throttling us for longer than callers should wait
+   Parameters: service name, seconds after which the request can be tried again, and reason
+   """
+   def __init__(self, service_name, retry_after, reason='rate limited'):
+      super().__init__('%s unavailable (%s), retry after %.1f s' % (service_name, reason, retry_after))
+      self.service_name = service_name
+      self.retry_after = retry_after
+
+
+class CircuitOpenError(ServiceUnavailableError):
+   """Raised instead of sending a request while the service's circuit is open"""
+   def __init__(self, service_name, retry_after):
+      super().__init__(service_name, retry_after, 'circuit open')
+
+
+"""
+Parses a Retry-After header, given either in seconds or as an HTTP date
+Parameters: header value, if any
+Output: seconds to wait, or None if the header is missing or invalid
+"""
+def parse_retry_after(value):
+   if not value:
+      return None
+   try:
+      return max(0.0, float(value))
+   except ValueError:
+      pass
+   try:
+      return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+   except (TypeError, ValueError):
+      return None
+
+
+"""
+Returns time.time() until which the service asked us to stop sending requests, from its response headers
+Handles Retry-After, Checkr's X-Ratelimit-Remaining/X-Ratelimit-Reset, and Salesforce's Sforce-Limit-Info daily API usage
+Parameters: response status code and headers
+Output: time.time() to pause until, or None if the service didn't ask for a pause
+"""
+def pause_until_from_headers(status_code, headers):
+   now = time.time()
+   retry_after = parse_retry_after(headers.get('Retry-After'))
+   if retry_after is not None:
+      return now + retry_after
+   if headers.get('X-Ratelimit-Remaining') == '0' and headers.get('X-Ratelimit-Reset'):
+      try:
+         reset = float(headers['X-Ratelimit-Reset'])
+      except ValueError:
+         reset = DEFAULT_THROTTLE_PAUSE
+      ## Checkr sends the reset as an epoch timestamp; small values are taken as seconds from now
+      return reset if reset > 1e9 else now + reset
+   limit_info = headers.get('Sforce-Limit-Info', '')
+   if limit_info.startswith('api-usage='):
+      try:
+         used, limit = [int(count) for count in limit_info[len('api-usage='):].split('/')]
+      except ValueError:
+         used, limit = 0, 1
+      if used >= limit:
+         return now + SALESFORCE_LIMIT_PAUSE
+   if status_code == 429:
+      return now + DEFAULT_THROTTLE_PAUSE
+   return None
+
+
+class LocalRateLimitBackend:
+   """
+   Keeps buckets and circuits in this process, for a single host and for benchmarks
+   Buckets store the GCRA theoretical arrival time 'tat': a request is allowed once tat - tolerance has passed, and moves tat on by one interval
+   """
+   def __init__(self):
+      self.buckets = {}
+      self.circuits = {}
+      self.lock = threading.Lock()
+
+   """
+   Reserves the next request slot of a bucket, unless it is further away than 'max_wait'
+   Parameters: bucket name, seconds between requests, seconds of burst tolerance, and maximum seconds to wait
+   Output: seconds to wait before sending the request; more than 'max_wait' if no slot was reserved
+   """
+   def reserve(self, name, interval, tolerance, max_wait):
+      now = time.time()
+      with self.lock:
+         tat = max(self.buckets.get(name, now), now)
+         wait = tat - tolerance - now
+         if wait <= max_wait:
+            self.buckets[name] = tat + interval
+         return max(0.0, wait)
+
+   def pause(self, name, tat):
+      with self.lock:
+         self.buckets[name] = max(self.buckets.get(name, 0.0), tat)
+
+   def get_circuit(self, name):
+      with self.lock:
+         return dict(self.circuits.get(name, {'circuit_state': CLOSED, 'failure_count': 0, 'opened_at': 0.0}))
+
+   def record_failure(self, name, failure_threshold):
+      now = time.time()
+      with self.lock:
+         circuit = self.circuits.setdefault(name, {'circuit_state': CLOSED, 'failure_count': 0, 'opened_at': 0.0})
+         circuit['failure_count'] += 1
+         if circuit['circuit_state'] == HALF_OPEN or (circuit['circuit_state'] == CLOSED and circuit['failure_count'] >= failure_threshold):
+            circuit.update(circuit_state=OPEN, opened_at=now)
+         return dict(circuit)
+
+   def record_success(self, name):
+      with self.lock:
+         self.circuits[name] = {'circuit_state': CLOSED, 'failure_count': 0, 'opened_at': 0.0}
+
+   """
+   Moves an open circuit whose reset timeout has passed to half-open, so the caller can send one probe request
+   A half-open circuit whose probe didn't report back within the reset timeout can be probed again
+   Parameters: circuit name and reset timeout in seconds
+   Output: True if this caller may send the probe
+   """
+   def try_probe(self, name, reset_timeout):
+      now = time.time()
+      with self.lock:
+         circuit = self.circuits.get(name)
+         if circuit is None or circuit['circuit_state'] == CLOSED or circuit['opened_at'] > now - reset_timeout:
+            return False
+         circuit.update(circuit_state=HALF_OPEN, opened_at=now)
+         return True
+
+
+class DynamoDBRateLimitBackend:
+   """
+   Keeps buckets and circuits in a DynamoDB table with partition key 'limit_key', shared by every Lambda instance and job worker
+   Buckets and circuits are changed with conditional updates, so concurrent callers never reserve the same slot or both send a probe
+   Parameters: DynamoDB table
+   """
+   def __init__(self, table):
+      self.table = table
+
+   def update(self, key, update_expression, values, condition, return_values='NONE'):
+      try:
+         return self.table.update_item(Key={'limit_key': key}, UpdateExpression=update_expression, ExpressionAttributeValues=values,
+                                       ConditionExpression=condition, ReturnValues=return_values).get('Attributes', {})
+      except ClientError as error:
+         if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return None
+         raise
+
+   """
+   Reserves the next request slot of a bucket, unless it is further away than 'max_wait'
+   A busy bucket is advanced by one interval; an idle or new one is restarted from now
+   Parameters: bucket name, seconds between requests, seconds of burst tolerance, and maximum seconds to wait
+   Output: seconds to wait before sending the request; more than 'max_wait' if no slot was reserved
+   """
+   def reserve(self, name, interval, tolerance, max_wait):
+      key = 'bucket:' + name
+      ## 'now' is kept across attempts: if restarting the bucket failed, another caller just restarted it from an earlier or equal
+      ## 'now', so advancing it succeeds next unless the bucket is further ahead than we may wait
+      now = time.time()
+      for attempt in range(MAX_RESERVE_ATTEMPTS):
+         attributes = self.update(key, "set tat = tat + :interval", {':interval': to_decimal(interval)},
+                                  Attr('tat').gte(to_decimal(now)) & Attr('tat').lte(to_decimal(now + tolerance + max_wait)), 'UPDATED_NEW')
+         if attributes is not None:
+            return max(0.0, float(attributes['tat']) - interval - tolerance - now)
+         if self.update(key, "set tat = :tat", {':tat': to_decimal(now + interval)},
+                        Attr('tat').not_exists() | Attr('tat').lt(to_decimal(now))) is not None:
+            return 0.0
+      ## Bucket is further ahead than we may wait, e.g. after the service asked for a pause
+      item = self.table.get_item(Key={'limit_key': key}, ConsistentRead=True).get('Item', {})
+      return max(float(item.get('tat', 0)) - tolerance - now, max_wait + interval)
+
+   def pause(self, name, tat):
+      self.update('bucket:' + name, "set tat = :tat", {':tat': to_decimal(tat)}, Attr('tat').not_exists() | Attr('tat').lt(to_decimal(tat)))
+
+   def get_circuit(self, name):
+      item = self.table.get_item(Key={'limit_key': 'circuit:' + name}).get('Item', {})
+      return {'circuit_state': item.get('circuit_state', CLOSED), 'failure_count': int(item.get('failure_count', 0)),
+              'opened_at': float(item.get('opened_at', 0))}
+
+   def record_failure(self, name, failure_threshold):
+      key = 'circuit:' + name
+      now = to_decimal(time.time())
+      circuit = self.table.update_item(Key={'limit_key': key}, UpdateExpression="add failure_count :one",
+                                       ExpressionAttributeValues={':one': 1}, ReturnValues='ALL_NEW')['Attributes']
+      state = circuit.get('circuit_state', CLOSED)
+      if state == HALF_OPEN or (state == CLOSED and circuit['failure_count'] >= failure_threshold):
+         if self.update(key, "set circuit_state = :open, opened_at = :now", {':open': OPEN, ':now': now},
+                        Attr('circuit_state').not_exists() | Attr('circuit_state').eq(state)) is not None:
+            circuit.update(circuit_state=OPEN, opened_at=now)
+      return {'circuit_state': circuit.get('circuit_state', CLOSED), 'failure_count': int(circuit['failure_count']),
+              'opened_at': float(circuit.get('opened_at', 0))}
+
+   def record_success(self, name):
+      self.table.update_item(Key={'limit_key': 'circuit:' + name}, UpdateExpression="set circuit_state = :closed, failure_count = :zero",
+                             ExpressionAttributeValues={':closed': CLOSED, ':zero': 0})
+
+   def try_probe(self, name, reset_timeout):
+      now = time.time()
+      return self.update('circuit:' + name, "set circuit_state = :half_open, opened_at = :now",
+                         {':half_open': HALF_OPEN, ':now': to_decimal(now)},
+                         Attr('circuit_state').is_in([OPEN, HALF_OPEN]) & Attr('opened_at').lte(to_decimal(now - reset_timeout))) is not None
+
+
+"""
+Converts seconds to a Decimal, which is how boto3 stores DynamoDB numbers
+Parameters: seconds
+Output: Decimal rounded to milliseconds
+"""
+def to_decimal(seconds):
+   return Decimal(str(round(seconds, 3)))
+
+
+class TokenBucket:
+   """
+   Token bucket allowing 'rate' requests per second with bursts of up to 'burst' requests
+   Parameters: service name, rate limit backend, requests per second, burst size, and maximum seconds a request waits for a token
+   """
+   def __init__(self, name, backend, rate, burst, max_wait):
+      self.name = name
+      self.backend = backend
+      self.interval = 1.0 / rate
+      self.tolerance = max(0, burst - 1) * self.interval
+      self.max_wait = max_wait
+
+   """
+   Waits for a token, or raises ServiceUnavailableError if none is available within the maximum wait
+   Parameters: None
+   Output: seconds waited
+   """
+   def acquire(self):
+      wait = self.reserve()
+      if wait > 0:
+         time.sleep(wait)
+      return wait
+
+   """
+   Reserves a token without waiting for it, for callers that wait on their own, e.g. with asyncio.sleep()
+   Parameters: None
+   Output: seconds to wait before the token may be used (raises ServiceUnavailableError if that is longer than the maximum wait)
+   """
+   def reserve(self):
+      wait = self.backend.reserve(self.name, self.interval, self.tolerance, self.max_wait)
+      if wait > self.max_wait:
+         raise ServiceUnavailableError(self.name, wait)
+      return wait
+
+   """
+   Stops handing out tokens until given time, after the service asked us to slow down
+   Parameters: time.time() of the next allowed request
+   Output: None
+   """
+   def pause(self, until):
+      self.backend.pause(self.name, until + self.tolerance)
+
+
+class CircuitBreaker:
+   """
+   Circuit breaker shared through the rate limit backend, whose state is read at most once per 'cache_ttl' seconds
+   Parameters: service name, rate limit backend, consecutive failures that open the circuit, seconds before an open circuit is probed,
+   and seconds circuit state is cached
+   """
+   def __init__(self, name, backend, failure_threshold, reset_timeout, cache_ttl=DEFAULT_CIRCUIT_CACHE_TTL):
+      self.name = name
+      self.backend = backend
+      self.failure_threshold = failure_threshold
+      self.reset_timeout = reset_timeout
+      self.cache_ttl = cache_ttl
+      self.circuit = None
+      self.fetched_at = 0.0
+      self.lock = threading.Lock()
+
+   def get_circuit(self):
+      with self.lock:
+         if self.circuit is None or time.monotonic() - self.fetched_at >= self.cache_ttl:
+            self.circuit = self.backend.get_circuit(self.name)
+            self.fetched_at = time.monotonic()
+         return self.circuit
+
+   def set_circuit(self, circuit):
+      with self.lock:
+         self.circuit = circuit
+         self.fetched_at = time.monotonic()
+
+   """
+   Lets a request through if the circuit is closed, or if it is the probe of a circuit whose reset timeout has passed
+   Parameters: None
+   Output: None (raises CircuitOpenError if the request should not be sent)
+   """
+   def before_request(self):
+      circuit = self.get_circuit()
+      if circuit['circuit_state'] == CLOSED:
+         return
+      retry_after = circuit['opened_at'] + self.reset_timeout - time.time()
+      if retry_after <= 0 and self.backend.try_probe(self.name, self.reset_timeout):
+         logger.info("Sending probe request to service with open circuit", extra={'service': self.name})
+         self.set_circuit({'circuit_state': HALF_OPEN, 'failure_count': circuit['failure_count'], 'opened_at': time.time()})
+         return
+      raise CircuitOpenError(self.name, max(retry_after, self.cache_ttl))
+
+   def record_success(self):
+      circuit = self.get_circuit()
+      if circuit['circuit_state'] != CLOSED or circuit['failure_count'] > 0:
+         if circuit['circuit_state'] != CLOSED:
+            logger.info("Closing circuit after successful request", extra={'service': self.name})
+         self.backend.record_success(self.name)
+         self.set_circuit({'circuit_state': CLOSED, 'failure_count': 0, 'opened_at': 0.0})
+
+   def record_failure(self):
+      circuit = self.backend.record_failure(self.name, self.failure_threshold)
+      with self.lock:
+         previous_state = self.circuit['circuit_state'] if self.circuit is not None else CLOSED
+      if circuit['circuit_state'] == OPEN and previous_state != OPEN:
+         logger.warning("Opening circuit after consecutive failures",
+                        extra={'service': self.name, 'failure_count': circuit['failure_count'], 'reset_timeout': self.reset_timeout})
+      self.set_circuit(circuit)
+
+
+class ServiceGuard:
+   """
+   Rate limiter and circuit breaker of one service, called around every attempt of every request to it
+   Parameters: service name, rate limit backend, requests per second, burst size, consecutive failures that open the circuit,
+   seconds before an open circuit is probed, and maximum seconds a request waits for a token
+   """
+   def __init__(self, name, backend, rate, burst, failure_threshold, reset_timeout, max_wait):
+      self.name = name
+      self.bucket = TokenBucket(name, backend, rate, burst, max_wait)
+      self.breaker = CircuitBreaker(name, backend, failure_threshold, reset_timeout,
+                                    0.0 if isinstance(backend, LocalRateLimitBackend) else DEFAULT_CIRCUIT_CACHE_TTL)
+
+   """
+   Waits until a request may be sent
+   Parameters: None
+   Output: None (raises ServiceUnavailableError if the request should be deferred)
+   """
+   def before_request(self):
+      self.breaker.before_request()
+      self.bucket.acquire()
+
+   """
+   Checks the circuit and reserves a token like before_request(), but returns the wait instead of sleeping
+   Parameters: None
+   Output: seconds to wait before sending the request (raises ServiceUnavailableError if the request should be deferred)
+   """
+   def reserve(self):
+      self.breaker.before_request()
+      return self.bucket.reserve()
+
+   """
+   Records the outcome of a request: 5xx responses count towards opening the circuit, and throttling headers pause the bucket
+   A 429 shows the service is up, so it only pauses the bucket
+   Parameters: response status code and headers
+   Output: None
+   """
+   def record_response(self, status_code, headers):
+      pause_until = pause_until_from_headers(status_code, headers)
+      if pause_until is not None:
+         logger.warning("Service asked for requests to be paused", extra={'service': self.name, 'status_code': status_code,
+                                                                          'pause': round(pause_until - time.time(), 1)})
+         self.bucket.pause(pause_until)
+      if status_code >= 500:
+         self.breaker.record_failure()
+      else:
+         self.breaker.record_success()
+
+   """
+   Records a connection error or timeout, which counts towards opening the circuit
+   Parameters: None
+   Output: None
+   """
+   def record_error(self):
+      self.breaker.record_failure()
+
+
+## Backend and guards are kept at module level so every client in a process shares them
+rate_limit_backend = None
+service_guards = {}
+service_guards_lock = threading.Lock()
+
+
+"""
+Creates rate limit backend selected by settings.rateLimitBackend ('dynamodb' or 'local')
+Parameters: None
+Output: rate limit backend, or None if rate limiting is turned off
+"""
+def create_rate_limit_backend():
+   if settings.rateLimitBackend == 'dynamodb':
+      return DynamoDBRateLimitBackend(get_dynamodb_table(settings.rateLimitTable))
+   if settings.rateLimitBackend == 'local':
+      return LocalRateLimitBackend()
+   if settings.rateLimitBackend:
+      raise ValueError('Unknown rate limit backend: ' + settings.rateLimitBackend)
+   return None
+
+
+"""
+Returns guard for given service ('checkr' or 'salesforce'), creating it on first use
+Every registered org (orgRegistry.py) has its own guards, named after the service and Organization ID, so one org's throttling
+or outage doesn't hold back requests of the others
+Parameters: service name, and registered org (None for the org configured by settings.py)
+Output: service guard, or None if rate limiting is turned off
+"""
+def get_service_guard(service_name, org=None):
+   global rate_limit_backend
+   guard_name = service_name if org is None else service_name + ':' + org.organizationID
+   with service_guards_lock:
+      if guard_name not in service_guards:
+         if rate_limit_backend is None:
+            rate_limit_backend = create_rate_limit_backend()
+         if rate_limit_backend is None:
+            return None
+         limits = settings if org is None else org
+         rate, burst = {'checkr': (limits.checkrRateLimit, limits.checkrBurst),
+                        'salesforce': (limits.salesforceRateLimit, limits.salesforceBurst)}[service_name]
+         service_guards[guard_name] = ServiceGuard(guard_name, rate_limit_backend, rate, burst, settings.circuitFailureThreshold,
+                                                   settings.circuitResetTimeout, settings.rateLimitMaxWait)
+      return service_guards[guard_name]
@@ -0,0 +1,112 @@
+"""
+Recomputes the status counters served by '/status' (statusCounters.py) from the background check table
+Scans the table once with parallel segments, counts items by status, counts candidates created, reports created and reports completed per day
+from the times stored on items, lists outstanding reports, and replaces the stored counters with the result
+Run once after deploying the counters, and whenever they may have drifted: after an 'Error updating status counters' log line or a
+'status_counters_lost' metric, or when a process was stopped between a transition and its counter update;
+transitions made while the scan runs may be missed, so run it when few background checks are in progress, or run it again
+Run from a host: PYTHON_ENV=qa python rebuildStatusCounters.py [--org <Organization ID>]
+"""
+import argparse
+import collections
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from settings import settings
+from backgroundCheckTable import get_background_check_table, scan_items
+from statusCounters import CHECKR_STATUSES, TOTALS_KEY, day_key, outstanding_key, get_status_scope, get_status_store
+from orgRegistry import get_org, org_context
+from structuredLogging import flush_logs
+
+STATUS_ATTRIBUTES = ['salesforce_lead_ID', 'checkr_report_ID', 'checkr_status', 'candidate_created_at', 'report_created_at', 'report_completed_at']
+
+
+"""
+Adds the counters of one page of items to counters being computed
+Items created before transition times were stored are only counted by status, since the day of their transitions isn't known
+Parameters: dictionary mapping sort key to counters, list of outstanding reports, and items
+Output: None
+"""
+def count_items(counters, outstanding, items):
+   totals = counters[TOTALS_KEY]
+   for item in items:
+      checkr_status = item.get('checkr_status')
+      if checkr_status not in CHECKR_STATUSES:
+         continue
+      totals[checkr_status] += 1
+      if item.get('candidate_created_at') is not None:
+         counters[day_key(int(item['candidate_created_at']))]['candidates_created'] += 1
+      report_created_at = int(item['report_created_at']) if item.get('report_created_at') is not None else None
+      if report_created_at is not None:
+         counters[day_key(report_created_at)]['reports_created'] += 1
+      if checkr_status == "report completed" and item.get('report_completed_at') is not None:
+         report_completed_at = int(item['report_completed_at'])
+         day_counters = counters[day_key(report_completed_at)]
+         day_counters['reports_completed'] += 1
+         if report_created_at is not None:
+            turnaround = max(0, report_completed_at - report_created_at)
+            for target in [day_counters, totals]:
+               target['turnaround_seconds'] += turnaround
+               target['turnaround_count'] += 1
+      if checkr_status == "report created" and item.get('checkr_report_ID'):
+         outstanding.append({'sort_key': outstanding_key(item['salesforce_lead_ID'], report_created_at), 'salesforce_lead_ID': item['salesforce_lead_ID'],
+                             'checkr_report_ID': item['checkr_report_ID'], 'report_created_at': report_created_at})
+
+
+"""
+Recomputes counters of the current scope (this environment or the registered org being handled) and stores them in place of the current ones
+Parameters: number of table segments scanned in parallel
+Output: dictionary mapping sort key to the counters stored
+"""
+def rebuild_status_counters(segments):
+   store = get_status_store()
+   if store is None:
+      raise ValueError('No status backend is configured (STATUS_BACKEND)')
+   background_check_table = get_background_check_table()
+   segment_results = []
+
+   def scan_segment(segment):
+      counters = collections.defaultdict(collections.Counter)
+      outstanding = []
+      for items in scan_items(background_check_table, STATUS_ATTRIBUTES, segment, segments):
+         count_items(counters, outstanding, items)
+      segment_results.append((counters, outstanding))
+
+   with ThreadPoolExecutor(max_workers=segments) as executor:
+      list(executor.map(scan_segment, range(segments)))
+   counters = collections.defaultdict(collections.Counter)
+   outstanding = []
+   for segment_counters, segment_outstanding in segment_results:
+      for sort_key, values in segment_counters.items():
+         counters[sort_key].update(values)
+      outstanding.extend(segment_outstanding)
+   ## Counters of every status are stored, so a status without items reads as zero rather than keeping an old count
+   counters = {sort_key: dict(values) for sort_key, values in counters.items()}
+   counters[TOTALS_KEY] = dict({checkr_status: 0 for checkr_status in CHECKR_STATUSES}, **counters.get(TOTALS_KEY, {}))
+   store.replace(get_status_scope(), counters, outstanding)
+   return counters
+
+
+def main():
+   parser = argparse.ArgumentParser(description='Recompute the status counters from the background check table')
+   parser.add_argument('--org', help='Organization ID of a registered org to rebuild instead of this environment')
+   parser.add_argument('--segments', type=int, default=settings.reconcileSegments, help='table segments scanned in parallel')
+   arguments = parser.parse_args()
+   org = None
+   if arguments.org and arguments.org != settings.salesforceOrgID:
+      org = get_org(arguments.org)
+      if org is None:
+         parser.error('org ' + arguments.org + ' is not registered')
+   try:
+      with org_context(org):
+         start = time.perf_counter()
+         counters = rebuild_status_counters(arguments.segments)
+         totals = counters[TOTALS_KEY]
+         print("Rebuilt status counters of %s in %.1f s: %s" % (get_status_scope(), time.perf_counter() - start,
+                                                              ', '.join('%d %s' % (totals[checkr_status], checkr_status) for checkr_status in CHECKR_STATUSES)))
+   finally:
+      flush_logs()
+
+
+if __name__ == '__main__':
+   sys.exit(main())
@@ -0,0 +1,333 @@
+"""
+Reconciles background checks whose 'report.completed' webhook was missed or failed
+Finds every item still at 'report created' with a parallel segmented scan, retrieves its Checkr report with bounded concurrency
+at no more than 'reconcileRate' requests per second, and processes completed reports with process_report() like the webhook would
+Progress is checkpointed after every scanned page, or at the last reconciled item of a page the deadline interrupted,
+so an interrupted run resumes where it stopped; the scheduled Lambda keeps its checkpoint in S3
+The org configured by settings.py and every registered org are reconciled in turn, each with its own table and checkpoint
+Run from a host: PYTHON_ENV=qa python reconcileReports.py [--org <Organization ID>] [--restart], or schedule lambda_handler() with an EventBridge rule
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from settings import settings
+from awsResources import get_aws_client
+from backgroundCheckTable import scan_items_by_status
+from backgroundCheck import get_background_check_table, retrieve_completed_report, process_report
+from checkrClient import RETRY_STATUS_CODES
+from rateLimiting import ServiceUnavailableError
+from salesforceWriter import flush_background_check_writers
+from orgRegistry import get_org, get_org_registry, get_org_path, get_current_org, get_org_settings, org_context, run_in_org
+from statusCounters import get_status_scope
+from tracing import get_tracer
+from structuredLogging import get_logger, flush_logs
+
+## Checkr report statuses of reports which aren't finished yet
+PENDING_STATUSES = ['pending', 'suspended']
+## Seconds before the Lambda timeout after which no new report is started, leaving time to finish those in progress
+LAMBDA_TIME_MARGIN = 60
+## Items read per scan page, so progress is checkpointed every few seconds rather than once per 1 MB page
+SCAN_PAGE_SIZE = 500
+
+logger = get_logger('reconcileReports')
+
+
+class RequestPacer:
+   """
+   Spaces out requests from all threads so no more than 'rate' are started per second
+   Parameters: maximum requests per second
+   """
+   def __init__(self, rate):
+      self.interval = 1.0 / rate
+      self.next_time = time.monotonic()
+      self.lock = threading.Lock()
+
+   def wait(self):
+      with self.lock:
+         now = time.monotonic()
+         start_time = max(now, self.next_time)
+         self.next_time = start_time + self.interval
+      if start_time > now:
+         time.sleep(start_time - now)
+
+
+class ReconcileCheckpoint:
+   """
+   Progress of a reconciliation run: where each scan segment should resume and how many items had each outcome
+   Saved to a JSON file after every page if a path is given; a checkpoint for a different number of segments is discarded
+   Parameters: checkpoint file path (or None to keep it in memory only), total number of segments, and checkpoint data to resume from, if any
+   """
+   def __init__(self, path, total_segments, data=None):
+      self.path = path
+      self.lock = threading.Lock()
+      if data is None:
+         data = self.load()
+      if data is None or data.get('total_segments') != total_segments:
+         data = {'total_segments': total_segments, 'segments': {}, 'counts': {}}
+      self.data = data
+
+   def start_key(self, segment):
+      return self.data['segments'].get(str(segment), {}).get('start_key')
+
+   def is_done(self, segment):
+      return self.data['segments'].get(str(segment), {}).get('done', False)
+
+   def is_complete(self):
+      return all(self.is_done(segment) for segment in range(self.data['total_segments']))
+
+   """
+   Records that a page of a segment, or its first items, has been reconciled, and saves the checkpoint
+   Parameters: segment number, key to resume the segment after (None to start it over, or if it was the last page), outcome counts,
+   and whether the segment is finished (by default, if there is no key to resume after)
+   Output: None
+   """
+   def record_page(self, segment, start_key, counts, done=None):
+      with self.lock:
+         self.data['segments'][str(segment)] = {'start_key': start_key, 'done': start_key is None if done is None else done}
+         for outcome, count in counts.items():
+            self.data['counts'][outcome] = self.data['counts'].get(outcome, 0) + count
+         self.save()
+
+   def load(self):
+      if self.path is None or not os.path.exists(self.path):
+         return None
+      with open(self.path) as checkpoint_file:
+         return json.load(checkpoint_file)
+
+   def save(self):
+      if self.path is None:
+         return
+      temporary_path = self.path + '.tmp'
+      with open(temporary_path, 'w') as checkpoint_file:
+         json.dump(self.data, checkpoint_file)
+      os.replace(temporary_path, self.path)
+
+   def clear(self):
+      if self.path is not None and os.path.exists(self.path):
+         os.remove(self.path)
+
+
+class S3ReconcileCheckpoint(ReconcileCheckpoint):
+   """
+   Checkpoint saved as a JSON object in S3, so a scheduled Lambda invocation resumes where the previous one stopped
+   Parameters: S3 bucket, object key and total number of segments
+   """
+   def __init__(self, bucket, key, total_segments):
+      self.bucket = bucket
+      super().__init__(key, total_segments)
+
+   def load(self):
+      try:
+         response = get_aws_client('s3').get_object(Bucket=self.bucket, Key=self.path)
+      except ClientError as error:
+         if error.response['Error']['Code'] in ['NoSuchKey', '404']:
+            return None
+         raise
+      return json.loads(response['Body'].read())
+
+   def save(self):
+      get_aws_client('s3').put_object(Bucket=self.bucket, Key=self.path, Body=json.dumps(self.data).encode(), ContentType='application/json')
+
+   def clear(self):
+      get_aws_client('s3').delete_object(Bucket=self.bucket, Key=self.path)
+
+
+class Reconciler:
+   """
+   Reconciles items stuck at 'report created' by scanning table segments in parallel and retrieving their Checkr reports concurrently
+   Parameters: DynamoDB table, checkpoint, number of scan segments, number of concurrent Checkr requests, and maximum Checkr requests per second
+   """
+   def __init__(self, background_check_table, checkpoint, segments, workers, rate):
+      self.background_check_table = background_check_table
+      self.checkpoint = checkpoint
+      self.segments = segments
+      self.workers = workers
+      self.pacer = RequestPacer(rate)
+      ## Reports are processed in worker threads, which don't inherit the org being reconciled
+      self.org = get_current_org()
+
+   """
+   Reconciles every segment that hasn't been finished yet
+   Parameters: time.time() after which no new report is started, if any
+   Output: True if every segment was finished, False if the deadline stopped the run
+   """
+   def run(self, deadline=None):
+      pending_segments = [segment for segment in range(self.segments) if not self.checkpoint.is_done(segment)]
+      if pending_segments:
+         with ThreadPoolExecutor(max_workers=self.workers) as fetch_executor:
+            with ThreadPoolExecutor(max_workers=len(pending_segments)) as scan_executor:
+               list(scan_executor.map(lambda segment: self.reconcile_segment(segment, fetch_executor, deadline), pending_segments))
+      return self.checkpoint.is_complete()
+
+   """
+   Scans one segment page by page, reconciling each page's items before checkpointing it
+   If the deadline passes during a page, the segment is checkpointed at the last item reconciled before the first one that wasn't started;
+   items after it that were reconciled anyway are no longer at 'report created', so the resumed scan doesn't return them again
+   Parameters: segment number, executor for Checkr requests, and deadline
+   Output: None
+   """
+   def reconcile_segment(self, segment, fetch_executor, deadline):
+      start_key = self.checkpoint.start_key(segment)
+      pages = scan_items_by_status(self.background_check_table, "report created", segment, self.segments, start_key, page_size=SCAN_PAGE_SIZE)
+      for items, next_key in pages:
+         outcomes = list(fetch_executor.map(lambda item: self.reconcile_item(item, deadline), items))
+         counts = collections.Counter(outcome for outcome in outcomes if outcome is not None)
+         if None not in outcomes:
+            self.checkpoint.record_page(segment, next_key, counts)
+            start_key = next_key
+            continue
+         stopped = outcomes.index(None)
+         if stopped > 0:
+            start_key = {'salesforce_lead_ID': items[stopped - 1]['salesforce_lead_ID']}
+         self.checkpoint.record_page(segment, start_key, counts, done=False)
+         return
+
+   """
+   Reconciles one item, unless the deadline has passed
+   Parameters: item with Salesforce lead ID and Checkr report ID, and deadline
+   Output: outcome of reconcile_report(), or None if the item was left for the next run
+   """
+   def reconcile_item(self, item, deadline=None):
+      if deadline is not None and time.time() >= deadline:
+         return None
+      with get_tracer().trace('reconcile'):
+         return run_in_org(self.org, self.reconcile_report, item)
+
+   """
+   Retrieves Checkr report for one item and processes it if it is completed
+   Reports Checkr couldn't return because of rate limiting or server errors are left for the next run, as are reports deferred
+   because Checkr or Salesforce is throttling us or its circuit is open
+   Parameters: item with Salesforce lead ID and Checkr report ID
+   Output: 'processed', 'pending', 'deferred' or 'failed'
+   """
+   def reconcile_report(self, item):
+      checkr_report_ID = item['checkr_report_ID']
+      try:
+         self.pacer.wait()
+         retrieve_report_response = retrieve_completed_report(checkr_report_ID)
+         if retrieve_report_response.status_code in RETRY_STATUS_CODES:
+            retrieve_report_response.close()
+            logger.warning("Checkr could not return report, leaving it for next run",
+                           extra={'report_ID': checkr_report_ID, 'status_code': retrieve_report_response.status_code})
+            return 'failed'
+         if retrieve_report_response.ok and retrieve_report_response.json().get('status') in PENDING_STATUSES:
+            retrieve_report_response.close()
+            return 'pending'
+         logger.info("Reconciling completed report", extra={'lead_ID': item['salesforce_lead_ID'], 'report_ID': checkr_report_ID})
+         process_report(checkr_report_ID, retrieve_report_response, salesforce_lead_ID=item['salesforce_lead_ID'])
+         return 'processed'
+      except ServiceUnavailableError as error:
+         logger.warning("Service unavailable, leaving report for next run", extra={'report_ID': checkr_report_ID, 'error': str(error)})
+         return 'deferred'
+      except Exception as error:
+         logger.error("Error reconciling report", extra={'report_ID': checkr_report_ID, 'error': repr(error)})
+         return 'failed'
+
+
+"""
+Returns orgs to reconcile: the org configured by settings.py followed by every registered org, or only the org given
+Parameters: Organization ID, or None for every org
+Output: list of orgs, None standing for the org configured by settings.py
+"""
+def get_orgs(organization_ID=None):
+   if organization_ID is None:
+      return [None] + list(get_org_registry().values())
+   if organization_ID == settings.salesforceOrgID:
+      return [None]
+   org = get_org(organization_ID)
+   if org is None:
+      raise LookupError("Org is not registered (organization_ID: " + organization_ID + ")")
+   return [org]
+
+
+"""
+Runs reconciliation of the org being handled with the configured segments, concurrency and rate, and writes buffered 'Background Check' objects
+Parameters: checkpoint and deadline, if any
+Output: True if every segment was finished
+"""
+def reconcile(checkpoint, deadline=None):
+   reconciler = Reconciler(get_background_check_table(), checkpoint, settings.reconcileSegments, settings.reconcileWorkers, settings.reconcileRate)
+   complete = reconciler.run(deadline)
+   flush_background_check_writers()
+   logger.info("Reconciliation complete" if complete else "Reconciliation stopped before deadline",
+               extra={'scope': get_status_scope(), 'counts': checkpoint.data['counts']})
+   return complete
+
+
+"""
+Lambda handler for scheduled reconciliation of every org, or only of event['organization_ID'] if given
+Stops starting new reports shortly before the Lambda timeout; progress of each org is checkpointed to its own S3 object in the
+'reconcileCheckpointBucket' bucket, so the next scheduled invocation resumes where this one stopped, and the object is deleted once the org's run is complete
+Without a bucket, checkpoints are only returned, and a run resumes only if they are passed back as event['checkpoints']
+Parameters: Lambda event and context
+Output: dictionary with 'complete' and, for each org by scope, 'complete', outcome counts and, if not complete, the checkpoint
+"""
+def lambda_handler(event, context):
+   event = event or {}
+   if not settings.reconcileCheckpointBucket:
+      logger.warning("RECONCILE_CHECKPOINT_BUCKET is not set, so an interrupted run only resumes if its checkpoints are passed back")
+   deadline = time.time() + context.get_remaining_time_in_millis() / 1000.0 - LAMBDA_TIME_MARGIN
+   result = {'complete': True, 'orgs': {}}
+   for org in get_orgs(event.get('organization_ID')):
+      with org_context(org):
+         scope = get_status_scope()
+         ## Orgs left once the deadline has passed are reconciled by the next invocation
+         if time.time() >= deadline:
+            result['complete'] = False
+            continue
+         if settings.reconcileCheckpointBucket:
+            checkpoint_key = get_org_path(settings.reconcileCheckpointKey, org)
+            checkpoint = S3ReconcileCheckpoint(settings.reconcileCheckpointBucket, checkpoint_key, settings.reconcileSegments)
+            if checkpoint.data['segments']:
+               logger.info("Resuming reconciliation", extra={'scope': scope, 'checkpoint_bucket': settings.reconcileCheckpointBucket,
+                                                             'checkpoint_key': checkpoint_key})
+         else:
+            checkpoint = ReconcileCheckpoint(None, settings.reconcileSegments, event.get('checkpoints', {}).get(scope))
+         complete = reconcile(checkpoint, deadline)
+      org_result = {'complete': complete, 'counts': checkpoint.data['counts']}
+      if complete:
+         checkpoint.clear()
+      else:
+         org_result['checkpoint'] = checkpoint.data
+         result['complete'] = False
+      result['orgs'][scope] = org_result
+   flush_logs()
+   return result
+
+
+def main():
+   parser = argparse.ArgumentParser(description='Reconcile background checks whose report.completed webhook was missed')
+   parser.add_argument('--org', help='Organization ID of the org to reconcile instead of every org')
+   parser.add_argument('--restart', action='store_true', help='ignore the checkpoints and start over')
+   arguments = parser.parse_args()
+   try:
+      orgs = get_orgs(arguments.org)
+   except LookupError:
+      parser.error('org ' + arguments.org + ' is not registered')
+   try:
+      for org in orgs:
+         with org_context(org):
+            checkpoint_path = get_org_path(settings.reconcileCheckpointPath, org)
+            checkpoint = ReconcileCheckpoint(checkpoint_path, settings.reconcileSegments)
+            if arguments.restart:
+               checkpoint.clear()
+               checkpoint = ReconcileCheckpoint(checkpoint_path, settings.reconcileSegments)
+            elif checkpoint.data['segments']:
+               logger.info("Resuming reconciliation", extra={'scope': get_status_scope(), 'checkpoint_path': checkpoint_path})
+            logger.info("Reconciling DynamoDB table", extra={'scope': get_status_scope(), 'table': get_org_settings().backgroundCheckTable,
+                                                             'segments': settings.reconcileSegments, 'workers': settings.reconcileWorkers,
+                                                             'rate': settings.reconcileRate})
+            if reconcile(checkpoint):
+               checkpoint.clear()
+   finally:
+      flush_logs()
+
+
+if __name__ == '__main__':
+   sys.exit(main())
@@ -0,0 +1,161 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from settings import settings
+from tracing import traced
+from structuredLogging import get_logger
+from rateLimiting import get_service_guard
+from orgRegistry import get_current_org, get_org_resource
+
+## Salesforce doesn't return an expiry with username-password OAuth tokens, so tokens are refreshed after this many seconds
+## or as soon as Salesforce rejects one with a 401, whichever comes first
+DEFAULT_TOKEN_LIFETIME = 3600
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 30
+
+logger = get_logger('salesforceClient')
+
+
+class SalesforceAuthError(Exception):
+   """Raised when Salesforce rejects the Connected App OAuth login"""
+
+
+class SalesforceClient:
+   """
+   Client for the Salesforce REST API which caches the OAuth access token and instance URL between calls
+   and sends every request over one keep-alive connection pool
+   If a service guard is given, every request waits for the rate limiter and raises ServiceUnavailableError while the circuit is open
+   Parameters: OAuth token URL, Connected App client ID and secret, Salesforce username and password,
+   token lifetime in seconds, connection pool size, request timeout in seconds, and service guard (rateLimiting.py), if any
+   """
+   def __init__(self, oauth_url, client_id, client_secret, username, password,
+                token_lifetime=DEFAULT_TOKEN_LIFETIME, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, guard=None):
+      self.oauth_url = oauth_url
+      self.client_id = client_id
+      self.client_secret = client_secret
+      self.username = username
+      self.password = password
+      self.token_lifetime = token_lifetime
+      self.timeout = timeout
+      self.guard = guard
+      self.session = requests.Session()
+      adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+      self.session.mount('https://', adapter)
+      self.session.mount('http://', adapter)
+      self.access_token = None
+      self.instance_url = None
+      self.token_expires_at = 0.0
+      self.token_lock = threading.Lock()
+
+   """
+   Returns cached access token and instance URL, logging in again if there is no token, it has expired, or a refresh is forced
+   Parameters: access token rejected by Salesforce, if any, which forces a refresh unless another thread already replaced it
+   Output: access token and instance URL
+   """
+   def get_token(self, rejected_token=None):
+      with self.token_lock:
+         token_valid = self.access_token is not None and time.monotonic() < self.token_expires_at
+         if token_valid and (rejected_token is None or rejected_token != self.access_token):
+            return self.access_token, self.instance_url
+         self.login()
+         return self.access_token, self.instance_url
+
+   """
+   Obtains access token and instance URL using Connected App and OAuth 2.0 username-password flow
+   Parameters: None
+   Output: None
+   """
+   @traced('salesforce_oauth_login')
+   def login(self):
+      logger.info("Obtaining Salesforce access token and instance URL using Connected App and Oauth authorization flow")
+      params = {"grant_type": "password", "client_id": self.client_id, "client_secret": self.client_secret,
+                "username": self.username, "password": self.password}
+      sf_response = self.send('post', self.oauth_url, params=params)
+      try:
+         sf_response_json = sf_response.json()
+      except ValueError:
+         sf_response_json = {"error": "invalid_response", "error_description": sf_response.text}
+      if "error" in sf_response_json or not sf_response.ok:
+         self.access_token = None
+         raise SalesforceAuthError('Salesforce OAuth error: %s: %s' % (sf_response_json.get("error"), sf_response_json.get("error_description")))
+      self.access_token = sf_response_json.get("access_token")
+      self.instance_url = sf_response_json.get("instance_url")
+      self.token_expires_at = time.monotonic() + self.token_lifetime
+
+   """
+   Makes call to Salesforce REST API, retrying once with a new access token if the cached one has been revoked or has expired
+   Parameters: action (the Salesforce URL), Salesforce URL params, method (get, post or patch), data for POST/PATCH
+   Output: JSON response, or None for PATCH
+   """
+   @traced('salesforce_api_call')
+   def call(self, action, parameters={}, method='get', data={}):
+      if method not in ['get', 'post', 'patch']:
+         raise ValueError('Method should be post or patch')
+      access_token, instance_url = self.get_token()
+      r = self.request(method, instance_url + action, access_token, parameters, data)
+      if r.status_code == 401:
+         logger.warning("Salesforce access token rejected, obtaining new access token")
+         access_token, instance_url = self.get_token(rejected_token=access_token)
+         r = self.request(method, instance_url + action, access_token, parameters, data)
+      if r.status_code < 300:
+         if method == 'patch':
+            return None
+         else:
+            return r.json()
+      else:
+         raise Exception('API Error when calling %s: %s' % (r.url, r.content))
+
+   def request(self, method, url, access_token, parameters, data):
+      headers = {'Content-type': 'application/json', 'Accept-Encoding': 'gzip', 'Authorization': 'Bearer %s' % access_token}
+      if method == 'get':
+         return self.send(method, url, headers=headers, params=parameters)
+      return self.send(method, url, headers=headers, json=data, params=parameters)
+
+   """
+   Sends one HTTP request to Salesforce, through the service guard if there is one
+   Parameters: method, URL, and keyword arguments of requests.Session.request()
+   Output: response (raises ServiceUnavailableError, without sending the request, if the guard defers it)
+   """
+   def send(self, method, url, **kwargs):
+      if self.guard is None:
+         return self.session.request(method, url, timeout=self.timeout, **kwargs)
+      self.guard.before_request()
+      try:
+         response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+      except (requests.ConnectionError, requests.Timeout):
+         self.guard.record_error()
+         raise
+      self.guard.record_response(response.status_code, response.headers)
+      return response
+
+   def close(self):
+      self.session.close()
+
+
+## Client is kept at module level so warm Lambda invocations reuse its access token and connections
+salesforce_client = None
+salesforce_client_lock = threading.Lock()
+
+
+"""
+Returns Salesforce client for current environment, creating it on first use or again after its secrets have been rotated
+A registered org being handled (orgRegistry.py) gets its own client, with its own OAuth token, connection pool and guard
+Parameters: None
+Output: Salesforce client
+"""
+def get_salesforce_client():
+   global salesforce_client
+   org = get_current_org()
+   if org is not None:
+      password, client_secret = org.salesforcePassword, org.salesforceClientSecret
+      return get_org_resource(org, 'salesforce_client',
+                              lambda: SalesforceClient(org.salesforceOAuthURL, org.salesforceClientID, client_secret, org.salesforceUsername,
+                                                       password, guard=get_service_guard('salesforce', org)),
+                              valid=lambda client: client.password == password and client.client_secret == client_secret)
+   with salesforce_client_lock:
+      if (salesforce_client is None or salesforce_client.password != settings.salesforcePassword
+          or salesforce_client.client_secret != settings.salesforceClientSecret):
+         salesforce_client = SalesforceClient(settings.salesforceOAuthURL, settings.salesforceClientID, settings.salesforceClientSecret,
+                                              settings.salesforceUsername, settings.salesforcePassword, guard=get_service_guard('salesforce'))
+      return salesforce_client
@@ -0,0 +1,203 @@
+"""
+Stores screening record sets of 'Background Check' objects (SSN trace addresses and aliases, and records of the three searches)
+that are too long for their long text area field in a Salesforce File (ContentVersion) linked to the object
+Record sets are serialized as compact JSON; long ones are compressed with gzip as they are encoded, so their whole JSON is never held in memory,
+and their field holds a truncated summary naming the file
+The file is uploaded once the object is created, before the report is considered processed; a file that can't be uploaded
+doesn't leave its summaries naming it (see upload_records_file())
+"""
+import base64
+import gzip
+import io
+import json
+import time
+from settings import settings
+from salesforceClient import get_salesforce_client
+from rateLimiting import ServiceUnavailableError
+from tracing import traced
+from structuredLogging import get_logger
+
+CONTENT_VERSION_ACTION = "/services/data/v49.0/sobjects/ContentVersion"
+BC_OBJECT_ACTION = "/services/data/v49.0/sobjects/Background_Check__c/"
+RECORDS_FILE_TITLE = 'Screening_Records'
+## Encoded records are joined into blocks of this many characters before being compressed, at zlib's default level,
+## which is about twice as fast as gzip's level 9 for record sets and compresses them almost as much
+COMPRESS_BLOCK_SIZE = 64 * 1024
+COMPRESS_LEVEL = 6
+## Uploads that fail are tried this many times, waiting FILE_UPLOAD_BACKOFF seconds then twice as long after each failure;
+## retries and uploads deferred by the Salesforce guard wait at most FILE_UPLOAD_MAX_WAIT seconds in all
+FILE_UPLOAD_ATTEMPTS = 3
+FILE_UPLOAD_BACKOFF = 1.0
+FILE_UPLOAD_MAX_WAIT = 10.0
+## Replaces the summary of a record set whose file couldn't be uploaded
+UPLOAD_FAILED_SUMMARY = '%d records; upload of Salesforce File %s failed, see Checkr report %s'
+
+logger = get_logger('salesforceFiles')
+
+
+class RecordsFile:
+   """
+   Gzip-compressed JSON object mapping field names to the record sets too long for their field, written as record sets are encoded,
+   to be stored as one Salesforce File once its 'Background Check' object has been created
+   Parameters: None
+   """
+   def __init__(self):
+      self.buffer = io.BytesIO()
+      self.stream = gzip.GzipFile(fileobj=self.buffer, mode='wb', compresslevel=COMPRESS_LEVEL, mtime=0)
+      self.record_counts = {}
+      self.data = None
+
+   @property
+   def file_name(self):
+      return RECORDS_FILE_TITLE + '.json.gz'
+
+   """
+   Writes record set of a field to the file
+   Parameters: field name, number of records, list of JSON strings already encoded, and generator of the rest of the JSON strings
+   Output: None
+   """
+   def write(self, field_name, record_count, head, chunks):
+      block = ['{' if not self.record_counts else ',', json.dumps(field_name), ':'] + head
+      block_length = sum(len(chunk) for chunk in block)
+      for chunk in chunks:
+         block.append(chunk)
+         block_length += len(chunk)
+         if block_length >= COMPRESS_BLOCK_SIZE:
+            self.stream.write(''.join(block).encode('utf-8'))
+            block = []
+            block_length = 0
+      self.stream.write(''.join(block).encode('utf-8'))
+      self.record_counts[field_name] = record_count
+
+   """
+   Ends JSON object and gzip stream
+   Parameters: None
+   Output: None
+   """
+   def close(self):
+      self.stream.write(b'}')
+      self.stream.close()
+      self.data = self.buffer.getvalue()
+
+
+"""
+Encodes record set as compact JSON one record at a time
+Parameters: record set (list of Checkr records)
+Output: generator of JSON strings
+"""
+def iterate_json(records):
+   yield '['
+   for index, record in enumerate(records):
+      if index:
+         yield ','
+      yield json.dumps(record, separators=(',', ':'), ensure_ascii=False)
+   yield ']'
+
+
+"""
+Returns values of the record set fields of a 'Background Check' object payload, and the file to store the record sets that don't fit in
+Encoding of a record set stops being buffered once it is longer than the field limit: the rest of its JSON is written to the file as it is encoded
+Parameters: list of (field name, record set) tuples
+Output: dictionary mapping field name to value (JSON, or a truncated summary naming the file) and RecordsFile, or None if every record set fits
+"""
+def prepare_records_fields(record_sets):
+   fields = {}
+   records_file = None
+   for field_name, records in record_sets:
+      chunks = iterate_json(records)
+      head = []
+      length = 0
+      for chunk in chunks:
+         head.append(chunk)
+         length += len(chunk)
+         if length > settings.screeningFieldLimit:
+            break
+      else:
+         fields[field_name] = ''.join(head)
+         continue
+      if records_file is None:
+         records_file = RecordsFile()
+      summary = '%d records, see %s in Salesforce File %s. First records: ' % (len(records), field_name, records_file.file_name)
+      fields[field_name] = summary + ''.join(head)[:max(0, settings.screeningSummaryLength - len(summary) - 3)] + '...'
+      records_file.write(field_name, len(records), head, chunks)
+   if records_file is not None:
+      records_file.close()
+   return fields, records_file
+
+
+"""
+Creates Salesforce File with the record sets of a 'Background Check' object and links it to the object
+Parameters: RecordsFile and ID of the 'Background Check' object
+Output: ContentVersion ID
+"""
+@traced('salesforce_file_upload')
+def create_content_version(records_file, record_ID):
+   content_version = {'Title': RECORDS_FILE_TITLE, 'PathOnClient': records_file.file_name, 'FirstPublishLocationId': record_ID,
+                      'VersionData': base64.b64encode(records_file.data).decode('ascii')}
+   return get_salesforce_client().call(CONTENT_VERSION_ACTION, method='post', data=content_version)['id']
+
+
+"""
+Replaces the summaries of a 'Background Check' object naming a file that couldn't be uploaded, so its fields don't point to a missing file
+Parameters: RecordsFile, ID of the 'Background Check' object, and Checkr report ID
+Output: None
+"""
+@traced('salesforce_file_upload_failed')
+def mark_records_file_failed(records_file, record_ID, checkr_report_ID):
+   fields = {field_name: UPLOAD_FAILED_SUMMARY % (record_count, records_file.file_name, checkr_report_ID)
+             for field_name, record_count in records_file.record_counts.items()}
+   get_salesforce_client().call(BC_OBJECT_ACTION + record_ID, method='patch', data=fields)
+
+
+"""
+Sends file of a 'Background Check' object to Salesforce, retrying failed uploads with backoff
+An upload deferred by the Salesforce guard isn't sent, so it doesn't use up an attempt: it is sent again once Salesforce should be available,
+as long as that is within 'FILE_UPLOAD_MAX_WAIT' seconds
+Parameters: RecordsFile, ID of the 'Background Check' object, and Salesforce lead ID
+Output: ContentVersion ID (raises the last error if the file couldn't be uploaded)
+"""
+def send_records_file(records_file, record_ID, salesforce_lead_ID):
+   deadline = time.monotonic() + FILE_UPLOAD_MAX_WAIT
+   attempt = 0
+   while True:
+      try:
+         return create_content_version(records_file, record_ID)
+      except ServiceUnavailableError as error:
+         last_error, delay = error, error.retry_after
+      except Exception as error:
+         attempt += 1
+         if attempt >= FILE_UPLOAD_ATTEMPTS:
+            raise
+         last_error, delay = error, FILE_UPLOAD_BACKOFF * 2 ** (attempt - 1)
+      if time.monotonic() + delay > deadline:
+         raise last_error
+      logger.warning("Error uploading screening records file, retrying", extra={'lead_ID': salesforce_lead_ID, 'attempt': attempt,
+                                                                                'delay': round(delay, 1), 'error': repr(last_error)})
+      time.sleep(delay)
+
+
+"""
+Uploads file of a 'Background Check' object once the object has been created, before the report is considered processed
+If the file can't be uploaded, the summaries naming it are replaced with a marker pointing to the Checkr report; if that fails too,
+the upload error is raised, so process_report() releases the report's claim and the redelivered webhook writes the report again
+Parameters: RecordsFile (or None), ID of the 'Background Check' object, Salesforce lead ID and Checkr report ID
+Output: None
+"""
+def upload_records_file(records_file, record_ID, salesforce_lead_ID, checkr_report_ID):
+   if records_file is None:
+      return
+   try:
+      content_version_ID = send_records_file(records_file, record_ID, salesforce_lead_ID)
+   except Exception as error:
+      logger.error("Error uploading screening records file, marking its fields", extra={'lead_ID': salesforce_lead_ID, 'report_ID': checkr_report_ID,
+                                                                                        'record_ID': record_ID, 'record_counts': records_file.record_counts,
+                                                                                        'error': repr(error)})
+      try:
+         mark_records_file_failed(records_file, record_ID, checkr_report_ID)
+      except Exception as mark_error:
+         logger.error("Error marking fields of screening records file that couldn't be uploaded, releasing report",
+                      extra={'lead_ID': salesforce_lead_ID, 'report_ID': checkr_report_ID, 'record_ID': record_ID, 'error': repr(mark_error)})
+         raise error
+      return
+   logger.info("Uploaded screening records file", extra={'lead_ID': salesforce_lead_ID, 'record_counts': records_file.record_counts,
+                                                         'bytes': len(records_file.data), 'content_version_ID': content_version_ID})
@@ -0,0 +1,194 @@
+import atexit
+import functools
+import threading
+import time
+from concurrent.futures import Future
+from settings import settings
+from salesforceClient import get_salesforce_client
+from tracing import traced
+from structuredLogging import get_logger
+from rateLimiting import ServiceUnavailableError
+from orgRegistry import get_current_org, get_org_resource, get_org_resources, run_in_org
+
+## sObject Collections API accepts at most 200 records per request
+MAX_BATCH_SIZE = 200
+## Times a batch is sent again after the whole Collections request failed, before its records are failed
+MAX_FLUSH_ATTEMPTS = 3
+COLLECTIONS_ACTION = "/services/data/v49.0/composite/sobjects"
+
+logger = get_logger('salesforceWriter')
+
+
+class SObjectWriter:
+   """
+   Buffers Salesforce sObject inserts and writes them with sObject Collections requests of up to 200 records
+   A buffer is flushed when it reaches the batch size, when its oldest record reaches the maximum age, or when flush() is called
+   Every added record gets a Future that resolves to its Salesforce record ID, or to an exception if Salesforce rejected it
+   Records added without retries fail their Future as soon as a write fails or is deferred, for callers that wait for the write
+   and retry the work themselves
+   Parameters: sObject type, function making Salesforce REST API calls, batch size, and maximum age of a buffered record in seconds
+   """
+   def __init__(self, sobject_type, api_call, batch_size=MAX_BATCH_SIZE, max_age=1.0):
+      self.sobject_type = sobject_type
+      self.api_call = api_call
+      self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+      self.max_age = max_age
+      self.lock = threading.Lock()
+      self.flush_lock = threading.Lock()
+      self.buffer = []
+      self.timer = None
+      self.records_written = 0
+      self.api_calls = 0
+
+   """
+   Adds record to buffer, flushing right away if buffer is full
+   Parameters: record fields, and whether a failed or deferred write of the record is retried by a later flush
+   Output: Future resolving to the created record ID
+   """
+   def add(self, record, retry=True):
+      future = Future()
+      with self.lock:
+         self.buffer.append((record, future, 0, retry))
+         full = len(self.buffer) >= self.batch_size
+         if not full and self.timer is None:
+            self.start_timer(self.max_age)
+      if full:
+         self.flush()
+      return future
+
+   """
+   Writes every buffered record, in batches of up to the batch size
+   Parameters: None
+   Output: number of records written successfully
+   """
+   def flush(self):
+      with self.flush_lock:
+         with self.lock:
+            pending = self.buffer
+            self.buffer = []
+            if self.timer is not None:
+               self.timer.cancel()
+               self.timer = None
+         written = 0
+         for start in range(0, len(pending), self.batch_size):
+            written += self.write_batch(pending[start:start + self.batch_size])
+         return written
+
+   """
+   Starts timer which flushes the buffer after given delay; called with self.lock held
+   Parameters: delay in seconds
+   Output: None
+   """
+   def start_timer(self, delay):
+      self.timer = threading.Timer(delay, self.flush)
+      self.timer.daemon = True
+      self.timer.start()
+
+   """
+   Writes one batch with an sObject Collections request, resolving each record's Future with its own result
+   If the request itself fails, the batch is put back in the buffer to be retried by the next flush
+   If it was deferred because Salesforce is throttling us or its circuit is open, the batch is kept without using up an attempt
+   and written once Salesforce should be available again
+   Records added without retries are failed with the error in both cases
+   Parameters: list of (record, future, attempts, retry) tuples
+   Output: number of records written successfully
+   """
+   @traced('salesforce_write', outcome=lambda written: 'success' if written else 'error')
+   def write_batch(self, batch):
+      records = [dict(record, attributes={'type': self.sobject_type}) for record, future, attempts, retry in batch]
+      try:
+         results = self.api_call(COLLECTIONS_ACTION, method='post', data={'allOrNone': False, 'records': records})
+      except ServiceUnavailableError as error:
+         deferred = [entry for entry in batch if entry[3]]
+         logger.warning("Deferring records until Salesforce is available",
+                        extra={'sobject_type': self.sobject_type, 'record_count': len(deferred), 'failed': len(batch) - len(deferred),
+                               'retry_after': round(error.retry_after, 1)})
+         for record, future, attempts, retry in batch:
+            if not retry:
+               future.set_exception(error)
+         if deferred:
+            with self.lock:
+               self.buffer = deferred + self.buffer
+               if self.timer is not None:
+                  self.timer.cancel()
+               self.start_timer(max(self.max_age, error.retry_after))
+         return 0
+      except Exception as error:
+         retried = [(record, future, attempts + 1, retry) for record, future, attempts, retry in batch
+                    if retry and attempts + 1 < MAX_FLUSH_ATTEMPTS]
+         logger.error("Error writing records, retrying those with attempts left",
+                      extra={'sobject_type': self.sobject_type, 'record_count': len(batch), 'retried': len(retried), 'error': repr(error)})
+         for record, future, attempts, retry in batch:
+            if not retry or attempts + 1 >= MAX_FLUSH_ATTEMPTS:
+               future.set_exception(error)
+         if retried:
+            with self.lock:
+               self.buffer = retried + self.buffer
+               if self.timer is None:
+                  self.start_timer(self.max_age)
+         return 0
+
+      self.api_calls += 1
+      written = 0
+      for (record, future, attempts, retry), result in zip(batch, results):
+         if result.get('success'):
+            written += 1
+            logger.debug("Created record", extra={'sobject_type': self.sobject_type, 'record_ID': result['id'], 'lead_ID': record.get('Lead__c')})
+            future.set_result(result['id'])
+         else:
+            logger.error("Error creating record", extra={'sobject_type': self.sobject_type, 'lead_ID': record.get('Lead__c'), 'errors': result.get('errors')})
+            future.set_exception(Exception('API Error when creating %s: %s' % (self.sobject_type, result.get('errors'))))
+      self.records_written += written
+      logger.info("Flushed records in 1 API call", extra={'sobject_type': self.sobject_type, 'record_count': len(batch), 'written': written,
+                                                        'calls_saved': self.records_written - self.api_calls})
+      return written
+
+
+## Writer is kept at module level so records from concurrent leads and jobs in one process share batches
+background_check_writer = None
+background_check_writer_lock = threading.Lock()
+
+
+"""
+Calls Salesforce REST API with the client of the org being handled
+Client is looked up on every call so writers use a new client after Salesforce secrets are rotated
+Parameters: action and keyword arguments of SalesforceClient.call()
+Output: JSON response
+"""
+def call_salesforce(action, **kwargs):
+   return get_salesforce_client().call(action, **kwargs)
+
+
+"""
+Returns writer for Salesforce 'Background Check' objects, creating it on first use
+A registered org being handled (orgRegistry.py) gets its own writer, whose records are written to that org even when its timer flushes them
+Parameters: None
+Output: sObject writer
+"""
+def get_background_check_writer():
+   global background_check_writer
+   org = get_current_org()
+   if org is not None:
+      return get_org_resource(org, 'background_check_writer',
+                              lambda: SObjectWriter('Background_Check__c', functools.partial(run_in_org, org, call_salesforce),
+                                                    batch_size=settings.salesforceBatchSize, max_age=settings.salesforceBatchMaxAge))
+   with background_check_writer_lock:
+      if background_check_writer is None:
+         background_check_writer = SObjectWriter('Background_Check__c', functools.partial(run_in_org, None, call_salesforce),
+                                                 batch_size=settings.salesforceBatchSize, max_age=settings.salesforceBatchMaxAge)
+      return background_check_writer
+
+
+"""
+Flushes buffered 'Background Check' objects of every org
+Writers of every org are flushed, since a request, job batch or process exit may leave objects buffered in writers of several orgs
+Parameters: None
+Output: None
+"""
+def flush_background_check_writers():
+   for writer in [background_check_writer] + get_org_resources('background_check_writer'):
+      if writer is not None:
+         writer.flush()
+
+
+atexit.register(flush_background_check_writers)
@@ -1,27 +1,148 @@
 import os
 import os.path
 import json
-import boto3
+import threading
+import time
 from dotenv import load_dotenv
+from awsResources import get_aws_client
 
 load_dotenv()
 
-ssmClient = boto3.client('ssm')
+## Secrets read from the environment or, if not set there, from SSM Parameter Store
+SECRET_NAMES = ["CHECKR_API_KEY", "BIM_API_KEY", "SALESFORCE_ORG_ID", "SALESFORCE_PASSWORD", "SALESFORCE_CLIENT_SECRET"]
+## SSM GetParameters accepts at most 10 names per call
+SSM_BATCH_SIZE = 10
+
+class SecretCache:
+    """
+    Caches secrets fetched from SSM Parameter Store for 'ttl' seconds, so rotated secrets are picked up without redeploying
+    Secrets are only fetched when first used, and all expired secrets are fetched together in one GetParameters call
+    """
+    def __init__(self, names, ttl):
+        self.names = names
+        self.ttl = ttl
+        self.values = {}
+        self.fetched_at = {}
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        value = os.getenv(name)
+        if value:
+            return value
+        with self.lock:
+            if name not in self.values or time.monotonic() - self.fetched_at[name] >= self.ttl:
+                self.fetch([secret_name for secret_name in self.names if not os.getenv(secret_name)] if name in self.names else [name])
+            return self.values[name]
+
+    def fetch(self, names):
+        ssm = get_aws_client('ssm')
+        for start in range(0, len(names), SSM_BATCH_SIZE):
+            response = ssm.get_parameters(Names=names[start:start + SSM_BATCH_SIZE], WithDecryption=True)
+            for parameter in response['Parameters']:
+                self.values[parameter['Name']] = parameter['Value']
+                self.fetched_at[parameter['Name']] = time.monotonic()
+            if response.get('InvalidParameters'):
+                raise KeyError('SSM parameters not found: ' + ', '.join(response['InvalidParameters']))
+
+secret_cache = SecretCache(SECRET_NAMES, float(os.getenv("SECRETS_TTL", "300")))
 
 def get_secret(name):
-    secret = os.getenv(name) or ssmClient.get_parameter(Name=name)['Parameter']['Value']
-    return secret
+    return secret_cache.get(name)
+
+class Secret:
+    """
+    Settings attribute whose value is read from the secret cache each time it is used
+    Assigning the attribute on the instance overrides the secret, e.g. in tests
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return get_secret(self.name)
 
 class Settings:
+    checkrApiKey = Secret("CHECKR_API_KEY")
+    bimApiKey = Secret("BIM_API_KEY")
+    salesforceOrgID = Secret("SALESFORCE_ORG_ID")
+    salesforcePassword = Secret("SALESFORCE_PASSWORD")
+    salesforceClientSecret = Secret("SALESFORCE_CLIENT_SECRET")
+
     def __init__(self):
         self.envName = os.getenv("PYTHON_ENV")
         self.checkrBaseUrl = "https://api.checkr.com"
-        self.checkrApiKey = get_secret("CHECKR_API_KEY")
-        self.bimApiKey = get_secret("BIM_API_KEY")
         self.backgroundCheckTable = f'bim-{self.envName}-background-check'
-        self.salesforceOrgID = get_secret("SALESFORCE_ORG_ID")
-        self.salesforcePassword = get_secret("SALESFORCE_PASSWORD")
-        self.salesforceClientSecret = get_secret("SALESFORCE_CLIENT_SECRET")
+        ## Number of leads from one Salesforce outbound message processed concurrently
+        self.leadWorkers = int(os.getenv("LEAD_WORKERS", "10"))
+        ## Job queue backend ('sqs', 'sqlite' or 'memory'); if unset, leads are processed before acknowledging the outbound message
+        self.jobQueueBackend = os.getenv("JOB_QUEUE_BACKEND", "")
+        self.jobQueueURL = os.getenv("JOB_QUEUE_URL")
+        self.jobQueuePath = os.getenv("JOB_QUEUE_PATH", f'/tmp/bim-{self.envName}-background-check-jobs.sqlite')
+        self.jobWorkers = int(os.getenv("JOB_WORKERS", "10"))
+        self.jobMaxAttempts = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+        ## 'Background Check' objects are written in batches of up to this many records, at most this many seconds after being queued
+        self.salesforceBatchSize = int(os.getenv("SALESFORCE_BATCH_SIZE", "200"))
+        self.salesforceBatchMaxAge = float(os.getenv("SALESFORCE_BATCH_MAX_AGE", "1.0"))
+        ## Screening record sets (addresses, aliases and search records) whose JSON is longer than this many characters are stored as
+        ## gzip-compressed Salesforce Files linked to the 'Background Check' object, and their field holds a summary of at most this many characters
+        self.screeningFieldLimit = int(os.getenv("SCREENING_FIELD_LIMIT", "32768"))
+        self.screeningSummaryLength = int(os.getenv("SCREENING_SUMMARY_LENGTH", "1000"))
+        ## Idempotency ledger of outbound message notifications ('dynamodb', 'memory', or '' to process redeliveries again),
+        ## seconds claims are kept, and seconds after which a claim still in progress can be taken over
+        ## 'dynamodb' needs the table created by migrateBackgroundCheckTable.py, so the default keeps claims in memory
+        self.idempotencyBackend = os.getenv("IDEMPOTENCY_BACKEND", "memory")
+        self.idempotencyTable = f'bim-{self.envName}-outbound-message-ledger'
+        self.idempotencyTTL = int(os.getenv("IDEMPOTENCY_TTL", str(48 * 60 * 60)))
+        self.idempotencyLease = int(os.getenv("IDEMPOTENCY_LEASE", "300"))
+        ## Client-side rate limiting and circuit breaking of Checkr and Salesforce requests: backend ('dynamodb' to share limits between
+        ## instances, 'local', or '' to turn it off), requests per second and burst size of each service, consecutive failures that open
+        ## a circuit, seconds before an open circuit is probed, and maximum seconds a request waits for its turn before it is deferred
+        self.rateLimitBackend = os.getenv("RATE_LIMIT_BACKEND", "local")
+        self.rateLimitTable = f'bim-{self.envName}-rate-limits'
+        self.checkrRateLimit = float(os.getenv("CHECKR_RATE_LIMIT", "10"))
+        self.checkrBurst = int(os.getenv("CHECKR_BURST", "20"))
+        self.salesforceRateLimit = float(os.getenv("SALESFORCE_RATE_LIMIT", "20"))
+        self.salesforceBurst = int(os.getenv("SALESFORCE_BURST", "40"))
+        self.circuitFailureThreshold = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+        self.circuitResetTimeout = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+        self.rateLimitMaxWait = float(os.getenv("RATE_LIMIT_MAX_WAIT", "5"))
+        ## Reconciliation of reports whose webhook was missed: parallel scan segments, concurrent Checkr fetches,
+        ## maximum Checkr requests per second, and file where progress is checkpointed
+        self.reconcileSegments = int(os.getenv("RECONCILE_SEGMENTS", "8"))
+        self.reconcileWorkers = int(os.getenv("RECONCILE_WORKERS", "10"))
+        self.reconcileRate = float(os.getenv("RECONCILE_RATE", "10"))
+        self.reconcileCheckpointPath = os.getenv("RECONCILE_CHECKPOINT_PATH", f'/tmp/bim-{self.envName}-reconcile-checkpoint.json')
+        ## S3 object where the scheduled Lambda checkpoints progress, so the next invocation resumes where the last one stopped
+        self.reconcileCheckpointBucket = os.getenv("RECONCILE_CHECKPOINT_BUCKET", "")
+        self.reconcileCheckpointKey = os.getenv("RECONCILE_CHECKPOINT_KEY", f'bim-{self.envName}/reconcile-checkpoint.json')
+        ## Bulk submission of background checks: leads processed concurrently, and file where progress is checkpointed
+        self.bulkWorkers = int(os.getenv("BULK_WORKERS", "10"))
+        self.bulkCheckpointPath = os.getenv("BULK_CHECKPOINT_PATH", f'/tmp/bim-{self.envName}-bulk-submit-checkpoint.json')
+        ## ASGI endpoints (asgiApp.py): Checkr connections shared by all requests, and threads running blocking calls such as DynamoDB requests
+        self.asyncPoolSize = int(os.getenv("ASYNC_POOL_SIZE", "100"))
+        self.asyncBlockingWorkers = int(os.getenv("ASYNC_BLOCKING_WORKERS", "50"))
+        ## Materialized status counters served by '/status' ('dynamodb', 'memory', or '' to turn them off), and days of daily counters returned
+        ## Off by default, since 'dynamodb' needs the table created by migrateBackgroundCheckTable.py and memory counters only count one process
+        self.statusBackend = os.getenv("STATUS_BACKEND", "")
+        self.statusTable = f'bim-{self.envName}-background-check-status'
+        self.statusDays = int(os.getenv("STATUS_DAYS", "7"))
+        ## Orgs served in addition to this environment's org: JSON registry file, orgs whose clients are cached at once,
+        ## and seconds after which clients of an unused org are evicted
+        self.orgRegistryPath = os.getenv("ORG_REGISTRY_PATH", "")
+        self.orgCacheSize = int(os.getenv("ORG_CACHE_SIZE", "20"))
+        self.orgIdleTimeout = float(os.getenv("ORG_IDLE_TIMEOUT", "900"))
+        ## Tracing: exporter ('emf', 'local' or 'none'), fraction of traces sampled, per-endpoint overrides such as '/checkr=0.1',
+        ## and CloudWatch namespace of the EMF metrics
+        self.traceExporter = os.getenv("TRACE_EXPORTER", "emf")
+        self.traceSampleRate = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+        self.traceSampleRates = {endpoint.strip(): float(rate) for endpoint, rate in
+                                 (pair.split("=") for pair in os.getenv("TRACE_SAMPLE_RATES", "").split(",") if pair.strip())}
+        self.metricsNamespace = os.getenv("METRICS_NAMESPACE", "BackgroundCheck")
+        ## Logging: default level, and per-module overrides such as 'checkrClient=DEBUG,salesforceWriter=WARNING'
+        self.logLevel = os.getenv("LOG_LEVEL", "INFO").upper()
+        self.logLevels = {module_name.strip(): level.strip().upper() for module_name, level in
+                          (pair.split("=") for pair in os.getenv("LOG_LEVELS", "").split(",") if pair.strip())}
         if self.envName == "qa":
             self.checkrPackage = "tasker_standard"
             self.salesforceUsername = "admin@believeinme.org.partial"
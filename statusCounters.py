@@ -0,0 +1,308 @@
+"""
+Materialized status counters of the background check process, so progress can be monitored without scanning the background check table
+Every state transition of a lead's item (candidate created, report created, report completed) adds to the counters of its environment
+(or registered org): the number of items in each status, per-day counts of candidates created, reports created and reports completed
+with their total turnaround, and an index of outstanding reports ordered by the time they were created
+Counters are updated with atomic additions once the conditional write making the transition has succeeded, so each transition is counted once;
+they are a separate request because the claim of a completed report must return the item, which a transaction can't
+A failed counter update is logged as an error and counted as the 'status_counters_lost' stage with an 'error' outcome in the trace metrics;
+counters it left wrong, or left behind by a process stopped between the transition and its update, are corrected by rebuildStatusCounters.py
+Backends: DynamoDB in production and in-memory for tests and benchmarks
+"""
+import datetime
+import threading
+import time
+from decimal import Decimal
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeSerializer
+from settings import settings
+from awsResources import get_dynamodb_table
+from tracing import traced, get_tracer
+from structuredLogging import get_logger
+from orgRegistry import get_current_org
+
+CHECKR_STATUSES = ['candidate created', 'report created', 'report completed']
+## Sort key of the counters item holding the number of items in each status and the total turnaround; every other counters item is one day
+TOTALS_KEY = 'totals'
+DAY_KEY_PREFIX = 'day#'
+
+logger = get_logger('statusCounters')
+
+
+"""
+Returns scope whose counters the current request or job updates: the registered org being handled, or this environment
+Parameters: None
+Output: scope name
+"""
+def get_status_scope():
+   org = get_current_org()
+   return org.organizationID if org is not None else str(settings.envName)
+
+
+"""
+Builds sort key of the counters item of one day
+Parameters: time of the transition (seconds since the epoch)
+Output: sort key
+"""
+def day_key(timestamp):
+   return DAY_KEY_PREFIX + datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%d')
+
+
+"""
+Builds sort key of a report in the outstanding reports index, which orders reports by creation time
+Reports created before creation times were stored on items sort first, as the oldest
+Parameters: Salesforce lead ID and report creation time, if known
+Output: sort key
+"""
+def outstanding_key(salesforce_lead_ID, report_created_at):
+   return '%012d#%s' % (int(report_created_at or 0), salesforce_lead_ID)
+
+
+class MemoryStatusStore:
+   """
+   In-memory counters for tests and benchmarks; counters are lost when the process exits
+   Parameters: None
+   """
+   def __init__(self):
+      self.counters = {}
+      self.outstanding = {}
+      self.lock = threading.Lock()
+
+   def apply(self, scope, increments, outstanding_put=None, outstanding_delete=None):
+      with self.lock:
+         for sort_key, values in increments.items():
+            counters = self.counters.setdefault(scope, {}).setdefault(sort_key, {})
+            for name, value in values.items():
+               counters[name] = counters.get(name, 0) + value
+         outstanding = self.outstanding.setdefault(scope, {})
+         if outstanding_put is not None:
+            outstanding[outstanding_put['sort_key']] = dict(outstanding_put)
+         if outstanding_delete is not None:
+            outstanding.pop(outstanding_delete, None)
+
+   def read(self, scope, first_day_key):
+      with self.lock:
+         counters = {sort_key: dict(values) for sort_key, values in self.counters.get(scope, {}).items()
+                     if sort_key == TOTALS_KEY or sort_key >= first_day_key}
+         outstanding = self.outstanding.get(scope, {})
+         oldest = dict(outstanding[min(outstanding)]) if outstanding else None
+         return counters, oldest
+
+   def replace(self, scope, counters, outstanding):
+      with self.lock:
+         self.counters[scope] = {sort_key: dict(values) for sort_key, values in counters.items()}
+         self.outstanding[scope] = {entry['sort_key']: dict(entry) for entry in outstanding}
+
+
+class DynamoDBStatusStore:
+   """
+   Counters stored in a DynamoDB table with partition key 'status_key' and sort key 'sort_key'
+   Counters items are in partition '<scope>#counters' and outstanding reports in partition '<scope>#outstanding', so the status of a scope
+   is read with one query for its counters from the first day shown and one query for its oldest outstanding report, whatever the table size
+   The counter additions and the outstanding report change of a transition are written together in one TransactWriteItems request
+   Parameters: DynamoDB table
+   """
+   def __init__(self, table):
+      self.table = table
+      self.serializer = TypeSerializer()
+
+   def serialize(self, values):
+      return {name: self.serializer.serialize(value) for name, value in values.items()}
+
+   @traced('status_counters_update')
+   def apply(self, scope, increments, outstanding_put=None, outstanding_delete=None):
+      transact_items = []
+      for sort_key, values in increments.items():
+         names = {'#c%d' % index: name for index, name in enumerate(values)}
+         transact_items.append({'Update': {
+            'TableName': self.table.name,
+            'Key': self.serialize({'status_key': scope + '#counters', 'sort_key': sort_key}),
+            'UpdateExpression': 'add ' + ', '.join('#c%d :c%d' % (index, index) for index in range(len(values))),
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': self.serialize({':c%d' % index: Decimal(str(value)) for index, value in enumerate(values.values())})
+         }})
+      if outstanding_put is not None:
+         transact_items.append({'Put': {'TableName': self.table.name,
+                                        'Item': self.serialize(dict(outstanding_put, status_key=scope + '#outstanding'))}})
+      if outstanding_delete is not None:
+         transact_items.append({'Delete': {'TableName': self.table.name,
+                                           'Key': self.serialize({'status_key': scope + '#outstanding', 'sort_key': outstanding_delete})}})
+      self.table.meta.client.transact_write_items(TransactItems=transact_items)
+
+   @traced('status_counters_read')
+   def read(self, scope, first_day_key):
+      ## 'day#...' sorts before 'totals', so one range query returns the days shown and the totals
+      response = self.table.query(KeyConditionExpression=Key('status_key').eq(scope + '#counters') & Key('sort_key').gte(first_day_key))
+      counters = {}
+      for item in response['Items']:
+         counters[item['sort_key']] = {name: value for name, value in item.items() if name not in ['status_key', 'sort_key']}
+      response = self.table.query(KeyConditionExpression=Key('status_key').eq(scope + '#outstanding'), Limit=1)
+      oldest = response['Items'][0] if response['Items'] else None
+      return counters, oldest
+
+   """
+   Replaces every counters item and outstanding report of a scope, e.g. with counters recomputed from the background check table
+   Parameters: scope, dictionary mapping sort key to counters, and list of outstanding reports
+   Output: None
+   """
+   def replace(self, scope, counters, outstanding):
+      with self.table.batch_writer(overwrite_by_pkeys=['status_key', 'sort_key']) as batch:
+         for partition in [scope + '#counters', scope + '#outstanding']:
+            query_kwargs = {'KeyConditionExpression': Key('status_key').eq(partition), 'ProjectionExpression': 'status_key, sort_key'}
+            while True:
+               response = self.table.query(**query_kwargs)
+               for item in response['Items']:
+                  batch.delete_item(Key={'status_key': item['status_key'], 'sort_key': item['sort_key']})
+               if 'LastEvaluatedKey' not in response:
+                  break
+               query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+         for sort_key, values in counters.items():
+            batch.put_item(Item=dict({name: Decimal(str(value)) for name, value in values.items()}, status_key=scope + '#counters', sort_key=sort_key))
+         for entry in outstanding:
+            batch.put_item(Item=dict(entry, status_key=scope + '#outstanding'))
+
+
+## Store is kept at module level so it is created once per process
+status_store = None
+status_store_lock = threading.Lock()
+
+
+"""
+Creates status store for configured backend
+Parameters: None
+Output: status store, or None if no status backend is configured
+"""
+def create_status_store():
+   if settings.statusBackend == 'dynamodb':
+      return DynamoDBStatusStore(get_dynamodb_table(settings.statusTable))
+   if settings.statusBackend == 'memory':
+      return MemoryStatusStore()
+   if settings.statusBackend:
+      raise ValueError('Unknown status backend: ' + settings.statusBackend)
+   return None
+
+
+"""
+Returns status store for configured backend, creating it on first use
+Parameters: None
+Output: status store, or None if no status backend is configured
+"""
+def get_status_store():
+   global status_store
+   with status_store_lock:
+      if status_store is None:
+         status_store = create_status_store()
+      return status_store
+
+
+"""
+Helper function to apply the counter changes of one transition to the current scope
+Counters are only used for monitoring, so a failed update doesn't fail the transition: it is logged with the changes that were lost
+and recorded outside any trace, so the metric counts every failure whatever the sample rate; rebuildStatusCounters.py repairs the counters
+Parameters: transition name, dictionary mapping sort key to counter additions, and outstanding report to add or sort key of one to remove
+Output: None
+"""
+def record_transition(transition, increments, outstanding_put=None, outstanding_delete=None):
+   store = get_status_store()
+   if store is None:
+      return
+   scope = get_status_scope()
+   started_at = time.perf_counter()
+   try:
+      store.apply(scope, increments, outstanding_put, outstanding_delete)
+   except Exception as error:
+      get_tracer().record(None, 'status_counters_lost', time.perf_counter() - started_at, 'error')
+      logger.error("Error updating status counters, run rebuildStatusCounters.py to correct them",
+                   extra={'transition': transition, 'scope': scope, 'increments': increments, 'outstanding_put': outstanding_put,
+                          'outstanding_delete': outstanding_delete, 'error': repr(error)})
+
+
+"""
+Counts a lead's item created at 'candidate created'
+An item it replaced at 'report created' or 'report completed', when the lead is checked again, is taken out of that status's count
+and of the outstanding reports or the turnaround totals in the same update; the day counters keep the replaced item's transitions
+Parameters: time the candidate was created, and item it replaced, if any
+Output: None
+"""
+def record_candidate_created(created_at, replaced_item=None):
+   totals = {'candidate created': 1}
+   outstanding_delete = None
+   replaced_status = (replaced_item or {}).get('checkr_status')
+   if replaced_status in ["report created", "report completed"]:
+      totals[replaced_status] = -1
+      report_created_at = replaced_item.get('report_created_at')
+      if replaced_status == "report created":
+         outstanding_delete = outstanding_key(replaced_item['salesforce_lead_ID'], report_created_at)
+      elif report_created_at is not None and replaced_item.get('report_completed_at') is not None:
+         totals.update(turnaround_seconds=-max(0, int(replaced_item['report_completed_at']) - int(report_created_at)), turnaround_count=-1)
+   record_transition('candidate created', {TOTALS_KEY: totals, day_key(created_at): {'candidates_created': 1}}, outstanding_delete=outstanding_delete)
+
+
+"""
+Counts a lead's item moved from 'candidate created' to 'report created', and adds its report to the outstanding reports
+Parameters: Salesforce lead ID, Checkr report ID and time the report was created
+Output: None
+"""
+def record_report_created(salesforce_lead_ID, checkr_report_ID, report_created_at):
+   record_transition('report created', {TOTALS_KEY: {'candidate created': -1, 'report created': 1}, day_key(report_created_at): {'reports_created': 1}},
+                     outstanding_put={'sort_key': outstanding_key(salesforce_lead_ID, report_created_at), 'salesforce_lead_ID': salesforce_lead_ID,
+                                      'checkr_report_ID': checkr_report_ID, 'report_created_at': int(report_created_at)})
+
+
+"""
+Counts a lead's item moved from 'report created' to 'report completed' with its turnaround, and removes its report from the outstanding reports
+Parameters: Salesforce lead ID, time the report was created (None for items created before it was stored), and time it was completed
+Output: None
+"""
+def record_report_completed(salesforce_lead_ID, report_created_at, report_completed_at):
+   day_counters = {'reports_completed': 1}
+   totals = {'report created': -1, 'report completed': 1}
+   if report_created_at is not None:
+      turnaround = max(0, int(report_completed_at) - int(report_created_at))
+      day_counters.update(turnaround_seconds=turnaround, turnaround_count=1)
+      totals.update(turnaround_seconds=turnaround, turnaround_count=1)
+   record_transition('report completed', {TOTALS_KEY: totals, day_key(report_completed_at): day_counters},
+                     outstanding_delete=outstanding_key(salesforce_lead_ID, report_created_at))
+
+
+"""
+Helper function to compute average turnaround of counters
+Parameters: counters
+Output: average turnaround in seconds, or None if no report with a known creation time was completed
+"""
+def average_turnaround(counters):
+   turnaround_count = counters.get('turnaround_count', 0)
+   return round(float(counters.get('turnaround_seconds', 0)) / float(turnaround_count), 1) if turnaround_count else None
+
+
+"""
+Reads status of the current scope from its counters, in constant time whatever the size of the background check table
+Parameters: number of days whose counters are returned, ending today (UTC)
+Output: dictionary with the number of items in each status, the oldest outstanding report, the average turnaround,
+and the counters of every day; None if no status backend is configured
+"""
+@traced('read_status')
+def get_status(days=None):
+   store = get_status_store()
+   if store is None:
+      return None
+   days = days or settings.statusDays
+   now = time.time()
+   day_keys = [day_key(now - offset * 86400) for offset in reversed(range(days))]
+   scope = get_status_scope()
+   counters, oldest = store.read(scope, day_keys[0])
+   totals = counters.get(TOTALS_KEY, {})
+   status = {'scope': scope, 'counts': {checkr_status: int(totals.get(checkr_status, 0)) for checkr_status in CHECKR_STATUSES},
+             'average_turnaround_seconds': average_turnaround(totals), 'oldest_outstanding_report': None, 'days': []}
+   if oldest is not None:
+      report_created_at = int(oldest['report_created_at']) if oldest.get('report_created_at') else None
+      status['oldest_outstanding_report'] = {'salesforce_lead_ID': oldest['salesforce_lead_ID'], 'checkr_report_ID': oldest['checkr_report_ID'],
+                                             'report_created_at': report_created_at,
+                                             'age_seconds': int(now - report_created_at) if report_created_at is not None else None}
+   for sort_key in day_keys:
+      day_counters = counters.get(sort_key, {})
+      status['days'].append({'date': sort_key[len(DAY_KEY_PREFIX):], 'candidates_created': int(day_counters.get('candidates_created', 0)),
+                             'reports_created': int(day_counters.get('reports_created', 0)),
+                             'reports_completed': int(day_counters.get('reports_completed', 0)),
+                             'average_turnaround_seconds': average_turnaround(day_counters)})
+   return status
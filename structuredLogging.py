@@ -0,0 +1,175 @@
+"""
+Structured logging for the background check process
+Every log record is written as one compact JSON line, with PII fields (SSNs, dates of birth, addresses, screening records) redacted
+Lines are buffered in memory and written by a background thread, or when flush_logs() is called at the end of each request or job,
+so the request path never waits on stdout
+"""
+import atexit
+import json
+import logging
+import sys
+import threading
+from settings import settings
+
+## Keys whose values are replaced wherever they appear in a log record, compared case-insensitively
+REDACTED_FIELDS = set(['ssn', 'dob', 'addresses', 'records', 'aliases', 'ssn__c', 'birthdate__c', 'addresses__c', 'aliases__c',
+                       'sex_offender_records__c', 'global_watchlist_records__c', 'national_criminal_search_records__c'])
+REDACTED_VALUE = '[REDACTED]'
+## Buffered lines are written after this many seconds, or as soon as this many are buffered
+FLUSH_INTERVAL = 1.0
+BUFFER_CAPACITY = 1000
+LOGGER_PREFIX = 'bim'
+## Encoder is created once, as json.dumps() with non-default options builds a new one on every call
+JSON_ENCODER = json.JSONEncoder(separators=(',', ':'), default=str)
+## Attributes every LogRecord has; any other attribute was passed in 'extra' and is written as a field
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | set(['message', 'asctime'])
+
+
+"""
+Returns copy of value with the values of PII fields replaced, at any depth
+Parameters: value (dictionary, list or scalar)
+Output: redacted copy
+"""
+def redact(value):
+   if isinstance(value, dict):
+      return {key: REDACTED_VALUE if str(key).lower() in REDACTED_FIELDS else redact(field_value) for key, field_value in value.items()}
+   if isinstance(value, (list, tuple)):
+      return [redact(item) for item in value]
+   return value
+
+
+class JSONFormatter(logging.Formatter):
+   """
+   Formats log record as one line of JSON with time, level, logger, message and the fields passed in 'extra', redacted
+   """
+   def format(self, record):
+      entry = {'time': round(record.created, 3), 'level': record.levelname, 'logger': record.name[len(LOGGER_PREFIX) + 1:],
+               'message': record.getMessage()}
+      for key, value in record.__dict__.items():
+         if key not in STANDARD_ATTRIBUTES:
+            entry[key] = REDACTED_VALUE if key.lower() in REDACTED_FIELDS else redact(value)
+      if record.exc_info:
+         entry['exception'] = self.formatException(record.exc_info)
+      return JSON_ENCODER.encode(entry)
+
+
+class BufferedHandler(logging.Handler):
+   """
+   Handler which keeps formatted lines in memory and writes them in one call from a background thread or on flush()
+   Writes to the current sys.stdout, which is where Lambda and CloudWatch pick up logs
+   Parameters: seconds between background writes, and number of buffered lines which triggers a write
+   """
+   def __init__(self, flush_interval=FLUSH_INTERVAL, capacity=BUFFER_CAPACITY):
+      logging.Handler.__init__(self)
+      self.flush_interval = flush_interval
+      self.capacity = capacity
+      self.buffer = []
+      self.buffer_lock = threading.Lock()
+      self.write_lock = threading.Lock()
+      self.wake = threading.Event()
+      self.bytes_written = 0
+      self.thread = threading.Thread(target=self.run, daemon=True)
+      self.thread.start()
+
+   def emit(self, record):
+      try:
+         self.write_line(self.format(record))
+      except Exception:
+         self.handleError(record)
+
+   """
+   Buffers an already formatted line, e.g. a CloudWatch Embedded Metric Format document
+   Parameters: line without trailing newline
+   Output: None
+   """
+   def write_line(self, line):
+      with self.buffer_lock:
+         self.buffer.append(line)
+         full = len(self.buffer) >= self.capacity
+      if full:
+         self.wake.set()
+
+   def flush(self):
+      with self.write_lock:
+         with self.buffer_lock:
+            lines = self.buffer
+            self.buffer = []
+         if lines:
+            text = '\n'.join(lines) + '\n'
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            self.bytes_written += len(text)
+
+   def run(self):
+      while True:
+         self.wake.wait(self.flush_interval)
+         self.wake.clear()
+         self.flush()
+
+
+## Handler is kept at module level so every logger in the process shares one buffer
+log_handler = None
+log_handler_lock = threading.Lock()
+
+
+"""
+Creates buffered JSON handler and sets the default and per-module log levels from settings, on first use
+Parameters: None
+Output: buffered handler
+"""
+def get_log_handler():
+   global log_handler
+   with log_handler_lock:
+      if log_handler is None:
+         log_handler = BufferedHandler()
+         log_handler.setFormatter(JSONFormatter())
+         root_logger = logging.getLogger(LOGGER_PREFIX)
+         root_logger.addHandler(log_handler)
+         root_logger.setLevel(settings.logLevel)
+         root_logger.propagate = False
+         for module_name, level in settings.logLevels.items():
+            logging.getLogger(LOGGER_PREFIX + '.' + module_name).setLevel(level)
+      return log_handler
+
+
+"""
+Stands in for Logger.findCaller(), which walks the stack on every call to find a file name and line number the JSON lines don't include
+Parameters: as Logger.findCaller()
+Output: placeholder caller
+"""
+def skip_find_caller(stack_info=False, stacklevel=1):
+   return '(unknown file)', 0, '(unknown function)', None
+
+
+"""
+Returns logger for given module
+Parameters: module name
+Output: logger
+"""
+def get_logger(module_name):
+   get_log_handler()
+   logger = logging.getLogger(LOGGER_PREFIX + '.' + module_name)
+   logger.findCaller = skip_find_caller
+   return logger
+
+
+"""
+Buffers a preformatted line, bypassing log levels and redaction, e.g. a CloudWatch Embedded Metric Format document
+Parameters: line without trailing newline
+Output: None
+"""
+def write_line(line):
+   get_log_handler().write_line(line)
+
+
+"""
+Writes every buffered line; called at the end of each request and job so nothing is lost when a Lambda invocation is frozen
+Parameters: None
+Output: None
+"""
+def flush_logs():
+   if log_handler is not None:
+      log_handler.flush()
+
+
+atexit.register(flush_logs)
@@ -0,0 +1,29 @@
+"""
+Shared setup of the tests: the modules of the repository root and the local stand-ins of the 'benchmarks' folder are importable,
+and the process environment is the benchmarks' one, so no AWS, Checkr or Salesforce account is needed
+Usage: python -m pytest -q
+"""
+import os
+import sys
+
+BENCHMARKS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')
+if BENCHMARKS_PATH not in sys.path:
+   sys.path.insert(0, BENCHMARKS_PATH)
+
+import benchmarkEnvironment
+import pytest
+import statusCounters
+from localDynamoDB import create_background_check_table
+
+
+@pytest.fixture
+def table():
+   return create_background_check_table()
+
+
+## Every test counts transitions in its own in-memory counters
+@pytest.fixture
+def status_store(monkeypatch):
+   store = statusCounters.MemoryStatusStore()
+   monkeypatch.setattr(statusCounters, 'status_store', store)
+   return store
@@ -0,0 +1,92 @@
+"""
+Tests of the report claim of the asyncio pipeline (asyncBackgroundCheck.py), which retrieves the report from Checkr while claiming it:
+the claim is released when the retrieval or the write of the 'Background Check' object fails, so the redelivered webhook processes the report
+"""
+import asyncio
+from types import SimpleNamespace
+import pytest
+import asyncBackgroundCheck
+import backgroundCheck
+from backgroundCheckTable import put_candidate_item, set_report_created
+from checkrClient import CheckrUnavailableError
+from salesforceWriter import SObjectWriter
+from statusCounters import get_status_scope, TOTALS_KEY
+
+LEAD_ID = '00Q000000000001AAA'
+
+
+class FakeAsyncCheckrClient:
+   """
+   Async Checkr client returning a report that couldn't be retrieved, or raising the given error
+   Parameters: error raised, if any
+   """
+   def __init__(self, error=None):
+      self.error = error
+      self.requests = 0
+
+   async def retrieve_report(self, checkr_report_ID, params=None):
+      self.requests += 1
+      if self.error is not None:
+         raise self.error
+      return SimpleNamespace(ok=False, json=lambda: {'error': ['Not found']})
+
+
+@pytest.fixture
+def services(monkeypatch, table, status_store):
+   services = SimpleNamespace(table=table, checkr=FakeAsyncCheckrClient(), write_error=None, records=[])
+
+   def api_call(action, method, data):
+      services.records.extend(data['records'])
+      if services.write_error is not None:
+         raise services.write_error
+      return [{'success': True, 'id': 'a00000000000000001'} for record in data['records']]
+
+   monkeypatch.setattr(backgroundCheck, 'get_background_check_table', lambda: table)
+   monkeypatch.setattr(backgroundCheck, 'get_background_check_writer', lambda: SObjectWriter('Background_Check__c', api_call, max_age=60))
+   monkeypatch.setattr(asyncBackgroundCheck, 'get_async_checkr_client', lambda: services.checkr)
+   put_candidate_item(table, LEAD_ID, 'Lead Name', 'candidate0')
+   set_report_created(table, LEAD_ID, 'candidate0', 'report0')
+   return services
+
+
+def process_report():
+   return asyncio.run(asyncBackgroundCheck.process_report('report0', salesforce_lead_ID=LEAD_ID))
+
+
+def test_processed_report_stays_claimed(services):
+   assert process_report().status_code == 400
+   assert services.table.items[LEAD_ID]['checkr_status'] == 'report completed'
+   assert len(services.records) == 1
+   ## The redelivered webhook finds the report completed and writes nothing
+   assert process_report() is None
+   assert len(services.records) == 1
+
+
+def test_claim_released_after_failed_write(services):
+   services.write_error = Exception('connection reset')
+   with pytest.raises(Exception, match='connection reset'):
+      process_report()
+   assert services.table.items[LEAD_ID]['checkr_status'] == 'report created'
+   services.write_error = None
+   assert process_report().status_code == 400
+   assert services.table.items[LEAD_ID]['checkr_status'] == 'report completed'
+
+
+def test_claim_released_after_failed_retrieval(services):
+   services.checkr.error = CheckrUnavailableError('/v1/reports/report0', 503)
+   with pytest.raises(CheckrUnavailableError):
+      process_report()
+   assert services.table.items[LEAD_ID]['checkr_status'] == 'report created'
+   assert services.records == []
+
+
+## Completion is only counted once the report is processed, so a released claim leaves the counters unchanged
+def test_released_claim_isnt_counted(services, status_store):
+   services.write_error = Exception('connection reset')
+   with pytest.raises(Exception):
+      process_report()
+   totals = status_store.counters[get_status_scope()][TOTALS_KEY]
+   assert totals['report created'] == 1 and totals.get('report completed', 0) == 0
+   services.write_error = None
+   process_report()
+   assert totals['report created'] == 0 and totals['report completed'] == 1
@@ -0,0 +1,123 @@
+"""
+Tests of the state changes of the circuit breaker (rateLimiting.py), with the local backend and the DynamoDB backend on a local table:
+closed until consecutive failures reach the threshold, open until the reset timeout has passed, then half-open for one probe request
+whose outcome closes or opens the circuit again
+"""
+import time
+from types import SimpleNamespace
+import pytest
+import rateLimiting
+from rateLimiting import CircuitBreaker, CircuitOpenError, ServiceGuard, LocalRateLimitBackend, DynamoDBRateLimitBackend, CLOSED, OPEN, HALF_OPEN
+from localDynamoDB import LocalTable
+
+FAILURE_THRESHOLD = 3
+RESET_TIMEOUT = 30.0
+
+
+## Circuits read the time through this clock, so reset timeouts can be passed without waiting
+@pytest.fixture
+def clock(monkeypatch):
+   clock = SimpleNamespace(now=1600000000.0)
+   monkeypatch.setattr(rateLimiting, 'time', SimpleNamespace(time=lambda: clock.now, monotonic=time.monotonic, sleep=time.sleep))
+   return clock
+
+
+@pytest.fixture(params=['local', 'dynamodb'])
+def backend(request, clock):
+   if request.param == 'local':
+      return LocalRateLimitBackend()
+   return DynamoDBRateLimitBackend(LocalTable(key='limit_key'))
+
+
+## Circuit state isn't cached, so every breaker sees the changes of the others right away
+def create_breaker(backend):
+   return CircuitBreaker('checkr', backend, FAILURE_THRESHOLD, RESET_TIMEOUT, cache_ttl=0.0)
+
+
+def open_circuit(breaker):
+   for _ in range(FAILURE_THRESHOLD):
+      breaker.before_request()
+      breaker.record_failure()
+
+
+def test_circuit_opens_after_consecutive_failures(backend, clock):
+   breaker = create_breaker(backend)
+   for _ in range(FAILURE_THRESHOLD - 1):
+      breaker.record_failure()
+   assert backend.get_circuit('checkr')['circuit_state'] == CLOSED
+   breaker.before_request()
+   breaker.record_failure()
+   assert backend.get_circuit('checkr')['circuit_state'] == OPEN
+   clock.now += 10
+   with pytest.raises(CircuitOpenError) as error:
+      breaker.before_request()
+   assert error.value.retry_after == pytest.approx(RESET_TIMEOUT - 10, abs=0.01)
+
+
+def test_success_resets_failure_count(backend, clock):
+   breaker = create_breaker(backend)
+   for _ in range(FAILURE_THRESHOLD - 1):
+      breaker.record_failure()
+   breaker.record_success()
+   breaker.record_failure()
+   circuit = backend.get_circuit('checkr')
+   assert circuit['circuit_state'] == CLOSED and circuit['failure_count'] == 1
+
+
+## Only one of the breakers sharing the backend sends the probe once the reset timeout has passed
+def test_one_probe_after_reset_timeout(backend, clock):
+   breaker, other_breaker = create_breaker(backend), create_breaker(backend)
+   open_circuit(breaker)
+   clock.now += RESET_TIMEOUT
+   breaker.before_request()
+   assert backend.get_circuit('checkr')['circuit_state'] == HALF_OPEN
+   with pytest.raises(CircuitOpenError):
+      other_breaker.before_request()
+
+
+def test_successful_probe_closes_circuit(backend, clock):
+   breaker = create_breaker(backend)
+   open_circuit(breaker)
+   clock.now += RESET_TIMEOUT
+   breaker.before_request()
+   breaker.record_success()
+   circuit = backend.get_circuit('checkr')
+   assert circuit['circuit_state'] == CLOSED and circuit['failure_count'] == 0
+   create_breaker(backend).before_request()
+
+
+def test_failed_probe_opens_circuit_again(backend, clock):
+   breaker = create_breaker(backend)
+   open_circuit(breaker)
+   clock.now += RESET_TIMEOUT
+   breaker.before_request()
+   breaker.record_failure()
+   circuit = backend.get_circuit('checkr')
+   assert circuit['circuit_state'] == OPEN and circuit['opened_at'] == pytest.approx(clock.now, abs=0.01)
+   clock.now += RESET_TIMEOUT - 1
+   with pytest.raises(CircuitOpenError):
+      breaker.before_request()
+
+
+## A probe that never reported back doesn't keep the circuit half-open forever
+def test_lost_probe_is_sent_again(backend, clock):
+   breaker = create_breaker(backend)
+   open_circuit(breaker)
+   clock.now += RESET_TIMEOUT
+   breaker.before_request()
+   clock.now += RESET_TIMEOUT
+   create_breaker(backend).before_request()
+   assert backend.get_circuit('checkr')['circuit_state'] == HALF_OPEN
+
+
+## A 429 shows the service is up: it pauses the bucket without counting towards opening the circuit, unlike a 5xx
+def test_guard_counts_server_errors_only(backend, clock):
+   guard = ServiceGuard('checkr', backend, rate=10, burst=10, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT, max_wait=1.0)
+   for _ in range(FAILURE_THRESHOLD):
+      guard.record_response(429, {'Retry-After': '1'})
+   assert backend.get_circuit('checkr')['circuit_state'] == CLOSED
+   for _ in range(FAILURE_THRESHOLD):
+      guard.record_response(503, {})
+   assert backend.get_circuit('checkr')['circuit_state'] == OPEN
+   with pytest.raises(CircuitOpenError):
+      guard.before_request()
@@ -0,0 +1,70 @@
+"""
+Tests of the claims of the idempotency ledger (idempotencyLedger.py), with the memory backend and the DynamoDB backend on a local table:
+a claim in progress is taken over once its lease has passed, a completed claim is kept until it expires, and a released claim can be taken again
+"""
+from types import SimpleNamespace
+import pytest
+import idempotencyLedger
+from idempotencyLedger import MemoryLedger, DynamoDBLedger, ledger_key
+from localDynamoDB import LocalTable
+
+TTL = 3600
+LEASE = 300
+KEY = ledger_key('04l000000000001AAA', '00Q000000000001AAA')
+
+
+## Ledgers read the time through this clock, so leases and expiry can be passed without waiting
+@pytest.fixture
+def clock(monkeypatch):
+   clock = SimpleNamespace(now=1600000000.0)
+   monkeypatch.setattr(idempotencyLedger, 'time', SimpleNamespace(time=lambda: clock.now))
+   return clock
+
+
+@pytest.fixture(params=['memory', 'dynamodb'])
+def ledger(request, clock):
+   if request.param == 'memory':
+      return MemoryLedger(ttl=TTL, lease=LEASE)
+   return DynamoDBLedger(LocalTable(key='idempotency_key'), ttl=TTL, lease=LEASE)
+
+
+def test_claim_in_progress_is_taken_over_after_lease(ledger, clock):
+   assert ledger.claim(KEY) is True
+   clock.now += LEASE - 1
+   assert ledger.claim(KEY) is False
+   clock.now += 1
+   assert ledger.claim(KEY) is True
+   assert ledger.claim(KEY) is False
+
+
+def test_completed_claim_is_kept_until_it_expires(ledger, clock):
+   ledger.claim(KEY)
+   ledger.complete(KEY, 'success')
+   clock.now += LEASE * 2
+   assert ledger.claim(KEY) is False
+   assert ledger.get(KEY)['claim_result'] == 'success'
+   clock.now += TTL
+   assert ledger.get(KEY) is None
+   assert ledger.claim(KEY) is True
+
+
+def test_released_claim_can_be_taken_again(ledger, clock):
+   ledger.claim(KEY)
+   ledger.release(KEY)
+   assert ledger.get(KEY) is None
+   assert ledger.claim(KEY) is True
+
+
+def test_release_keeps_completed_claim(ledger, clock):
+   ledger.claim(KEY)
+   ledger.complete(KEY, 'queued')
+   ledger.release(KEY)
+   assert ledger.claim(KEY) is False
+
+
+def test_memory_ledger_prunes_expired_claims(clock):
+   ledger = MemoryLedger(ttl=TTL, lease=LEASE)
+   ledger.claim(KEY)
+   clock.now += max(TTL, idempotencyLedger.MEMORY_PRUNE_INTERVAL) + 1
+   ledger.claim('other')
+   assert list(ledger.entries) == ['other']
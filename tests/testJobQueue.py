@@ -0,0 +1,85 @@
+"""
+Tests of the lease of jobs received from the SQLite queue backend (jobQueue.py): a received job is hidden from other workers
+until it is completed, retried, or its visibility timeout has passed; and of jobs given up on after their last attempt
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from jobQueue import JobQueue, MemoryQueueBackend, SQLiteQueueBackend, new_job, MAX_VISIBILITY_TIMEOUT
+
+
+@pytest.fixture
+def backend(tmp_path):
+   return SQLiteQueueBackend(str(tmp_path / 'jobs.sqlite'), visibility_timeout=0.2)
+
+
+def test_received_job_is_hidden_until_lease_expires(backend):
+   job = new_job('report_completed', {'salesforce_lead_ID': '00Q000000000001AAA'})
+   backend.enqueue([job])
+   (received, receipt), = backend.receive()
+   assert received['id'] == job['id'] and received['attempts'] == 1
+   assert backend.receive() == []
+   time.sleep(0.25)
+   (received, receipt), = backend.receive()
+   assert received['attempts'] == 2
+
+
+def test_completed_job_is_removed(backend):
+   backend.enqueue([new_job('report_completed', {})])
+   (job, receipt), = backend.receive()
+   backend.complete(receipt)
+   time.sleep(0.25)
+   assert backend.receive() == []
+   assert backend.depth() == 0
+
+
+def test_retried_job_is_received_after_delay(backend):
+   backend.enqueue([new_job('report_completed', {})])
+   (job, receipt), = backend.receive()
+   backend.retry(receipt, job, 0)
+   (job, receipt), = backend.receive()
+   assert job['attempts'] == 2
+
+
+## Jobs are leased in one write transaction, so workers receiving at the same time never get the same job
+def test_concurrent_workers_receive_each_job_once(backend):
+   backend.enqueue([new_job('background_check', {'index': index}) for index in range(50)])
+   backend.visibility_timeout = 60
+   with ThreadPoolExecutor(max_workers=8) as executor:
+      batches = list(executor.map(lambda index: backend.receive(max_jobs=5), range(20)))
+   received = [job['id'] for batch in batches for job, receipt in batch]
+   assert len(received) == 50 and len(set(received)) == 50
+
+
+def test_jobs_survive_restart(backend):
+   backend.enqueue([new_job('report_completed', {})])
+   restarted = SQLiteQueueBackend(backend.path, visibility_timeout=0.2)
+   assert restarted.depth() == 1
+   assert len(restarted.receive()) == 1
+
+
+## A job given up on is kept, since its outbound message was acknowledged and nothing else would start the lead's background check
+def test_job_failing_every_attempt_is_dead_lettered(backend):
+   def fail(payload, attempt):
+      raise Exception('Salesforce unavailable')
+   job_queue = JobQueue(backend, {'background_check': fail}, max_attempts=2, backoff_base=0.0)
+   job_ID = job_queue.enqueue('background_check', {'salesforce_lead_ID': '00Q000000000001AAA'})
+   job_queue.drain(wait=0)
+   job_queue.drain(wait=0)
+   assert backend.depth() == 0
+   (dead_job_ID, body), = backend.connection.execute("SELECT id, body FROM dead_jobs").fetchall()
+   assert dead_job_ID == job_ID and json.loads(body)['attempts'] == 2
+   assert job_queue.metrics.counts['failed'] == 1
+
+
+## A job received again after its last attempt, e.g. from an SQS queue without a redrive policy, is hidden instead of run
+def test_job_received_after_maximum_attempts_isnt_run():
+   handled = []
+   backend = MemoryQueueBackend()
+   job_queue = JobQueue(backend, {'background_check': lambda payload, attempt: handled.append(payload)}, max_attempts=2)
+   job = dict(new_job('background_check', {}), attempts=3)
+   backend.enqueue([job])
+   assert job_queue.run_job(job, job['id']) is False
+   assert handled == [] and backend.receive() == []
+   assert backend.available_at[job['id']] > time.time() + MAX_VISIBILITY_TIMEOUT - 60
@@ -0,0 +1,72 @@
+"""
+Tests of reconciling every org (reconcileReports.py): each org's table is scanned with the org selected, its reports are processed
+with the org selected in the worker threads, and each org gets its own checkpoint
+"""
+import pytest
+import orgRegistry
+import reconcileReports
+from backgroundCheckTable import put_candidate_item, set_report_created
+from orgRegistry import Org, get_current_org, get_org_path
+from settings import settings
+from localDynamoDB import create_background_check_table
+
+ORG_ID = '00D000000000001EAA'
+
+
+class LambdaContext:
+   def get_remaining_time_in_millis(self):
+      return 300000
+
+
+@pytest.fixture
+def org(monkeypatch):
+   org = Org({'organizationID': ORG_ID, 'checkrApiKey': 'ORG_CHECKR_API_KEY', 'salesforcePassword': 'ORG_SALESFORCE_PASSWORD',
+              'salesforceClientSecret': 'ORG_SALESFORCE_CLIENT_SECRET', 'checkrPackage': 'basic_plus', 'salesforceOAuthURL': 'http://localhost',
+              'salesforceClientID': 'client', 'salesforceUsername': 'user', 'backgroundCheckTable': 'bim-org-background-check'})
+   monkeypatch.setattr(orgRegistry, 'org_registry', {ORG_ID: org})
+   return org
+
+
+## Each org has its own table with one report at 'report created', and reconciling a report records the org it ran in
+@pytest.fixture
+def reconciled(monkeypatch, org, table, status_store):
+   tables = {None: table, ORG_ID: create_background_check_table()}
+   for organization_ID, org_table in tables.items():
+      put_candidate_item(org_table, 'lead-' + str(organization_ID), 'Lead', 'candidate')
+      set_report_created(org_table, 'lead-' + str(organization_ID), 'candidate', 'report')
+   monkeypatch.setattr(reconcileReports, 'get_background_check_table', lambda: tables[orgRegistry.get_current_org_ID()])
+   reconciled = []
+
+   def reconcile_report(self, item):
+      reconciled.append((orgRegistry.get_current_org_ID(), item['salesforce_lead_ID']))
+      return 'processed'
+
+   monkeypatch.setattr(reconcileReports.Reconciler, 'reconcile_report', reconcile_report)
+   monkeypatch.setattr(settings, 'reconcileCheckpointBucket', '')
+   return reconciled
+
+
+def test_every_org_is_reconciled_in_its_own_org(reconciled):
+   result = reconcileReports.lambda_handler({}, LambdaContext())
+   assert result['complete']
+   assert sorted(reconciled, key=str) == sorted([(None, 'lead-None'), (ORG_ID, 'lead-' + ORG_ID)], key=str)
+   assert result['orgs'][str(settings.envName)]['counts'] == {'processed': 1}
+   assert result['orgs'][ORG_ID]['counts'] == {'processed': 1}
+   assert get_current_org() is None
+
+
+def test_only_given_org_is_reconciled(reconciled):
+   result = reconcileReports.lambda_handler({'organization_ID': ORG_ID}, LambdaContext())
+   assert reconciled == [(ORG_ID, 'lead-' + ORG_ID)]
+   assert list(result['orgs']) == [ORG_ID]
+
+
+def test_unregistered_org_is_rejected(org):
+   with pytest.raises(LookupError):
+      reconcileReports.get_orgs('00D000000000002EAA')
+
+
+def test_orgs_have_their_own_checkpoints(org):
+   assert get_org_path('/tmp/reconcile-checkpoint.json', None) == '/tmp/reconcile-checkpoint.json'
+   assert get_org_path('/tmp/reconcile-checkpoint.json', org) == '/tmp/reconcile-checkpoint-' + ORG_ID + '.json'
+   assert get_org_path('bim-qa/reconcile-checkpoint.json', org) == 'bim-qa/reconcile-checkpoint-' + ORG_ID + '.json'
@@ -0,0 +1,67 @@
+"""
+Tests of the atomic claim of a completed report and its release (backgroundCheckTable.py)
+"""
+from concurrent.futures import ThreadPoolExecutor
+from backgroundCheckTable import put_candidate_item, set_report_created, claim_report_completion, release_report_completion
+
+LEAD_ID = '00Q000000000001AAA'
+
+
+def create_report_item(table, report_ID='report0'):
+   put_candidate_item(table, LEAD_ID, 'Lead Name', 'candidate0')
+   set_report_created(table, LEAD_ID, 'candidate0', report_ID)
+
+
+def test_only_first_claim_succeeds(table, status_store):
+   create_report_item(table)
+   assert claim_report_completion(table, LEAD_ID, 'report0') is True
+   assert claim_report_completion(table, LEAD_ID, 'report0') is False
+   assert table.items[LEAD_ID]['checkr_status'] == 'report completed'
+   assert 'report_completed_at' in table.items[LEAD_ID]
+
+
+def test_claim_returns_item(table, status_store):
+   create_report_item(table)
+   claimed, item = claim_report_completion(table, LEAD_ID, 'report0', return_item=True)
+   assert claimed is True
+   assert item['name'] == 'Lead Name' and item['checkr_status'] == 'report completed'
+
+
+## A failed claim reads the item again, since the pinned botocore can't return it with the ConditionalCheckFailedException
+def test_failed_claim_returns_item_as_it_was(table, status_store):
+   create_report_item(table)
+   claim_report_completion(table, LEAD_ID, 'report0')
+   claimed, item = claim_report_completion(table, LEAD_ID, 'report0', return_item=True)
+   assert claimed is False
+   assert item['checkr_report_ID'] == 'report0' and item['checkr_status'] == 'report completed'
+
+
+def test_failed_claim_of_missing_item_returns_none(table, status_store):
+   assert claim_report_completion(table, LEAD_ID, 'report0', return_item=True) == (False, None)
+   assert LEAD_ID not in table.items
+
+
+def test_claim_of_another_report_fails(table, status_store):
+   create_report_item(table)
+   claimed, item = claim_report_completion(table, LEAD_ID, 'report1', return_item=True)
+   assert claimed is False
+   assert item['checkr_report_ID'] == 'report0' and item['checkr_status'] == 'report created'
+
+
+def test_release_lets_report_be_claimed_again(table, status_store):
+   create_report_item(table)
+   claim_report_completion(table, LEAD_ID, 'report0')
+   assert release_report_completion(table, LEAD_ID, 'report0') is True
+   assert table.items[LEAD_ID]['checkr_status'] == 'report created'
+   assert 'report_completed_at' not in table.items[LEAD_ID]
+   assert release_report_completion(table, LEAD_ID, 'report0') is False
+   assert claim_report_completion(table, LEAD_ID, 'report0') is True
+
+
+## Only one of many deliveries of the same webhook handled at once claims the report
+def test_concurrent_claims(table, status_store):
+   create_report_item(table)
+   table.latency = 0.01
+   with ThreadPoolExecutor(max_workers=10) as executor:
+      results = list(executor.map(lambda index: claim_report_completion(table, LEAD_ID, 'report0'), range(20)))
+   assert results.count(True) == 1
@@ -0,0 +1,117 @@
+"""
+Tests of failed writes of the buffered Salesforce writer (salesforceWriter.py), and of the report claim released when the
+'Background Check' object of a completed report can't be written (backgroundCheck.py)
+"""
+from types import SimpleNamespace
+import pytest
+import backgroundCheck
+from backgroundCheckTable import put_candidate_item, set_report_created
+from rateLimiting import ServiceUnavailableError
+from salesforceWriter import SObjectWriter, MAX_FLUSH_ATTEMPTS
+
+LEAD_ID = '00Q000000000001AAA'
+
+
+class FakeCollections:
+   """
+   sObject Collections endpoint answering every record with a new ID, or raising the given error for every request
+   Parameters: error raised, if any
+   """
+   def __init__(self, error=None):
+      self.error = error
+      self.requests = []
+
+   def __call__(self, action, method, data):
+      self.requests.append(data['records'])
+      if self.error is not None:
+         raise self.error
+      return [{'success': True, 'id': 'a00%015d' % index} for index in range(len(data['records']))]
+
+
+## Timers are kept from flushing during the tests, so only the flushes of the tests write records
+def create_writer(api_call):
+   return SObjectWriter('Background_Check__c', api_call, max_age=60)
+
+
+def test_written_record_resolves_future():
+   writer = create_writer(FakeCollections())
+   future = writer.add({'Lead__c': LEAD_ID})
+   assert writer.flush() == 1
+   assert future.result(timeout=0) == 'a00000000000000000'
+
+
+def test_record_without_retry_fails_right_away():
+   collections = FakeCollections(Exception('connection reset'))
+   writer = create_writer(collections)
+   future = writer.add({'Lead__c': LEAD_ID}, retry=False)
+   assert writer.flush() == 0
+   with pytest.raises(Exception, match='connection reset'):
+      future.result(timeout=0)
+   assert writer.buffer == []
+
+
+def test_record_with_retry_is_buffered_until_attempts_run_out():
+   collections = FakeCollections(Exception('connection reset'))
+   writer = create_writer(collections)
+   future = writer.add({'Lead__c': LEAD_ID})
+   for attempt in range(1, MAX_FLUSH_ATTEMPTS):
+      writer.flush()
+      assert not future.done()
+      assert [entry[2] for entry in writer.buffer] == [attempt]
+   writer.flush()
+   with pytest.raises(Exception, match='connection reset'):
+      future.result(timeout=0)
+   assert writer.buffer == []
+   assert len(collections.requests) == MAX_FLUSH_ATTEMPTS
+
+
+## A deferred write doesn't use up an attempt of records with retries, and fails records without
+def test_deferred_write_keeps_records_with_retry():
+   error = ServiceUnavailableError('salesforce', 60)
+   writer = create_writer(FakeCollections(error))
+   retried = writer.add({'Lead__c': LEAD_ID})
+   waited = writer.add({'Lead__c': LEAD_ID}, retry=False)
+   writer.flush()
+   assert waited.exception(timeout=0) is error
+   assert not retried.done()
+   assert [(entry[1], entry[2]) for entry in writer.buffer] == [(retried, 0)]
+   writer.timer.cancel()
+
+
+def test_rejected_record_fails_its_future_only():
+   def api_call(action, method, data):
+      return [{'success': True, 'id': 'a00000000000000001'}, {'success': False, 'errors': ['STRING_TOO_LONG']}]
+   writer = create_writer(api_call)
+   written, rejected = writer.add({'Lead__c': LEAD_ID}), writer.add({'Lead__c': LEAD_ID})
+   assert writer.flush() == 1
+   assert written.result(timeout=0) == 'a00000000000000001'
+   with pytest.raises(Exception, match='STRING_TOO_LONG'):
+      rejected.result(timeout=0)
+
+
+def test_create_BC_object_waiting_raises_write_error(monkeypatch):
+   writer = create_writer(FakeCollections(Exception('connection reset')))
+   monkeypatch.setattr(backgroundCheck, 'get_background_check_writer', lambda: writer)
+   with pytest.raises(Exception, match='connection reset'):
+      backgroundCheck.create_BC_object({'Lead__c': LEAD_ID}, wait=True)
+   assert writer.buffer == []
+
+
+## The claim of a report whose object couldn't be written is released, so the redelivered webhook creates the object
+@pytest.mark.parametrize('error', [None, Exception('connection reset')])
+def test_report_claim_released_after_failed_write(monkeypatch, table, status_store, error):
+   collections = FakeCollections(error)
+   monkeypatch.setattr(backgroundCheck, 'get_background_check_table', lambda: table)
+   monkeypatch.setattr(backgroundCheck, 'get_background_check_writer', lambda: create_writer(collections))
+   put_candidate_item(table, LEAD_ID, 'Lead Name', 'candidate0')
+   set_report_created(table, LEAD_ID, 'candidate0', 'report0')
+   ## Report that couldn't be retrieved, whose 'Background Check' object records the error
+   response = SimpleNamespace(ok=False, json=lambda: {'error': ['Not found']}, close=lambda: None)
+   if error is None:
+      assert backgroundCheck.process_report('report0', response, salesforce_lead_ID=LEAD_ID).status_code == 400
+      assert table.items[LEAD_ID]['checkr_status'] == 'report completed'
+   else:
+      with pytest.raises(Exception, match='connection reset'):
+         backgroundCheck.process_report('report0', response, salesforce_lead_ID=LEAD_ID)
+      assert table.items[LEAD_ID]['checkr_status'] == 'report created'
+   assert len(collections.requests) == 1
@@ -0,0 +1,54 @@
+"""
+Tests of the upload of the Salesforce File holding screening record sets too long for their field (salesforceFiles.py):
+a failed upload is retried, and a file that still can't be uploaded never leaves its 'Background Check' object naming it
+"""
+import pytest
+import salesforceFiles
+from localServices import LocalServices
+from payloads import build_lead, build_outbound_message, build_report_webhook
+
+RECORD_FIELDS = ['Addresses__c', 'Aliases__c', 'Sex_Offender_Records__c', 'Global_Watchlist_Records__c', 'National_Criminal_Search_Records__c']
+
+
+## Checkr reports have enough records per search for every record set to go to the file
+@pytest.fixture
+def services(monkeypatch):
+   monkeypatch.setattr(salesforceFiles, 'FILE_UPLOAD_BACKOFF', 0.01)
+   with LocalServices(record_count=1000, salesforce_field_limit=32768) as services:
+      services.client.post('/background-check', data=build_outbound_message([build_lead(0)]))
+      services.item = services.table.items[build_lead(0)['Id']]
+      yield services
+
+
+def send_webhook(services):
+   return services.client.post('/checkr', json=build_report_webhook(services.item['checkr_report_ID'], custom_ID=services.item['salesforce_lead_ID']))
+
+
+def test_failed_upload_is_retried(services):
+   services.salesforce.file_errors = salesforceFiles.FILE_UPLOAD_ATTEMPTS - 1
+   assert send_webhook(services).status_code == 200
+   record, = [record for record in services.salesforce.created() if record.get('Status_Background_Check__c') == 'clear']
+   assert len(services.salesforce.created('ContentVersion')) == 1
+   assert all('see %s in Salesforce File' % field_name in record[field_name] for field_name in RECORD_FIELDS)
+
+
+def test_fields_marked_when_upload_fails(services):
+   services.salesforce.file_errors = salesforceFiles.FILE_UPLOAD_ATTEMPTS
+   assert send_webhook(services).status_code == 200
+   record, = [record for record in services.salesforce.created() if record.get('Status_Background_Check__c') == 'clear']
+   assert services.salesforce.created('ContentVersion') == []
+   for field_name in RECORD_FIELDS:
+      assert record[field_name] == salesforceFiles.UPLOAD_FAILED_SUMMARY % (1000, 'Screening_Records.json.gz', services.item['checkr_report_ID'])
+   assert services.table.items[services.item['salesforce_lead_ID']]['checkr_status'] == 'report completed'
+
+
+## If the fields can't be marked either, the report is released so the redelivered webhook writes it again
+def test_report_released_when_fields_cant_be_marked(monkeypatch, services):
+   def fail(*args):
+      raise Exception('Salesforce unavailable')
+   monkeypatch.setattr(salesforceFiles, 'mark_records_file_failed', fail)
+   services.salesforce.file_errors = salesforceFiles.FILE_UPLOAD_ATTEMPTS
+   assert send_webhook(services).status_code == 500
+   assert services.table.items[services.item['salesforce_lead_ID']]['checkr_status'] == 'report created'
+   assert send_webhook(services).status_code == 200
+   assert len(services.salesforce.created('ContentVersion')) == 1
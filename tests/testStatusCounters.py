@@ -0,0 +1,122 @@
+"""
+Tests of the status counters (statusCounters.py) updated by the transitions of background check items, with the memory backend and the
+DynamoDB backend on a local table: each transition is counted once, counters rebuilt from the table match them, and a failed update
+is recorded for the rebuild instead of failing the transition
+"""
+import pytest
+import rebuildStatusCounters
+import statusCounters
+from backgroundCheckTable import put_candidate_item, set_report_created, claim_report_completion, release_report_completion
+from statusCounters import MemoryStatusStore, DynamoDBStatusStore, get_status, record_report_completed
+from tracing import get_tracer
+from localDynamoDB import create_status_table
+
+
+@pytest.fixture(params=['memory', 'dynamodb'])
+def store(request, monkeypatch):
+   store = MemoryStatusStore() if request.param == 'memory' else DynamoDBStatusStore(create_status_table())
+   monkeypatch.setattr(statusCounters, 'status_store', store)
+   return store
+
+
+def lead_ID(index):
+   return '00Q%015d' % index
+
+
+def create_report(table, index):
+   put_candidate_item(table, lead_ID(index), 'Lead %d' % index, 'candidate%d' % index)
+   set_report_created(table, lead_ID(index), 'candidate%d' % index, 'report%d' % index)
+
+
+## Claims and counts a completed report like process_report()
+def complete_report(table, index):
+   claimed, item = claim_report_completion(table, lead_ID(index), 'report%d' % index, return_item=True)
+   assert claimed
+   record_report_completed(lead_ID(index), item.get('report_created_at'), item['report_completed_at'])
+
+
+def test_transitions_move_counts_between_statuses(table, store):
+   put_candidate_item(table, lead_ID(0), 'Lead 0', 'candidate0')
+   assert get_status()['counts'] == {'candidate created': 1, 'report created': 0, 'report completed': 0}
+   set_report_created(table, lead_ID(0), 'candidate0', 'report0')
+   status = get_status()
+   assert status['counts'] == {'candidate created': 0, 'report created': 1, 'report completed': 0}
+   assert status['oldest_outstanding_report']['checkr_report_ID'] == 'report0'
+   complete_report(table, 0)
+   status = get_status()
+   assert status['counts'] == {'candidate created': 0, 'report created': 0, 'report completed': 1}
+   assert status['oldest_outstanding_report'] is None
+   assert status['average_turnaround_seconds'] is not None
+   assert [day['reports_completed'] for day in status['days']][-1] == 1
+
+
+## Retries of a transition that already happened, e.g. after a timeout, aren't counted again
+def test_repeated_transitions_are_counted_once(table, store):
+   put_candidate_item(table, lead_ID(0), 'Lead 0', 'candidate0')
+   put_candidate_item(table, lead_ID(0), 'Lead 0', 'candidate0')
+   set_report_created(table, lead_ID(0), 'candidate0', 'report0')
+   set_report_created(table, lead_ID(0), 'candidate0', 'report0')
+   status = get_status()
+   assert status['counts'] == {'candidate created': 0, 'report created': 1, 'report completed': 0}
+   assert status['days'][-1]['candidates_created'] == 1 and status['days'][-1]['reports_created'] == 1
+
+
+## A lead checked again replaces its item, whose report is no longer counted at its status or outstanding
+def test_replaced_report_leaves_its_status(monkeypatch, table, store):
+   monkeypatch.setattr(rebuildStatusCounters, 'get_background_check_table', lambda: table)
+   for index in range(2):
+      create_report(table, index)
+   complete_report(table, 0)
+   put_candidate_item(table, lead_ID(0), 'Lead 0', 'candidate0-again')
+   put_candidate_item(table, lead_ID(1), 'Lead 1', 'candidate1-again')
+   live = get_status()
+   assert live['counts'] == {'candidate created': 2, 'report created': 0, 'report completed': 0}
+   assert live['oldest_outstanding_report'] is None
+   assert live['average_turnaround_seconds'] is None
+   rebuildStatusCounters.rebuild_status_counters(2)
+   assert get_status()['counts'] == live['counts']
+
+
+## Outstanding reports are ordered by creation time, then lead ID
+def test_completed_report_leaves_outstanding_reports(table, store):
+   for index in range(3):
+      create_report(table, index)
+   assert get_status()['oldest_outstanding_report']['checkr_report_ID'] == 'report0'
+   complete_report(table, 0)
+   assert get_status()['oldest_outstanding_report']['checkr_report_ID'] == 'report1'
+
+
+def test_rebuild_matches_live_counters(monkeypatch, table, store):
+   monkeypatch.setattr(rebuildStatusCounters, 'get_background_check_table', lambda: table)
+   for index in range(10):
+      create_report(table, index)
+   for index in range(4):
+      complete_report(table, index)
+   ## A released claim moves the item back without having been counted as completed
+   claim_report_completion(table, lead_ID(4), 'report4')
+   release_report_completion(table, lead_ID(4), 'report4')
+   put_candidate_item(table, lead_ID(10), 'Lead 10', 'candidate10')
+   live = get_status()
+   rebuildStatusCounters.rebuild_status_counters(2)
+   rebuilt = get_status()
+   assert live['counts'] == rebuilt['counts'] == {'candidate created': 1, 'report created': 6, 'report completed': 4}
+   assert live['days'] == rebuilt['days']
+   assert live['oldest_outstanding_report']['salesforce_lead_ID'] == rebuilt['oldest_outstanding_report']['salesforce_lead_ID']
+
+
+## A counter update that fails doesn't fail the transition; it is recorded so the counters are rebuilt
+def test_failed_update_is_recorded(monkeypatch, table, store):
+   def fail(*args):
+      raise Exception('throttled')
+   monkeypatch.setattr(store, 'apply', fail)
+   monkeypatch.setattr(get_tracer(), 'untraced_spans', [])
+   put_candidate_item(table, lead_ID(0), 'Lead 0', 'candidate0')
+   assert table.items[lead_ID(0)]['checkr_status'] == 'candidate created'
+   assert [(stage, outcome) for stage, duration, outcome in get_tracer().untraced_spans] == [('status_counters_lost', 'error')]
+
+
+def test_counters_off_without_backend(monkeypatch, table):
+   monkeypatch.setattr(statusCounters, 'status_store', None)
+   monkeypatch.setattr(statusCounters.settings, 'statusBackend', '')
+   put_candidate_item(table, lead_ID(0), 'Lead 0', 'candidate0')
+   assert get_status() is None
@@ -0,0 +1,371 @@
+"""
+Lightweight tracing of the stages of the background check process
+Each stage is timed in a span, and spans are exported as CloudWatch Embedded Metric Format (EMF) metrics with dimensions
+for endpoint, stage, environment and outcome; Lambda sends EMF lines written to stdout to CloudWatch as metrics without API calls
+A trace groups the spans of one request, job or reconciled report and is sampled as a whole, so high-volume webhook traffic
+can be sampled down without losing the breakdown of the traces that are kept
+"""
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import random
+import threading
+import time
+from settings import settings
+from structuredLogging import write_line
+
+## EMF allows at most 100 values for one metric in one document
+EMF_MAX_VALUES = 100
+## Spans recorded outside any trace (e.g. by timer threads) are exported once this many are buffered, or when the next trace ends
+UNTRACED_BUFFER_SIZE = 100
+UNTRACED_ENDPOINT = 'none'
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class Trace:
+   """
+   Spans of one request, job or reconciled report, exported together when the trace ends
+   Parameters: endpoint (or job type) the trace belongs to, and whether it is sampled
+   """
+   def __init__(self, endpoint, sampled):
+      self.endpoint = endpoint
+      self.sampled = sampled
+      self.started_at = time.perf_counter()
+      self.spans = []
+      self.token = None
+
+
+class Span:
+   """
+   Context manager which records how long its block took; set 'outcome' to 'error' for failures that aren't exceptions
+   """
+   __slots__ = ('tracer', 'trace', 'stage', 'outcome', 'started_at')
+
+   def __init__(self, tracer, trace, stage):
+      self.tracer = tracer
+      self.trace = trace
+      self.stage = stage
+      self.outcome = 'success'
+
+   def __enter__(self):
+      self.started_at = time.perf_counter()
+      return self
+
+   def __exit__(self, exc_type, exc_value, traceback):
+      self.tracer.record(self.trace, self.stage, time.perf_counter() - self.started_at, 'error' if exc_type else self.outcome)
+      return False
+
+
+class UnsampledSpan:
+   """
+   Span used when the trace isn't sampled, which records nothing
+   """
+   outcome = 'success'
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, exc_type, exc_value, traceback):
+      return False
+
+   def __setattr__(self, name, value):
+      pass
+
+
+UNSAMPLED_SPAN = UnsampledSpan()
+
+
+class EMFExporter:
+   """
+   Writes spans to the log as CloudWatch Embedded Metric Format documents, one per stage and outcome with up to 100 durations each
+   Parameters: CloudWatch namespace and environment name
+   """
+   def __init__(self, namespace, environment):
+      self.namespace = namespace
+      self.environment = environment
+
+   """
+   Writes EMF documents for spans of one endpoint
+   Parameters: endpoint, list of (stage, duration in milliseconds, outcome) tuples, and sample rate of the trace
+   Output: None
+   """
+   def export(self, endpoint, spans, sample_rate):
+      durations = {}
+      for stage, duration_ms, outcome in spans:
+         durations.setdefault((stage, outcome), []).append(round(duration_ms, 3))
+      timestamp = int(time.time() * 1000)
+      for (stage, outcome), values in durations.items():
+         for start in range(0, len(values), EMF_MAX_VALUES):
+            document = {'_aws': {'Timestamp': timestamp,
+                                 'CloudWatchMetrics': [{'Namespace': self.namespace,
+                                                        'Dimensions': [['Endpoint', 'Stage', 'Environment', 'Outcome']],
+                                                        'Metrics': [{'Name': 'Duration', 'Unit': 'Milliseconds'}]}]},
+                        'Endpoint': endpoint, 'Stage': stage, 'Environment': self.environment, 'Outcome': outcome,
+                        'SampleRate': sample_rate, 'Duration': values[start:start + EMF_MAX_VALUES]}
+            write_line(json.dumps(document, separators=(',', ':')))
+
+
+class LocalExporter:
+   """
+   Keeps exported spans in memory for tests and benchmarks
+   """
+   def __init__(self):
+      self.lock = threading.Lock()
+      self.spans = []
+
+   def export(self, endpoint, spans, sample_rate):
+      with self.lock:
+         self.spans.extend((endpoint, stage, duration_ms, outcome) for stage, duration_ms, outcome in spans)
+
+   """
+   Groups exported span durations by stage
+   Parameters: endpoint to restrict to, if any
+   Output: dictionary mapping stage to list of durations in milliseconds
+   """
+   def durations_by_stage(self, endpoint=None):
+      durations = {}
+      with self.lock:
+         for span_endpoint, stage, duration_ms, outcome in self.spans:
+            if endpoint is None or span_endpoint == endpoint:
+               durations.setdefault(stage, []).append(duration_ms)
+      return durations
+
+   def clear(self):
+      with self.lock:
+         self.spans = []
+
+
+class Tracer:
+   """
+   Creates traces and spans, and exports the spans of sampled traces when they end
+   Parameters: exporter (None to record nothing), default fraction of traces sampled, and dictionary of per-endpoint sample rates
+   """
+   def __init__(self, exporter, sample_rate=1.0, sample_rates=None):
+      self.exporter = exporter
+      self.sample_rate = sample_rate
+      self.sample_rates = dict(sample_rates or {})
+      self.lock = threading.Lock()
+      self.untraced_spans = []
+
+   def get_sample_rate(self, endpoint):
+      if self.exporter is None:
+         return 0.0
+      return self.sample_rates.get(endpoint, self.sample_rate)
+
+   """
+   Starts trace for given endpoint in the current context, deciding whether it is sampled
+   Parameters: endpoint or job type
+   Output: trace, to be passed to end_trace()
+   """
+   def start_trace(self, endpoint):
+      sample_rate = self.get_sample_rate(endpoint)
+      trace = Trace(endpoint, sample_rate >= 1.0 or (sample_rate > 0.0 and random.random() < sample_rate))
+      trace.token = current_trace.set(trace)
+      return trace
+
+   """
+   Ends trace, recording its total duration as the 'request' stage, and exports its spans if it is sampled
+   Buffered untraced spans are exported too, so they are written before a Lambda invocation is frozen
+   Parameters: trace and outcome of the request or job
+   Output: None
+   """
+   def end_trace(self, trace, outcome='success'):
+      if trace.token is not None:
+         current_trace.reset(trace.token)
+         trace.token = None
+      if self.untraced_spans:
+         self.flush()
+      if not trace.sampled:
+         return
+      trace.spans.append(('request', (time.perf_counter() - trace.started_at) * 1000, outcome))
+      self.exporter.export(trace.endpoint, trace.spans, self.get_sample_rate(trace.endpoint))
+      trace.spans = []
+
+   """
+   Context manager which runs a block in its own trace, ending it with 'error' outcome if the block raises
+   Parameters: endpoint or job type
+   Output: context manager
+   """
+   def trace(self, endpoint):
+      return TraceContext(self, endpoint)
+
+   """
+   Returns span for given stage in the current trace
+   Parameters: stage name
+   Output: span context manager
+   """
+   def span(self, stage):
+      if self.exporter is None:
+         return UNSAMPLED_SPAN
+      trace = current_trace.get()
+      if not self.is_sampled(trace):
+         return UNSAMPLED_SPAN
+      return Span(self, trace, stage)
+
+   def is_sampled(self, trace):
+      if trace is not None:
+         return trace.sampled
+      if self.exporter is None:
+         return False
+      sample_rate = self.get_sample_rate(UNTRACED_ENDPOINT)
+      return sample_rate >= 1.0 or (sample_rate > 0.0 and random.random() < sample_rate)
+
+   """
+   Records a finished span in its trace, or in the buffer of untraced spans
+   Parameters: trace (None if span is outside any trace), stage name, duration in seconds and outcome
+   Output: None
+   """
+   def record(self, trace, stage, duration, outcome):
+      span = (stage, duration * 1000, outcome)
+      if trace is not None:
+         trace.spans.append(span)
+         return
+      with self.lock:
+         self.untraced_spans.append(span)
+         full = len(self.untraced_spans) >= UNTRACED_BUFFER_SIZE
+      if full:
+         self.flush()
+
+   def flush(self):
+      with self.lock:
+         spans = self.untraced_spans
+         self.untraced_spans = []
+      if spans and self.exporter is not None:
+         self.exporter.export(UNTRACED_ENDPOINT, spans, self.get_sample_rate(UNTRACED_ENDPOINT))
+
+
+class TraceContext:
+   def __init__(self, tracer, endpoint):
+      self.tracer = tracer
+      self.endpoint = endpoint
+
+   def __enter__(self):
+      self.trace = self.tracer.start_trace(self.endpoint)
+      return self.trace
+
+   def __exit__(self, exc_type, exc_value, traceback):
+      self.tracer.end_trace(self.trace, 'error' if exc_type else 'success')
+      return False
+
+
+## Tracer is kept at module level so every module records spans into the same traces
+tracer = None
+tracer_lock = threading.Lock()
+
+
+"""
+Creates tracer with exporter and sample rates from settings
+Parameters: None
+Output: tracer
+"""
+def create_tracer():
+   if settings.traceExporter == 'emf':
+      exporter = EMFExporter(settings.metricsNamespace, settings.envName)
+   elif settings.traceExporter == 'local':
+      exporter = LocalExporter()
+   else:
+      exporter = None
+   return Tracer(exporter, settings.traceSampleRate, settings.traceSampleRates)
+
+
+"""
+Returns tracer for current process, creating it on first use
+Parameters: None
+Output: tracer
+"""
+def get_tracer():
+   global tracer
+   if tracer is None:
+      with tracer_lock:
+         if tracer is None:
+            tracer = create_tracer()
+   return tracer
+
+
+"""
+Returns span for given stage in the current trace, to be used as a context manager
+Parameters: stage name
+Output: span
+"""
+def span(stage):
+   return get_tracer().span(stage)
+
+
+"""
+Decorator which records every call of the decorated function as a span; coroutine functions are timed until they return
+Parameters: stage name, and optional function mapping the return value to an outcome ('success' or 'error')
+Output: decorator
+"""
+def traced(stage, outcome=None):
+   def decorator(function):
+      if inspect.iscoroutinefunction(function):
+         @functools.wraps(function)
+         async def async_wrapper(*args, **kwargs):
+            active_tracer = get_tracer()
+            trace = current_trace.get()
+            if not active_tracer.is_sampled(trace):
+               return await function(*args, **kwargs)
+            started_at = time.perf_counter()
+            try:
+               result = await function(*args, **kwargs)
+            except Exception:
+               active_tracer.record(trace, stage, time.perf_counter() - started_at, 'error')
+               raise
+            active_tracer.record(trace, stage, time.perf_counter() - started_at, outcome(result) if outcome else 'success')
+            return result
+         return async_wrapper
+
+      @functools.wraps(function)
+      def wrapper(*args, **kwargs):
+         active_tracer = get_tracer()
+         trace = current_trace.get()
+         if not active_tracer.is_sampled(trace):
+            return function(*args, **kwargs)
+         started_at = time.perf_counter()
+         try:
+            result = function(*args, **kwargs)
+         except Exception:
+            active_tracer.record(trace, stage, time.perf_counter() - started_at, 'error')
+            raise
+         active_tracer.record(trace, stage, time.perf_counter() - started_at, outcome(result) if outcome else 'success')
+         return result
+      return wrapper
+   return decorator
+
+
+"""
+Outcome of a function returning a requests response: 'error' unless the response status is below 400
+Parameters: response
+Output: outcome
+"""
+def response_outcome(response):
+   return 'success' if response.ok else 'error'
+
+
+"""
+Wraps function so it runs in the trace that is current now, e.g. when it is called from a worker thread
+Parameters: function
+Output: wrapped function
+"""
+def propagate(function):
+   context = contextvars.copy_context()
+   @functools.wraps(function)
+   def wrapper(*args, **kwargs):
+      return context.copy().run(function, *args, **kwargs)
+   return wrapper
+
+
+"""
+Exports spans recorded outside any trace
+Parameters: None
+Output: None
+"""
+def flush_tracer():
+   if tracer is not None:
+      tracer.flush()
+
+
+atexit.register(flush_tracer)